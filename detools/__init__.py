@@ -10,12 +10,22 @@ from elftools.elf.elffile import ELFFile
 
 from .create import create_patch
 from .create import create_patch_filenames
+from .create import create_patch_bytes
 from .apply import apply_patch
 from .apply import apply_patch_in_place
 from .apply import apply_patch_bsdiff
 from .apply import apply_patch_filenames
+from .apply import apply_patch_resumable
+from .apply import apply_patch_resumable_filenames
+from .apply import apply_patch_chain
+from .apply import apply_patch_chain_filenames
 from .apply import apply_patch_in_place_filenames
 from .apply import apply_patch_bsdiff_filenames
+from .apply import apply_patch_bytes
+from .apply import apply_patch_into
+from .apply import apply_patches
+from .apply import ApplyPatchResult
+from .apply import AsyncPatchApplier
 from .info import patch_info
 from .info import patch_info_filename
 from .errors import Error
@@ -221,13 +231,28 @@ def _do_create_patch(args):
                            to_data_begin,
                            to_data_end,
                            to_code_begin,
-                           to_code_end)
+                           to_code_end,
+                           args.heatshrink_window_sz2,
+                           args.heatshrink_lookahead_sz2,
+                           args.lzma_options,
+                           args.unchanged_segments)
 
     print("Successfully created patch '{}'!".format(args.patchfile))
 
 
 def _do_apply_patch(args):
-    apply_patch_filenames(args.fromfile, args.patchfile, args.tofile)
+    if args.checkpoint is None:
+        apply_patch_filenames(args.fromfile, args.patchfile, args.tofile)
+    else:
+        apply_patch_resumable_filenames(args.fromfile,
+                                        args.patchfile,
+                                        args.tofile,
+                                        args.checkpoint,
+                                        args.checkpoint_interval)
+
+
+def _do_apply_patch_chain(args):
+    apply_patch_chain_filenames(args.fromfile, args.patchfiles, args.tofile)
 
 
 def _do_apply_patch_in_place(args):
@@ -238,6 +263,52 @@ def _do_apply_patch_bsdiff(args):
     apply_patch_bsdiff_filenames(args.fromfile, args.patchfile, args.tofile)
 
 
+def _read_manifest(filename):
+    jobs = []
+
+    with open(filename, 'r') as fin:
+        for number, line in enumerate(fin, 1):
+            line = line.split('#', 1)[0].strip()
+
+            if not line:
+                continue
+
+            job = line.split()
+
+            if len(job) != 3:
+                raise Error(
+                    "{}:{}: Expected <fromfile> <patchfile> <tofile>, but "
+                    "got '{}'.".format(filename, number, line))
+
+            jobs.append(tuple(job))
+
+    return jobs
+
+
+def _do_apply_patches(args):
+    results = apply_patches(_read_manifest(args.manifest),
+                            max_workers=args.max_workers,
+                            digest=args.digest)
+    failed = 0
+
+    for result in results:
+        if result.error is not None:
+            failed += 1
+            print("{}: error: {}".format(result.tofile, result.error))
+        else:
+            line = '{}: {} bytes in {:.3f} s'.format(result.tofile,
+                                                     result.to_size,
+                                                     result.elapsed)
+
+            if result.digest is not None:
+                line += ', {} {}'.format(args.digest, result.digest)
+
+            print(line)
+
+    if failed > 0:
+        raise Error('{} of {} patches failed.'.format(failed, len(results)))
+
+
 def _format_size(value):
     return format_size(value, binary=True)
 
@@ -302,6 +373,19 @@ def _patch_info_in_place_segment(fsize,
     print()
 
 
+def _patch_info_in_place_unchanged_segment(fsize,
+                                           segment_index,
+                                           to_offset_begin,
+                                           to_offset_end):
+    print('------------------- Segment {} -------------------'.format(
+        segment_index))
+    print()
+    print('To range:           {} - {}'.format(fsize(to_offset_begin),
+                                               fsize(to_offset_end)))
+    print('Unchanged:          yes')
+    print()
+
+
 def _patch_info_normal(detailed,
                        fsize,
                        patch_size,
@@ -395,6 +479,14 @@ def _patch_info_in_place(fsize,
         from_offset_end = min(from_size, memory_size - from_shift_size)
         to_offset_begin = (segment_size * i)
         to_offset_end = min(to_offset_begin + segment_size, to_size)
+
+        if normal_info is None:
+            _patch_info_in_place_unchanged_segment(fsize,
+                                                   i + 1,
+                                                   to_offset_begin,
+                                                   to_offset_end)
+            continue
+
         _patch_info_in_place_segment(fsize,
                                      i + 1,
                                      from_offset_begin,
@@ -426,6 +518,30 @@ def to_binary_size(value):
     return parse_size(value, binary=True)
 
 
+def to_lzma_options(value):
+    """Convert 'auto' or comma separated <name>=<value> pairs to LZMA
+    options.
+
+    """
+
+    if value == 'auto':
+        return value
+
+    options = {}
+
+    for item in value.split(','):
+        name, _, option = item.partition('=')
+
+        if name == 'bcj':
+            options[name] = option
+        elif name == 'dict_size':
+            options[name] = to_binary_size(option)
+        else:
+            options[name] = int(option)
+
+    return options
+
+
 def _main():
     parser = argparse.ArgumentParser(description='Binary delta encoding utility.')
 
@@ -451,6 +567,26 @@ def _main():
                            choices=sorted(_COMPRESSIONS),
                            default='lzma',
                            help='Compression algorithm (default: lzma).')
+    subparser.add_argument(
+        '--heatshrink-window-sz2',
+        type=int,
+        default=8,
+        help=('Heatshrink window size as a 2-logarithm, 4-15 '
+              '(default: %(default)s).'))
+    subparser.add_argument(
+        '--heatshrink-lookahead-sz2',
+        type=int,
+        default=7,
+        help=('Heatshrink lookahead size as a 2-logarithm, 3 to window size '
+              'minus one (default: %(default)s).'))
+    subparser.add_argument(
+        '--lzma-options',
+        type=to_lzma_options,
+        help=('LZMA options, either auto to pick the options giving the '
+              'smallest patch for the data format, or comma separated '
+              'bcj=<filter>, dict_size=<size>, lc=<bits>, lp=<bits> and '
+              'pb=<bits>. Filter is arm, arm-thumb, ia64, powerpc, sparc '
+              'or x86.'))
     subparser.add_argument('--memory-size',
                            type=to_binary_size,
                            help='Target memory size.')
@@ -462,6 +598,11 @@ def _main():
         '--minimum-shift-size',
         type=to_binary_size,
         help='Minimum shift size (default: 2 * segment size).')
+    subparser.add_argument(
+        '--unchanged-segments',
+        action='store_true',
+        help=('Mark in-place segments already in memory, to neither erase '
+              'nor write them. Requires an applier supporting the marker.'))
     subparser.add_argument(
         '--data-format',
         choices=sorted(_DATA_FORMATS),
@@ -504,11 +645,29 @@ def _main():
     # Apply patch subparser.
     subparser = subparsers.add_parser('apply_patch',
                                       description='Apply given patch.')
+    subparser.add_argument(
+        '--checkpoint',
+        help=('Checkpoint file. An interrupted apply is resumed from it, if '
+              'it exists.'))
+    subparser.add_argument(
+        '--checkpoint-interval',
+        type=to_binary_size,
+        default='1 MiB',
+        help='Number of to-bytes between checkpoints (default: %(default)s).')
     subparser.add_argument('fromfile', help='From file.')
     subparser.add_argument('patchfile', help='Patch file.')
     subparser.add_argument('tofile', help='Created to file.')
     subparser.set_defaults(func=_do_apply_patch)
 
+    # Apply patch chain subparser.
+    subparser = subparsers.add_parser(
+        'apply_patch_chain',
+        description='Apply given chain of patches, first to last.')
+    subparser.add_argument('fromfile', help='From file.')
+    subparser.add_argument('tofile', help='Created to file.')
+    subparser.add_argument('patchfiles', nargs='+', help='Patch files.')
+    subparser.set_defaults(func=_do_apply_patch_chain)
+
     # In-place apply patch subparser.
     subparser = subparsers.add_parser('apply_patch_in_place',
                                       description='Apply given in-place patch.')
@@ -524,6 +683,20 @@ def _main():
     subparser.add_argument('tofile', help='Created to file.')
     subparser.set_defaults(func=_do_apply_patch_bsdiff)
 
+    # Apply patches subparser.
+    subparser = subparsers.add_parser(
+        'apply_patches',
+        description=('Apply patches listed in given manifest concurrently. '
+                     'Each line in the manifest is <fromfile> <patchfile> '
+                     '<tofile>, and comments start with #.'))
+    subparser.add_argument('-w', '--max-workers',
+                           type=int,
+                           help='Maximum number of worker threads.')
+    subparser.add_argument('-d', '--digest',
+                           help='Digest algorithm, for example sha256.')
+    subparser.add_argument('manifest', help='Manifest file.')
+    subparser.set_defaults(func=_do_apply_patches)
+
     # Patch info subparser.
     subparser = subparsers.add_parser('patch_info',
                                       description='Display patch info.')
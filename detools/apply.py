@@ -1,5 +1,14 @@
 import os
 import struct
+import time
+import hashlib
+import asyncio
+import threading
+from zlib import crc32
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from lzma import LZMADecompressor
 from bz2 import BZ2Decompressor
 import bitstruct
@@ -12,18 +21,29 @@ from .common import COMPRESSION_LZMA
 from .common import COMPRESSION_CRLE
 from .common import COMPRESSION_BZ2
 from .common import COMPRESSION_HEATSHRINK
+from .common import COMPRESSION_HEATSHRINK_SIZES
 from .common import PATCH_TYPE_NORMAL
 from .common import PATCH_TYPE_IN_PLACE
+from .common import PATCH_TYPE_IN_PLACE_UNCHANGED
+from .common import SEGMENT_UNCHANGED
 from .common import format_bad_compression_string
 from .common import format_bad_compression_number
 from .common import file_size
+from .common import MemoryFile
+from .common import add_bytes
 from .common import unpack_size
+from .common import pack_usize
+from .common import unpack_usize
 from .data_format import create_readers
 
 
 class PatchReader(object):
+    """Decompresses patch data. The CRC32 of all decompressed data is
+    kept in `crc` if `crc` is ``True``.
 
-    def __init__(self, fpatch, compression):
+    """
+
+    def __init__(self, fpatch, compression, crc=False):
         if compression == 'lzma':
             self._decompressor = LZMADecompressor()
         elif compression == 'bz2':
@@ -34,14 +54,29 @@ class PatchReader(object):
             self._decompressor = NoneDecompressor(patch_data_length(fpatch))
         elif compression == 'heatshrink':
             self._decompressor = HeatshrinkDecompressor(patch_data_length(fpatch))
+        elif compression == 'heatshrink-sizes':
+            self._decompressor = HeatshrinkDecompressor(patch_data_length(fpatch),
+                                                        header=True)
         else:
             raise Error(format_bad_compression_string(compression))
 
         self._fpatch = fpatch
+        self.offset = 0
+        self.crc = 0 if crc else None
 
     def read(self, size):
         return self.decompress(size)
 
+    def skip(self, size):
+        """Decompress and discard `size` bytes.
+
+        """
+
+        while size > 0:
+            chunk_size = min(size, 4096)
+            self.decompress(chunk_size)
+            size -= chunk_size
+
     def decompress(self, size):
         """Decompress `size` bytes.
 
@@ -66,18 +101,53 @@ class PatchReader(object):
             except Exception:
                 raise Error('Patch decompression failed.')
 
+        self.offset += len(buf)
+
+        if self.crc is not None:
+            self.crc = crc32(buf, self.crc)
+
         return buf
 
     @property
     def eof(self):
+        """Feed remaining patch data to the decompressor, if needed, to find
+        the end of the stream. This is needed when patch data arrives in
+        small pieces.
+
+        """
+
+        while not self._decompressor.eof:
+            if self._decompressor.needs_input:
+                data = self._fpatch.read(4096)
+
+                if not data:
+                    break
+            else:
+                data = b''
+
+            try:
+                if self._decompressor.decompress(data, 1):
+                    return False
+            except Exception:
+                return False
+
+            if not data and not self._decompressor.needs_input:
+                break
+
         return self._decompressor.eof
 
 
-def iter_chunks(patch_reader, to_pos, to_size, message):
-    size = unpack_size(patch_reader)
+def iter_chunks(patch_reader, to_pos, to_size, message, size=None):
+    """Yields chunk size, patch data and number of bytes left. `size` is
+    given when resuming in the middle of the chunks.
+
+    """
+
+    if size is None:
+        size = unpack_size(patch_reader)
 
-    if to_pos + size > to_size:
-        raise Error(message)
+        if to_pos + size > to_size:
+            raise Error(message)
 
     offset = 0
 
@@ -86,21 +156,23 @@ def iter_chunks(patch_reader, to_pos, to_size, message):
         offset += chunk_size
         patch_data = patch_reader.decompress(chunk_size)
 
-        yield chunk_size, patch_data
+        yield chunk_size, patch_data, size - offset
 
 
-def iter_diff_chunks(patch_reader, to_pos, to_size):
+def iter_diff_chunks(patch_reader, to_pos, to_size, size=None):
     return iter_chunks(patch_reader,
                        to_pos,
                        to_size,
-                       "Patch diff data too long.")
+                       "Patch diff data too long.",
+                       size)
 
 
-def iter_extra_chunks(patch_reader, to_pos, to_size):
+def iter_extra_chunks(patch_reader, to_pos, to_size, size=None):
     return iter_chunks(patch_reader,
                        to_pos,
                        to_size,
-                       "Patch extra data too long.")
+                       "Patch extra data too long.",
+                       size)
 
 
 def patch_data_length(fpatch):
@@ -122,6 +194,8 @@ def convert_compression(compression):
         compression = 'bz2'
     elif compression == COMPRESSION_HEATSHRINK:
         compression = 'heatshrink'
+    elif compression == COMPRESSION_HEATSHRINK_SIZES:
+        compression = 'heatshrink-sizes'
     else:
         raise Error(format_bad_compression_number(compression))
 
@@ -150,7 +224,8 @@ def read_header_normal(fpatch):
 
 
 def read_header_in_place(fpatch):
-    """Read an in-place header.
+    """Read an in-place header. The last returned value is True if
+    segments may be marked as unchanged.
 
     """
 
@@ -161,8 +236,9 @@ def read_header_in_place(fpatch):
 
     patch_type, compression = unpack_header(header)
 
-    if patch_type != PATCH_TYPE_IN_PLACE:
-        raise Error("Expected patch type 1, but got {}.".format(patch_type))
+    if patch_type not in [PATCH_TYPE_IN_PLACE, PATCH_TYPE_IN_PLACE_UNCHANGED]:
+        raise Error(
+            "Expected patch type 1 or 2, but got {}.".format(patch_type))
 
     compression = convert_compression(compression)
     memory_size = unpack_size(fpatch)
@@ -170,8 +246,15 @@ def read_header_in_place(fpatch):
     shift_size = unpack_size(fpatch)
     from_size = unpack_size(fpatch)
     to_size = unpack_size(fpatch)
+    unchanged_segments = (patch_type == PATCH_TYPE_IN_PLACE_UNCHANGED)
 
-    return compression, memory_size, segment_size, shift_size, from_size, to_size
+    return (compression,
+            memory_size,
+            segment_size,
+            shift_size,
+            from_size,
+            to_size,
+            unchanged_segments)
 
 
 def offtin(data):
@@ -203,6 +286,56 @@ def read_header_bsdiff(fpatch):
     return ctrl_size, diff_size, to_size
 
 
+def iter_chunk_sizes(size):
+    while size > 0:
+        chunk_size = min(size, 4096)
+        size -= chunk_size
+
+        yield chunk_size
+
+
+class OffsetFile(object):
+    """A file-like object of `size` bytes at `offset` in given file. Each
+    read seeks to its own position first, so several offset files can
+    read from the same file in any order.
+
+    """
+
+    def __init__(self, fin, offset, size):
+        self._fin = fin
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self._size - self._position
+        else:
+            size = min(size, self._size - self._position)
+
+        if size <= 0:
+            return b''
+
+        self._fin.seek(self._offset + self._position, os.SEEK_SET)
+        data = self._fin.read(size)
+        self._position += len(data)
+
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._position = offset
+        elif whence == os.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._size + offset
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
 def shift_memory(fmem, memory_size, shift_size, from_size):
     """Shift given memory.
 
@@ -223,41 +356,47 @@ def shift_memory(fmem, memory_size, shift_size, from_size):
 
 
 def apply_patch_in_place_segment(fmem,
+                                 ffrom,
+                                 dfdiff,
                                  patch_reader,
                                  to_offset,
                                  to_size,
                                  from_offset):
-    """Apply given in-place segment patch.
+    """Apply given in-place segment patch. From-data is read from `ffrom`
+    at `from_offset` and to-data is written to `fmem` at `to_offset`.
 
     """
 
-    dfpatch_size = unpack_size(patch_reader)
-
-    if dfpatch_size > 0:
-        raise NotImplementedError()
-
     to_pos = 0
 
     while to_pos < to_size:
         # Diff data.
-        for chunk_size, patch_data in iter_diff_chunks(patch_reader,
-                                                       to_pos,
-                                                       to_size):
-            fmem.seek(from_offset, os.SEEK_SET)
-            from_data = fmem.read(chunk_size)
+        for chunk_size, patch_data, _ in iter_diff_chunks(patch_reader,
+                                                          to_pos,
+                                                          to_size):
+            ffrom.seek(from_offset, os.SEEK_SET)
+            from_data = ffrom.read(chunk_size)
             from_offset += chunk_size
+            data = add_bytes(patch_data, from_data)
+
+            if dfdiff is not None:
+                dfdiff.seek(to_offset + to_pos)
+                data = add_bytes(data, dfdiff.read(chunk_size))
+
             fmem.seek(to_offset + to_pos, os.SEEK_SET)
-            fmem.write(bytearray(
-                (pb + fb) & 0xff for pb, fb in zip(patch_data, from_data)
-            ))
+            fmem.write(data)
             to_pos += chunk_size
 
         # Extra data.
         fmem.seek(to_offset + to_pos, os.SEEK_SET)
 
-        for chunk_size, patch_data in iter_extra_chunks(patch_reader,
-                                                        to_pos,
-                                                        to_size):
+        for chunk_size, patch_data, _ in iter_extra_chunks(patch_reader,
+                                                           to_pos,
+                                                           to_size):
+            if dfdiff is not None:
+                dfdiff.seek(to_offset + to_pos)
+                patch_data = add_bytes(patch_data, dfdiff.read(chunk_size))
+
             fmem.write(patch_data)
             to_pos += chunk_size
 
@@ -265,9 +404,7 @@ def apply_patch_in_place_segment(fmem,
         from_offset += unpack_size(patch_reader)
 
 
-def create_data_format_readers(patch_reader, ffrom, to_size):
-    dfpatch_size = unpack_size(patch_reader)
-
+def create_data_format_readers(patch_reader, dfpatch_size, ffrom, to_size):
     if dfpatch_size > 0:
         data_format = unpack_size(patch_reader)
         patch = patch_reader.decompress(dfpatch_size)
@@ -283,66 +420,153 @@ def create_data_format_readers(patch_reader, ffrom, to_size):
     return dfdiff, ffrom
 
 
-def apply_patch(ffrom, fpatch, fto):
-    """Apply given normal patch `fpatch` to `ffrom` to create
-    `fto`. Returns the size of the created to-data.
+CHECKPOINT_DIFF  = 0
+CHECKPOINT_EXTRA = 1
 
-    All arguments are file-like objects.
 
-    >>> ffrom = open('foo.mem', 'rb')
-    >>> fpatch = open('foo.patch', 'rb')
-    >>> fto = open('foo.new', 'wb')
-    >>> apply_patch(ffrom, fpatch, fto)
-    2780
+class Checkpointer(object):
+    """Calls given callback with a checkpoint every `interval` bytes of
+    to-data.
 
     """
 
+    def __init__(self, callback, interval):
+        self._callback = callback
+        self._interval = interval
+        self._next_to_pos = interval
+
+    def update(self, patch_reader, ffrom, fto, to_pos, to_size, kind, left):
+        if to_pos < self._next_to_pos:
+            return
+
+        fto.flush()
+        self._callback(b''.join([pack_usize(to_size),
+                                 pack_usize(patch_reader.crc),
+                                 pack_usize(patch_reader.offset),
+                                 pack_usize(to_pos),
+                                 pack_usize(ffrom.tell()),
+                                 pack_usize(kind),
+                                 pack_usize(left)]))
+        self._next_to_pos = to_pos + self._interval
+
+
+def restore_checkpoint(checkpoint, patch_reader, ffrom, fto, dfdiff, to_size):
+    fcheckpoint = BytesIO(checkpoint)
+
+    try:
+        checkpoint_to_size = unpack_usize(fcheckpoint)
+        patch_crc = unpack_usize(fcheckpoint)
+        patch_offset = unpack_usize(fcheckpoint)
+        to_pos = unpack_usize(fcheckpoint)
+        from_pos = unpack_usize(fcheckpoint)
+        kind = unpack_usize(fcheckpoint)
+        left = unpack_usize(fcheckpoint)
+    except Error:
+        raise Error('Failed to read the checkpoint.')
+
+    if checkpoint_to_size != to_size:
+        raise Error('Checkpoint does not match the patch.')
+
+    if (patch_offset < patch_reader.offset
+        or to_pos + left > to_size
+        or kind not in [CHECKPOINT_DIFF, CHECKPOINT_EXTRA]):
+        raise Error('Bad checkpoint.')
+
+    # There is no way to save and restore the decompressor state, so
+    # the patch data up to the checkpoint is decompressed again.
+    patch_reader.skip(patch_offset - patch_reader.offset)
+
+    if patch_reader.crc != patch_crc:
+        raise Error('Checkpoint does not match the patch.')
+
+    ffrom.seek(from_pos)
+    fto.seek(to_pos)
+
+    if dfdiff is not None:
+        dfdiff.seek(to_pos)
+
+    return to_pos, kind, left
+
+
+def apply_patch_normal(ffrom, fpatch, fto, checkpoint, checkpointer):
     compression, to_size = read_header_normal(fpatch)
 
     if to_size == 0:
         return to_size
 
-    patch_reader = PatchReader(fpatch, compression)
-    dfdiff, ffrom = create_data_format_readers(patch_reader, ffrom, to_size)
-    to_pos = 0
+    patch_reader = PatchReader(fpatch,
+                               compression,
+                               checkpointer is not None)
+    dfdiff, ffrom = create_data_format_readers(patch_reader,
+                                               unpack_size(patch_reader),
+                                               ffrom,
+                                               to_size)
+
+    if checkpoint is None:
+        to_pos = 0
+        kind = CHECKPOINT_DIFF
+        left = None
+    else:
+        to_pos, kind, left = restore_checkpoint(checkpoint,
+                                                patch_reader,
+                                                ffrom,
+                                                fto,
+                                                dfdiff,
+                                                to_size)
 
     while to_pos < to_size:
         # Diff data.
-        for chunk_size, patch_data in iter_diff_chunks(patch_reader,
-                                                       to_pos,
-                                                       to_size):
-            from_data = ffrom.read(chunk_size)
+        if kind == CHECKPOINT_DIFF:
+            for chunk_size, patch_data, left in iter_diff_chunks(patch_reader,
+                                                                 to_pos,
+                                                                 to_size,
+                                                                 left):
+                from_data = ffrom.read(chunk_size)
 
-            if dfdiff is not None:
-                dfdiff_data = dfdiff.read(chunk_size)
-                data = bytearray(
-                    (pb + fb + db) & 0xff for pb, fb, db in zip(patch_data,
-                                                                from_data,
-                                                                dfdiff_data)
-                )
-            else:
-                data = bytearray(
-                    (pb + fb) & 0xff for pb, fb in zip(patch_data, from_data)
-                )
+                data = add_bytes(patch_data, from_data)
 
-            fto.write(data)
-            to_pos += chunk_size
+                if dfdiff is not None:
+                    data = add_bytes(data, dfdiff.read(chunk_size))
+
+                fto.write(data)
+                to_pos += chunk_size
+
+                if checkpointer is not None:
+                    checkpointer.update(patch_reader,
+                                        ffrom,
+                                        fto,
+                                        to_pos,
+                                        to_size,
+                                        CHECKPOINT_DIFF,
+                                        left)
+
+            left = None
 
         # Extra data.
-        for chunk_size, patch_data in iter_extra_chunks(patch_reader,
-                                                        to_pos,
-                                                        to_size):
+        for chunk_size, patch_data, left in iter_extra_chunks(patch_reader,
+                                                              to_pos,
+                                                              to_size,
+                                                              left):
             if dfdiff is not None:
-                dfdiff_data = dfdiff.read(chunk_size)
-                data = bytearray(
-                    (dd + db) & 0xff for dd, db in zip(patch_data, dfdiff_data)
-                )
+                data = add_bytes(patch_data, dfdiff.read(chunk_size))
             else:
                 data = patch_data
 
             fto.write(data)
             to_pos += chunk_size
 
+            if checkpointer is not None:
+                checkpointer.update(patch_reader,
+                                    ffrom,
+                                    fto,
+                                    to_pos,
+                                    to_size,
+                                    CHECKPOINT_EXTRA,
+                                    left)
+
+        kind = CHECKPOINT_DIFF
+        left = None
+
         # Adjustment.
         size = unpack_size(patch_reader)
         ffrom.seek(size, os.SEEK_CUR)
@@ -353,6 +577,110 @@ def apply_patch(ffrom, fpatch, fto):
     return to_size
 
 
+def apply_patch(ffrom, fpatch, fto):
+    """Apply given normal patch `fpatch` to `ffrom` to create
+    `fto`. Returns the size of the created to-data.
+
+    All arguments are file-like objects.
+
+    >>> ffrom = open('foo.mem', 'rb')
+    >>> fpatch = open('foo.patch', 'rb')
+    >>> fto = open('foo.new', 'wb')
+    >>> apply_patch(ffrom, fpatch, fto)
+    2780
+
+    """
+
+    return apply_patch_normal(ffrom, fpatch, fto, None, None)
+
+
+def apply_patch_resumable(ffrom,
+                          fpatch,
+                          fto,
+                          checkpoint_callback,
+                          checkpoint=None,
+                          checkpoint_interval=1048576):
+    """Same as :func:`~detools.apply_patch()`, but calls
+    `checkpoint_callback` with a checkpoint about every
+    `checkpoint_interval` bytes of to-data. A checkpoint is a bytes
+    object to be persisted by the callback. `fto` is flushed before the
+    callback is called.
+
+    Resume an interrupted apply by calling this function again with
+    the last checkpoint and `fto` opened for update, without
+    truncating it. The patch data up to the checkpoint is decompressed
+    again, but neither read from `ffrom` nor written to `fto`. A
+    checkpoint contains the to-data size and the CRC32 of the
+    decompressed patch data up to it, and :class:`~detools.Error` is
+    raised if resumed with another patch.
+
+    >>> checkpoints = []
+    >>> apply_patch_resumable(ffrom, fpatch, fto, checkpoints.append)
+    ... interrupted ...
+    >>> fto = open('foo.new', 'r+b')
+    >>> apply_patch_resumable(ffrom,
+    ...                       fpatch,
+    ...                       fto,
+    ...                       checkpoints.append,
+    ...                       checkpoints[-1])
+    2780
+
+    """
+
+    return apply_patch_normal(ffrom,
+                              fpatch,
+                              fto,
+                              checkpoint,
+                              Checkpointer(checkpoint_callback,
+                                           checkpoint_interval))
+
+
+def apply_patch_into(from_buf, patch_buf, out_buf):
+    """Apply given normal patch `patch_buf` to `from_buf` and write the
+    created to-data to the beginning of the preallocated buffer
+    `out_buf`. Returns the size of the created to-data.
+
+    All arguments are bytes-like objects, and `out_buf` must be
+    writable and at least the to-size given in the patch header. No
+    intermediate copies of the from-data or the to-data are made.
+
+    >>> to_data = bytearray(2780)
+    >>> apply_patch_into(from_data, patch, to_data)
+    2780
+
+    """
+
+    fpatch = MemoryFile(patch_buf)
+    _, to_size = read_header_normal(fpatch)
+    fto = MemoryFile(out_buf)
+
+    if len(fto) < to_size:
+        raise Error(
+            'Expected an output buffer of at least {} bytes, but got {}.'.format(
+                to_size,
+                len(fto)))
+
+    fpatch.seek(0, os.SEEK_SET)
+
+    return apply_patch(MemoryFile(from_buf), fpatch, fto)
+
+
+def apply_patch_bytes(from_buf, patch_buf):
+    """Same as :func:`~detools.apply_patch()`, but with bytes-like
+    objects instead of file-like objects. Returns the created to-data
+    as bytes.
+
+    >>> apply_patch_bytes(from_data, patch)
+    b'...'
+
+    """
+
+    fto = BytesIO()
+    apply_patch(MemoryFile(from_buf), MemoryFile(patch_buf), fto)
+
+    return fto.getvalue()
+
+
 def apply_patch_in_place(fmem, fpatch):
     """Apply given in-place patch `fpatch` to `fmem`. Returns the size of
     the created to-data.
@@ -371,20 +699,55 @@ def apply_patch_in_place(fmem, fpatch):
      segment_size,
      shift_size,
      from_size,
-     to_size) = read_header_in_place(fpatch)
+     to_size,
+     unchanged_segments) = read_header_in_place(fpatch)
 
     if to_size > 0:
         patch_reader = PatchReader(fpatch, compression)
         shift_memory(fmem, memory_size, shift_size, from_size)
 
+        # A data format patch in the first segment is for the whole
+        # image, with from-data at the shifted offset in memory.
+        dfpatch_size = unpack_size(patch_reader)
+        dfdiff, ffrom = create_data_format_readers(
+            patch_reader,
+            dfpatch_size,
+            OffsetFile(fmem,
+                       shift_size,
+                       min(from_size, memory_size - shift_size)),
+            to_size)
+
+        if dfdiff is None:
+            ffrom = fmem
+            from_base = 0
+        else:
+            from_base = shift_size
+
         for i, to_pos in enumerate(range(0, to_size, segment_size)):
             from_offset = max(segment_size * (i + 1), shift_size)
             segment_to_size = min(segment_size, to_size - to_pos)
+
+            if i > 0:
+                dfpatch_size = unpack_size(patch_reader)
+
+                if dfpatch_size not in [0, SEGMENT_UNCHANGED]:
+                    raise Error(
+                        'Expected data format patch only in first segment.')
+
+            # The to-data of unchanged segments is already in memory.
+            if dfpatch_size == SEGMENT_UNCHANGED:
+                if not unchanged_segments:
+                    raise Error('Unexpected unchanged segment.')
+
+                continue
+
             apply_patch_in_place_segment(fmem,
+                                         ffrom,
+                                         dfdiff,
                                          patch_reader,
                                          to_pos,
                                          segment_to_size,
-                                         from_offset)
+                                         from_offset - from_base)
 
         if not patch_reader.eof:
             raise Error('End of patch not found.')
@@ -407,58 +770,230 @@ def apply_patch_bsdiff(ffrom, fpatch, fto):
     """
 
     ctrl_size, diff_size, to_size = read_header_bsdiff(fpatch)
-
-    ctrl_decompressor = BZ2Decompressor()
-    diff_decompressor = BZ2Decompressor()
-    extra_decompressor = BZ2Decompressor()
-
-    ctrl_decompressor.decompress(fpatch.read(ctrl_size), 0)
-    diff_decompressor.decompress(fpatch.read(diff_size), 0)
-    extra_decompressor.decompress(fpatch.read(), 0)
-
+    ctrl_offset = fpatch.tell()
+    diff_offset = ctrl_offset + ctrl_size
+    extra_offset = diff_offset + diff_size
+    extra_size = file_size(fpatch) - extra_offset
+    ctrl_reader = PatchReader(OffsetFile(fpatch, ctrl_offset, ctrl_size),
+                              'bz2')
+    diff_reader = PatchReader(OffsetFile(fpatch, diff_offset, diff_size),
+                              'bz2')
+    extra_reader = PatchReader(OffsetFile(fpatch, extra_offset, extra_size),
+                               'bz2')
     to_pos = 0
 
     while to_pos < to_size:
         # Control data.
-        diff_size = offtin(ctrl_decompressor.decompress(b'', 8))
-        extra_size = offtin(ctrl_decompressor.decompress(b'', 8))
-        adjustment = offtin(ctrl_decompressor.decompress(b'', 8))
+        diff_size = offtin(ctrl_reader.decompress(8))
+        extra_size = offtin(ctrl_reader.decompress(8))
+        adjustment = offtin(ctrl_reader.decompress(8))
 
         # Diff data.
         if to_pos + diff_size > to_size:
             raise Error("Patch diff data too long.")
 
-        diff_data = diff_decompressor.decompress(b'', diff_size)
-        from_data = ffrom.read(diff_size)
-        data = bytearray(
-            (db + fb) & 0xff for db, fb in zip(diff_data, from_data)
-        )
-        fto.write(data)
-        to_pos += diff_size
+        for chunk_size in iter_chunk_sizes(diff_size):
+            diff_data = diff_reader.decompress(chunk_size)
+            from_data = ffrom.read(chunk_size)
+            fto.write(add_bytes(diff_data, from_data))
+            to_pos += chunk_size
 
         # Extra data.
         if to_pos + extra_size > to_size:
             raise Error("Patch extra data too long.")
 
-        extra_data = extra_decompressor.decompress(b'', extra_size)
-        fto.write(extra_data)
-        to_pos += extra_size
+        for chunk_size in iter_chunk_sizes(extra_size):
+            fto.write(extra_reader.decompress(chunk_size))
+            to_pos += chunk_size
 
         # Adjustment.
         ffrom.seek(adjustment, os.SEEK_CUR)
 
-    if not ctrl_decompressor.eof:
+    if not ctrl_reader.eof:
         raise Error('End of control data not found.')
 
-    if not diff_decompressor.eof:
+    if not diff_reader.eof:
         raise Error('End of diff data not found.')
 
-    if not extra_decompressor.eof:
+    if not extra_reader.eof:
         raise Error('End of extra data not found.')
 
     return to_size
 
 
+# Intermediate to-data in a patch chain larger than this is kept in a
+# temporary file instead of in memory.
+CHAIN_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+class ChainBuffer(object):
+    """The to-data of one stage in a patch chain, written by one thread
+    and read as from-data by the next stage in another. Reads wait for
+    the data to be written.
+
+    The data is kept in memory up to `spool_size` bytes, and in a
+    temporary file after that. It is released by :meth:`release` once
+    the next stage is done with it.
+
+    """
+
+    def __init__(self, spool_size):
+        self._file = SpooledTemporaryFile(spool_size)
+        self._size = 0
+        self._done = False
+        self._failed = False
+        self._released = False
+        self._condition = threading.Condition()
+
+    def write(self, data):
+        with self._condition:
+            if not self._released:
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(data)
+                self._size += len(data)
+                self._condition.notify_all()
+
+        return len(data)
+
+    def close(self, failed=False):
+        with self._condition:
+            self._done = True
+            self._failed = failed
+            self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._released = True
+            self._file.close()
+
+    def _wait(self, end):
+        while not self._done:
+            if end is not None and self._size >= end:
+                break
+
+            self._condition.wait()
+
+        if self._failed:
+            raise Error('Previous patch in chain failed.')
+
+    def size(self):
+        """Wait for all data and return its size.
+
+        """
+
+        with self._condition:
+            self._wait(None)
+
+            return self._size
+
+    def read(self, offset, size):
+        """Wait for and read up to `size` bytes at `offset`, or all data
+        from `offset` if `size` is negative.
+
+        """
+
+        with self._condition:
+            if size < 0:
+                self._wait(None)
+            else:
+                self._wait(offset + size)
+
+            self._file.seek(offset)
+
+            return self._file.read(size)
+
+
+class ChainReader(object):
+    """A file-like object reading from a :class:`ChainBuffer`.
+
+    """
+
+    def __init__(self, buf):
+        self._buf = buf
+        self._position = 0
+
+    def read(self, size=-1):
+        data = self._buf.read(self._position, size)
+        self._position += len(data)
+
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._position = offset
+        elif whence == os.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._buf.size() + offset
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def release(self):
+        self._buf.release()
+
+
+def apply_patch_chain_stage(ffrom, fpatch, fto):
+    failed = True
+
+    try:
+        to_size = apply_patch(ffrom, fpatch, fto)
+        failed = False
+    finally:
+        if isinstance(ffrom, ChainReader):
+            ffrom.release()
+
+        if isinstance(fto, ChainBuffer):
+            fto.close(failed)
+
+    return to_size
+
+
+def apply_patch_chain(ffrom, fpatches, fto, spool_size=CHAIN_SPOOL_SIZE):
+    """Apply given chain of normal patches `fpatches` to `ffrom` to
+    create `fto`. Returns the size of the created to-data.
+
+    All patches are applied concurrently, each in its own thread. Each
+    patch reads its from-data from the to-data of the previous patch
+    as soon as it has been created, so no one pass per patch over the
+    data is needed. Patches may read their from-data in any order, so
+    each intermediate to-data is kept until the patch reading it has
+    been applied. Up to `spool_size` bytes of it are kept in memory,
+    the rest in a temporary file.
+
+    All arguments except `spool_size` are file-like objects.
+
+    >>> ffrom = open('foo-1.bin', 'rb')
+    >>> fpatches = [open('foo-1-2.patch', 'rb'), open('foo-2-3.patch', 'rb')]
+    >>> fto = open('foo-3.bin', 'wb')
+    >>> apply_patch_chain(ffrom, fpatches, fto)
+    2780
+
+    """
+
+    fpatches = list(fpatches)
+
+    if not fpatches:
+        raise Error('Expected at least one patch.')
+
+    buffers = [ChainBuffer(spool_size) for _ in fpatches[:-1]]
+    ffroms = [ffrom] + [ChainReader(buf) for buf in buffers]
+    ftos = buffers + [fto]
+
+    with ThreadPoolExecutor(max_workers=len(fpatches)) as executor:
+        futures = [
+            executor.submit(apply_patch_chain_stage, ffrom, fpatch, fto)
+            for ffrom, fpatch, fto in zip(ffroms, fpatches, ftos)
+        ]
+
+        for future in futures:
+            to_size = future.result()
+
+    return to_size
+
+
 def apply_patch_filenames(fromfile, patchfile, tofile):
     """Same as :func:`~detools.apply_patch()`, but with filenames instead
     of file-like objects.
@@ -474,6 +1009,86 @@ def apply_patch_filenames(fromfile, patchfile, tofile):
                 return apply_patch(ffrom, fpatch, fto)
 
 
+def apply_patch_resumable_filenames(fromfile,
+                                    patchfile,
+                                    tofile,
+                                    checkpointfile,
+                                    checkpoint_interval=1048576):
+    """Same as :func:`~detools.apply_patch_resumable()`, but with filenames
+    instead of file-like objects. Checkpoints are persisted in
+    `checkpointfile`. The apply is resumed if `checkpointfile` exists,
+    and it is removed once the patch has been applied.
+
+    >>> apply_patch_resumable_filenames('foo.old',
+    ...                                 'foo.patch',
+    ...                                 'foo.new',
+    ...                                 'foo.checkpoint')
+    2780
+
+    """
+
+    if os.path.exists(checkpointfile):
+        with open(checkpointfile, 'rb') as fcheckpoint:
+            checkpoint = fcheckpoint.read()
+
+        mode = 'r+b'
+    else:
+        checkpoint = None
+        mode = 'wb'
+
+    with open(fromfile, 'rb') as ffrom:
+        with open(patchfile, 'rb') as fpatch:
+            with open(tofile, mode) as fto:
+                def save_checkpoint(checkpoint):
+                    os.fsync(fto.fileno())
+                    tmpfile = checkpointfile + '.tmp'
+
+                    with open(tmpfile, 'wb') as fcheckpoint:
+                        fcheckpoint.write(checkpoint)
+                        fcheckpoint.flush()
+                        os.fsync(fcheckpoint.fileno())
+
+                    os.replace(tmpfile, checkpointfile)
+
+                to_size = apply_patch_resumable(ffrom,
+                                                fpatch,
+                                                fto,
+                                                save_checkpoint,
+                                                checkpoint,
+                                                checkpoint_interval)
+                fto.truncate(to_size)
+
+    if os.path.exists(checkpointfile):
+        os.remove(checkpointfile)
+
+    return to_size
+
+
+def apply_patch_chain_filenames(fromfile, patchfiles, tofile):
+    """Same as :func:`~detools.apply_patch_chain()`, but with filenames
+    instead of file-like objects.
+
+    >>> apply_patch_chain_filenames('foo-1.bin',
+    ...                             ['foo-1-2.patch', 'foo-2-3.patch'],
+    ...                             'foo-3.bin')
+    2780
+
+    """
+
+    fpatches = []
+
+    try:
+        for patchfile in patchfiles:
+            fpatches.append(open(patchfile, 'rb'))
+
+        with open(fromfile, 'rb') as ffrom:
+            with open(tofile, 'wb') as fto:
+                return apply_patch_chain(ffrom, fpatches, fto)
+    finally:
+        for fpatch in fpatches:
+            fpatch.close()
+
+
 def apply_patch_in_place_filenames(memfile, patchfile):
     """Same as :func:`~detools.apply_patch_in_place()`, but with filenames
     instead of file-like objects.
@@ -501,3 +1116,326 @@ def apply_patch_bsdiff_filenames(fromfile, patchfile, tofile):
         with open(patchfile, 'rb') as fpatch:
             with open(tofile, 'wb') as fto:
                 return apply_patch_bsdiff(ffrom, fpatch, fto)
+
+
+class _DigestWriter(object):
+
+    def __init__(self, fto, digest):
+        self._fto = fto
+        self._hash = hashlib.new(digest)
+
+    def write(self, data):
+        self._hash.update(data)
+
+        return self._fto.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class ApplyPatchResult(object):
+    """The result of one job given to :func:`~detools.apply_patches()`.
+
+    `to_size` is the size of the created to-file, `digest` its hex
+    digest, if requested, and `elapsed` the time in seconds it took to
+    apply the patch. `error` is ``None`` on success, and otherwise the
+    error message.
+
+    """
+
+    def __init__(self, fromfile, patchfile, tofile):
+        self.fromfile = fromfile
+        self.patchfile = patchfile
+        self.tofile = tofile
+        self.to_size = None
+        self.digest = None
+        self.elapsed = None
+        self.error = None
+
+
+def _apply_patches_job(job, digest):
+    result = ApplyPatchResult(*job)
+    start_time = time.perf_counter()
+
+    try:
+        with open(result.fromfile, 'rb') as ffrom:
+            with open(result.patchfile, 'rb') as fpatch:
+                with open(result.tofile, 'wb') as fto:
+                    if digest is not None:
+                        fto = _DigestWriter(fto, digest)
+
+                    result.to_size = apply_patch(ffrom, fpatch, fto)
+
+                    if digest is not None:
+                        result.digest = fto.hexdigest()
+    except Exception as e:
+        result.error = str(e)
+
+    result.elapsed = time.perf_counter() - start_time
+
+    return result
+
+
+def apply_patches(jobs, max_workers=None, digest=None):
+    """Apply many normal patches concurrently in a pool of `max_workers`
+    threads. `jobs` is an iterable of ``(fromfile, patchfile, tofile)``
+    filename tuples. Decompression, diff additions and file I/O are done
+    without holding the GIL.
+
+    `digest` is an optional :mod:`hashlib` algorithm name, for example
+    ``'sha256'``, of the digest to calculate over each to-file.
+
+    Returns a list of :class:`~detools.ApplyPatchResult`, in the same
+    order as `jobs`. A failing job does not stop the others.
+
+    >>> results = apply_patches([('foo.old', 'foo.patch', 'foo.new')],
+    ...                         digest='sha256')
+    >>> results[0].to_size
+    2780
+
+    """
+
+    if digest is not None:
+        try:
+            hashlib.new(digest)
+        except ValueError:
+            raise Error("Unsupported digest '{}'.".format(digest))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_apply_patches_job, job, digest)
+            for job in jobs
+        ]
+
+        return [future.result() for future in futures]
+
+
+class _PatchStream(object):
+    """A blocking, thread safe file-like object of patch data written by
+    one thread and read by another. At most `max_buffered` bytes are
+    buffered at a time. `on_space` is called, in the reading thread,
+    when buffered data has been read or the stream is closed.
+
+    """
+
+    def __init__(self, patch_size, max_buffered, on_space):
+        self._patch_size = patch_size
+        self._max_buffered = max_buffered
+        self._on_space = on_space
+        self._chunks = deque()
+        self._buffered = 0
+        self._position = 0
+        self._read_position = 0
+        self._finished = False
+        self._closed = False
+        self._aborted = False
+        self._condition = threading.Condition()
+
+    def try_write(self, data):
+        """Buffer given data, at most `max_buffered` bytes, if there is room
+        for it. Returns ``False`` if there is not. Data written after
+        the stream has been closed is discarded.
+
+        """
+
+        with self._condition:
+            if self._closed:
+                return True
+
+            if self._buffered + len(data) > self._max_buffered:
+                return False
+
+            self._chunks.append(bytes(data))
+            self._buffered += len(data)
+            self._condition.notify_all()
+
+            return True
+
+    def finish(self):
+        with self._condition:
+            self._finished = True
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        self._on_space()
+
+    def abort(self):
+        """Make current and future reads raise :class:`~detools.Error` and
+        discard buffered and future data.
+
+        """
+
+        with self._condition:
+            self._aborted = True
+            self._closed = True
+            self._chunks.clear()
+            self._buffered = 0
+            self._condition.notify_all()
+
+    def read(self, size=-1):
+        if self._position != self._read_position:
+            raise Error('Streamed patches can not be seeked.')
+
+        with self._condition:
+            while not (self._chunks or self._finished or self._aborted):
+                self._condition.wait()
+
+            if self._aborted:
+                raise Error('Patch apply aborted.')
+
+            if not self._chunks:
+                return b''
+
+            data = self._chunks.popleft()
+
+            if 0 <= size < len(data):
+                self._chunks.appendleft(data[size:])
+                data = data[:size]
+
+            self._buffered -= len(data)
+            self._position += len(data)
+            self._read_position = self._position
+
+        self._on_space()
+
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Only seeking to the end, to get the patch size, and back is
+        possible.
+
+        """
+
+        if whence == os.SEEK_END:
+            if self._patch_size is None:
+                raise Error(
+                    'Patch size must be given for streamed patches with '
+                    'compression none, crle or heatshrink.')
+
+            self._position = self._patch_size + offset
+        elif whence == os.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = offset
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class AsyncPatchApplier(object):
+    """Apply a normal patch to `ffrom` to create `fto` while the patch is
+    fed in pieces from an :mod:`asyncio` event loop, typically as it is
+    downloaded. The patch is applied in a dedicated thread, so neither
+    decompression nor file I/O stalls the event loop, and at most
+    `max_buffered` bytes of the patch are held in memory.
+
+    `patch_size` is the total size of the patch. It is only required
+    for patches with compression none, crle or heatshrink.
+
+    Call :meth:`aclose()` to abort the apply if the patch will not be
+    fully fed, for example because its download failed. Used as an
+    asynchronous context manager, the apply is aborted when the
+    context is exited without the patch being finalized.
+
+    >>> async with AsyncPatchApplier(open('foo.old', 'rb'),
+    ...                              open('foo.new', 'wb')) as applier:
+    ...     async for data in download('foo.patch'):
+    ...         await applier.feed(data)
+    ...     await applier.finalize()
+    2780
+
+    """
+
+    def __init__(self, ffrom, fto, patch_size=None, max_buffered=65536):
+        self._ffrom = ffrom
+        self._fto = fto
+        self._max_buffered = max_buffered
+        self._stream = _PatchStream(patch_size, max_buffered, self._on_space)
+        self._loop = None
+        self._space = None
+        self._executor = None
+        self._future = None
+
+    def _apply(self):
+        try:
+            return apply_patch(self._ffrom, self._stream, self._fto)
+        finally:
+            self._stream.close()
+
+    def _on_space(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._space.set)
+
+    def _start(self):
+        if self._future is None:
+            self._loop = asyncio.get_running_loop()
+            self._space = asyncio.Event()
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._future = self._loop.run_in_executor(self._executor,
+                                                      self._apply)
+            self._future.add_done_callback(
+                lambda _: self._executor.shutdown(wait=False))
+
+    async def feed(self, data):
+        """Feed given patch data. Data larger than `max_buffered` bytes is
+        buffered in pieces, each waiting until there is room for it.
+        Raises :class:`~detools.Error` if applying the patch has
+        failed.
+
+        """
+
+        self._start()
+        data = memoryview(data)
+
+        for offset in range(0, len(data), self._max_buffered):
+            piece = data[offset:offset + self._max_buffered]
+
+            while True:
+                self._space.clear()
+
+                if self._stream.try_write(piece):
+                    break
+
+                await self._space.wait()
+
+        if self._future.done():
+            self._future.result()
+
+    async def finalize(self):
+        """Signal the end of the patch and wait for it to be fully
+        applied. Returns the size of the created to-data.
+
+        """
+
+        self._start()
+        self._stream.finish()
+
+        return await self._future
+
+    async def aclose(self):
+        """Abort applying the patch, unless it has already been applied, and
+        wait for the apply thread to finish.
+
+        """
+
+        if self._future is None:
+            return
+
+        self._stream.abort()
+
+        try:
+            await self._future
+        except Error:
+            pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
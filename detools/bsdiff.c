@@ -175,22 +175,21 @@ static int append_buffer(PyObject *list_p, uint8_t *buf_p, int64_t size)
 static int parse_args(PyObject *args_p,
                       Py_ssize_t *suffix_array_length_p,
                       int64_t **sa_pp,
-                      char **from_pp,
-                      char **to_pp,
-                      Py_ssize_t *from_size_p,
-                      Py_ssize_t *to_size_p)
+                      Py_buffer *from_buffer_p,
+                      Py_buffer *to_buffer_p)
 {
     int res;
     PyObject *sa_p;
-    PyObject *from_bytes_p;
-    PyObject *to_bytes_p;
     int i;
 
+    /* Any object supporting the buffer protocol is accepted for the
+       from- and to-data, so callers do not have to copy them into
+       bytes objects first. */
     res = PyArg_ParseTuple(args_p,
-                           "OOO",
+                           "Oy*y*",
                            &sa_p,
-                           &from_bytes_p,
-                           &to_bytes_p);
+                           from_buffer_p,
+                           to_buffer_p);
 
     if (res == 0) {
         return (-1);
@@ -199,35 +198,24 @@ static int parse_args(PyObject *args_p,
     *suffix_array_length_p = PyList_Size(sa_p);
 
     if (*suffix_array_length_p <= 0) {
-        return (-1);
+        goto err1;
     }
 
     *sa_pp = PyMem_Malloc(*suffix_array_length_p * sizeof(**sa_pp));
 
     if (*sa_pp == NULL) {
-        return (-1);
+        goto err1;
     }
 
     for (i = 0; i < *suffix_array_length_p; i++) {
         (*sa_pp)[i] = PyLong_AsLong(PyList_GET_ITEM(sa_p, i));
     }
 
-    res = PyBytes_AsStringAndSize(from_bytes_p, from_pp, from_size_p);
-
-    if (res != 0) {
-        goto err1;
-    }
-
-    res = PyBytes_AsStringAndSize(to_bytes_p, to_pp, to_size_p);
-
-    if (res != 0) {
-        goto err1;
-    }
-
-    return (res);
+    return (0);
 
  err1:
-    PyMem_Free(*sa_pp);
+    PyBuffer_Release(from_buffer_p);
+    PyBuffer_Release(to_buffer_p);
 
     return (-1);
 }
@@ -477,6 +465,8 @@ static PyObject *m_create_patch(PyObject *self_p, PyObject *args_p)
     uint8_t *to_p;
     Py_ssize_t from_size;
     Py_ssize_t to_size;
+    Py_buffer from_buffer;
+    Py_buffer to_buffer;
     int64_t *sa_p;
     uint8_t *debuf_p;
     PyObject *list_p;
@@ -485,15 +475,18 @@ static PyObject *m_create_patch(PyObject *self_p, PyObject *args_p)
     res = parse_args(args_p,
                      &suffix_array_length,
                      &sa_p,
-                     (char **)&from_p,
-                     (char **)&to_p,
-                     &from_size,
-                     &to_size);
+                     &from_buffer,
+                     &to_buffer);
 
     if (res != 0) {
         return (NULL);
     }
 
+    from_p = (uint8_t *)from_buffer.buf;
+    from_size = from_buffer.len;
+    to_p = (uint8_t *)to_buffer.buf;
+    to_size = to_buffer.len;
+
     debuf_p = PyMem_Malloc(to_size + 1);
 
     if (debuf_p == NULL) {
@@ -520,6 +513,8 @@ static PyObject *m_create_patch(PyObject *self_p, PyObject *args_p)
 
     PyMem_Free(debuf_p);
     PyMem_Free(sa_p);
+    PyBuffer_Release(&from_buffer);
+    PyBuffer_Release(&to_buffer);
 
     return (list_p);
 
@@ -531,12 +526,61 @@ static PyObject *m_create_patch(PyObject *self_p, PyObject *args_p)
 
  err1:
     PyMem_Free(sa_p);
+    PyBuffer_Release(&from_buffer);
+    PyBuffer_Release(&to_buffer);
 
     return (NULL);
 }
 
+/**
+ * def add_bytes(a, b) -> bytes
+ *
+ * Byte by byte addition, modulo 256, without holding the GIL.
+ */
+static PyObject *m_add_bytes(PyObject *self_p, PyObject *args_p)
+{
+    int res;
+    Py_buffer a;
+    Py_buffer b;
+    Py_ssize_t size;
+    Py_ssize_t i;
+    uint8_t *a_p;
+    uint8_t *b_p;
+    uint8_t *dst_p;
+    PyObject *bytes_p;
+
+    res = PyArg_ParseTuple(args_p, "y*y*", &a, &b);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    size = MIN(a.len, b.len);
+    bytes_p = PyBytes_FromStringAndSize(NULL, size);
+
+    if (bytes_p != NULL) {
+        a_p = (uint8_t *)a.buf;
+        b_p = (uint8_t *)b.buf;
+        dst_p = (uint8_t *)PyBytes_AS_STRING(bytes_p);
+
+        Py_BEGIN_ALLOW_THREADS
+
+        for (i = 0; i < size; i++) {
+            dst_p[i] = (uint8_t)(a_p[i] + b_p[i]);
+        }
+
+        Py_END_ALLOW_THREADS
+    }
+
+    PyBuffer_Release(&a);
+    PyBuffer_Release(&b);
+
+    return (bytes_p);
+}
+
 static PyMethodDef module_methods[] = {
     { "pack_size", m_pack_size, METH_O },
+    { "add_bytes", m_add_bytes, METH_VARARGS },
     { "create_patch", m_create_patch, METH_VARARGS },
     { NULL }
 };
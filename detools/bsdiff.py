@@ -95,6 +95,29 @@ def pack_size(value):
     return packed
 
 
+def add_bytes(a, b):
+    """Add given byte strings byte by byte, modulo 256. The result is as
+    long as the shortest of the two.
+
+    All bytes are added at once as lanes of one big integer, with the
+    carry out of each lane masked away.
+
+    """
+
+    size = min(len(a), len(b))
+
+    if size == 0:
+        return b''
+
+    x = int.from_bytes(a[:size], 'little')
+    y = int.from_bytes(b[:size], 'little')
+    high = int.from_bytes(size * b'\x80', 'little')
+    low = (high >> 7) * 0x7f
+    value = ((x & low) + (y & low)) ^ ((x ^ y) & high)
+
+    return value.to_bytes(size, 'little')
+
+
 def create_patch(suffix_array, from_data, to_data):
     """Return chunks of data.
 
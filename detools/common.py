@@ -5,19 +5,29 @@ from .errors import Error
 
 try:
     from .cbsdiff import pack_size
+    from .cbsdiff import add_bytes
 except ImportError:
     from .bsdiff import pack_size
+    from .bsdiff import add_bytes
 
 
 PATCH_TYPE_NORMAL    = 0
 PATCH_TYPE_IN_PLACE  = 1
 
+# In-place patch that may mark segments as unchanged.
+PATCH_TYPE_IN_PLACE_UNCHANGED = 2
+
 COMPRESSION_NONE        = 0
 COMPRESSION_LZMA        = 1
 COMPRESSION_CRLE        = 2
 COMPRESSION_BZ2         = 3
 COMPRESSION_HEATSHRINK  = 4
 
+# Heatshrink with the window and lookahead sizes in a header byte. Not
+# a compression string of its own, but selected by create_patch() for
+# compression heatshrink with non-default sizes.
+COMPRESSION_HEATSHRINK_SIZES = 5
+
 COMPRESSIONS = {
     'none': COMPRESSION_NONE,
     'lzma': COMPRESSION_LZMA,
@@ -26,6 +36,11 @@ COMPRESSIONS = {
     'heatshrink': COMPRESSION_HEATSHRINK
 }
 
+# In-place segment data format patch size marking a segment whose
+# to-data is already in memory. No segment patch follows. Only valid
+# in patches of type PATCH_TYPE_IN_PLACE_UNCHANGED.
+SEGMENT_UNCHANGED = -1
+
 DATA_FORMAT_ARM_CORTEX_M4 = 0
 DATA_FORMAT_AARCH64       = 1
 DATA_FORMAT_XTENSA_LX106  = 2
@@ -109,6 +124,68 @@ def file_read(f):
     return f.read()
 
 
+class MemoryFile(object):
+    """A file-like object over given buffer. Reads return memoryview
+    slices of the buffer and writes are done in place, so no data is
+    copied.
+
+    """
+
+    def __init__(self, buf):
+        self._buf = memoryview(buf).cast('B')
+        self._position = 0
+
+    def __len__(self):
+        return len(self._buf)
+
+    def read(self, size=-1):
+        if size < 0:
+            end = len(self._buf)
+        else:
+            end = min(self._position + size, len(self._buf))
+
+        data = self._buf[self._position:end]
+        self._position += len(data)
+
+        return data
+
+    def write(self, data):
+        if self._buf.readonly:
+            raise Error('Output buffer is not writable.')
+
+        end = self._position + len(data)
+
+        if end > len(self._buf):
+            raise Error(
+                'Output buffer of {} bytes is too small.'.format(
+                    len(self._buf)))
+
+        self._buf[self._position:end] = data
+        self._position = end
+
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = len(self._buf) + offset
+        else:
+            raise ValueError('Invalid whence {}.'.format(whence))
+
+        if position < 0:
+            raise ValueError('Negative seek position {}.'.format(position))
+
+        self._position = position
+
+        return position
+
+    def tell(self):
+        return self._position
+
+
 def unpack_size_with_length(fin):
     try:
         byte = fin.read(1)[0]
@@ -0,0 +1,586 @@
+/**
+ * BSD 2-Clause License
+ *
+ * Copyright (c) 2019, Erik Moqvist
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ * * Redistributions of source code must retain the above copyright
+ *   notice, this list of conditions and the following disclaimer.
+ *
+ * * Redistributions in binary form must reproduce the above copyright
+ *   notice, this list of conditions and the following disclaimer in
+ *   the documentation and/or other materials provided with the
+ *   distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+ * FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+ * COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+ * INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+ * (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+ * SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+ * HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+ * STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ * ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+ * OF THE POSSIBILITY OF SUCH DAMAGE.
+ */
+
+/*
+ * C implementation of the CRLE segment functions in crle.py.
+ */
+
+#include <stdint.h>
+#include <string.h>
+#include <Python.h>
+
+#define MINIMUM_REPEATED_SIZE                               6
+
+#define SCATTERED                                           0
+#define REPEATED                                            1
+
+struct buf_t {
+    uint8_t *buf_p;
+    Py_ssize_t size;
+    Py_ssize_t capacity;
+};
+
+static PyObject *error_p = NULL;
+
+static int buf_reserve(struct buf_t *self_p, Py_ssize_t size)
+{
+    Py_ssize_t capacity;
+    uint8_t *buf_p;
+
+    if (size > PY_SSIZE_T_MAX - self_p->size) {
+        PyErr_NoMemory();
+
+        return (-1);
+    }
+
+    size += self_p->size;
+
+    if (size <= self_p->capacity) {
+        return (0);
+    }
+
+    capacity = self_p->capacity;
+
+    if (capacity < 64) {
+        capacity = 64;
+    }
+
+    while (capacity < size) {
+        if (capacity > PY_SSIZE_T_MAX / 2) {
+            capacity = size;
+        } else {
+            capacity *= 2;
+        }
+    }
+
+    buf_p = PyMem_Realloc(self_p->buf_p, (size_t)capacity);
+
+    if (buf_p == NULL) {
+        PyErr_NoMemory();
+
+        return (-1);
+    }
+
+    self_p->buf_p = buf_p;
+    self_p->capacity = capacity;
+
+    return (0);
+}
+
+static int buf_append(struct buf_t *self_p,
+                      const uint8_t *buf_p,
+                      Py_ssize_t size)
+{
+    if (size == 0) {
+        return (0);
+    }
+
+    if (buf_reserve(self_p, size) != 0) {
+        return (-1);
+    }
+
+    memcpy(&self_p->buf_p[self_p->size], buf_p, (size_t)size);
+    self_p->size += size;
+
+    return (0);
+}
+
+static int buf_append_repeated(struct buf_t *self_p,
+                               uint8_t value,
+                               Py_ssize_t size)
+{
+    if (size == 0) {
+        return (0);
+    }
+
+    if (buf_reserve(self_p, size) != 0) {
+        return (-1);
+    }
+
+    memset(&self_p->buf_p[self_p->size], value, (size_t)size);
+    self_p->size += size;
+
+    return (0);
+}
+
+static int buf_append_segment_header(struct buf_t *self_p,
+                                     uint8_t kind,
+                                     Py_ssize_t size)
+{
+    uint8_t buf[11];
+    Py_ssize_t length;
+
+    buf[0] = kind;
+    length = 1;
+
+    do {
+        buf[length] = (0x80 | (size & 0x7f));
+        size >>= 7;
+        length++;
+    } while (size > 0);
+
+    buf[length - 1] &= 0x7f;
+
+    return (buf_append(self_p, &buf[0], length));
+}
+
+static int bytearray_append(PyObject *bytearray_p,
+                            const uint8_t *buf_p,
+                            Py_ssize_t size)
+{
+    Py_ssize_t offset;
+
+    if (size == 0) {
+        return (0);
+    }
+
+    offset = PyByteArray_GET_SIZE(bytearray_p);
+
+    if (PyByteArray_Resize(bytearray_p, offset + size) != 0) {
+        return (-1);
+    }
+
+    memcpy(PyByteArray_AS_STRING(bytearray_p) + offset, buf_p, (size_t)size);
+
+    return (0);
+}
+
+static int bytearray_append_repeated(PyObject *bytearray_p,
+                                     uint8_t value,
+                                     Py_ssize_t size)
+{
+    Py_ssize_t offset;
+
+    offset = PyByteArray_GET_SIZE(bytearray_p);
+
+    if (PyByteArray_Resize(bytearray_p, offset + size) != 0) {
+        return (-1);
+    }
+
+    memset(PyByteArray_AS_STRING(bytearray_p) + offset, value, (size_t)size);
+
+    return (0);
+}
+
+/**
+ * Compress given scattered data, if any, and clear it.
+ */
+static int compress_scattered(struct buf_t *compressed_p,
+                              PyObject *scattered_p)
+{
+    Py_ssize_t size;
+
+    size = PyByteArray_GET_SIZE(scattered_p);
+
+    if (size == 0) {
+        return (0);
+    }
+
+    if (buf_append_segment_header(compressed_p, SCATTERED, size) != 0) {
+        return (-1);
+    }
+
+    if (buf_append(compressed_p,
+                   (uint8_t *)PyByteArray_AS_STRING(scattered_p),
+                   size) != 0) {
+        return (-1);
+    }
+
+    return (PyByteArray_Resize(scattered_p, 0));
+}
+
+static int compress_segments(struct buf_t *compressed_p,
+                             const uint8_t *data_p,
+                             Py_ssize_t size,
+                             PyObject *scattered_p,
+                             uint8_t *run_byte_p,
+                             Py_ssize_t *run_length_p,
+                             int flushing)
+{
+    Py_ssize_t i;
+    Py_ssize_t begin;
+    Py_ssize_t run_begin;
+    Py_ssize_t run_length;
+    uint8_t run_byte;
+
+    run_byte = *run_byte_p;
+    run_length = *run_length_p;
+
+    /* Data before begin is either in the scattered buffer or
+       compressed. */
+    begin = 0;
+
+    for (i = 0; i <= size; i++) {
+        if (i < size) {
+            if ((run_length > 0) && (data_p[i] == run_byte)) {
+                run_length++;
+                continue;
+            }
+        } else if (!flushing) {
+            break;
+        }
+
+        /* The run ends at i. The run may have started in previous
+           data. */
+        run_begin = (i - run_length);
+
+        if (run_length >= MINIMUM_REPEATED_SIZE) {
+            if (run_begin > begin) {
+                if (bytearray_append(scattered_p,
+                                     &data_p[begin],
+                                     run_begin - begin) != 0) {
+                    return (-1);
+                }
+            }
+
+            if (compress_scattered(compressed_p, scattered_p) != 0) {
+                return (-1);
+            }
+
+            if (buf_append_segment_header(compressed_p,
+                                          REPEATED,
+                                          run_length) != 0) {
+                return (-1);
+            }
+
+            if (buf_append(compressed_p, &run_byte, 1) != 0) {
+                return (-1);
+            }
+
+            begin = i;
+        } else if (run_begin < 0) {
+            if (bytearray_append_repeated(scattered_p,
+                                          run_byte,
+                                          -run_begin) != 0) {
+                return (-1);
+            }
+        }
+
+        if (i < size) {
+            run_byte = data_p[i];
+            run_length = 1;
+        } else {
+            run_length = 0;
+        }
+    }
+
+    if (flushing) {
+        if (bytearray_append(scattered_p, &data_p[begin], size - begin) != 0) {
+            return (-1);
+        }
+
+        if (compress_scattered(compressed_p, scattered_p) != 0) {
+            return (-1);
+        }
+    } else if (size - run_length > begin) {
+        if (bytearray_append(scattered_p,
+                             &data_p[begin],
+                             size - run_length - begin) != 0) {
+            return (-1);
+        }
+    }
+
+    *run_byte_p = run_byte;
+    *run_length_p = run_length;
+
+    return (0);
+}
+
+/**
+ * def compress_segments(data,
+ *                       scattered,
+ *                       run_byte,
+ *                       run_length,
+ *                       flushing) -> (bytes, int, int)
+ */
+static PyObject *m_compress_segments(PyObject *self_p, PyObject *args_p)
+{
+    int res;
+    Py_buffer data;
+    PyObject *scattered_p;
+    int run_byte;
+    uint8_t run_byte_u8;
+    Py_ssize_t run_length;
+    int flushing;
+    struct buf_t compressed;
+    PyObject *compressed_p;
+
+    res = PyArg_ParseTuple(args_p,
+                           "y*O!inp",
+                           &data,
+                           &PyByteArray_Type,
+                           &scattered_p,
+                           &run_byte,
+                           &run_length,
+                           &flushing);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    compressed.buf_p = NULL;
+    compressed.size = 0;
+    compressed.capacity = 0;
+    compressed_p = NULL;
+    run_byte_u8 = (uint8_t)run_byte;
+    res = compress_segments(&compressed,
+                            (uint8_t *)data.buf,
+                            data.len,
+                            scattered_p,
+                            &run_byte_u8,
+                            &run_length,
+                            flushing);
+
+    if (res == 0) {
+        compressed_p = PyBytes_FromStringAndSize((char *)compressed.buf_p,
+                                                 compressed.size);
+    }
+
+    PyMem_Free(compressed.buf_p);
+    PyBuffer_Release(&data);
+
+    if (compressed_p == NULL) {
+        return (NULL);
+    }
+
+    return (Py_BuildValue("(Nin)", compressed_p, run_byte_u8, run_length));
+}
+
+/**
+ * Unpack a size. Returns the offset after it, or zero if more data is
+ * needed.
+ */
+static Py_ssize_t unpack_size(const uint8_t *buf_p,
+                              Py_ssize_t size,
+                              Py_ssize_t offset,
+                              Py_ssize_t *value_p)
+{
+    uint8_t byte;
+    uint64_t value;
+    int shift;
+
+    value = 0;
+    shift = 0;
+
+    do {
+        if (offset == size) {
+            return (0);
+        }
+
+        byte = buf_p[offset];
+        offset++;
+
+        if (shift >= 63) {
+            if ((byte & 0x7f) != 0) {
+                PyErr_NoMemory();
+
+                return (-1);
+            }
+        } else {
+            value |= ((uint64_t)(byte & 0x7f) << shift);
+            shift += 7;
+        }
+    } while (byte & 0x80);
+
+    if (value > PY_SSIZE_T_MAX) {
+        PyErr_NoMemory();
+
+        return (-1);
+    }
+
+    *value_p = (Py_ssize_t)value;
+
+    return (offset);
+}
+
+static Py_ssize_t decompress_segments(struct buf_t *decompressed_p,
+                                      const uint8_t *indata_p,
+                                      Py_ssize_t size,
+                                      Py_ssize_t *scattered_left_p)
+{
+    Py_ssize_t position;
+    Py_ssize_t offset;
+    Py_ssize_t length;
+    Py_ssize_t value;
+    uint8_t kind;
+
+    position = 0;
+
+    while (1) {
+        if (*scattered_left_p > 0) {
+            length = (size - position);
+
+            if (length > *scattered_left_p) {
+                length = *scattered_left_p;
+            }
+
+            if (buf_append(decompressed_p, &indata_p[position], length) != 0) {
+                return (-1);
+            }
+
+            position += length;
+            *scattered_left_p -= length;
+
+            if (*scattered_left_p > 0) {
+                break;
+            }
+        }
+
+        if (position == size) {
+            break;
+        }
+
+        kind = indata_p[position];
+
+        if ((kind != SCATTERED) && (kind != REPEATED)) {
+            PyErr_Format(error_p,
+                         "Expected kind scattered(0) or repeated(1), but "
+                         "got %d.",
+                         kind);
+
+            return (-1);
+        }
+
+        offset = unpack_size(indata_p, size, position + 1, &value);
+
+        if (offset < 0) {
+            return (-1);
+        } else if (offset == 0) {
+            break;
+        }
+
+        if (kind == SCATTERED) {
+            *scattered_left_p = value;
+            position = offset;
+        } else {
+            if (offset == size) {
+                break;
+            }
+
+            if (buf_append_repeated(decompressed_p,
+                                    indata_p[offset],
+                                    value) != 0) {
+                return (-1);
+            }
+
+            position = (offset + 1);
+        }
+    }
+
+    return (position);
+}
+
+/**
+ * def decompress_segments(indata,
+ *                         number_of_scattered_bytes_left) -> (bytes, int, int)
+ */
+static PyObject *m_decompress_segments(PyObject *self_p, PyObject *args_p)
+{
+    int res;
+    Py_buffer indata;
+    Py_ssize_t scattered_left;
+    Py_ssize_t position;
+    struct buf_t decompressed;
+    PyObject *decompressed_p;
+
+    res = PyArg_ParseTuple(args_p, "y*n", &indata, &scattered_left);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    decompressed.buf_p = NULL;
+    decompressed.size = 0;
+    decompressed.capacity = 0;
+    decompressed_p = NULL;
+    position = decompress_segments(&decompressed,
+                                   (uint8_t *)indata.buf,
+                                   indata.len,
+                                   &scattered_left);
+
+    if (position >= 0) {
+        decompressed_p = PyBytes_FromStringAndSize(
+            (char *)decompressed.buf_p,
+            decompressed.size);
+    }
+
+    PyMem_Free(decompressed.buf_p);
+    PyBuffer_Release(&indata);
+
+    if (decompressed_p == NULL) {
+        return (NULL);
+    }
+
+    return (Py_BuildValue("(Nnn)", decompressed_p, position, scattered_left));
+}
+
+static PyMethodDef module_methods[] = {
+    { "compress_segments", m_compress_segments, METH_VARARGS },
+    { "decompress_segments", m_decompress_segments, METH_VARARGS },
+    { NULL }
+};
+
+static PyModuleDef module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "ccrle",
+    .m_doc = NULL,
+    .m_size = -1,
+    .m_methods = module_methods
+};
+
+PyMODINIT_FUNC PyInit_ccrle(void)
+{
+    PyObject *m_p;
+    PyObject *errors_p;
+
+    errors_p = PyImport_ImportModule("detools.errors");
+
+    if (errors_p == NULL) {
+        return (NULL);
+    }
+
+    error_p = PyObject_GetAttrString(errors_p, "Error");
+    Py_DECREF(errors_p);
+
+    if (error_p == NULL) {
+        return (NULL);
+    }
+
+    /* Module creation. */
+    m_p = PyModule_Create(&module);
+
+    if (m_p == NULL) {
+        return (NULL);
+    }
+
+    return (m_p);
+}
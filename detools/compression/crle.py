@@ -6,6 +6,7 @@ general.
 
 """
 
+import re
 import struct
 from ..errors import Error
 
@@ -15,12 +16,16 @@ MINIMUM_REPEATED_SIZE = 6
 SCATTERED = 0
 REPEATED = 1
 
+RE_REPEATED = re.compile(b'(.)\\1{%d,}' % (MINIMUM_REPEATED_SIZE - 1),
+                         re.DOTALL)
+
 
 class CrleCompressor(object):
 
     def __init__(self):
-        self._data = b''
-        self._flushing = False
+        self._scattered = bytearray()
+        self._run_byte = 0
+        self._run_length = 0
         self._number_of_compressed_bytes = 0
 
     def compress(self, data):
@@ -28,105 +33,33 @@ class CrleCompressor(object):
 
         """
 
-        self._data += data
+        (compressed,
+         self._run_byte,
+         self._run_length) = _compress_segments(data,
+                                                self._scattered,
+                                                self._run_byte,
+                                                self._run_length,
+                                                False)
+        self._number_of_compressed_bytes += len(compressed)
 
-        return self.compress_segment()
+        return compressed
 
     def flush(self):
         """Compress and return remaining data.
 
         """
 
-        if self._number_of_compressed_bytes == len(self._data) == 0:
+        (compressed,
+         self._run_byte,
+         self._run_length) = _compress_segments(b'',
+                                                self._scattered,
+                                                self._run_byte,
+                                                self._run_length,
+                                                True)
+
+        if self._number_of_compressed_bytes == len(compressed) == 0:
             compressed = struct.pack('B', SCATTERED)
             compressed += pack_size(0)
-        else:
-            self._flushing = True
-            compressed = []
-
-            while True:
-                chunk = self.compress_segment()
-
-                if not chunk:
-                    break
-
-                compressed.append(chunk)
-
-            compressed = b''.join(compressed)
-
-        return compressed
-
-    def find_repeated_segment(self):
-        """Find the first repeated segment in the data and return its offset
-        and length. Return ``(None, None)`` if no repeated segment was
-        found.
-
-        """
-
-        for offset in range(len(self._data)):
-            byte = self._data[offset]
-            length = 0
-
-            while ((offset + length < len(self._data))
-                   and (byte == self._data[offset + length])):
-                length += 1
-
-            if length >= MINIMUM_REPEATED_SIZE:
-                return offset, length
-
-        return None, None
-
-    def get_segment(self):
-        """Get a segment of scattered or repeated data. Returns the segment
-        kind and data. Returns ``(None, None)`` if no segment was
-        found.
-
-        """
-
-        offset, length = self.find_repeated_segment()
-
-        if offset is None:
-            if self._flushing:
-                kind = SCATTERED
-                data = self._data
-                self._data = b''
-            else:
-                kind = None
-                data = None
-        elif offset > 0:
-            data = self._data[:offset]
-            self._data = self._data[offset:]
-            kind = SCATTERED
-        elif offset + length < len(self._data) or self._flushing:
-            data = self._data[:length]
-            self._data = self._data[length:]
-            kind = REPEATED
-        else:
-            kind = None
-            data = None
-
-        return kind, data
-
-    def compress_segment(self):
-        """Compress one segment and return it.
-
-        """
-
-        if len(self._data) == 0:
-            return b''
-
-        kind, data = self.get_segment()
-
-        if kind is None:
-            return b''
-
-        compressed = struct.pack('B', kind)
-        compressed += pack_size(len(data))
-
-        if kind == SCATTERED:
-            compressed += data
-        else:
-            compressed += data[:1]
 
         self._number_of_compressed_bytes += len(compressed)
 
@@ -137,8 +70,8 @@ class CrleDecompressor(object):
 
     def __init__(self, number_of_bytes):
         self._number_of_indata_bytes_left = number_of_bytes
-        self._indata = b''
-        self._outdata = b''
+        self._indata = bytearray()
+        self._outdata = bytearray()
         self._number_of_scattered_bytes_left = 0
 
     def decompress(self, data, size):
@@ -154,9 +87,15 @@ class CrleDecompressor(object):
 
         self._indata += data
         self._number_of_indata_bytes_left -= len(data)
-        self._outdata += self.decompress_segments()
-        data = self._outdata[:size]
-        self._outdata = self._outdata[size:]
+        (outdata,
+         consumed,
+         self._number_of_scattered_bytes_left) = _decompress_segments(
+             self._indata,
+             self._number_of_scattered_bytes_left)
+        del self._indata[:consumed]
+        self._outdata += outdata
+        data = bytes(self._outdata[:size])
+        del self._outdata[:size]
 
         return data
 
@@ -170,57 +109,136 @@ class CrleDecompressor(object):
                 and len(self._outdata) == 0
                 and len(self._indata) == 0)
 
-    def decompress_segments(self):
-        segments = []
 
-        try:
-            while True:
-                segments.append(self.decompress_segment())
-        except IndexError:
-            pass
+def pack_segment(kind, size, data):
+    return struct.pack('B', kind) + pack_size(size) + data
 
-        return b''.join(segments)
 
-    def decompress_segment(self):
-        """Try to decompress a segment. Raises IndexError if not enough data
-        is available..
+def compress_segments(data, scattered, run_byte, run_length, flushing):
+    """Compress all complete segments in given data, which follows
+    given scattered data and a run of `run_length` `run_byte` bytes.
+    Scattered data that is not yet followed by a repeated segment is
+    appended to `scattered`. Returns the compressed segments and the
+    trailing run, which may continue in next data. Everything is
+    compressed if `flushing` is ``True``.
 
-        """
+    Each byte is only searched once by the regular expression, so the
+    time complexity is linear in the total data size.
+
+    """
+
+    compressed = bytearray()
+
+    # Only the last bytes of a long trailing run are needed to find
+    # it again.
+    prefix_length = min(run_length, MINIMUM_REPEATED_SIZE)
+    run_length -= prefix_length
+    data = prefix_length * bytes((run_byte, )) + data
+    position = 0
+    tail = None
+
+    for mo in RE_REPEATED.finditer(data):
+        begin, end = mo.span()
+
+        if end == len(data) and not flushing:
+            tail = begin
+            break
+
+        scattered += data[position:begin]
+
+        if scattered:
+            compressed += pack_segment(SCATTERED, len(scattered), scattered)
+            del scattered[:]
+
+        length = end - begin
 
-        if self._number_of_scattered_bytes_left == 0:
-            kind = self._indata[0]
-
-            if kind == SCATTERED:
-                length, offset = unpack_size(self._indata, 1)
-                remaining = (offset + length - len(self._indata))
-
-                if remaining > 0:
-                    self._number_of_scattered_bytes_left = remaining
-                    length -= remaining
-
-                repetitions = 1
-            elif kind == REPEATED:
-                repetitions, offset = unpack_size(self._indata, 1)
-                length = 1
-            else:
-                raise Error(
-                    'Expected kind scattered(0) or repeated(1), but got {}.'.format(
-                        kind))
-        elif len(self._indata) > 0:
-            length = min(len(self._indata), self._number_of_scattered_bytes_left)
-            offset = 0
-            repetitions = 1
-            self._number_of_scattered_bytes_left -= length
+        if begin == 0:
+            length += run_length
+
+        compressed += pack_segment(REPEATED, length, data[begin:begin + 1])
+        position = end
+
+    if tail is not None:
+        scattered += data[position:tail]
+        run_byte = data[tail]
+
+        if tail == 0:
+            run_length += len(data)
         else:
-            raise IndexError
+            run_length = len(data) - tail
+    elif flushing:
+        scattered += data[position:]
 
-        if len(self._indata) < offset + length:
-            raise IndexError
+        if scattered:
+            compressed += pack_segment(SCATTERED, len(scattered), scattered)
+            del scattered[:]
 
-        data = repetitions * self._indata[offset:offset + length]
-        self._indata = self._indata[offset + length:]
+        run_length = 0
+    else:
+        # A trailing run shorter than the minimum repeated size may
+        # still become a repeated segment.
+        tail = len(data)
 
-        return data
+        while tail > position and data[tail - 1] == data[-1]:
+            tail -= 1
+
+        scattered += data[position:tail]
+        run_length = len(data) - tail
+
+        if run_length > 0:
+            run_byte = data[-1]
+
+    return bytes(compressed), run_byte, run_length
+
+
+def decompress_segments(indata, number_of_scattered_bytes_left):
+    """Decompress all complete segments in given data, and the first
+    part of a scattered segment. Returns the decompressed data, the
+    number of consumed bytes and the number of scattered bytes left in
+    the last segment.
+
+    """
+
+    outdata = bytearray()
+    position = 0
+
+    while True:
+        if number_of_scattered_bytes_left > 0:
+            length = min(len(indata) - position,
+                         number_of_scattered_bytes_left)
+            outdata += indata[position:position + length]
+            position += length
+            number_of_scattered_bytes_left -= length
+
+            if number_of_scattered_bytes_left > 0:
+                break
+
+        if position == len(indata):
+            break
+
+        kind = indata[position]
+
+        if kind not in [SCATTERED, REPEATED]:
+            raise Error(
+                'Expected kind scattered(0) or repeated(1), but got {}.'.format(
+                    kind))
+
+        try:
+            value, offset = unpack_size(indata, position + 1)
+        except IndexError:
+            break
+
+        if kind == SCATTERED:
+            number_of_scattered_bytes_left = value
+            position = offset
+        else:
+            if offset == len(indata):
+                break
+
+            outdata += value * indata[offset:offset + 1]
+            position = offset + 1
+
+    return outdata, position, number_of_scattered_bytes_left
 
 
 def pack_size(value):
@@ -253,3 +271,11 @@ def unpack_size(buf, position):
         position += 1
 
     return value, position
+
+
+try:
+    from .ccrle import compress_segments as _compress_segments
+    from .ccrle import decompress_segments as _decompress_segments
+except ImportError:
+    _compress_segments = compress_segments
+    _decompress_segments = decompress_segments
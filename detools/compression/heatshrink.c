@@ -0,0 +1,582 @@
+/**
+ * BSD 2-Clause License
+ *
+ * Copyright (c) 2019, Erik Moqvist
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions
+ * are met:
+ *
+ * * Redistributions of source code must retain the above copyright
+ *   notice, this list of conditions and the following disclaimer.
+ *
+ * * Redistributions in binary form must reproduce the above copyright
+ *   notice, this list of conditions and the following disclaimer in
+ *   the documentation and/or other materials provided with the
+ *   distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+ * "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+ * LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+ * FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+ * COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+ * INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+ * (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+ * SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+ * HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+ * STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+ * ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+ * OF THE POSSIBILITY OF SUCH DAMAGE.
+ */
+
+
+/*
+ * Python bindings of the heatshrink encoder and decoder in
+ * src/c/heatshrink.
+ */
+
+#include <stdint.h>
+#include <string.h>
+#include <Python.h>
+#include "heatshrink_encoder.h"
+#include "heatshrink_decoder.h"
+
+/* Patch data is sinked into the decoder in chunks of this size. */
+#define DECODER_INPUT_BUFFER_SIZE                         256
+
+/* Encoder output is polled in chunks of this size. */
+#define ENCODER_POLL_SIZE                                 512
+
+struct buf_t {
+    uint8_t *buf_p;
+    Py_ssize_t size;
+    Py_ssize_t capacity;
+};
+
+typedef struct {
+    PyObject_HEAD
+    heatshrink_encoder *encoder_p;
+} encoder_t;
+
+typedef struct {
+    PyObject_HEAD
+    heatshrink_decoder *decoder_p;
+} decoder_t;
+
+static PyObject *error_p = NULL;
+
+static int buf_reserve(struct buf_t *self_p, Py_ssize_t size)
+{
+    Py_ssize_t capacity;
+    uint8_t *buf_p;
+
+    if (size > PY_SSIZE_T_MAX - self_p->size) {
+        PyErr_NoMemory();
+
+        return (-1);
+    }
+
+    size += self_p->size;
+
+    if (size <= self_p->capacity) {
+        return (0);
+    }
+
+    capacity = self_p->capacity;
+
+    if (capacity < ENCODER_POLL_SIZE) {
+        capacity = ENCODER_POLL_SIZE;
+    }
+
+    while (capacity < size) {
+        if (capacity > PY_SSIZE_T_MAX / 2) {
+            capacity = size;
+        } else {
+            capacity *= 2;
+        }
+    }
+
+    buf_p = PyMem_Realloc(self_p->buf_p, (size_t)capacity);
+
+    if (buf_p == NULL) {
+        PyErr_NoMemory();
+
+        return (-1);
+    }
+
+    self_p->buf_p = buf_p;
+    self_p->capacity = capacity;
+
+    return (0);
+}
+
+static int check_sizes(int window_sz2, int lookahead_sz2)
+{
+    if ((window_sz2 < HEATSHRINK_MIN_WINDOW_BITS)
+        || (window_sz2 > HEATSHRINK_MAX_WINDOW_BITS)) {
+        PyErr_Format(error_p,
+                     "Expected heatshrink window size %d-%d, but got %d.",
+                     HEATSHRINK_MIN_WINDOW_BITS,
+                     HEATSHRINK_MAX_WINDOW_BITS,
+                     window_sz2);
+
+        return (-1);
+    }
+
+    if ((lookahead_sz2 < HEATSHRINK_MIN_LOOKAHEAD_BITS)
+        || (lookahead_sz2 >= window_sz2)) {
+        PyErr_Format(error_p,
+                     "Expected heatshrink lookahead size %d-%d, but got %d.",
+                     HEATSHRINK_MIN_LOOKAHEAD_BITS,
+                     window_sz2 - 1,
+                     lookahead_sz2);
+
+        return (-1);
+    }
+
+    return (0);
+}
+
+/**
+ * Poll all available output from given encoder.
+ */
+static int encoder_poll(heatshrink_encoder *encoder_p,
+                        struct buf_t *compressed_p)
+{
+    HSE_poll_res pres;
+    size_t size;
+
+    do {
+        if (buf_reserve(compressed_p, ENCODER_POLL_SIZE) != 0) {
+            return (-1);
+        }
+
+        pres = heatshrink_encoder_poll(
+            encoder_p,
+            &compressed_p->buf_p[compressed_p->size],
+            ENCODER_POLL_SIZE,
+            &size);
+
+        if (pres < 0) {
+            PyErr_SetString(error_p, "Heatshrink poll failed.");
+
+            return (-1);
+        }
+
+        compressed_p->size += (Py_ssize_t)size;
+    } while (pres == HSER_POLL_MORE);
+
+    return (0);
+}
+
+static int encoder_compress(heatshrink_encoder *encoder_p,
+                            struct buf_t *compressed_p,
+                            uint8_t *data_p,
+                            Py_ssize_t size)
+{
+    HSE_sink_res sres;
+    size_t sunk;
+
+    while (size > 0) {
+        sres = heatshrink_encoder_sink(encoder_p, data_p, (size_t)size, &sunk);
+
+        if (sres < 0) {
+            PyErr_SetString(error_p, "Heatshrink sink failed.");
+
+            return (-1);
+        }
+
+        data_p += sunk;
+        size -= (Py_ssize_t)sunk;
+
+        if (encoder_poll(encoder_p, compressed_p) != 0) {
+            return (-1);
+        }
+    }
+
+    return (0);
+}
+
+static int encoder_flush(heatshrink_encoder *encoder_p,
+                         struct buf_t *compressed_p)
+{
+    HSE_finish_res fres;
+
+    while (1) {
+        fres = heatshrink_encoder_finish(encoder_p);
+
+        if (fres == HSER_FINISH_DONE) {
+            break;
+        } else if (fres != HSER_FINISH_MORE) {
+            PyErr_SetString(error_p, "Heatshrink finish failed.");
+
+            return (-1);
+        }
+
+        if (encoder_poll(encoder_p, compressed_p) != 0) {
+            return (-1);
+        }
+    }
+
+    return (0);
+}
+
+static PyObject *buf_to_bytes(struct buf_t *buf_p, int res)
+{
+    PyObject *bytes_p;
+
+    bytes_p = NULL;
+
+    if (res == 0) {
+        bytes_p = PyBytes_FromStringAndSize((char *)buf_p->buf_p,
+                                            buf_p->size);
+    }
+
+    PyMem_Free(buf_p->buf_p);
+
+    return (bytes_p);
+}
+
+static PyObject *encoder_new(PyTypeObject *type_p,
+                             PyObject *args_p,
+                             PyObject *kwargs_p)
+{
+    int res;
+    int window_sz2;
+    int lookahead_sz2;
+    encoder_t *self_p;
+
+    (void)kwargs_p;
+
+    res = PyArg_ParseTuple(args_p, "ii", &window_sz2, &lookahead_sz2);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    if (check_sizes(window_sz2, lookahead_sz2) != 0) {
+        return (NULL);
+    }
+
+    self_p = (encoder_t *)type_p->tp_alloc(type_p, 0);
+
+    if (self_p == NULL) {
+        return (NULL);
+    }
+
+    self_p->encoder_p = heatshrink_encoder_alloc((uint8_t)window_sz2,
+                                                 (uint8_t)lookahead_sz2);
+
+    if (self_p->encoder_p == NULL) {
+        Py_DECREF(self_p);
+
+        return (PyErr_NoMemory());
+    }
+
+    return ((PyObject *)self_p);
+}
+
+static void encoder_dealloc(encoder_t *self_p)
+{
+    if (self_p->encoder_p != NULL) {
+        heatshrink_encoder_free(self_p->encoder_p);
+    }
+
+    Py_TYPE(self_p)->tp_free((PyObject *)self_p);
+}
+
+/**
+ * def compress(self, data) -> bytes
+ */
+static PyObject *m_encoder_compress(encoder_t *self_p, PyObject *args_p)
+{
+    int res;
+    Py_buffer data;
+    struct buf_t compressed;
+
+    res = PyArg_ParseTuple(args_p, "y*", &data);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    compressed.buf_p = NULL;
+    compressed.size = 0;
+    compressed.capacity = 0;
+    res = encoder_compress(self_p->encoder_p,
+                           &compressed,
+                           (uint8_t *)data.buf,
+                           data.len);
+    PyBuffer_Release(&data);
+
+    return (buf_to_bytes(&compressed, res));
+}
+
+/**
+ * def flush(self) -> bytes
+ */
+static PyObject *m_encoder_flush(encoder_t *self_p, PyObject *args_p)
+{
+    int res;
+    struct buf_t compressed;
+
+    (void)args_p;
+
+    compressed.buf_p = NULL;
+    compressed.size = 0;
+    compressed.capacity = 0;
+    res = encoder_flush(self_p->encoder_p, &compressed);
+
+    return (buf_to_bytes(&compressed, res));
+}
+
+static PyObject *decoder_new(PyTypeObject *type_p,
+                             PyObject *args_p,
+                             PyObject *kwargs_p)
+{
+    int res;
+    int window_sz2;
+    int lookahead_sz2;
+    decoder_t *self_p;
+
+    (void)kwargs_p;
+
+    res = PyArg_ParseTuple(args_p, "ii", &window_sz2, &lookahead_sz2);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    if (check_sizes(window_sz2, lookahead_sz2) != 0) {
+        return (NULL);
+    }
+
+    self_p = (decoder_t *)type_p->tp_alloc(type_p, 0);
+
+    if (self_p == NULL) {
+        return (NULL);
+    }
+
+    self_p->decoder_p = heatshrink_decoder_alloc(DECODER_INPUT_BUFFER_SIZE,
+                                                 (uint8_t)window_sz2,
+                                                 (uint8_t)lookahead_sz2);
+
+    if (self_p->decoder_p == NULL) {
+        Py_DECREF(self_p);
+
+        return (PyErr_NoMemory());
+    }
+
+    return ((PyObject *)self_p);
+}
+
+static void decoder_dealloc(decoder_t *self_p)
+{
+    if (self_p->decoder_p != NULL) {
+        heatshrink_decoder_free(self_p->decoder_p);
+    }
+
+    Py_TYPE(self_p)->tp_free((PyObject *)self_p);
+}
+
+/**
+ * Decompress up to given number of bytes into given buffer. Returns
+ * the number of consumed bytes, or -1 on failure.
+ */
+static Py_ssize_t decoder_decompress(heatshrink_decoder *decoder_p,
+                                     uint8_t *data_p,
+                                     Py_ssize_t data_size,
+                                     uint8_t *buf_p,
+                                     Py_ssize_t *size_p)
+{
+    HSD_poll_res pres;
+    HSD_sink_res sres;
+    Py_ssize_t consumed;
+    Py_ssize_t offset;
+    size_t size;
+
+    consumed = 0;
+    offset = 0;
+
+    while (offset < *size_p) {
+        pres = heatshrink_decoder_poll(decoder_p,
+                                       &buf_p[offset],
+                                       (size_t)(*size_p - offset),
+                                       &size);
+
+        if (pres < 0) {
+            PyErr_SetString(error_p, "Heatshrink poll failed.");
+
+            return (-1);
+        }
+
+        offset += (Py_ssize_t)size;
+
+        if ((pres == HSDR_POLL_MORE) || (consumed == data_size)) {
+            break;
+        }
+
+        sres = heatshrink_decoder_sink(decoder_p,
+                                       &data_p[consumed],
+                                       (size_t)(data_size - consumed),
+                                       &size);
+
+        if (sres < 0) {
+            PyErr_SetString(error_p, "Heatshrink sink failed.");
+
+            return (-1);
+        }
+
+        consumed += (Py_ssize_t)size;
+    }
+
+    *size_p = offset;
+
+    return (consumed);
+}
+
+/**
+ * def decompress(self, data, size) -> (bytes, int)
+ *
+ * Returns at most `size` decompressed bytes and the number of consumed
+ * bytes in `data`. Unconsumed data must be given again in next call.
+ */
+static PyObject *m_decoder_decompress(decoder_t *self_p, PyObject *args_p)
+{
+    int res;
+    Py_buffer data;
+    Py_ssize_t size;
+    Py_ssize_t consumed;
+    PyObject *decompressed_p;
+
+    res = PyArg_ParseTuple(args_p, "y*n", &data, &size);
+
+    if (res == 0) {
+        return (NULL);
+    }
+
+    if (size < 0) {
+        size = 0;
+    }
+
+    decompressed_p = PyBytes_FromStringAndSize(NULL, size);
+
+    if (decompressed_p == NULL) {
+        PyBuffer_Release(&data);
+
+        return (NULL);
+    }
+
+    consumed = decoder_decompress(
+        self_p->decoder_p,
+        (uint8_t *)data.buf,
+        data.len,
+        (uint8_t *)PyBytes_AS_STRING(decompressed_p),
+        &size);
+    PyBuffer_Release(&data);
+
+    if (consumed < 0) {
+        Py_DECREF(decompressed_p);
+
+        return (NULL);
+    }
+
+    if (_PyBytes_Resize(&decompressed_p, size) != 0) {
+        return (NULL);
+    }
+
+    return (Py_BuildValue("(Nn)", decompressed_p, consumed));
+}
+
+static PyMethodDef encoder_methods[] = {
+    { "compress", (PyCFunction)m_encoder_compress, METH_VARARGS },
+    { "flush", (PyCFunction)m_encoder_flush, METH_NOARGS },
+    { NULL }
+};
+
+static PyMethodDef decoder_methods[] = {
+    { "decompress", (PyCFunction)m_decoder_decompress, METH_VARARGS },
+    { NULL }
+};
+
+static PyTypeObject encoder_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "detools.compression.cheatshrink.Encoder",
+    .tp_basicsize = sizeof(encoder_t),
+    .tp_dealloc = (destructor)encoder_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_methods = encoder_methods,
+    .tp_new = encoder_new
+};
+
+static PyTypeObject decoder_type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "detools.compression.cheatshrink.Decoder",
+    .tp_basicsize = sizeof(decoder_t),
+    .tp_dealloc = (destructor)decoder_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_methods = decoder_methods,
+    .tp_new = decoder_new
+};
+
+static PyModuleDef module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "cheatshrink",
+    .m_doc = NULL,
+    .m_size = -1
+};
+
+PyMODINIT_FUNC PyInit_cheatshrink(void)
+{
+    PyObject *m_p;
+    PyObject *errors_p;
+
+    errors_p = PyImport_ImportModule("detools.errors");
+
+    if (errors_p == NULL) {
+        return (NULL);
+    }
+
+    error_p = PyObject_GetAttrString(errors_p, "Error");
+    Py_DECREF(errors_p);
+
+    if (error_p == NULL) {
+        return (NULL);
+    }
+
+    if (PyType_Ready(&encoder_type) < 0) {
+        return (NULL);
+    }
+
+    if (PyType_Ready(&decoder_type) < 0) {
+        return (NULL);
+    }
+
+    /* Module creation. */
+    m_p = PyModule_Create(&module);
+
+    if (m_p == NULL) {
+        return (NULL);
+    }
+
+    Py_INCREF(&encoder_type);
+
+    if (PyModule_AddObject(m_p, "Encoder", (PyObject *)&encoder_type) < 0) {
+        Py_DECREF(&encoder_type);
+        Py_DECREF(m_p);
+
+        return (NULL);
+    }
+
+    Py_INCREF(&decoder_type);
+
+    if (PyModule_AddObject(m_p, "Decoder", (PyObject *)&decoder_type) < 0) {
+        Py_DECREF(&decoder_type);
+        Py_DECREF(m_p);
+
+        return (NULL);
+    }
+
+    return (m_p);
+}
@@ -1,52 +1,131 @@
-"""Heatshrink wrapper.
+"""Heatshrink wrapper, using the encoder and decoder in src/c/heatshrink.
+
+Patches with compression heatshrink use a window size of 8 and a
+lookahead size of 7, as 2-logarithms. Other sizes are stored in a
+header byte at the start of the compressed data, with the window size
+in the upper four bits and the lookahead size in the lower four bits,
+and the patch uses compression number
+``COMPRESSION_HEATSHRINK_SIZES`` to not be misread by decoders
+without header support.
 
 """
 
+import bitstruct
+from ..errors import Error
+
 try:
-    from heatshrink.core import Writer
-    from heatshrink.core import Reader
-    from heatshrink.core import Encoder
+    from .cheatshrink import Encoder
+    from .cheatshrink import Decoder
 except ImportError:
-    print('detools: Failed to import heatshrink.')
+    print('detools: Failed to import the heatshrink C extension.')
+
+
+DEFAULT_WINDOW_SZ2 = 8
+DEFAULT_LOOKAHEAD_SZ2 = 7
+
+
+def has_header(window_sz2, lookahead_sz2):
+    return (window_sz2 != DEFAULT_WINDOW_SZ2
+            or lookahead_sz2 != DEFAULT_LOOKAHEAD_SZ2)
+
+
+def pack_header(window_sz2, lookahead_sz2):
+    if not 4 <= window_sz2 <= 15:
+        raise Error(
+            'Expected heatshrink window size 4-15, but got {}.'.format(
+                window_sz2))
+
+    if not 3 <= lookahead_sz2 < window_sz2:
+        raise Error(
+            'Expected heatshrink lookahead size 3-{}, but got {}.'.format(
+                window_sz2 - 1,
+                lookahead_sz2))
+
+    return bitstruct.pack('u4u4', window_sz2, lookahead_sz2)
+
+
+def unpack_header(data):
+    return bitstruct.unpack('u4u4', data)
 
 
 class HeatshrinkCompressor(object):
 
-    def __init__(self):
-        self._encoder = Encoder(Writer(window_sz2=8, lookahead_sz2=7))
+    def __init__(self, window_sz2, lookahead_sz2):
+        self._data = pack_header(window_sz2, lookahead_sz2)
+
+        if not has_header(window_sz2, lookahead_sz2):
+            self._data = b''
+
+        self._encoder = Encoder(window_sz2, lookahead_sz2)
 
     def compress(self, data):
-        return self._encoder.fill(data)
+        compressed = self._data + self._encoder.compress(data)
+        self._data = b''
+
+        return compressed
 
     def flush(self):
-        return self._encoder.finish()
+        compressed = self._data + self._encoder.flush()
+        self._data = b''
+
+        return compressed
 
 
 class HeatshrinkDecompressor(object):
 
-    def __init__(self, number_of_bytes):
-        self._number_of_bytes_left = number_of_bytes
-        self._data = b''
-        self._encoder = Encoder(Reader(window_sz2=8, lookahead_sz2=7))
+    def __init__(self, number_of_bytes, header=False):
+        self._number_of_indata_bytes_left = number_of_bytes
+        self._indata = bytearray()
+
+        if header:
+            self._decoder = None
+        else:
+            self._decoder = Decoder(DEFAULT_WINDOW_SZ2, DEFAULT_LOOKAHEAD_SZ2)
+
+        self._output_pending = False
 
     def decompress(self, data, size):
-        if self._number_of_bytes_left > 0:
-            self._data += self._encoder.fill(data)
-            self._number_of_bytes_left -= len(data)
+        """Decompress up to size bytes. Compressed data not yet consumed by
+        the decoder is kept until next call, so at most `size` bytes
+        are decompressed.
+
+        """
+
+        if self.eof:
+            raise Error('Already at end of stream.')
+
+        if len(data) > self._number_of_indata_bytes_left:
+            data = data[:self._number_of_indata_bytes_left]
+
+        self._indata += data
+        self._number_of_indata_bytes_left -= len(data)
+
+        if self._decoder is None:
+            if not self._indata:
+                return b''
+
+            window_sz2, lookahead_sz2 = unpack_header(bytes(self._indata[:1]))
+            self._decoder = Decoder(window_sz2, lookahead_sz2)
+            del self._indata[:1]
 
-        if self._number_of_bytes_left == 0:
-            self._data += self._encoder.finish()
-            self._number_of_bytes_left = -1
+        decompressed, consumed = self._decoder.decompress(self._indata, size)
+        del self._indata[:consumed]
 
-        decompressed = self._data[:size]
-        self._data = self._data[size:]
+        # The decoder may have more output if the output was limited
+        # by size.
+        self._output_pending = (len(decompressed) > 0
+                                and len(decompressed) == size)
 
         return decompressed
 
     @property
     def needs_input(self):
-        return self._data == b'' and not self.eof
+        return (len(self._indata) == 0
+                and not self._output_pending
+                and not self.eof)
 
     @property
     def eof(self):
-        return self._number_of_bytes_left == -1 and self._data == b''
+        return (self._number_of_indata_bytes_left == 0
+                and len(self._indata) == 0
+                and not self._output_pending)
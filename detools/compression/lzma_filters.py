@@ -0,0 +1,212 @@
+"""LZMA compression with tuned options.
+
+Default patches are compressed in the legacy .lzma format with the
+default options and an 8 MiB dictionary. The legacy format also
+stores given lc, lp, pb and dictionary size options. Branch converter
+(BCJ) filters need the .xz format, which describes its filter chain
+in the stream, without integrity check. Decoders detect the format
+from the first bytes.
+
+"""
+
+import lzma
+from ..errors import Error
+from ..common import format_or
+
+
+BCJ_FILTERS = {
+    'arm': lzma.FILTER_ARM,
+    'arm-thumb': lzma.FILTER_ARMTHUMB,
+    'ia64': lzma.FILTER_IA64,
+    'powerpc': lzma.FILTER_POWERPC,
+    'sparc': lzma.FILTER_SPARC,
+    'x86': lzma.FILTER_X86
+}
+
+OPTIONS = ['bcj', 'dict_size', 'lc', 'lp', 'pb']
+
+MINIMUM_DICT_SIZE = 4096
+MAXIMUM_DICT_SIZE = 1536 * 1024 * 1024
+
+# BCJ filter to try per data format when auto-tuning. Python's lzma
+# module has no ARM64 filter, and there is no Xtensa filter.
+DATA_FORMAT_BCJ_FILTERS = {
+    'arm-cortex-m4': 'arm-thumb',
+    'aarch64': None,
+    'xtensa-lx106': None
+}
+
+# lc, lp and pb combinations to try when auto-tuning. Diff streams are
+# byte oriented, so pb=0 often wins, even for code.
+AUTO_LITERAL_AND_POSITION_BITS = [
+    (3, 0, 2),
+    (3, 0, 0),
+    (0, 0, 0),
+    (0, 1, 1)
+]
+
+
+def check_options(options):
+    """Raises an error if given dictionary of LZMA options is not valid.
+
+    """
+
+    for name in options:
+        if name not in OPTIONS:
+            raise Error(
+                'Expected LZMA option {}, but got {}.'.format(
+                    format_or(OPTIONS),
+                    name))
+
+    bcj = options.get('bcj')
+
+    if bcj is not None and bcj not in BCJ_FILTERS:
+        raise Error(
+            'Expected LZMA BCJ filter {}, but got {}.'.format(
+                format_or(sorted(BCJ_FILTERS)),
+                bcj))
+
+    for name in ['lc', 'lp', 'pb']:
+        value = options.get(name, 0)
+
+        if not 0 <= value <= 4:
+            raise Error(
+                'Expected LZMA {} 0-4, but got {}.'.format(name, value))
+
+    lc = options.get('lc', 3)
+    lp = options.get('lp', 0)
+
+    if lc + lp > 4:
+        raise Error(
+            'Expected LZMA lc plus lp at most 4, but got {}.'.format(lc + lp))
+
+    dict_size = options.get('dict_size', MINIMUM_DICT_SIZE)
+
+    if not MINIMUM_DICT_SIZE <= dict_size <= MAXIMUM_DICT_SIZE:
+        raise Error(
+            'Expected LZMA dictionary size {}-{}, but got {}.'.format(
+                MINIMUM_DICT_SIZE,
+                MAXIMUM_DICT_SIZE,
+                dict_size))
+
+
+def fitted_dict_size(size):
+    """Returns the smallest power of two dictionary size that fits given
+    number of bytes. A bigger dictionary does not give a smaller
+    patch, but needs more RAM when decompressing.
+
+    """
+
+    return max(MINIMUM_DICT_SIZE, 1 << (size - 1).bit_length())
+
+
+def create_lzma_compressor(options):
+    """Returns a LZMA compressor with given options. The legacy .lzma
+    format is used if no BCJ filter is given.
+
+    """
+
+    filter_options = {
+        'preset': lzma.PRESET_DEFAULT
+    }
+
+    for name in ['dict_size', 'lc', 'lp', 'pb']:
+        if name in options:
+            filter_options[name] = options[name]
+
+    bcj = options.get('bcj')
+
+    if bcj is None:
+        filter_options['id'] = lzma.FILTER_LZMA1
+        compressor = lzma.LZMACompressor(format=lzma.FORMAT_ALONE,
+                                         filters=[filter_options])
+    else:
+        filter_options['id'] = lzma.FILTER_LZMA2
+        compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ,
+                                         check=lzma.CHECK_NONE,
+                                         filters=[
+                                             {'id': BCJ_FILTERS[bcj]},
+                                             filter_options
+                                         ])
+
+    return compressor
+
+
+def auto_options(data_format, size):
+    """Returns the LZMA options to try when auto-tuning compression of
+    `size` bytes of given data format.
+
+    """
+
+    bcjs = [None]
+    bcj = DATA_FORMAT_BCJ_FILTERS.get(data_format)
+
+    if bcj is not None:
+        bcjs.append(bcj)
+
+    dict_size = fitted_dict_size(size)
+    candidates = []
+
+    for bcj in bcjs:
+        for lc, lp, pb in AUTO_LITERAL_AND_POSITION_BITS:
+            options = {
+                'dict_size': dict_size,
+                'lc': lc,
+                'lp': lp,
+                'pb': pb
+            }
+
+            if bcj is not None:
+                options['bcj'] = bcj
+
+            candidates.append(options)
+
+    return candidates
+
+
+class LzmaCompressor(object):
+    """LZMA compressor with given options, a dictionary with the
+    optional keys ``'bcj'``, ``'dict_size'``, ``'lc'``, ``'lp'`` and
+    ``'pb'``.
+
+    """
+
+    def __init__(self, options):
+        check_options(options)
+        self._compressor = create_lzma_compressor(options)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class LzmaAutoCompressor(object):
+    """Buffers all data and compresses it with the LZMA options for given
+    data format that gives the smallest output, when flushed.
+
+    """
+
+    def __init__(self, data_format):
+        self._data_format = data_format
+        self._data = bytearray()
+
+    def compress(self, data):
+        self._data += data
+
+        return b''
+
+    def flush(self):
+        best = None
+
+        for options in auto_options(self._data_format, len(self._data)):
+            compressor = create_lzma_compressor(options)
+            compressed = compressor.compress(self._data) + compressor.flush()
+
+            if best is None or len(compressed) < len(best):
+                best = compressed
+
+        self._data = bytearray()
+
+        return best
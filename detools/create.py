@@ -7,8 +7,14 @@ from .errors import Error
 from .compression.crle import CrleCompressor
 from .compression.none import NoneCompressor
 from .compression.heatshrink import HeatshrinkCompressor
+from .compression.heatshrink import has_header as heatshrink_has_header
+from .compression.lzma_filters import LzmaCompressor
+from .compression.lzma_filters import LzmaAutoCompressor
 from .common import PATCH_TYPE_NORMAL
 from .common import PATCH_TYPE_IN_PLACE
+from .common import PATCH_TYPE_IN_PLACE_UNCHANGED
+from .common import SEGMENT_UNCHANGED
+from .common import COMPRESSION_HEATSHRINK_SIZES
 from .common import DATA_FORMATS
 from .common import format_bad_compression_string
 from .common import compression_string_to_number
@@ -17,6 +23,7 @@ from .common import file_size
 from .common import file_read
 from .common import pack_size
 from .common import DataSegment
+from .common import MemoryFile
 from .common import unpack_size_bytes
 from .data_format import encode as data_format_encode
 
@@ -33,9 +40,31 @@ def pack_header(patch_type, compression):
     return bitstruct.pack('p1u3u4', patch_type, compression)
 
 
-def create_compressor(compression):
+def compression_to_number(compression,
+                          heatshrink_window_sz2,
+                          heatshrink_lookahead_sz2):
+    number = compression_string_to_number(compression)
+
+    if compression == 'heatshrink':
+        if heatshrink_has_header(heatshrink_window_sz2,
+                                 heatshrink_lookahead_sz2):
+            number = COMPRESSION_HEATSHRINK_SIZES
+
+    return number
+
+
+def create_compressor(compression,
+                      heatshrink_window_sz2,
+                      heatshrink_lookahead_sz2,
+                      lzma_options,
+                      data_format):
     if compression == 'lzma':
-        compressor = lzma.LZMACompressor(format=lzma.FORMAT_ALONE)
+        if lzma_options is None:
+            compressor = lzma.LZMACompressor(format=lzma.FORMAT_ALONE)
+        elif lzma_options == 'auto':
+            compressor = LzmaAutoCompressor(data_format)
+        else:
+            compressor = LzmaCompressor(lzma_options)
     elif compression == 'bz2':
         compressor = BZ2Compressor()
     elif compression == 'none':
@@ -43,45 +72,42 @@ def create_compressor(compression):
     elif compression == 'crle':
         compressor = CrleCompressor()
     elif compression == 'heatshrink':
-        compressor = HeatshrinkCompressor()
+        compressor = HeatshrinkCompressor(heatshrink_window_sz2,
+                                          heatshrink_lookahead_sz2)
     else:
         raise Error(format_bad_compression_string(compression))
 
     return compressor
 
 
-def create_patch_normal_data(ffrom,
-                             fto,
-                             fpatch,
-                             compression,
-                             data_format,
-                             data_segment):
-    to_size = file_size(fto)
+def create_data_format_patch(ffrom, fto, data_format, data_segment):
+    """Returns the new from-data and to-data files, along with the data
+    format patch, prefixed by its size.
 
-    if to_size == 0:
-        return
-
-    compressor = create_compressor(compression)
+    """
 
     if data_format is None:
-        dfpatch = pack_size(0)
-    else:
-        ffrom, fto, patch = data_format_encode(
-            ffrom,
-            fto,
-            data_format,
-            data_segment)
-
-        # with open('data-format-from.bin', 'wb') as fout:
-        #     fout.write(file_read(ffrom))
-        #
-        # with open('data-format-to.bin', 'wb') as fout:
-        #     fout.write(file_read(fto))
-
-        dfpatch = pack_size(len(patch))
-        dfpatch += pack_size(DATA_FORMATS[data_format])
-        dfpatch += patch
+        return ffrom, fto, pack_size(0)
+
+    ffrom, fto, patch = data_format_encode(ffrom,
+                                           fto,
+                                           data_format,
+                                           data_segment)
+
+    # with open('data-format-from.bin', 'wb') as fout:
+    #     fout.write(file_read(ffrom))
+    #
+    # with open('data-format-to.bin', 'wb') as fout:
+    #     fout.write(file_read(fto))
 
+    dfpatch = pack_size(len(patch))
+    dfpatch += pack_size(DATA_FORMATS[data_format])
+    dfpatch += patch
+
+    return ffrom, fto, dfpatch
+
+
+def write_patch_normal_data(ffrom, fto, fpatch, compressor, dfpatch):
     fpatch.write(compressor.compress(dfpatch))
     from_data = file_read(ffrom)
     suffix_array = sais.sais(from_data)
@@ -98,19 +124,53 @@ def create_patch_normal_data(ffrom,
     fpatch.write(compressor.flush())
 
 
+def create_patch_normal_data(ffrom,
+                             fto,
+                             fpatch,
+                             compression,
+                             heatshrink_window_sz2,
+                             heatshrink_lookahead_sz2,
+                             lzma_options,
+                             data_format,
+                             data_segment):
+    to_size = file_size(fto)
+
+    if to_size == 0:
+        return
+
+    compressor = create_compressor(compression,
+                                   heatshrink_window_sz2,
+                                   heatshrink_lookahead_sz2,
+                                   lzma_options,
+                                   data_format)
+    ffrom, fto, dfpatch = create_data_format_patch(ffrom,
+                                                   fto,
+                                                   data_format,
+                                                   data_segment)
+    write_patch_normal_data(ffrom, fto, fpatch, compressor, dfpatch)
+
+
 def create_patch_normal(ffrom,
                         fto,
                         fpatch,
                         compression,
+                        heatshrink_window_sz2,
+                        heatshrink_lookahead_sz2,
+                        lzma_options,
                         data_format,
                         data_segment):
     fpatch.write(pack_header(PATCH_TYPE_NORMAL,
-                             compression_string_to_number(compression)))
+                             compression_to_number(compression,
+                                                   heatshrink_window_sz2,
+                                                   heatshrink_lookahead_sz2)))
     fpatch.write(pack_size(file_size(fto)))
     create_patch_normal_data(ffrom,
                              fto,
                              fpatch,
                              compression,
+                             heatshrink_window_sz2,
+                             heatshrink_lookahead_sz2,
+                             lzma_options,
                              data_format,
                              data_segment)
 
@@ -132,15 +192,39 @@ def calc_shift(memory_size, segment_size, minimum_shift_size, from_size):
     return shift_size
 
 
+def is_segment_unchanged(from_data,
+                         shifted_from_data,
+                         shift_size,
+                         to_offset,
+                         to_data):
+    """Returns True if given to-data segment is already in memory once
+    the from-data has been shifted. Memory below the shift size is
+    left as is by the shift.
+
+    """
+
+    if to_offset < shift_size:
+        memory_data = from_data[to_offset:to_offset + len(to_data)]
+    else:
+        to_offset -= shift_size
+        memory_data = shifted_from_data[to_offset:to_offset + len(to_data)]
+
+    return memory_data == to_data
+
+
 def create_patch_in_place(ffrom,
                           fto,
                           fpatch,
                           compression,
+                          heatshrink_window_sz2,
+                          heatshrink_lookahead_sz2,
+                          lzma_options,
                           memory_size,
                           segment_size,
                           minimum_shift_size,
                           data_format,
-                          data_segment):
+                          data_segment,
+                          unchanged_segments):
     if (memory_size % segment_size) != 0:
         raise Error(
             'Memory size {} is not a multiple of segment size {}.'.format(
@@ -156,37 +240,66 @@ def create_patch_in_place(ffrom,
                 minimum_shift_size,
                 segment_size))
 
-    from_data = ffrom.read()
-    from_size = len(from_data)
-    to_data = fto.read()
-    to_size = len(to_data)
+    memory_from_data = ffrom.read()
+    from_size = len(memory_from_data)
+    memory_to_data = fto.read()
+    to_size = len(memory_to_data)
     shift_size = calc_shift(memory_size,
                             segment_size,
                             minimum_shift_size,
-                            len(from_data))
+                            from_size)
     shifted_size = (memory_size - shift_size)
-    from_data = from_data[:shifted_size]
+    shifted_from_data = memory_from_data[:shifted_size]
     number_of_to_segments = div_ceil(to_size, segment_size)
 
-    # Create a normal patch for each segment.
+    # The data format is encoded once for the whole image, and its
+    # patch is stored in the first segment.
+    ffrom, fto, dfpatch = create_data_format_patch(BytesIO(shifted_from_data),
+                                                   BytesIO(memory_to_data),
+                                                   data_format,
+                                                   data_segment)
+    from_data = file_read(ffrom)
+    to_data = file_read(fto)
+
+    # Create a normal patch for each segment, except for segments
+    # already in memory, which are neither erased nor written, if
+    # enabled.
     fsegments = BytesIO()
 
     for segment in range(number_of_to_segments):
         to_offset = (segment * segment_size)
+
+        if unchanged_segments and dfpatch == pack_size(0):
+            if is_segment_unchanged(
+                    memory_from_data,
+                    shifted_from_data,
+                    shift_size,
+                    to_offset,
+                    memory_to_data[to_offset:to_offset + segment_size]):
+                fsegments.write(pack_size(SEGMENT_UNCHANGED))
+                continue
+
         from_offset = max(to_offset + segment_size - shift_size, 0)
-        fsegment = BytesIO()
-        create_patch_normal_data(
+        write_patch_normal_data(
             BytesIO(from_data[from_offset:]),
             BytesIO(to_data[to_offset:to_offset + segment_size]),
-            fsegment,
-            'none',
-            data_format,
-            data_segment)
-        fsegments.write(fsegment.getvalue())
-
-    # Create the patch.
-    fpatch.write(pack_header(PATCH_TYPE_IN_PLACE,
-                             compression_string_to_number(compression)))
+            fsegments,
+            NoneCompressor(),
+            dfpatch)
+        dfpatch = pack_size(0)
+
+    # Create the patch. Unchanged segment markers need a patch type
+    # of their own, as appliers without support for them would
+    # misread them as data format patch sizes.
+    if unchanged_segments:
+        patch_type = PATCH_TYPE_IN_PLACE_UNCHANGED
+    else:
+        patch_type = PATCH_TYPE_IN_PLACE
+
+    fpatch.write(pack_header(patch_type,
+                             compression_to_number(compression,
+                                                   heatshrink_window_sz2,
+                                                   heatshrink_lookahead_sz2)))
     fpatch.write(pack_size(memory_size))
     fpatch.write(pack_size(segment_size))
     fpatch.write(pack_size(shift_size))
@@ -196,7 +309,11 @@ def create_patch_in_place(ffrom,
     if to_size == 0:
         return
 
-    compressor = create_compressor(compression)
+    compressor = create_compressor(compression,
+                                   heatshrink_window_sz2,
+                                   heatshrink_lookahead_sz2,
+                                   lzma_options,
+                                   data_format)
     fpatch.write(compressor.compress(fsegments.getvalue()))
     fpatch.write(compressor.flush())
 
@@ -267,18 +384,43 @@ def create_patch(ffrom,
                  to_data_begin=0,
                  to_data_end=0,
                  to_code_begin=0,
-                 to_code_end=0):
+                 to_code_end=0,
+                 heatshrink_window_sz2=8,
+                 heatshrink_lookahead_sz2=7,
+                 lzma_options=None,
+                 unchanged_segments=False):
     """Create a patch from `ffrom` to `fto` and write it to `fpatch`. All
     three arguments are file-like objects.
 
-    `compression` must be ``'bz2'``, ``'crle'``, ``'lzma'`` or
-    ``'none'``.
+    `compression` must be ``'bz2'``, ``'crle'``, ``'heatshrink'``,
+    ``'lzma'`` or ``'none'``.
 
     `patch_type` must be ``'normal'``, ``'in-place'`` or ``'bsdiff'``.
 
     `memory_size`, `segment_size` and `minimum_shift_size` are used
     when creating an in-place patch.
 
+    Give `unchanged_segments` as ``True`` to mark in-place to-data
+    segments already in memory after the shift, which are then neither
+    erased nor written when applying the patch. Such patches can only
+    be applied by detools versions supporting the marker.
+
+    `heatshrink_window_sz2` and `heatshrink_lookahead_sz2` are the
+    heatshrink window and lookahead sizes as 2-logarithms. Sizes other
+    than the default 8 and 7 are stored in the patch, which can only
+    be applied by detools versions supporting them. A bigger window
+    often gives a smaller patch, but the decoder needs
+    ``2 ** heatshrink_window_sz2`` bytes of RAM for it.
+
+    `lzma_options` tunes LZMA compression. It is ``None`` for the
+    default options, ``'auto'`` to try options suitable for
+    `data_format` and keep the smallest patch, or a dictionary with
+    the optional keys ``'bcj'``, ``'dict_size'``, ``'lc'``, ``'lp'``
+    and ``'pb'``. ``'bcj'`` is a branch converter filter, one of
+    ``'arm'``, ``'arm-thumb'``, ``'ia64'``, ``'powerpc'``,
+    ``'sparc'`` and ``'x86'``. The decoder needs a dictionary sized
+    buffer, so a small `dict_size` saves RAM.
+
     >>> ffrom = open('foo.old', 'rb')
     >>> fto = open('foo.new', 'rb')
     >>> fpatch = open('foo.patch', 'wb')
@@ -304,6 +446,9 @@ def create_patch(ffrom,
                             fto,
                             fpatch,
                             compression,
+                            heatshrink_window_sz2,
+                            heatshrink_lookahead_sz2,
+                            lzma_options,
                             data_format,
                             data_segment)
     elif patch_type == 'in-place':
@@ -311,17 +456,38 @@ def create_patch(ffrom,
                               fto,
                               fpatch,
                               compression,
+                              heatshrink_window_sz2,
+                              heatshrink_lookahead_sz2,
+                              lzma_options,
                               memory_size,
                               segment_size,
                               minimum_shift_size,
                               data_format,
-                              data_segment)
+                              data_segment,
+                              unchanged_segments)
     elif patch_type == 'bsdiff':
         create_patch_bsdiff(ffrom, fto, fpatch)
     else:
         raise Error("Bad patch type '{}'.".format(patch_type))
 
 
+def create_patch_bytes(from_buf, to_buf, **kwargs):
+    """Same as :func:`~detools.create_patch()`, but with bytes-like
+    objects instead of file-like objects. The given buffers are used
+    as is, without being copied. Returns the patch as bytes.
+
+    Keyword arguments are passed to :func:`~detools.create_patch()`.
+
+    >>> patch = create_patch_bytes(b'0123456789', b'01234567890')
+
+    """
+
+    fpatch = BytesIO()
+    create_patch(MemoryFile(from_buf), MemoryFile(to_buf), fpatch, **kwargs)
+
+    return fpatch.getvalue()
+
+
 def create_patch_filenames(fromfile,
                            tofile,
                            patchfile,
@@ -342,7 +508,11 @@ def create_patch_filenames(fromfile,
                            to_data_begin=0,
                            to_data_end=0,
                            to_code_begin=0,
-                           to_code_end=0):
+                           to_code_end=0,
+                           heatshrink_window_sz2=8,
+                           heatshrink_lookahead_sz2=7,
+                           lzma_options=None,
+                           unchanged_segments=False):
     """Same as :func:`~detools.create_patch()`, but with filenames instead
     of file-like objects.
 
@@ -373,4 +543,8 @@ def create_patch_filenames(fromfile,
                              to_data_begin,
                              to_data_end,
                              to_code_begin,
-                             to_code_end)
+                             to_code_end,
+                             heatshrink_window_sz2,
+                             heatshrink_lookahead_sz2,
+                             lzma_options,
+                             unchanged_segments)
@@ -68,8 +68,6 @@ class DiffReader(UtilsDiffReader):
         if code_pointers_blocks is not None:
             self._write_u64_values_to_to(code_pointers_blocks, code_pointers)
 
-        self._fdiff.seek(0)
-
     def _write_add_values_to_to(self, blocks, from_dict):
         self._write_values_to_to_with_callback(blocks, from_dict, self._pack_add)
 
@@ -55,8 +55,6 @@ class DiffReader(UtilsDiffReader):
         if code_pointers_blocks is not None:
             self._write_s32_values_to_to(code_pointers_blocks, code_pointers)
 
-        self._fdiff.seek(0)
-
     def _write_bw_values_to_to(self, bw_blocks, bw):
         self._write_values_to_to_with_callback(bw_blocks, bw, self._pack_bw)
 
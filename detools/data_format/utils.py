@@ -4,8 +4,10 @@ from io import BytesIO
 from io import StringIO
 import difflib
 import textwrap
+from array import array
+from bisect import bisect_left
 from contextlib import redirect_stdout
-from ..common import file_read
+from ..common import file_size
 from ..common import pack_size
 from ..common import unpack_size
 from ..common import pack_usize
@@ -88,14 +90,78 @@ class Blocks(object):
 
 
 class DiffReader(object):
+    """Diff data calculated in :meth:`read()` from sorted tables of patch
+    points. Memory usage is proportional to the number of patch
+    points, not the to-size.
+
+    """
 
     def __init__(self, ffrom, to_size):
         self._ffrom = ffrom
-        # ToDo: Calculate in read() for less memory usage.
-        self._fdiff = BytesIO(b'\x00' * to_size)
+        self._to_size = to_size
+        self._position = 0
+        self._points = []
+        self._addresses = None
+        self._orders = None
+        self._offsets = None
+        self._data = None
+        self._maximum_size = 0
 
     def read(self, size=-1):
-        return self._fdiff.read(size)
+        if self._addresses is None:
+            self._create_tables()
+
+        begin = min(self._position, self._to_size)
+
+        if size < 0:
+            end = self._to_size
+        else:
+            end = min(begin + size, self._to_size)
+
+        buf = bytearray(end - begin)
+        first = bisect_left(self._addresses, begin - self._maximum_size + 1)
+        last = bisect_left(self._addresses, end)
+
+        # Later patch points overwrite earlier ones.
+        for i in sorted(range(first, last), key=self._orders.__getitem__):
+            address = self._addresses[i]
+            value = self._data[self._offsets[i]:self._offsets[i + 1]]
+            value_begin = max(begin - address, 0)
+            value_end = min(end - address, len(value))
+
+            if value_begin < value_end:
+                offset = address + value_begin - begin
+                buf[offset:offset + value_end - value_begin] = (
+                    value[value_begin:value_end])
+
+        self._position = end
+
+        return bytes(buf)
+
+    def seek(self, position, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += self._to_size
+
+        self._position = position
+
+    def tell(self):
+        return self._position
+
+    def _create_tables(self):
+        points = sorted(self._points)
+        self._points = None
+        self._addresses = array('q', [address for address, _, _ in points])
+        self._orders = array('q', [order for _, order, _ in points])
+        self._offsets = array('q', [0])
+        offset = 0
+
+        for _, _, value in points:
+            offset += len(value)
+            self._offsets.append(offset)
+
+        self._data = b''.join([value for _, _, value in points])
 
     def _write_values_to_to_with_callback(self, blocks, from_dict, pack_callback):
         from_sorted = sorted(from_dict.items())
@@ -105,8 +171,12 @@ class DiffReader(object):
 
             for i, value in enumerate(values):
                 from_address, from_value = from_sorted[from_offset + i]
-                self._fdiff.seek(to_address + from_address - from_address_base)
-                self._fdiff.write(pack_callback(from_value - value))
+                value = pack_callback(from_value - value)
+                self._points.append(
+                    (to_address + from_address - from_address_base,
+                     len(self._points),
+                     value))
+                self._maximum_size = max(self._maximum_size, len(value))
 
     def _write_s32_values_to_to(self, blocks, from_dict):
         self._write_values_to_to_with_callback(blocks,
@@ -126,16 +196,59 @@ class DiffReader(object):
 
 
 class FromReader(object):
+    """From data read from given file, with bytes at patch points zeroed
+    in :meth:`read()`. Memory usage is proportional to the number of
+    patch points, not the from-size.
+
+    """
 
     def __init__(self, ffrom):
-        # ToDo: Calculate in read() for less memory usage.
-        self._ffrom = BytesIO(file_read(ffrom))
+        self._ffrom = ffrom
+        self._position = 0
+        self._zeros = []
+        self._addresses = None
+        self._ends = None
+        self._maximum_size = 0
 
     def read(self, size=-1):
-        return self._ffrom.read(size)
+        if self._addresses is None:
+            self._create_tables()
+
+        self._ffrom.seek(self._position)
+        buf = bytearray(self._ffrom.read(size))
+        begin = self._position
+        end = begin + len(buf)
+        first = bisect_left(self._addresses, begin - self._maximum_size + 1)
+        last = bisect_left(self._addresses, end)
+
+        for i in range(first, last):
+            zeros_begin = max(self._addresses[i], begin)
+            zeros_end = min(self._ends[i], end)
+
+            if zeros_begin < zeros_end:
+                buf[zeros_begin - begin:zeros_end - begin] = (
+                    bytes(zeros_end - zeros_begin))
+
+        self._position = end
+
+        return bytes(buf)
 
     def seek(self, position, whence=os.SEEK_SET):
-        self._ffrom.seek(position, whence)
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += file_size(self._ffrom)
+
+        self._position = position
+
+    def tell(self):
+        return self._position
+
+    def _create_tables(self):
+        zeros = sorted(self._zeros)
+        self._zeros = None
+        self._addresses = array('q', [address for address, _ in zeros])
+        self._ends = array('q', [end for _, end in zeros])
 
     def _write_zeros_to_from(self, blocks, from_dict, overwrite_size=4):
         from_sorted = sorted(from_dict.items())
@@ -143,8 +256,10 @@ class FromReader(object):
         for from_offset, _, values in blocks:
             for i in range(len(values)):
                 from_address = from_sorted[from_offset + i][0]
-                self._ffrom.seek(from_address)
-                self._ffrom.write(overwrite_size * b'\x00')
+                self._zeros.append((from_address,
+                                    from_address + overwrite_size))
+
+        self._maximum_size = max(self._maximum_size, overwrite_size)
 
 
 def get_matching_blocks(from_addresses, to_addresses):
@@ -6,6 +6,8 @@ from .apply import read_header_in_place
 from .apply import PatchReader
 from .common import PATCH_TYPE_NORMAL
 from .common import PATCH_TYPE_IN_PLACE
+from .common import PATCH_TYPE_IN_PLACE_UNCHANGED
+from .common import SEGMENT_UNCHANGED
 from .common import file_size
 from .common import unpack_size
 from .common import unpack_size_with_length
@@ -105,7 +107,8 @@ def patch_info_in_place(fpatch):
      segment_size,
      shift_size,
      from_size,
-     to_size) = read_header_in_place(fpatch)
+     to_size,
+     unchanged_segments) = read_header_in_place(fpatch)
     segments = []
 
     if to_size > 0:
@@ -115,6 +118,13 @@ def patch_info_in_place(fpatch):
             segment_to_size = min(segment_size, to_size - to_pos)
             dfpatch_size = unpack_size(patch_reader)
 
+            if dfpatch_size == SEGMENT_UNCHANGED:
+                if not unchanged_segments:
+                    raise Error('Unexpected unchanged segment.')
+
+                segments.append((dfpatch_size, None, None))
+                continue
+
             if dfpatch_size > 0:
                 data_format = unpack_size(patch_reader)
                 data_format = data_format_number_to_string(data_format)
@@ -147,7 +157,7 @@ def patch_info(fpatch, fsize=None):
 
     if patch_type == PATCH_TYPE_NORMAL:
         return 'normal', patch_info_normal(fpatch, fsize)
-    elif patch_type == PATCH_TYPE_IN_PLACE:
+    elif patch_type in [PATCH_TYPE_IN_PLACE, PATCH_TYPE_IN_PLACE_UNCHANGED]:
         return 'in-place', patch_info_in_place(fpatch)
     else:
         raise Error('Bad patch type {}.'.format(patch_type))
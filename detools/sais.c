@@ -797,34 +797,36 @@ static int sais(const uint8_t *t_p, int *sa_p, int n)
 static PyObject *m_sais(PyObject *self_p, PyObject* arg_p)
 {
     int res;
-    char *buf_p;
+    Py_buffer buffer;
     Py_ssize_t size;
     int *suffix_array_p;
     PyObject *list_p;
     PyObject *value_p;
     Py_ssize_t i;
 
-    /* Input argument conversion. */
-    res = PyBytes_AsStringAndSize(arg_p, &buf_p, &size);
+    /* Input argument conversion. Any bytes-like object is accepted. */
+    res = PyObject_GetBuffer(arg_p, &buffer, PyBUF_SIMPLE);
 
     if (res == -1) {
         return (NULL);
     }
 
+    size = buffer.len;
+
     if (size > INT_MAX) {
         PyErr_SetString(PyExc_ValueError, "SA-IS data too long (over INT_MAX).");
 
-        return (NULL);
+        goto err0;
     }
 
     suffix_array_p = PyMem_Malloc((size + 1) * sizeof(int));
 
     if (suffix_array_p == NULL) {
-        return (NULL);
+        goto err0;
     }
 
     /* Execute the SA-IS algorithm. */
-    res = sais((uint8_t *)buf_p, suffix_array_p, (int)size);
+    res = sais((uint8_t *)buffer.buf, suffix_array_p, (int)size);
 
     if (res != 0) {
         goto err1;
@@ -850,6 +852,7 @@ static PyObject *m_sais(PyObject *self_p, PyObject* arg_p)
     }
 
     PyMem_Free(suffix_array_p);
+    PyBuffer_Release(&buffer);
 
     return (list_p);
 
@@ -859,6 +862,9 @@ static PyObject *m_sais(PyObject *self_p, PyObject* arg_p)
  err1:
     PyMem_Free(suffix_array_p);
 
+ err0:
+    PyBuffer_Release(&buffer);
+
     return (NULL);
 }
 
@@ -32,9 +32,6 @@ def setup(ext_modules):
             'bitstruct',
             'pyelftools'
         ],
-        extras_require={
-            'heatshrink': ['heatshrink']
-        },
         ext_modules=ext_modules,
         test_suite="tests",
         entry_points={
@@ -45,7 +42,20 @@ def setup(ext_modules):
 try:
     setup([
         Extension(name="detools.csais", sources=["detools/sais.c"]),
-        Extension(name="detools.cbsdiff", sources=["detools/bsdiff.c"])
+        Extension(name="detools.cbsdiff", sources=["detools/bsdiff.c"]),
+        Extension(name="detools.compression.ccrle",
+                  sources=["detools/compression/crle.c"]),
+        Extension(name="detools.compression.cheatshrink",
+                  sources=[
+                      "detools/compression/heatshrink.c",
+                      "src/c/heatshrink/heatshrink_encoder.c",
+                      "src/c/heatshrink/heatshrink_decoder.c"
+                  ],
+                  include_dirs=["src/c/heatshrink"],
+                  define_macros=[
+                      ("HEATSHRINK_DYNAMIC_ALLOC", "1"),
+                      ("HEATSHRINK_USE_INDEX", "1")
+                  ])
     ])
 except:
     print('WARNING: Failed to build the C extension.')
@@ -31,17 +31,27 @@
  */
 
 #include <stdlib.h>
+#include <limits.h>
 #include "detools.h"
 
-/* Patch types. */
-#define PATCH_TYPE_NORMAL                                   0
-#define PATCH_TYPE_IN_PLACE                                 1
+#if DETOOLS_CONFIG_BSDIFF == 1
+#    include <bzlib.h>
+#endif
+
+#if DETOOLS_CONFIG_SIMD == 1
+#    if defined(__SSE2__)
+#        include <emmintrin.h>
+#        define ADD_SSE2                                    1
+#    elif defined(__ARM_NEON)
+#        include <arm_neon.h>
+#        define ADD_NEON                                    1
+#    endif
+#endif
 
-/* Compressions. */
-#define COMPRESSION_NONE                                    0
-#define COMPRESSION_LZMA                                    1
-#define COMPRESSION_CRLE                                    2
-#define COMPRESSION_HEATSHRINK                              4
+/* In-place segment data format patch size of segments already in
+   memory. Only valid in patches of type
+   DETOOLS_PATCH_TYPE_IN_PLACE_UNCHANGED. */
+#define SEGMENT_UNCHANGED                                   -1
 
 #define MIN(x, y) (((x) < (y)) ? (x) : (y))
 #define MAX(x, y) (((x) > (y)) ? (x) : (y))
@@ -106,7 +116,7 @@ static int chunk_read(struct detools_apply_patch_chunk_t *self_p,
 }
 
 static int chunk_unpack_header_size(struct detools_apply_patch_chunk_t *self_p,
-                                    int *size_p)
+                                    int64_t *size_p)
 {
     uint8_t byte;
     int offset;
@@ -128,7 +138,11 @@ static int chunk_unpack_header_size(struct detools_apply_patch_chunk_t *self_p,
             return (-DETOOLS_SHORT_HEADER);
         }
 
-        *size_p |= ((byte & 0x7f) << offset);
+        if (offset > 56) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
+
+        *size_p |= ((int64_t)(byte & 0x7f) << offset);
         offset += 7;
     }
 
@@ -144,7 +158,7 @@ static void unpack_usize_init(struct detools_unpack_usize_t *self_p)
 
 static int unpack_usize(struct detools_unpack_usize_t *self_p,
                         struct detools_apply_patch_chunk_t *patch_chunk_p,
-                        int *size_p)
+                        size_t *size_p)
 {
     int res;
     uint8_t byte;
@@ -171,7 +185,11 @@ static int unpack_usize(struct detools_unpack_usize_t *self_p,
                 return (res);
             }
 
-            self_p->value |= ((byte & 0x7f) << self_p->offset);
+            if (self_p->offset > 63) {
+                return (-DETOOLS_CORRUPT_PATCH);
+            }
+
+            self_p->value |= ((uint64_t)(byte & 0x7f) << self_p->offset);
             self_p->offset += 7;
             break;
 
@@ -180,11 +198,104 @@ static int unpack_usize(struct detools_unpack_usize_t *self_p,
         }
     } while ((byte & 0x80) != 0);
 
-    *size_p = self_p->value;
+    if ((uint64_t)(size_t)self_p->value != self_p->value) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    *size_p = (size_t)self_p->value;
 
     return (0);
 }
 
+/*
+ * Diff addition.
+ */
+
+#define ADD_LOW_BITS            UINT64_C(0x7f7f7f7f7f7f7f7f)
+#define ADD_HIGH_BITS           UINT64_C(0x8080808080808080)
+
+static uint64_t load_u64(const uint8_t *buf_p)
+{
+    uint64_t value;
+
+    memcpy(&value, buf_p, sizeof(value));
+
+    return (value);
+}
+
+static void store_u64(uint8_t *buf_p, uint64_t value)
+{
+    memcpy(buf_p, &value, sizeof(value));
+}
+
+static bool is_all_zeros(const uint8_t *buf_p, size_t size)
+{
+    size_t i;
+
+    for (i = 0; i + 8 <= size; i += 8) {
+        if (load_u64(&buf_p[i]) != 0) {
+            return (false);
+        }
+    }
+
+    for (; i < size; i++) {
+        if (buf_p[i] != 0) {
+            return (false);
+        }
+    }
+
+    return (true);
+}
+
+/**
+ * Add given from data to given diff data, byte by byte modulo 256,
+ * and store the result in the diff buffer. Eight bytes are added at a
+ * time by masking out the high bit of each byte so no carry crosses
+ * byte boundaries, and then adding the high bits back without carry.
+ */
+static void add_from_to_diff(uint8_t *diff_p,
+                             const uint8_t *from_p,
+                             size_t size)
+{
+    size_t i;
+    uint64_t diff;
+    uint64_t from;
+
+    if (is_all_zeros(diff_p, size)) {
+        memcpy(diff_p, from_p, size);
+
+        return;
+    }
+
+    i = 0;
+
+#if defined(ADD_SSE2)
+    for (; i + 16 <= size; i += 16) {
+        _mm_storeu_si128(
+            (__m128i *)&diff_p[i],
+            _mm_add_epi8(_mm_loadu_si128((const __m128i *)&diff_p[i]),
+                         _mm_loadu_si128((const __m128i *)&from_p[i])));
+    }
+#elif defined(ADD_NEON)
+    for (; i + 16 <= size; i += 16) {
+        vst1q_u8(&diff_p[i], vaddq_u8(vld1q_u8(&diff_p[i]),
+                                      vld1q_u8(&from_p[i])));
+    }
+#endif
+
+    for (; i + 8 <= size; i += 8) {
+        diff = load_u64(&diff_p[i]);
+        from = load_u64(&from_p[i]);
+        store_u64(&diff_p[i],
+                  (((diff & ADD_LOW_BITS) + (from & ADD_LOW_BITS))
+                   ^ ((diff ^ from) & ADD_HIGH_BITS)));
+    }
+
+    for (; i < size; i++) {
+        diff_p[i] = (uint8_t)(diff_p[i] + from_p[i]);
+    }
+}
+
 /*
  * None patch reader.
  */
@@ -254,6 +365,77 @@ static int patch_reader_none_init(struct detools_apply_patch_patch_reader_t *sel
 
 #if DETOOLS_CONFIG_COMPRESSION_HEATSHRINK == 1
 
+/* Input buffer size of dynamically allocated decoders. Patch data is
+   sinked one byte at a time. */
+#define HEATSHRINK_DYNAMIC_INPUT_BUFFER_SIZE 1
+
+/* Window and lookahead sizes of compression heatshrink. */
+#define HEATSHRINK_DEFAULT_WINDOW_SZ2 8
+#define HEATSHRINK_DEFAULT_LOOKAHEAD_SZ2 7
+
+/**
+ * Read the heatshrink header, if any, with the window size in the
+ * upper four bits and the lookahead size in the lower four bits, and
+ * prepare the decoder. Returns one(1) if more patch data is needed.
+ */
+static int patch_reader_heatshrink_read_header(
+    struct detools_apply_patch_patch_reader_t *self_p)
+{
+    int res;
+    struct detools_apply_patch_patch_reader_heatshrink_t *heatshrink_p;
+    uint8_t byte;
+    uint8_t window_sz2;
+    uint8_t lookahead_sz2;
+
+    heatshrink_p = &self_p->compression.heatshrink;
+
+    if (heatshrink_p->decoder_p != NULL) {
+        return (0);
+    }
+
+    if (heatshrink_p->has_header) {
+        res = chunk_get(self_p->patch_chunk_p, &byte);
+
+        if (res != 0) {
+            return (1);
+        }
+
+        window_sz2 = (byte >> 4);
+        lookahead_sz2 = (byte & 0xf);
+    } else {
+        window_sz2 = HEATSHRINK_DEFAULT_WINDOW_SZ2;
+        lookahead_sz2 = HEATSHRINK_DEFAULT_LOOKAHEAD_SZ2;
+    }
+
+#if HEATSHRINK_DYNAMIC_ALLOC
+    if ((window_sz2 < HEATSHRINK_MIN_WINDOW_BITS)
+        || (window_sz2 > HEATSHRINK_MAX_WINDOW_BITS)
+        || (lookahead_sz2 < HEATSHRINK_MIN_LOOKAHEAD_BITS)
+        || (lookahead_sz2 >= window_sz2)) {
+        return (-DETOOLS_HEATSHRINK_HEADER);
+    }
+
+    heatshrink_p->decoder_p = heatshrink_decoder_alloc(
+        HEATSHRINK_DYNAMIC_INPUT_BUFFER_SIZE,
+        window_sz2,
+        lookahead_sz2);
+
+    if (heatshrink_p->decoder_p == NULL) {
+        return (-DETOOLS_OUT_OF_MEMORY);
+    }
+#else
+    if ((window_sz2 != HEATSHRINK_STATIC_WINDOW_BITS)
+        || (lookahead_sz2 != HEATSHRINK_STATIC_LOOKAHEAD_BITS)) {
+        return (-DETOOLS_HEATSHRINK_HEADER);
+    }
+
+    heatshrink_decoder_reset(&heatshrink_p->decoder);
+    heatshrink_p->decoder_p = &heatshrink_p->decoder;
+#endif
+
+    return (0);
+}
+
 static int patch_reader_heatshrink_decompress(
     struct detools_apply_patch_patch_reader_t *self_p,
     uint8_t *buf_p,
@@ -267,12 +449,18 @@ static int patch_reader_heatshrink_decompress(
     HSD_sink_res sres;
     uint8_t byte;
 
+    res = patch_reader_heatshrink_read_header(self_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
     heatshrink_p = &self_p->compression.heatshrink;
     left = *size_p;
 
     while (1) {
         /* Get available data. */
-        pres = heatshrink_decoder_poll(&heatshrink_p->decoder,
+        pres = heatshrink_decoder_poll(heatshrink_p->decoder_p,
                                        buf_p,
                                        left,
                                        &size);
@@ -292,7 +480,7 @@ static int patch_reader_heatshrink_decompress(
         res = chunk_get(self_p->patch_chunk_p, &byte);
 
         if (res == 0) {
-            sres = heatshrink_decoder_sink(&heatshrink_p->decoder,
+            sres = heatshrink_decoder_sink(heatshrink_p->decoder_p,
                                            &byte,
                                            sizeof(byte),
                                            &size);
@@ -322,7 +510,17 @@ static int patch_reader_heatshrink_destroy(
 
     heatshrink_p = &self_p->compression.heatshrink;
 
-    fres = heatshrink_decoder_finish(&heatshrink_p->decoder);
+    /* No decoder if no compressed data was read. */
+    if (heatshrink_p->decoder_p == NULL) {
+        return (0);
+    }
+
+    fres = heatshrink_decoder_finish(heatshrink_p->decoder_p);
+
+#if HEATSHRINK_DYNAMIC_ALLOC
+    heatshrink_decoder_free(heatshrink_p->decoder_p);
+#endif
+    heatshrink_p->decoder_p = NULL;
 
     if (fres == HSDR_FINISH_DONE) {
         return (0);
@@ -332,9 +530,11 @@ static int patch_reader_heatshrink_destroy(
 }
 
 static int patch_reader_heatshrink_init(
-    struct detools_apply_patch_patch_reader_t *self_p)
+    struct detools_apply_patch_patch_reader_t *self_p,
+    bool has_header)
 {
-    heatshrink_decoder_reset(&self_p->compression.heatshrink.decoder);
+    self_p->compression.heatshrink.has_header = has_header;
+    self_p->compression.heatshrink.decoder_p = NULL;
     self_p->destroy = patch_reader_heatshrink_destroy;
     self_p->decompress = patch_reader_heatshrink_decompress;
 
@@ -357,9 +557,9 @@ static int get_decompressed_data(
     int res;
 
     if (lzma_p->output_size >= size) {
-        memcpy(buf_p, lzma_p->output_p, size);
-        memmove(lzma_p->output_p,
-                &lzma_p->output_p[size],
+        memcpy(buf_p, &lzma_p->output[0], size);
+        memmove(&lzma_p->output[0],
+                &lzma_p->output[size],
                 lzma_p->output_size - size);
         lzma_p->output_size -= size;
         res = 0;
@@ -370,64 +570,80 @@ static int get_decompressed_data(
     return (res);
 }
 
-static int prepare_input_buffer(struct detools_apply_patch_patch_reader_t *self_p)
+/**
+ * Allocate from the arena. Memory is freed all at once when the patch
+ * reader is destroyed.
+ */
+static void *lzma_arena_alloc(void *opaque_p, size_t nmemb, size_t size)
 {
-    struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
-    uint8_t *next_p;
-    size_t left;
+    struct detools_apply_patch_patch_reader_t *self_p;
+    size_t offset;
+    void *buf_p;
 
-    lzma_p = &self_p->compression.lzma;
-    left = chunk_left(self_p->patch_chunk_p);
+    self_p = (struct detools_apply_patch_patch_reader_t *)opaque_p;
 
-    if (left == 0) {
-        return (1);
+    if ((size != 0) && (nmemb > SIZE_MAX / size)) {
+        return (NULL);
     }
 
-    next_p = malloc(lzma_p->stream.avail_in + left);
-
-    if (next_p == NULL) {
-        return (-DETOOLS_OUT_OF_MEMORY);
-    }
+    size *= nmemb;
+    offset = ((self_p->lzma_arena.offset + 7) & ~(size_t)7);
 
-    if (lzma_p->stream.next_in != NULL) {
-        memcpy(next_p, lzma_p->stream.next_in, lzma_p->stream.avail_in);
-        free(lzma_p->input_p);
+    if ((offset > self_p->lzma_arena.size)
+        || (size > self_p->lzma_arena.size - offset)) {
+        return (NULL);
     }
 
-    lzma_p->input_p = next_p;
-    chunk_read_all_no_check(self_p->patch_chunk_p,
-                            &lzma_p->input_p[lzma_p->stream.avail_in],
-                            left);
-    lzma_p->stream.next_in = next_p;
-    lzma_p->stream.avail_in += left;
+    buf_p = &self_p->lzma_arena.buf_p[offset];
+    self_p->lzma_arena.offset = (offset + size);
 
-    return (0);
+    return (buf_p);
 }
 
-static int prepare_output_buffer(struct detools_apply_patch_patch_reader_t *self_p,
-                                 size_t size)
+static void lzma_arena_free(void *opaque_p, void *buf_p)
 {
-    struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
-    uint8_t *output_p;
-
-    lzma_p = &self_p->compression.lzma;
+    (void)opaque_p;
+    (void)buf_p;
+}
 
-    output_p = malloc(size);
+static int lzma_ret_to_error(lzma_ret ret)
+{
+    switch (ret) {
 
-    if (output_p == NULL) {
+    case LZMA_MEM_ERROR:
+    case LZMA_MEMLIMIT_ERROR:
         return (-DETOOLS_OUT_OF_MEMORY);
-    }
 
-    if (lzma_p->output_p != NULL) {
-        memcpy(output_p, lzma_p->output_p, lzma_p->output_size);
-        free(lzma_p->output_p);
+    default:
+        return (-DETOOLS_LZMA_DECODE);
     }
+}
 
-    lzma_p->output_p = output_p;
-    lzma_p->stream.next_out = (output_p + lzma_p->output_size);
-    lzma_p->stream.avail_out = (size - lzma_p->output_size);
+/**
+ * Move unconsumed input to the beginning of the input buffer, and fill
+ * the rest of it with patch data.
+ */
+static void lzma_fill_input_buffer(
+    struct detools_apply_patch_patch_reader_t *self_p)
+{
+    struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
+    size_t size;
 
-    return (0);
+    lzma_p = &self_p->compression.lzma;
+
+    if (lzma_p->stream.avail_in > 0) {
+        memmove(&lzma_p->input[0],
+                lzma_p->stream.next_in,
+                lzma_p->stream.avail_in);
+    }
+
+    size = MIN(sizeof(lzma_p->input) - lzma_p->stream.avail_in,
+               chunk_left(self_p->patch_chunk_p));
+    chunk_read_all_no_check(self_p->patch_chunk_p,
+                            &lzma_p->input[lzma_p->stream.avail_in],
+                            size);
+    lzma_p->stream.next_in = &lzma_p->input[0];
+    lzma_p->stream.avail_in += size;
 }
 
 static int patch_reader_lzma_decompress(
@@ -435,77 +651,136 @@ static int patch_reader_lzma_decompress(
     uint8_t *buf_p,
     size_t *size_p)
 {
-    int res;
     struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
     lzma_ret ret;
 
     lzma_p = &self_p->compression.lzma;
+    *size_p = MIN(*size_p, sizeof(lzma_p->output));
 
-    /* Check if enough decompressed data is available. */
-    res = get_decompressed_data(lzma_p, buf_p, *size_p);
-
-    if (res == 0) {
-        return (res);
-    }
-
-    while (1) {
-        /* Try to decompress requested data. */
-        if (lzma_p->stream.avail_in > 0) {
-            res = prepare_output_buffer(self_p, *size_p);
+    /* Decompress until enough decompressed data is available. */
+    while (get_decompressed_data(lzma_p, buf_p, *size_p) != 0) {
+        /* The decoder consumes all input it can, so only refill the
+           input buffer once it is empty, leaving the rest of the
+           patch data in the chunk. */
+        if (lzma_p->stream.avail_in == 0) {
+            lzma_fill_input_buffer(self_p);
 
-            if (res != 0) {
-                return (res);
+            if (lzma_p->stream.avail_in == 0) {
+                return (1);
             }
+        }
 
-            ret = lzma_code(&lzma_p->stream, LZMA_RUN);
+        lzma_p->stream.next_out = &lzma_p->output[lzma_p->output_size];
+        lzma_p->stream.avail_out = (*size_p - lzma_p->output_size);
+        ret = lzma_code(&lzma_p->stream, LZMA_RUN);
 
-            switch (ret) {
+        switch (ret) {
 
-            case LZMA_OK:
-            case LZMA_STREAM_END:
-                break;
+        case LZMA_OK:
+            break;
 
-            default:
-                return (-DETOOLS_LZMA_DECODE);
+        case LZMA_STREAM_END:
+            /* No more data will be decompressed. */
+            if (lzma_p->stream.avail_out > 0) {
+                return (-DETOOLS_CORRUPT_PATCH);
             }
 
-            lzma_p->output_size = (size_t)(lzma_p->stream.next_out - lzma_p->output_p);
+            break;
+
+        default:
+            return (lzma_ret_to_error(ret));
         }
 
-        /* Check if enough decompressed data is available. */
-        res = get_decompressed_data(lzma_p, buf_p, *size_p);
+        lzma_p->output_size = (size_t)(lzma_p->stream.next_out
+                                       - &lzma_p->output[0]);
+    }
 
-        if (res == 0) {
-            return (res);
-        }
+    return (0);
+}
+
+/**
+ * Decode the end of the stream, which must not contain any more
+ * decompressed data.
+ */
+static int lzma_decode_end(struct detools_apply_patch_patch_reader_t *self_p)
+{
+    struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
+    lzma_ret ret;
+    uint8_t byte;
 
-        /* Get more data to decompress. */
-        res = prepare_input_buffer(self_p);
+    lzma_p = &self_p->compression.lzma;
 
-        if (res != 0) {
-            return (res);
+    if (lzma_p->output_size > 0) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    lzma_fill_input_buffer(self_p);
+
+    if (lzma_p->stream.avail_in == 0) {
+        return (0);
+    }
+
+    lzma_p->stream.next_out = &byte;
+    lzma_p->stream.avail_out = 1;
+    ret = lzma_code(&lzma_p->stream, LZMA_RUN);
+
+    switch (ret) {
+
+    case LZMA_OK:
+        break;
+
+    case LZMA_STREAM_END:
+        /* Data after the end of the stream. */
+        if (lzma_p->stream.avail_in > 0) {
+            return (-DETOOLS_CORRUPT_PATCH);
         }
+
+        break;
+
+    default:
+        return (lzma_ret_to_error(ret));
+    }
+
+    if (lzma_p->stream.avail_out == 0) {
+        return (-DETOOLS_CORRUPT_PATCH);
     }
+
+    return (0);
 }
 
-static int patch_reader_lzma_destroy(
+static int patch_reader_lzma_drain(
     struct detools_apply_patch_patch_reader_t *self_p)
 {
-    struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
-
-    lzma_p = &self_p->compression.lzma;
+    int res;
 
-    if (lzma_p->input_p != NULL) {
-        free(lzma_p->input_p);
+    if (!chunk_available(self_p->patch_chunk_p)) {
+        return (-DETOOLS_ALREADY_DONE);
     }
 
-    if (lzma_p->output_p != NULL) {
-        free(lzma_p->output_p);
+    res = lzma_decode_end(self_p);
+
+    if (res != 0) {
+        return (res);
     }
 
+    return (1);
+}
+
+static int patch_reader_lzma_destroy(
+    struct detools_apply_patch_patch_reader_t *self_p)
+{
+    struct detools_apply_patch_patch_reader_lzma_t *lzma_p;
+    int res;
+
+    lzma_p = &self_p->compression.lzma;
+    res = lzma_decode_end(self_p);
     lzma_end(&lzma_p->stream);
 
-    if ((lzma_p->stream.avail_in == 0) && (lzma_p->output_size == 0)) {
+    if (res != 0) {
+        return (res);
+    }
+
+    if (lzma_p->stream.avail_in == 0) {
         return (0);
     } else {
         return (-DETOOLS_CORRUPT_PATCH);
@@ -520,17 +795,32 @@ static int patch_reader_lzma_init(struct detools_apply_patch_patch_reader_t *sel
     lzma_p = &self_p->compression.lzma;
     memset(&lzma_p->stream, 0, sizeof(lzma_p->stream));
 
-    ret = lzma_alone_decoder(&lzma_p->stream, UINT64_MAX);
+    /* The memory usage limit is an estimate, so let the arena
+       allocator decide if there is enough memory instead. */
+    if (self_p->lzma_arena.buf_p != NULL) {
+        self_p->lzma_arena.offset = 0;
+        lzma_p->allocator.alloc = lzma_arena_alloc;
+        lzma_p->allocator.free = lzma_arena_free;
+        lzma_p->allocator.opaque = self_p;
+        lzma_p->stream.allocator = &lzma_p->allocator;
+    }
+
+    /* Both the legacy .lzma format and the .xz format, used for
+       filter chains with a branch converter (BCJ), are accepted. */
+    ret = lzma_auto_decoder(&lzma_p->stream, UINT64_MAX, 0);
 
     if (ret != LZMA_OK) {
+        if (ret == LZMA_MEM_ERROR) {
+            return (-DETOOLS_OUT_OF_MEMORY);
+        }
+
         return (-DETOOLS_LZMA_INIT);
     }
 
-    lzma_p->input_p = NULL;
-    lzma_p->output_p = NULL;
     lzma_p->output_size = 0;
     self_p->destroy = patch_reader_lzma_destroy;
     self_p->decompress = patch_reader_lzma_decompress;
+    self_p->drain = patch_reader_lzma_drain;
 
     return (0);
 }
@@ -583,7 +873,7 @@ static int patch_reader_crle_decompress_scattered_size(
     struct detools_apply_patch_patch_reader_crle_t *crle_p)
 {
     int res;
-    int size;
+    size_t size;
 
     res = unpack_usize(&crle_p->kind.scattered.size,
                        self_p->patch_chunk_p,
@@ -594,7 +884,7 @@ static int patch_reader_crle_decompress_scattered_size(
     }
 
     crle_p->state = detools_crle_state_scattered_data_t;
-    crle_p->kind.scattered.number_of_bytes_left = (size_t)size;
+    crle_p->kind.scattered.number_of_bytes_left = size;
 
     return (2);
 }
@@ -629,7 +919,7 @@ static int patch_reader_crle_decompress_repeated_repetitions(
     struct detools_apply_patch_patch_reader_crle_t *crle_p)
 {
     int res;
-    int repetitions;
+    size_t repetitions;
 
     res = unpack_usize(&crle_p->kind.repeated.size,
                        self_p->patch_chunk_p,
@@ -640,7 +930,7 @@ static int patch_reader_crle_decompress_repeated_repetitions(
     }
 
     crle_p->state = detools_crle_state_repeated_data_t;
-    crle_p->kind.repeated.number_of_bytes_left = (size_t)repetitions;
+    crle_p->kind.repeated.number_of_bytes_left = repetitions;
 
     return (2);
 }
@@ -783,30 +1073,35 @@ static int patch_reader_init(struct detools_apply_patch_patch_reader_t *self_p,
 
     self_p->patch_chunk_p = patch_chunk_p;
     self_p->size.state = detools_unpack_usize_state_first_t;
+    self_p->drain = NULL;
 
     switch (compression) {
 
 #if DETOOLS_CONFIG_COMPRESSION_NONE == 1
-    case COMPRESSION_NONE:
+    case DETOOLS_COMPRESSION_NONE:
         res = patch_reader_none_init(self_p, patch_size);
         break;
 #endif
 
 #if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
-    case COMPRESSION_LZMA:
+    case DETOOLS_COMPRESSION_LZMA:
         res = patch_reader_lzma_init(self_p);
         break;
 #endif
 
 #if DETOOLS_CONFIG_COMPRESSION_CRLE == 1
-    case COMPRESSION_CRLE:
+    case DETOOLS_COMPRESSION_CRLE:
         res = patch_reader_crle_init(self_p);
         break;
 #endif
 
 #if DETOOLS_CONFIG_COMPRESSION_HEATSHRINK == 1
-    case COMPRESSION_HEATSHRINK:
-        res = patch_reader_heatshrink_init(self_p);
+    case DETOOLS_COMPRESSION_HEATSHRINK:
+        res = patch_reader_heatshrink_init(self_p, false);
+        break;
+
+    case DETOOLS_COMPRESSION_HEATSHRINK_SIZES:
+        res = patch_reader_heatshrink_init(self_p, true);
         break;
 #endif
 
@@ -818,6 +1113,21 @@ static int patch_reader_init(struct detools_apply_patch_patch_reader_t *self_p,
     return (res);
 }
 
+/**
+ * Consume patch data after the last to-data byte, for example the end
+ * of an LZMA stream that did not fit in the input buffer.
+ *
+ * @return one(1) if patch data was consumed, or negative error code.
+ */
+static int patch_reader_drain(struct detools_apply_patch_patch_reader_t *self_p)
+{
+    if (self_p->drain == NULL) {
+        return (-DETOOLS_ALREADY_DONE);
+    }
+
+    return (self_p->drain(self_p));
+}
+
 /**
  * Try to decompress given number of bytes.
  *
@@ -838,7 +1148,7 @@ static int patch_reader_decompress(
  */
 static int patch_reader_unpack_size(
     struct detools_apply_patch_patch_reader_t *self_p,
-    int *size_p)
+    int64_t *size_p)
 {
     int res;
     uint8_t byte;
@@ -870,7 +1180,11 @@ static int patch_reader_unpack_size(
                 return (res);
             }
 
-            self_p->size.value |= ((byte & 0x7f) << self_p->size.offset);
+            if (self_p->size.offset > 56) {
+                return (-DETOOLS_CORRUPT_PATCH);
+            }
+
+            self_p->size.value |= ((int64_t)(byte & 0x7f) << self_p->size.offset);
             self_p->size.offset += 7;
 
             break;
@@ -897,1066 +1211,4786 @@ static int common_process_size(
     struct detools_apply_patch_patch_reader_t *patch_reader_p,
     size_t to_pos,
     size_t to_size,
-    int *size_p)
+    size_t *size_p)
 {
     int res;
+    int64_t size;
 
-    res = patch_reader_unpack_size(patch_reader_p, size_p);
+    res = patch_reader_unpack_size(patch_reader_p, &size);
 
     if (res != 0) {
         return (res);
     }
 
-    if (to_pos + (size_t)*size_p > to_size) {
+    if ((size < 0) || ((uint64_t)size > (uint64_t)(to_size - to_pos))) {
         return (-DETOOLS_CORRUPT_PATCH);
     }
 
+    *size_p = (size_t)size;
+
     return (res);
 }
 
+#if DETOOLS_DATA_FORMAT == 1
+
 /*
- * Low level normal patch type functionality.
+ * Data format functionality.
  */
 
-static int process_init(struct detools_apply_patch_t *self_p)
-{
-    int patch_type;
-    int compression;
-    uint8_t byte;
-    int res;
-    int to_size;
+/* Data formats. */
+#define DATA_FORMAT_ARM_CORTEX_M4                           0
+#define DATA_FORMAT_AARCH64                                 1
+#define DATA_FORMAT_XTENSA_LX106                            2
+
+/* Value types. */
+#define DATA_FORMAT_TYPE_S32                                0
+#define DATA_FORMAT_TYPE_U24                                1
+#define DATA_FORMAT_TYPE_U64                                2
+#define DATA_FORMAT_TYPE_BW                                 3
+#define DATA_FORMAT_TYPE_BL                                 4
+#define DATA_FORMAT_TYPE_ADD                                5
+#define DATA_FORMAT_TYPE_ADRP                               6
+
+/* Value kinds, in patch order. Data and code pointers are common to
+   all data formats. */
+#define DATA_FORMAT_KIND_DATA_POINTERS                      0
+#define DATA_FORMAT_KIND_CODE_POINTERS                      1
+
+#define ARM_CORTEX_M4_KIND_BW                               2
+#define ARM_CORTEX_M4_KIND_BL                               3
+#define ARM_CORTEX_M4_KIND_LDR                              4
+#define ARM_CORTEX_M4_KIND_LDR_W                            5
+
+#define AARCH64_KIND_B                                      2
+#define AARCH64_KIND_BL                                     3
+#define AARCH64_KIND_ADD                                    4
+#define AARCH64_KIND_ADD_GENERIC                            5
+#define AARCH64_KIND_LDR                                    6
+#define AARCH64_KIND_ADRP                                   7
+#define AARCH64_KIND_STR                                    8
+#define AARCH64_KIND_STR_IMM_64                             9
+
+#define XTENSA_LX106_KIND_CALL0                             2
+
+/* Number of bytes kept before the current disassembler position. */
+#define DATA_FORMAT_READER_LOOKBACK                         16
+
+/* Must be a power of two larger than the maximum ldr offset. */
+#define ARM_CORTEX_M4_LITERALS_SIZE                         8192
+
+typedef int (*data_format_read_t)(void *arg_p,
+                                  uint8_t *buf_p,
+                                  size_t offset,
+                                  size_t size);
 
-    if (chunk_get(&self_p->chunk, &byte) != 0) {
-        return (-DETOOLS_SHORT_HEADER);
-    }
+/**
+ * Buffered reader of from-data used by the disassemblers.
+ */
+struct data_format_reader_t {
+    data_format_read_t read;
+    void *arg_p;
+    size_t size;
+    size_t begin;
+    size_t end;
+    uint8_t buf[256];
+};
 
-    patch_type = ((byte >> 4) & 0x7);
-    compression = (byte & 0xf);
+#if DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1
 
-    if (patch_type != PATCH_TYPE_NORMAL) {
-        return (-DETOOLS_BAD_PATCH_TYPE);
-    }
+/* Later kinds overwrite earlier ones. */
+static const uint8_t arm_cortex_m4_order[] = {
+    ARM_CORTEX_M4_KIND_LDR,
+    ARM_CORTEX_M4_KIND_LDR_W,
+    ARM_CORTEX_M4_KIND_BL,
+    ARM_CORTEX_M4_KIND_BW,
+    DATA_FORMAT_KIND_DATA_POINTERS,
+    DATA_FORMAT_KIND_CODE_POINTERS
+};
 
-    res = chunk_unpack_header_size(&self_p->chunk, &to_size);
+static const uint8_t arm_cortex_m4_types[] = {
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_BW,
+    DATA_FORMAT_TYPE_BL,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_S32
+};
 
-    if (res != 0) {
-        return (res);
-    }
+#endif
 
-    res = patch_reader_init(&self_p->patch_reader,
-                            &self_p->chunk,
-                            self_p->patch_size - self_p->chunk.offset,
-                            compression);
+#if DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1
+
+static const uint8_t aarch64_order[] = {
+    AARCH64_KIND_B,
+    AARCH64_KIND_BL,
+    AARCH64_KIND_ADD,
+    AARCH64_KIND_ADD_GENERIC,
+    AARCH64_KIND_LDR,
+    AARCH64_KIND_ADRP,
+    AARCH64_KIND_STR,
+    AARCH64_KIND_STR_IMM_64,
+    DATA_FORMAT_KIND_DATA_POINTERS,
+    DATA_FORMAT_KIND_CODE_POINTERS
+};
 
-    if (res != 0) {
-        return (res);
-    }
+static const uint8_t aarch64_types[] = {
+    DATA_FORMAT_TYPE_U64,
+    DATA_FORMAT_TYPE_U64,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_ADD,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_ADRP,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_S32
+};
 
-    if (to_size < 0) {
-        return (-DETOOLS_CORRUPT_PATCH);
-    }
+#endif
 
-    self_p->to_pos = 0;
-    self_p->to_size = (size_t)to_size;
+#if DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106 == 1
 
-    if (to_size > 0) {
-        self_p->state = detools_apply_patch_state_dfpatch_size_t;
-    } else {
-        self_p->state = detools_apply_patch_state_done_t;
-    }
+static const uint8_t xtensa_lx106_order[] = {
+    XTENSA_LX106_KIND_CALL0,
+    DATA_FORMAT_KIND_DATA_POINTERS,
+    DATA_FORMAT_KIND_CODE_POINTERS
+};
 
-    return (res);
+static const uint8_t xtensa_lx106_types[] = {
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_S32,
+    DATA_FORMAT_TYPE_U24
+};
+
+#endif
+
+static uint32_t unpack_u32(const uint8_t *buf_p)
+{
+    return ((uint32_t)buf_p[0]
+            | ((uint32_t)buf_p[1] << 8)
+            | ((uint32_t)buf_p[2] << 16)
+            | ((uint32_t)buf_p[3] << 24));
 }
 
-static int process_dfpatch_size(struct detools_apply_patch_t *self_p)
+static void pack_u32(uint8_t *buf_p, uint32_t value)
 {
-    int res;
-    int size;
+    buf_p[0] = (uint8_t)value;
+    buf_p[1] = (uint8_t)(value >> 8);
+    buf_p[2] = (uint8_t)(value >> 16);
+    buf_p[3] = (uint8_t)(value >> 24);
+}
 
-    res = patch_reader_unpack_size(&self_p->patch_reader, &size);
+static size_t data_format_type_size(int type)
+{
+    switch (type) {
 
-    if (res != 0) {
-        return (res);
+    case DATA_FORMAT_TYPE_U24:
+        return (3);
+
+    case DATA_FORMAT_TYPE_U64:
+        return (8);
+
+    default:
+        return (4);
     }
+}
 
-    if (size > 0) {
-        return (-DETOOLS_NOT_IMPLEMENTED);
+static int data_format_init(struct detools_data_format_t *self_p,
+                            int64_t data_format)
+{
+    const uint8_t *types_p;
+    int i;
+
+    switch (data_format) {
+
+#if DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1
+    case DATA_FORMAT_ARM_CORTEX_M4:
+        types_p = &arm_cortex_m4_types[0];
+        self_p->order_p = &arm_cortex_m4_order[0];
+        self_p->number_of_kinds = sizeof(arm_cortex_m4_order);
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1
+    case DATA_FORMAT_AARCH64:
+        types_p = &aarch64_types[0];
+        self_p->order_p = &aarch64_order[0];
+        self_p->number_of_kinds = sizeof(aarch64_order);
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106 == 1
+    case DATA_FORMAT_XTENSA_LX106:
+        types_p = &xtensa_lx106_types[0];
+        self_p->order_p = &xtensa_lx106_order[0];
+        self_p->number_of_kinds = sizeof(xtensa_lx106_order);
+        break;
+#endif
+
+    default:
+        return (-DETOOLS_BAD_DATA_FORMAT);
     }
 
-    self_p->state = detools_apply_patch_state_diff_size_t;
+    for (i = 0; i < self_p->number_of_kinds; i++) {
+        self_p->kinds[i].type = types_p[i];
+        self_p->kinds[i].base = 0;
+        self_p->kinds[i].first_block = 0;
+        self_p->kinds[i].first_value = 0;
+        self_p->kinds[i].number_of_values = 0;
+    }
+
+    self_p->data_format = data_format;
+    self_p->state = detools_data_format_state_data_pointers_present_t;
+    self_p->number.offset = 0;
+    self_p->data_offset_begin = 0;
+    self_p->data_begin = 0;
+    self_p->data_end = 0;
+    self_p->code_begin = 0;
+    self_p->code_end = 0;
+    self_p->number_of_blocks = 0;
+    self_p->number_of_values = 0;
+    self_p->value = 0;
 
     return (0);
 }
 
-static int process_size(struct detools_apply_patch_t *self_p,
-                        enum detools_apply_patch_state_t next_state)
+/**
+ * Continue with the header of the next kind in the patch, or with the
+ * values if all headers have been unpacked.
+ */
+static void data_format_next_kind(struct detools_data_format_t *self_p)
 {
-    int res;
-    int size;
-
-    res = common_process_size(&self_p->patch_reader,
-                              self_p->to_pos,
-                              self_p->to_size,
-                              &size);
+    struct detools_data_format_kind_t *kind_p;
 
-    if (res != 0) {
-        return (res);
+    do {
+        self_p->kind++;
+    } while (((self_p->kind == DATA_FORMAT_KIND_DATA_POINTERS)
+              && !self_p->data_pointers_present)
+             || ((self_p->kind == DATA_FORMAT_KIND_CODE_POINTERS)
+                 && !self_p->code_pointers_present));
+
+    if (self_p->kind < self_p->number_of_kinds) {
+        kind_p = &self_p->kinds[self_p->kind];
+        kind_p->first_block = self_p->number_of_blocks;
+        kind_p->first_value = self_p->number_of_values;
+        self_p->state = detools_data_format_state_number_of_blocks_t;
+    } else if (self_p->number_of_values > 0) {
+        self_p->state = detools_data_format_state_values_t;
+    } else {
+        self_p->state = detools_data_format_state_done_t;
     }
-
-    self_p->state = next_state;
-    self_p->chunk_size = (size_t)size;
-
-    return (res);
 }
 
-static int process_data(struct detools_apply_patch_t *self_p,
-                        enum detools_apply_patch_state_t next_state)
+static int data_format_process_number(struct detools_data_format_t *self_p,
+                                      uint64_t value)
 {
-    int res;
-    size_t i;
-    uint8_t to[128];
-    size_t to_size;
-    uint8_t from[128];
+    struct detools_data_format_block_t *block_p;
+    int64_t signed_value;
 
-    to_size = MIN(sizeof(to), self_p->chunk_size);
+    signed_value = (int64_t)value;
+    block_p = &self_p->blocks[self_p->number_of_blocks];
 
-    if (to_size == 0) {
-        self_p->state = next_state;
+    switch (self_p->state) {
 
-        return (0);
-    }
+    case detools_data_format_state_data_offset_t:
+        self_p->data_offset_begin = value;
+        self_p->state = detools_data_format_state_data_begin_t;
+        break;
 
-    res = patch_reader_decompress(&self_p->patch_reader,
-                                  &to[0],
-                                  &to_size);
+    case detools_data_format_state_data_begin_t:
+        self_p->data_begin = value;
+        self_p->state = detools_data_format_state_data_end_t;
+        break;
 
-    if (res != 0) {
-        return (res);
-    }
+    case detools_data_format_state_data_end_t:
+        self_p->data_end = value;
+        self_p->state = detools_data_format_state_code_pointers_present_t;
+        break;
 
-    if (next_state == detools_apply_patch_state_extra_size_t) {
-        res = self_p->from_read(self_p->arg_p, &from[0], to_size);
+    case detools_data_format_state_code_begin_t:
+        self_p->code_begin = value;
+        self_p->state = detools_data_format_state_code_end_t;
+        break;
 
-        if (res != 0) {
-            return (-DETOOLS_IO_FAILED);
+    case detools_data_format_state_code_end_t:
+        self_p->code_end = value;
+        self_p->kind = -1;
+        data_format_next_kind(self_p);
+        break;
+
+    case detools_data_format_state_number_of_blocks_t:
+        if (signed_value < 0) {
+            return (-DETOOLS_CORRUPT_PATCH);
         }
 
-        for (i = 0; i < to_size; i++) {
-            to[i] = (uint8_t)(to[i] + from[i]);
+        if (value > (DETOOLS_CONFIG_DATA_FORMAT_MAX_BLOCKS
+                     - self_p->number_of_blocks)) {
+            return (-DETOOLS_OUT_OF_MEMORY);
         }
-    }
 
-    self_p->to_pos += to_size;
-    self_p->chunk_size -= to_size;
+        if (value == 0) {
+            data_format_next_kind(self_p);
+        } else {
+            self_p->blocks_left = (size_t)value;
+            self_p->state = detools_data_format_state_from_offset_t;
+        }
 
-    res = self_p->to_write(self_p->arg_p, &to[0], to_size);
+        break;
 
-    if (res != 0) {
-        return (-DETOOLS_IO_FAILED);
-    }
+    case detools_data_format_state_from_offset_t:
+        if ((signed_value < 0) || (signed_value > (int64_t)UINT32_MAX)) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-    return (res);
-}
+        block_p->from_offset = (uint32_t)value;
+        self_p->state = detools_data_format_state_to_address_t;
+        break;
 
-static int process_diff_size(struct detools_apply_patch_t *self_p)
-{
-    return (process_size(self_p, detools_apply_patch_state_diff_data_t));
-}
+    case detools_data_format_state_to_address_t:
+        if ((signed_value < 0) || (signed_value > (int64_t)UINT32_MAX)) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-static int process_diff_data(struct detools_apply_patch_t *self_p)
-{
-    return (process_data(self_p, detools_apply_patch_state_extra_size_t));
-}
+        block_p->to_address = (uint32_t)value;
+        self_p->state = detools_data_format_state_number_of_values_t;
+        break;
 
-static int process_extra_size(struct detools_apply_patch_t *self_p)
-{
-    return (process_size(self_p, detools_apply_patch_state_extra_data_t));
-}
+    case detools_data_format_state_number_of_values_t:
+        if (signed_value < 0) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-static int process_extra_data(struct detools_apply_patch_t *self_p)
-{
-    return (process_data(self_p, detools_apply_patch_state_adjustment_t));
-}
+        if (value > (DETOOLS_CONFIG_DATA_FORMAT_MAX_VALUES
+                     - self_p->number_of_values)) {
+            return (-DETOOLS_OUT_OF_MEMORY);
+        }
 
-static int process_adjustment(struct detools_apply_patch_t *self_p)
-{
-    int res;
-    int offset;
+        block_p->number_of_values = (uint32_t)value;
+        self_p->kinds[self_p->kind].number_of_values += (size_t)value;
+        self_p->number_of_values += (size_t)value;
+        self_p->number_of_blocks++;
+        self_p->blocks_left--;
 
-    res = patch_reader_unpack_size(&self_p->patch_reader, &offset);
+        if (self_p->blocks_left == 0) {
+            data_format_next_kind(self_p);
+        } else {
+            self_p->state = detools_data_format_state_from_offset_t;
+        }
 
-    if (res != 0) {
-        return (res);
-    }
+        break;
 
-    res = self_p->from_seek(self_p->arg_p, offset);
+    case detools_data_format_state_values_t:
+        if ((signed_value < INT32_MIN) || (signed_value > INT32_MAX)) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-    if (res != 0) {
-        return (-DETOOLS_IO_FAILED);
-    }
+        self_p->values[self_p->value] = (uint32_t)value;
+        self_p->value++;
 
-    if (self_p->to_pos == self_p->to_size) {
-        self_p->state = detools_apply_patch_state_done_t;
-    } else {
-        self_p->state = detools_apply_patch_state_diff_size_t;
+        if (self_p->value == self_p->number_of_values) {
+            self_p->state = detools_data_format_state_done_t;
+        }
+
+        break;
+
+    default:
+        return (-DETOOLS_INTERNAL_ERROR);
     }
 
-    return (res);
+    return (0);
 }
 
-static int apply_patch_process_once(struct detools_apply_patch_t *self_p)
+static int data_format_process_byte(struct detools_data_format_t *self_p,
+                                    uint8_t byte)
 {
-    int res;
+    uint64_t value;
 
     switch (self_p->state) {
 
-    case detools_apply_patch_state_init_t:
-        res = process_init(self_p);
-        break;
+    case detools_data_format_state_data_pointers_present_t:
+        self_p->data_pointers_present = (byte == 1);
 
-    case detools_apply_patch_state_dfpatch_size_t:
-        res = process_dfpatch_size(self_p);
-        break;
+        if (self_p->data_pointers_present) {
+            self_p->state = detools_data_format_state_data_offset_t;
+        } else {
+            self_p->state = detools_data_format_state_code_pointers_present_t;
+        }
 
-    case detools_apply_patch_state_diff_size_t:
-        res = process_diff_size(self_p);
-        break;
+        return (0);
 
-    case detools_apply_patch_state_diff_data_t:
-        res = process_diff_data(self_p);
-        break;
+    case detools_data_format_state_code_pointers_present_t:
+        self_p->code_pointers_present = (byte == 1);
 
-    case detools_apply_patch_state_extra_size_t:
-        res = process_extra_size(self_p);
-        break;
+        if (self_p->code_pointers_present) {
+            self_p->state = detools_data_format_state_code_begin_t;
+        } else {
+            self_p->kind = -1;
+            data_format_next_kind(self_p);
+        }
 
-    case detools_apply_patch_state_extra_data_t:
-        res = process_extra_data(self_p);
-        break;
+        return (0);
 
-    case detools_apply_patch_state_adjustment_t:
-        res = process_adjustment(self_p);
-        break;
+    case detools_data_format_state_done_t:
+        return (-DETOOLS_CORRUPT_PATCH);
 
-    case detools_apply_patch_state_done_t:
-        res = -DETOOLS_ALREADY_DONE;
+    default:
         break;
+    }
 
-    case detools_apply_patch_state_failed_t:
-        res = -DETOOLS_ALREADY_FAILED;
-        break;
+    if (self_p->number.offset == 0) {
+        self_p->number.is_signed = ((byte & 0x40) == 0x40);
+        self_p->number.value = (byte & 0x3f);
+        self_p->number.offset = 6;
+    } else {
+        if (self_p->number.offset >= 64) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-    default:
-        res = -DETOOLS_INTERNAL_ERROR;
-        break;
+        self_p->number.value |= ((uint64_t)(byte & 0x7f)
+                                 << self_p->number.offset);
+        self_p->number.offset += 7;
     }
 
-    if (res < 0) {
-        self_p->state = detools_apply_patch_state_failed_t;
+    if ((byte & 0x80) != 0) {
+        return (0);
     }
 
-    return (res);
+    value = self_p->number.value;
+
+    if (self_p->number.is_signed) {
+        value = (0 - value);
+    }
+
+    self_p->number.offset = 0;
+
+    return (data_format_process_number(self_p, value));
 }
 
-static int apply_patch_common_finalize(
-    int res,
-    struct detools_apply_patch_patch_reader_t *patch_reader_p,
-    size_t to_size)
+/**
+ * Decompress and unpack the next part of the data format patch.
+ */
+static int data_format_process(
+    struct detools_data_format_t *self_p,
+    struct detools_apply_patch_patch_reader_t *patch_reader_p)
 {
-    if (res == 1) {
-        res = -DETOOLS_NOT_ENOUGH_PATCH_DATA;
-    }
+    int res;
+    uint8_t buf[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t size;
+    size_t i;
 
-    if (res == -DETOOLS_ALREADY_DONE) {
-        res = 0;
+    size = MIN(sizeof(buf), self_p->size);
+    res = patch_reader_decompress(patch_reader_p, &buf[0], &size);
+
+    if (res != 0) {
+        return (res);
     }
 
-    if (patch_reader_p->destroy != NULL) {
-        if (res == 0) {
-            res = patch_reader_p->destroy(patch_reader_p);
-        } else {
-            (void)patch_reader_p->destroy(patch_reader_p);
+    for (i = 0; i < size; i++) {
+        res = data_format_process_byte(self_p, buf[i]);
+
+        if (res != 0) {
+            return (res);
         }
     }
 
-    if (res == 0) {
-        res = (int)to_size;
+    self_p->size -= size;
+
+    if ((self_p->size == 0)
+        && (self_p->state != detools_data_format_state_done_t)) {
+        return (-DETOOLS_CORRUPT_PATCH);
     }
 
-    return (res);
+    return (0);
 }
 
-int detools_apply_patch_init(struct detools_apply_patch_t *self_p,
-                             detools_read_t from_read,
-                             detools_seek_t from_seek,
-                             size_t patch_size,
-                             detools_write_t to_write,
-                             void *arg_p)
+static bool data_format_is_unpacked(struct detools_data_format_t *self_p)
 {
-    self_p->from_read = from_read;
-    self_p->from_seek = from_seek;
-    self_p->patch_size = patch_size;
-    self_p->to_write = to_write;
-    self_p->arg_p = arg_p;
-    self_p->state = detools_apply_patch_state_init_t;
-    self_p->patch_reader.destroy = NULL;
+    return (self_p->size == 0);
+}
 
-    return (0);
+static void data_format_cursor_reset(struct detools_data_format_kind_t *kind_p)
+{
+    kind_p->rank = 0;
+    kind_p->cursor.block = kind_p->first_block;
+    kind_p->cursor.index = 0;
+    kind_p->cursor.value = 0;
 }
 
-int detools_apply_patch_process(struct detools_apply_patch_t *self_p,
-                                const uint8_t *patch_p,
-                                size_t size)
+/**
+ * Find the value at given cursor, skipping empty blocks.
+ *
+ * @return true and the value index if available, otherwise false.
+ */
+static bool data_format_cursor_get(struct detools_data_format_t *self_p,
+                                   struct detools_data_format_kind_t *kind_p,
+                                   struct detools_data_format_cursor_t *cursor_p,
+                                   size_t *index_p)
 {
-    int res;
-
-    res = 0;
-    self_p->chunk.buf_p = patch_p;
-    self_p->chunk.size = size;
-    self_p->chunk.offset = 0;
-
-    while (chunk_available(&self_p->chunk) && (res >= 0)) {
-        res = apply_patch_process_once(self_p);
+    if (cursor_p->value == kind_p->number_of_values) {
+        return (false);
     }
 
-    if (res == 1) {
-        res = 0;
+    while (cursor_p->index == self_p->blocks[cursor_p->block].number_of_values) {
+        cursor_p->block++;
+        cursor_p->index = 0;
     }
 
-    return (res);
+    *index_p = (kind_p->first_value + cursor_p->value);
+
+    return (true);
 }
 
-int detools_apply_patch_finalize(struct detools_apply_patch_t *self_p)
+static void data_format_cursor_next(struct detools_data_format_cursor_t *cursor_p)
 {
-    int res;
-
-    self_p->chunk.size = 0;
-    self_p->chunk.offset = 0;
-
-    do {
-        res = apply_patch_process_once(self_p);
-    } while (res == 0);
-
-    return (apply_patch_common_finalize(res,
-                                        &self_p->patch_reader,
-                                        self_p->to_size));
+    cursor_p->index++;
+    cursor_p->value++;
 }
 
-/*
- * Low level in-place patch type functionality.
+/**
+ * To position of the value at given cursor.
  */
+static int64_t data_format_cursor_to_pos(
+    struct detools_data_format_t *self_p,
+    struct detools_data_format_cursor_t *cursor_p,
+    size_t index)
+{
+    return ((int64_t)self_p->blocks[cursor_p->block].to_address
+            + self_p->from_addresses[index]
+            - self_p->from_addresses[index - cursor_p->index]);
+}
 
-static int in_place_all_steps_completed(struct detools_apply_patch_in_place_t *self_p)
+/**
+ * A value of given kind was found at given from-address. Replace the
+ * patch values of this rank with to-values.
+ */
+static int data_format_emit(struct detools_data_format_t *self_p,
+                            int kind,
+                            size_t address,
+                            uint64_t from_value)
 {
-    int res;
+    struct detools_data_format_kind_t *kind_p;
+    size_t rank;
+    size_t index;
+    uint64_t value;
+
+    kind_p = &self_p->kinds[kind];
+    rank = kind_p->rank;
+    kind_p->rank++;
+
+    while (data_format_cursor_get(self_p, kind_p, &kind_p->cursor, &index)) {
+        if (self_p->blocks[kind_p->cursor.block].from_offset
+            + kind_p->cursor.index > rank) {
+            break;
+        }
 
-    res = 0;
+        if (self_p->blocks[kind_p->cursor.block].from_offset
+            + kind_p->cursor.index < rank) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-    if (self_p->step_set != NULL) {
-        res = self_p->step_set(self_p->arg_p, 0);
+        value = (from_value - (uint64_t)(int64_t)(int32_t)self_p->values[index]);
 
-        if (res != 0) {
-            res = -DETOOLS_STEP_SET_FAILED;
+        if (kind_p->type == DATA_FORMAT_TYPE_U64) {
+            value -= kind_p->base;
+
+            if (((int64_t)value < INT32_MIN) || ((int64_t)value > INT32_MAX)) {
+                return (-DETOOLS_NOT_IMPLEMENTED);
+            }
         }
+
+        self_p->from_addresses[index] = (uint32_t)address;
+        self_p->values[index] = (uint32_t)value;
+        data_format_cursor_next(&kind_p->cursor);
     }
 
-    return (res);
+    return (0);
 }
 
-static int in_place_is_step_completed(struct detools_apply_patch_in_place_t *self_p,
-                                      bool *res_p)
+static int data_format_emit_pointer(struct detools_data_format_t *self_p,
+                                    size_t address,
+                                    uint64_t value,
+                                    bool *emitted_p)
 {
-    int res;
-    int completed_step;
-
-    if (self_p->step_get != NULL) {
-        res = self_p->step_get(self_p->arg_p, &completed_step);
-
-        if (res != 0) {
-            return (-DETOOLS_STEP_GET_FAILED);
-        }
-
-        *res_p = (self_p->ongoing_step <= completed_step);
-    } else {
-        *res_p = false;
+    *emitted_p = true;
+
+    if ((self_p->data_begin <= value) && (value < self_p->data_end)) {
+        return (data_format_emit(self_p,
+                                 DATA_FORMAT_KIND_DATA_POINTERS,
+                                 address,
+                                 value));
+    } else if ((self_p->code_begin <= value) && (value < self_p->code_end)) {
+        return (data_format_emit(self_p,
+                                 DATA_FORMAT_KIND_CODE_POINTERS,
+                                 address,
+                                 value));
     }
 
+    *emitted_p = false;
+
     return (0);
 }
 
-static int in_place_next_step(struct detools_apply_patch_in_place_t *self_p)
+static bool data_format_is_data(struct detools_data_format_t *self_p,
+                                size_t address)
+{
+    return ((self_p->data_offset_begin <= address)
+            && (address < (self_p->data_offset_begin
+                           + self_p->data_end
+                           - self_p->data_begin)));
+}
+
+/**
+ * Read up to given number of bytes at given address.
+ *
+ * @return Number of read bytes or negative error code.
+ */
+static int data_format_reader_read(struct data_format_reader_t *self_p,
+                                   size_t address,
+                                   uint8_t *buf_p,
+                                   size_t size)
 {
     int res;
-    bool is_step_completed;
+    size_t begin;
+    size_t keep;
+    size_t read_size;
 
-    res = 0;
+    if (address >= self_p->size) {
+        return (0);
+    }
 
-    if (self_p->step_set != NULL) {
-        res = in_place_is_step_completed(self_p, &is_step_completed);
+    size = MIN(size, self_p->size - address);
 
-        if (res != 0) {
-            return (res);
+    if (address < self_p->begin) {
+        return (-DETOOLS_INTERNAL_ERROR);
+    }
+
+    if (address + size > self_p->end) {
+        begin = (MAX(address, self_p->begin + DATA_FORMAT_READER_LOOKBACK)
+                 - DATA_FORMAT_READER_LOOKBACK);
+
+        if (begin < self_p->end) {
+            keep = (self_p->end - begin);
+            memmove(&self_p->buf[0], &self_p->buf[begin - self_p->begin], keep);
+        } else {
+            keep = 0;
         }
 
-        if (!is_step_completed) {
-            res = self_p->step_set(self_p->arg_p, self_p->ongoing_step);
+        read_size = MIN(sizeof(self_p->buf) - keep,
+                        self_p->size - (begin + keep));
+        res = self_p->read(self_p->arg_p,
+                           &self_p->buf[keep],
+                           begin + keep,
+                           read_size);
 
-            if (res != 0) {
-                res = -DETOOLS_STEP_SET_FAILED;
-            }
+        if (res != 0) {
+            return (res);
         }
+
+        self_p->begin = begin;
+        self_p->end = (begin + keep + read_size);
     }
 
-    self_p->ongoing_step++;
+    memcpy(buf_p, &self_p->buf[address - self_p->begin], size);
 
-    return (res);
+    return ((int)size);
 }
 
-static int in_place_mem_read(struct detools_apply_patch_in_place_t *self_p,
-                             void *dst_p,
-                             uintptr_t src,
-                             size_t size)
-{
-    int res;
-    bool is_step_completed;
+#if DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1
 
-    res = in_place_is_step_completed(self_p, &is_step_completed);
+static uint16_t unpack_u16(const uint8_t *buf_p)
+{
+    return (uint16_t)(buf_p[0] | (buf_p[1] << 8));
+}
 
-    if (res != 0) {
-        return (res);
+static uint32_t arm_cortex_m4_unpack_bw(uint16_t upper_16, uint16_t lower_16)
+{
+    uint32_t s;
+    uint32_t value;
+
+    s = ((upper_16 & 0x400u) >> 10);
+    value = ((s << 24)
+             | ((uint32_t)(lower_16 & 0x800u) << 12)
+             | ((uint32_t)(lower_16 & 0x2000u) << 9)
+             | ((uint32_t)(upper_16 & 0x3fu) << 16)
+             | ((uint32_t)(lower_16 & 0x7ffu) << 5)
+             | ((uint32_t)(upper_16 & 0x3c0u) >> 5)
+             | ((uint32_t)(lower_16 & 0x1000u) >> 12));
+
+    if (s == 1) {
+        value -= (1u << 25);
     }
 
-    if (!is_step_completed) {
-        return (self_p->mem_read(self_p->arg_p, dst_p, src, size));
-    } else {
-        memset(dst_p, 0, size);
-
-        return (0);
-    }
+    return (value);
 }
 
-static int in_place_mem_write(struct detools_apply_patch_in_place_t *self_p,
-                              uintptr_t dst,
-                              void *src_p,
-                              size_t size)
+static uint32_t arm_cortex_m4_unpack_bl(uint16_t upper_16, uint16_t lower_16)
 {
-    int res;
-    bool is_step_completed;
+    uint32_t s;
+    uint32_t i1;
+    uint32_t i2;
+    uint32_t value;
+
+    s = ((upper_16 & 0x400u) >> 10);
+    i1 = (1u - ((((lower_16 & 0x2000u) >> 13) ^ s)));
+    i2 = (1u - ((((lower_16 & 0x800u) >> 11) ^ s)));
+    value = ((s << 23)
+             | (i1 << 22)
+             | (i2 << 21)
+             | ((uint32_t)(upper_16 & 0x3ffu) << 11)
+             | (lower_16 & 0x7ffu));
+
+    if (s == 1) {
+        value -= (1u << 24);
+    }
 
-    res = in_place_is_step_completed(self_p, &is_step_completed);
+    return (value);
+}
 
-    if (res != 0) {
-        return (res);
-    }
+static void arm_cortex_m4_pack_bw(uint8_t *buf_p, uint32_t value)
+{
+    uint32_t t;
+    uint32_t cond;
+    uint32_t imm32;
+    uint16_t upper_16;
+    uint16_t lower_16;
+
+    value &= 0x1ffffff;
+    t = (value & 1);
+    cond = ((value >> 1) & 0xf);
+    imm32 = (value >> 5);
+    upper_16 = (uint16_t)(0xf000
+                          | (((imm32 >> 19) & 1) << 10)
+                          | (cond << 6)
+                          | ((imm32 >> 11) & 0x3f));
+    lower_16 = (uint16_t)(0x8000
+                          | (((imm32 >> 17) & 1) << 13)
+                          | (t << 12)
+                          | (((imm32 >> 18) & 1) << 11)
+                          | (imm32 & 0x7ff));
+    buf_p[0] = (uint8_t)upper_16;
+    buf_p[1] = (uint8_t)(upper_16 >> 8);
+    buf_p[2] = (uint8_t)lower_16;
+    buf_p[3] = (uint8_t)(lower_16 >> 8);
+}
 
-    if (!is_step_completed) {
-        return (self_p->mem_write(self_p->arg_p, dst, src_p, size));
-    } else {
-        return (0);
-    }
+static void arm_cortex_m4_pack_bl(uint8_t *buf_p, uint32_t value)
+{
+    uint32_t s;
+    uint32_t j1;
+    uint32_t j2;
+    uint16_t upper_16;
+    uint16_t lower_16;
+
+    value &= 0xffffff;
+    s = (value >> 23);
+    j1 = (1u - (((value >> 22) & 1) ^ s));
+    j2 = (1u - (((value >> 21) & 1) ^ s));
+    upper_16 = (uint16_t)(0xf000 | (s << 10) | ((value >> 11) & 0x3ff));
+    lower_16 = (uint16_t)(0xd000 | (j1 << 13) | (j2 << 11) | (value & 0x7ff));
+    buf_p[0] = (uint8_t)upper_16;
+    buf_p[1] = (uint8_t)(upper_16 >> 8);
+    buf_p[2] = (uint8_t)lower_16;
+    buf_p[3] = (uint8_t)(lower_16 >> 8);
 }
 
-static int in_place_mem_erase(struct detools_apply_patch_in_place_t *self_p,
-                              uintptr_t addr,
-                              size_t size)
+static bool arm_cortex_m4_is_literal(const uint8_t *literals_p, size_t address)
 {
-    int res;
-    bool is_step_completed;
+    address %= ARM_CORTEX_M4_LITERALS_SIZE;
 
-    res = in_place_is_step_completed(self_p, &is_step_completed);
+    return ((literals_p[address / 8] & (1 << (address % 8))) != 0);
+}
 
-    if (res != 0) {
-        return (res);
+static void arm_cortex_m4_add_literal(uint8_t *literals_p,
+                                      size_t address,
+                                      size_t offset,
+                                      size_t size)
+{
+    if ((address % 4) == 2) {
+        address -= 2;
     }
 
-    if (!is_step_completed) {
-        return (self_p->mem_erase(self_p->arg_p, addr, size));
-    } else {
-        return (0);
+    address += offset;
+
+    if (address + 4 <= size) {
+        address %= ARM_CORTEX_M4_LITERALS_SIZE;
+        literals_p[address / 8] |= (uint8_t)(1 << (address % 8));
     }
 }
 
-static int in_place_shift_memory(struct detools_apply_patch_in_place_t *self_p,
-                                 size_t memory_size,
-                                 size_t from_size)
+/**
+ * Emit ldr and ldr.w literals before given address in address order.
+ */
+static int arm_cortex_m4_emit_literals(struct detools_data_format_t *self_p,
+                                       struct data_format_reader_t *reader_p,
+                                       uint8_t *ldr_p,
+                                       uint8_t *ldr_w_p,
+                                       size_t *address_p,
+                                       size_t end)
 {
-    size_t i;
-    size_t number_of_segments;
     int res;
-    size_t read_address;
-    size_t write_address;
-    uint8_t buf[128];
-    size_t offset;
-    size_t size;
+    size_t address;
+    uint8_t buf[4];
+    uint8_t mask;
 
-    number_of_segments = DIV_CEIL(MIN(from_size, memory_size - self_p->shift_size),
-                                  self_p->segment_size);
-    read_address = ((number_of_segments - 1) * self_p->segment_size);
-    write_address = (read_address + self_p->shift_size);
+    for (address = *address_p; address + 4 <= end; address++) {
+        mask = (uint8_t)(1 << (address % 8));
 
-    for (i = 0; i < number_of_segments; i++) {
-        /* Erase segment to write to. */
-        res = in_place_mem_erase(self_p,
-                                 write_address,
-                                 self_p->segment_size);
+        if (!arm_cortex_m4_is_literal(ldr_p, address)
+            && !arm_cortex_m4_is_literal(ldr_w_p, address)) {
+            continue;
+        }
 
-        if (res != 0) {
+        res = data_format_reader_read(reader_p, address, &buf[0], 4);
+
+        if (res < 0) {
             return (res);
         }
 
-        /* Copy data to erased segment. */
-        offset = 0;
-
-        while (offset < self_p->segment_size) {
-            size = MIN(sizeof(buf), self_p->segment_size - offset);
-            res = in_place_mem_read(self_p,
-                                    &buf[0],
-                                    read_address + offset,
-                                    size);
+        if (arm_cortex_m4_is_literal(ldr_p, address)) {
+            ldr_p[(address % ARM_CORTEX_M4_LITERALS_SIZE) / 8] &= (uint8_t)~mask;
+            res = data_format_emit(self_p,
+                                   ARM_CORTEX_M4_KIND_LDR,
+                                   address,
+                                   unpack_u32(&buf[0]));
 
             if (res != 0) {
                 return (res);
             }
+        }
 
-            res = in_place_mem_write(self_p,
-                                     write_address + offset,
-                                     &buf[0],
-                                     size);
+        if (arm_cortex_m4_is_literal(ldr_w_p, address)) {
+            ldr_w_p[(address % ARM_CORTEX_M4_LITERALS_SIZE) / 8] &= (uint8_t)~mask;
+            res = data_format_emit(self_p,
+                                   ARM_CORTEX_M4_KIND_LDR_W,
+                                   address,
+                                   unpack_u32(&buf[0]));
 
             if (res != 0) {
                 return (res);
             }
-
-            offset += size;
-        }
-
-        res = in_place_next_step(self_p);
-
-        if (res != 0) {
-            return (res);
         }
-
-        write_address -= self_p->segment_size;
-        read_address -= self_p->segment_size;
     }
 
+    *address_p = address;
+
     return (0);
 }
 
-static int in_place_read_header(struct detools_apply_patch_in_place_t *self_p,
-                                int *compression_p,
-                                int *memory_size_p,
-                                int *segment_size_p,
-                                int *shift_size_p,
-                                int *from_size_p,
-                                int *to_size_p)
+static bool arm_cortex_m4_is_32_bit(uint16_t upper_16)
+{
+    return (((upper_16 & 0xfff0) == 0xfbb0)
+            || ((upper_16 & 0xfff0) == 0xfb90)
+            || ((upper_16 & 0xfff0) == 0xf8d0)
+            || ((upper_16 & 0xfff0) == 0xf850)
+            || ((upper_16 & 0xffe0) == 0xfa00)
+            || ((upper_16 & 0xffc0) == 0xe900));
+}
+
+static int arm_cortex_m4_disassemble(struct detools_data_format_t *self_p,
+                                     struct data_format_reader_t *reader_p)
 {
-    int patch_type;
-    uint8_t byte;
     int res;
+    uint8_t ldr[ARM_CORTEX_M4_LITERALS_SIZE / 8];
+    uint8_t ldr_w[ARM_CORTEX_M4_LITERALS_SIZE / 8];
+    uint8_t buf[4];
+    size_t size;
+    size_t address;
+    size_t literals_address;
+    uint16_t upper_16;
+    uint16_t lower_16;
+    bool emitted;
+
+    memset(&ldr[0], 0, sizeof(ldr));
+    memset(&ldr_w[0], 0, sizeof(ldr_w));
+    size = reader_p->size;
+    address = 0;
+    literals_address = 0;
+
+    while (address < size) {
+        if (data_format_is_data(self_p, address)) {
+            res = data_format_reader_read(reader_p, address, &buf[0], 4);
+
+            if (res < 0) {
+                return (res);
+            }
 
-    if (chunk_get(&self_p->chunk, &byte) != 0) {
-        return (-DETOOLS_SHORT_HEADER);
-    }
+            if (res != 4) {
+                address = size;
+            } else {
+                res = data_format_emit_pointer(self_p,
+                                               address,
+                                               unpack_u32(&buf[0]),
+                                               &emitted);
+                address += 4;
+            }
+        } else if (arm_cortex_m4_is_literal(&ldr[0], address)
+                   || arm_cortex_m4_is_literal(&ldr_w[0], address)) {
+            address = MIN(address + 4, size);
+            res = 0;
+        } else {
+            res = data_format_reader_read(reader_p, address, &buf[0], 4);
 
-    patch_type = ((byte >> 4) & 0x7);
-    *compression_p = (byte & 0xf);
+            if (res < 0) {
+                return (res);
+            }
 
-    if (patch_type != PATCH_TYPE_IN_PLACE) {
-        return (-DETOOLS_BAD_PATCH_TYPE);
-    }
+            if (res < 2) {
+                address = size;
+            } else {
+                upper_16 = unpack_u16(&buf[0]);
+                lower_16 = unpack_u16(&buf[2]);
+
+                if ((upper_16 & 0xf800) == 0xf000) {
+                    if (res != 4) {
+                        address = size;
+                    } else if ((lower_16 & 0xd000) == 0xd000) {
+                        res = data_format_emit(
+                            self_p,
+                            ARM_CORTEX_M4_KIND_BL,
+                            address,
+                            arm_cortex_m4_unpack_bl(upper_16, lower_16));
+                        address += 4;
+                    } else if ((lower_16 & 0xc000) == 0x8000) {
+                        res = data_format_emit(
+                            self_p,
+                            ARM_CORTEX_M4_KIND_BW,
+                            address,
+                            arm_cortex_m4_unpack_bw(upper_16, lower_16));
+                        address += 4;
+                    } else {
+                        address += 4;
+                    }
+                } else if ((upper_16 & 0xf800) == 0x4800) {
+                    arm_cortex_m4_add_literal(&ldr[0],
+                                              address,
+                                              4u * (upper_16 & 0xffu) + 4,
+                                              size);
+                    address += 2;
+                } else if (upper_16 == 0xf8df) {
+                    if (res != 4) {
+                        address = size;
+                    } else {
+                        arm_cortex_m4_add_literal(&ldr_w[0],
+                                                  address,
+                                                  (lower_16 & 0xfffu) + 4,
+                                                  size);
+                        address += 4;
+                    }
+                } else if (arm_cortex_m4_is_32_bit(upper_16)) {
+                    address = MIN(address + 4, size);
+                } else {
+                    address += 2;
+                }
+
+                if (res > 0) {
+                    res = 0;
+                }
+            }
+        }
 
-    res = chunk_unpack_header_size(&self_p->chunk, memory_size_p);
+        if (res != 0) {
+            return (res);
+        }
 
-    if (res != 0) {
-        return (res);
+        res = arm_cortex_m4_emit_literals(self_p,
+                                          reader_p,
+                                          &ldr[0],
+                                          &ldr_w[0],
+                                          &literals_address,
+                                          address);
+
+        if (res != 0) {
+            return (res);
+        }
     }
 
-    res = chunk_unpack_header_size(&self_p->chunk, segment_size_p);
+    return (0);
+}
 
-    if (res != 0) {
-        return (res);
-    }
+#endif
 
-    res = chunk_unpack_header_size(&self_p->chunk, shift_size_p);
+#if DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1
 
-    if (res != 0) {
-        return (res);
-    }
+static void aarch64_pack_add(uint8_t *buf_p, uint32_t value)
+{
+    uint32_t reg;
+
+    reg = ((value >> 14) & 0x1f);
+    pack_u32(buf_p,
+             ((0x91u << 24)
+              | (((value >> 12) & 0x3) << 22)
+              | ((value & 0xfff) << 10)
+              | (reg << 5)
+              | reg));
+}
 
-    res = chunk_unpack_header_size(&self_p->chunk, from_size_p);
+static void aarch64_pack_adrp(uint8_t *buf_p, uint32_t value)
+{
+    pack_u32(buf_p,
+             ((1u << 31)
+              | ((value & 0x3) << 29)
+              | (0x10u << 24)
+              | (((value >> 2) & 0x7ffff) << 5)
+              | ((value >> 21) & 0x1f)));
+}
 
-    if (res != 0) {
-        return (res);
+static int aarch64_disassemble_instruction(struct detools_data_format_t *self_p,
+                                           size_t address,
+                                           uint32_t value)
+{
+    int kind;
+    uint32_t rn;
+    uint32_t rd;
+
+    if ((value & 0xfc000000) == 0x94000000) {
+        kind = AARCH64_KIND_BL;
+    } else if ((value & 0xff000000) == 0x91000000) {
+        rn = ((value >> 5) & 0x1f);
+        rd = (value & 0x1f);
+
+        if (rn == rd) {
+            kind = AARCH64_KIND_ADD;
+            value = (((value >> 10) & 0xfff)
+                     | (((value >> 22) & 0x3) << 12)
+                     | (rn << 14));
+        } else {
+            kind = AARCH64_KIND_ADD_GENERIC;
+        }
+    } else if ((value & 0xff000000) == 0x14000000) {
+        /* Branches are not patched. */
+        return (0);
+    } else if (((value & 0xffc00000) == 0xf9400000)
+               || ((value & 0xffc00000) == 0xb9400000)
+               || ((value & 0xffc00000) == 0x39400000)
+               || ((value & 0xffc00000) == 0x39000000)
+               || ((value & 0xffe00000) == 0xf8400000)
+               || ((value & 0xffe00000) == 0xb8400000)) {
+        kind = AARCH64_KIND_LDR;
+    } else if (((value & 0xffc00000) == 0xa9000000)
+               || ((value & 0xffc00000) == 0xb9000000)) {
+        kind = AARCH64_KIND_STR;
+    } else if ((value & 0x9f000000) == 0x90000000) {
+        kind = AARCH64_KIND_ADRP;
+        value = (((value >> 29) & 0x3)
+                 | (((value >> 5) & 0x7ffff) << 2)
+                 | ((value & 0x1f) << 21));
+    } else if ((value & 0xffc00000) == 0xf9000000) {
+        kind = AARCH64_KIND_STR_IMM_64;
+    } else {
+        return (0);
     }
 
-    return (chunk_unpack_header_size(&self_p->chunk, to_size_p));
+    return (data_format_emit(self_p, kind, address, value));
 }
 
-static int in_place_process_init(struct detools_apply_patch_in_place_t *self_p)
+static int aarch64_disassemble(struct detools_data_format_t *self_p,
+                               struct data_format_reader_t *reader_p)
 {
     int res;
-    int compression;
-    int memory_size;
-    int segment_size;
-    int shift_size;
-    int from_size;
-    int to_size;
+    uint8_t buf[8];
+    size_t size;
+    size_t address;
+    bool emitted;
 
-    res = in_place_read_header(self_p,
-                               &compression,
-                               &memory_size,
-                               &segment_size,
-                               &shift_size,
-                               &from_size,
-                               &to_size);
+    size = reader_p->size;
+    address = 0;
 
-    if (res != 0) {
-        return (res);
-    }
+    while (address < size) {
+        if (data_format_is_data(self_p, address)) {
+            res = data_format_reader_read(reader_p, address, &buf[0], 8);
 
-    res = patch_reader_init(&self_p->patch_reader,
-                            &self_p->chunk,
+            if (res < 0) {
+                return (res);
+            }
+
+            if (res != 8) {
+                address = size;
+                res = 0;
+            } else {
+                res = data_format_emit_pointer(
+                    self_p,
+                    address,
+                    (unpack_u32(&buf[0])
+                     | ((uint64_t)unpack_u32(&buf[4]) << 32)),
+                    &emitted);
+                address += (emitted ? 8 : 4);
+            }
+        } else {
+            res = data_format_reader_read(reader_p, address, &buf[0], 4);
+
+            if (res < 0) {
+                return (res);
+            }
+
+            if (res != 4) {
+                address = size;
+                res = 0;
+            } else {
+                res = aarch64_disassemble_instruction(self_p,
+                                                      address,
+                                                      unpack_u32(&buf[0]));
+                address += 4;
+            }
+        }
+
+        if (res != 0) {
+            return (res);
+        }
+    }
+
+    return (0);
+}
+
+#endif
+
+#if DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106 == 1
+
+static int xtensa_lx106_disassemble(struct detools_data_format_t *self_p,
+                                    struct data_format_reader_t *reader_p)
+{
+    int res;
+    uint8_t buf[4];
+    size_t size;
+    size_t address;
+    bool emitted;
+
+    size = reader_p->size;
+    address = 0;
+
+    while (address < size) {
+        if (data_format_is_data(self_p, address)) {
+            res = data_format_reader_read(reader_p, address, &buf[0], 4);
+
+            if (res < 0) {
+                return (res);
+            }
+
+            if (res != 4) {
+                address = size;
+                res = 0;
+            } else {
+                res = data_format_emit_pointer(self_p,
+                                               address,
+                                               unpack_u32(&buf[0]),
+                                               &emitted);
+                address += 4;
+            }
+        } else {
+            res = data_format_reader_read(reader_p, address, &buf[0], 3);
+
+            if (res < 0) {
+                return (res);
+            }
+
+            if ((buf[0] & 0x3f) == 0x05) {
+                if (res != 3) {
+                    address = size;
+                    res = 0;
+                } else {
+                    res = data_format_emit(self_p,
+                                           XTENSA_LX106_KIND_CALL0,
+                                           address,
+                                           ((uint32_t)buf[0]
+                                            | ((uint32_t)buf[1] << 8)
+                                            | ((uint32_t)buf[2] << 16)));
+                    address += 3;
+                }
+            } else {
+                if ((buf[0] == 0x66) || ((buf[0] & 0xf) == 0x01)) {
+                    address = MIN(address + 3, size);
+                } else if ((buf[0] & 0xf) == 0x04) {
+                    address = MIN(address + 2, size);
+                } else {
+                    address++;
+                }
+
+                res = 0;
+            }
+        }
+
+        if (res != 0) {
+            return (res);
+        }
+    }
+
+    return (0);
+}
+
+#endif
+
+/**
+ * Check that all patch values were found in the from-data and that
+ * the to-positions of each kind are sorted.
+ */
+static int data_format_check(struct detools_data_format_t *self_p)
+{
+    int i;
+    struct detools_data_format_kind_t *kind_p;
+    size_t index;
+    int64_t to_pos;
+    int64_t previous_to_pos;
+
+    for (i = 0; i < self_p->number_of_kinds; i++) {
+        kind_p = &self_p->kinds[i];
+
+        if (kind_p->cursor.value != kind_p->number_of_values) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
+
+        data_format_cursor_reset(kind_p);
+        previous_to_pos = INT64_MIN;
+
+        while (data_format_cursor_get(self_p, kind_p, &kind_p->cursor, &index)) {
+            to_pos = data_format_cursor_to_pos(self_p, &kind_p->cursor, index);
+
+            if (to_pos < previous_to_pos) {
+                return (-DETOOLS_CORRUPT_PATCH);
+            }
+
+            previous_to_pos = to_pos;
+            data_format_cursor_next(&kind_p->cursor);
+        }
+
+        data_format_cursor_reset(kind_p);
+    }
+
+    return (0);
+}
+
+/**
+ * Disassemble the from-data and calculate the to-values of all patch
+ * values.
+ */
+static int data_format_disassemble(struct detools_data_format_t *self_p,
+                                   data_format_read_t read,
+                                   void *arg_p,
+                                   size_t from_size)
+{
+    int res;
+    int i;
+    struct data_format_reader_t reader;
+
+    if ((uint64_t)from_size > UINT32_MAX) {
+        return (-DETOOLS_NOT_IMPLEMENTED);
+    }
+
+    for (i = 0; i < self_p->number_of_kinds; i++) {
+        data_format_cursor_reset(&self_p->kinds[i]);
+    }
+
+    self_p->kinds[DATA_FORMAT_KIND_DATA_POINTERS].base = self_p->data_begin;
+    self_p->kinds[DATA_FORMAT_KIND_CODE_POINTERS].base = self_p->code_begin;
+    reader.read = read;
+    reader.arg_p = arg_p;
+    reader.size = from_size;
+    reader.begin = 0;
+    reader.end = 0;
+
+    switch (self_p->data_format) {
+
+#if DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1
+    case DATA_FORMAT_ARM_CORTEX_M4:
+        res = arm_cortex_m4_disassemble(self_p, &reader);
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1
+    case DATA_FORMAT_AARCH64:
+        res = aarch64_disassemble(self_p, &reader);
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106 == 1
+    case DATA_FORMAT_XTENSA_LX106:
+        res = xtensa_lx106_disassemble(self_p, &reader);
+        break;
+#endif
+
+    default:
+        res = -DETOOLS_INTERNAL_ERROR;
+        break;
+    }
+
+    if (res != 0) {
+        return (res);
+    }
+
+    return (data_format_check(self_p));
+}
+
+static void data_format_pack(struct detools_data_format_kind_t *kind_p,
+                             uint32_t value,
+                             uint8_t *buf_p)
+{
+    uint64_t value_64;
+    int i;
+
+    switch (kind_p->type) {
+
+#if DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1
+    case DATA_FORMAT_TYPE_BW:
+        arm_cortex_m4_pack_bw(buf_p, value);
+        break;
+
+    case DATA_FORMAT_TYPE_BL:
+        arm_cortex_m4_pack_bl(buf_p, value);
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1
+    case DATA_FORMAT_TYPE_ADD:
+        aarch64_pack_add(buf_p, value);
+        break;
+
+    case DATA_FORMAT_TYPE_ADRP:
+        aarch64_pack_adrp(buf_p, value);
+        break;
+#endif
+
+    case DATA_FORMAT_TYPE_U64:
+        value_64 = (kind_p->base + (uint64_t)(int64_t)(int32_t)value);
+
+        for (i = 0; i < 8; i++) {
+            buf_p[i] = (uint8_t)(value_64 >> (8 * i));
+        }
+
+        break;
+
+    default:
+        pack_u32(buf_p, value);
+        break;
+    }
+}
+
+/**
+ * Zero from-data bytes at patch values of all kinds.
+ */
+static void data_format_from(struct detools_data_format_t *self_p,
+                             size_t from_pos,
+                             uint8_t *buf_p,
+                             size_t size)
+{
+    int i;
+    struct detools_data_format_kind_t *kind_p;
+    const uint32_t *addresses_p;
+    size_t overwrite_size;
+    size_t low;
+    size_t high;
+    size_t middle;
+    size_t begin;
+    size_t end;
+
+    for (i = 0; i < self_p->number_of_kinds; i++) {
+        kind_p = &self_p->kinds[i];
+        addresses_p = &self_p->from_addresses[kind_p->first_value];
+        overwrite_size = data_format_type_size(kind_p->type);
+        low = 0;
+        high = kind_p->number_of_values;
+
+        while (low < high) {
+            middle = ((low + high) / 2);
+
+            if (addresses_p[middle] + overwrite_size <= from_pos) {
+                low = (middle + 1);
+            } else {
+                high = middle;
+            }
+        }
+
+        while ((low < kind_p->number_of_values)
+               && (addresses_p[low] < from_pos + size)) {
+            begin = MAX(addresses_p[low], from_pos);
+            end = MIN(addresses_p[low] + overwrite_size, from_pos + size);
+            memset(&buf_p[begin - from_pos], 0, end - begin);
+            low++;
+        }
+    }
+}
+
+/**
+ * Write the diff of patch values at given to-position to given buffer,
+ * with later kinds overwriting earlier ones.
+ *
+ * @return true if any diff was written, otherwise false.
+ */
+static bool data_format_diff(struct detools_data_format_t *self_p,
+                             size_t to_pos,
+                             uint8_t *diff_p,
+                             size_t size)
+{
+    int i;
+    int j;
+    struct detools_data_format_kind_t *kind_p;
+    struct detools_data_format_cursor_t cursor;
+    size_t index;
+    int64_t begin;
+    int64_t end;
+    int64_t value_to_pos;
+    int64_t value_size;
+    uint8_t buf[8];
+    bool written;
+
+    begin = (int64_t)to_pos;
+    end = (int64_t)(to_pos + size);
+    written = false;
+
+    for (i = 0; i < self_p->number_of_kinds; i++) {
+        kind_p = &self_p->kinds[self_p->order_p[i]];
+        value_size = (int64_t)data_format_type_size(kind_p->type);
+
+        /* Skip values before the buffer. */
+        while (data_format_cursor_get(self_p, kind_p, &kind_p->cursor, &index)) {
+            value_to_pos = data_format_cursor_to_pos(self_p,
+                                                     &kind_p->cursor,
+                                                     index);
+
+            if (value_to_pos + value_size > begin) {
+                break;
+            }
+
+            data_format_cursor_next(&kind_p->cursor);
+        }
+
+        cursor = kind_p->cursor;
+
+        while (data_format_cursor_get(self_p, kind_p, &cursor, &index)) {
+            value_to_pos = data_format_cursor_to_pos(self_p, &cursor, index);
+
+            if (value_to_pos >= end) {
+                break;
+            }
+
+            if (!written) {
+                memset(diff_p, 0, size);
+                written = true;
+            }
+
+            data_format_pack(kind_p, self_p->values[index], &buf[0]);
+
+            for (j = 0; j < value_size; j++) {
+                if ((value_to_pos + j >= begin) && (value_to_pos + j < end)) {
+                    diff_p[value_to_pos + j - begin] = buf[j];
+                }
+            }
+
+            data_format_cursor_next(&cursor);
+        }
+    }
+
+    return (written);
+}
+
+/**
+ * Add the diff of patch values to given to-data of at most
+ * DETOOLS_CONFIG_WORK_BUFFER_SIZE bytes.
+ */
+static void data_format_add_diff(struct detools_data_format_t *self_p,
+                                 size_t to_pos,
+                                 uint8_t *to_p,
+                                 size_t size)
+{
+    size_t i;
+    uint8_t diff[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+
+    if (data_format_diff(self_p, to_pos, &diff[0], size)) {
+        for (i = 0; i < size; i++) {
+            to_p[i] = (uint8_t)(to_p[i] + diff[i]);
+        }
+    }
+}
+
+#endif
+
+/*
+ * CRC32 of to-data digests and of patch data in checkpoints.
+ */
+
+static const uint32_t crc32_table[16] = {
+    0x00000000, 0x1db71064, 0x3b6e20c8, 0x26d930ac,
+    0x76dc4190, 0x6b6b51f4, 0x4db26158, 0x5005713c,
+    0xedb88320, 0xf00f9344, 0xd6d6a3e8, 0xcb61b38c,
+    0x9b64c2b0, 0x86d3d2d4, 0xa00ae278, 0xbdbdf21c
+};
+
+static uint32_t crc32_update(uint32_t crc, const uint8_t *buf_p, size_t size)
+{
+    size_t i;
+
+    for (i = 0; i < size; i++) {
+        crc ^= buf_p[i];
+        crc = ((crc >> 4) ^ crc32_table[crc & 0xf]);
+        crc = ((crc >> 4) ^ crc32_table[crc & 0xf]);
+    }
+
+    return (crc);
+}
+
+#if DETOOLS_DIGEST == 1
+
+/*
+ * Digests of to-data.
+ */
+
+#if DETOOLS_CONFIG_DIGEST_SHA256 == 1
+
+static const uint32_t sha256_k[64] = {
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5,
+    0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3,
+    0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc,
+    0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7,
+    0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13,
+    0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3,
+    0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5,
+    0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208,
+    0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+};
+
+static uint32_t sha256_rotr(uint32_t value, int count)
+{
+    return ((value >> count) | (value << (32 - count)));
+}
+
+static void sha256_compress(uint32_t *state_p, const uint8_t *block_p)
+{
+    uint32_t w[64];
+    uint32_t v[8];
+    uint32_t t1;
+    uint32_t t2;
+    int i;
+
+    for (i = 0; i < 16; i++) {
+        w[i] = (((uint32_t)block_p[4 * i] << 24)
+                | ((uint32_t)block_p[4 * i + 1] << 16)
+                | ((uint32_t)block_p[4 * i + 2] << 8)
+                | (uint32_t)block_p[4 * i + 3]);
+    }
+
+    for (i = 16; i < 64; i++) {
+        w[i] = (w[i - 16]
+                + (sha256_rotr(w[i - 15], 7)
+                   ^ sha256_rotr(w[i - 15], 18)
+                   ^ (w[i - 15] >> 3))
+                + w[i - 7]
+                + (sha256_rotr(w[i - 2], 17)
+                   ^ sha256_rotr(w[i - 2], 19)
+                   ^ (w[i - 2] >> 10)));
+    }
+
+    memcpy(&v[0], state_p, sizeof(v));
+
+    for (i = 0; i < 64; i++) {
+        t1 = (v[7]
+              + (sha256_rotr(v[4], 6)
+                 ^ sha256_rotr(v[4], 11)
+                 ^ sha256_rotr(v[4], 25))
+              + ((v[4] & v[5]) ^ (~v[4] & v[6]))
+              + sha256_k[i]
+              + w[i]);
+        t2 = ((sha256_rotr(v[0], 2)
+               ^ sha256_rotr(v[0], 13)
+               ^ sha256_rotr(v[0], 22))
+              + ((v[0] & v[1]) ^ (v[0] & v[2]) ^ (v[1] & v[2])));
+        memmove(&v[1], &v[0], 7 * sizeof(v[0]));
+        v[4] += t1;
+        v[0] = (t1 + t2);
+    }
+
+    for (i = 0; i < 8; i++) {
+        state_p[i] += v[i];
+    }
+}
+
+static void sha256_update(struct detools_digest_t *self_p,
+                          const uint8_t *buf_p,
+                          size_t size)
+{
+    size_t offset;
+    size_t chunk_size;
+
+    while (size > 0) {
+        offset = (self_p->kind.sha256.size % 64);
+        chunk_size = MIN(64 - offset, size);
+        memcpy(&self_p->kind.sha256.buf[offset], buf_p, chunk_size);
+        self_p->kind.sha256.size += chunk_size;
+        buf_p += chunk_size;
+        size -= chunk_size;
+
+        if (offset + chunk_size == 64) {
+            sha256_compress(&self_p->kind.sha256.state[0],
+                            &self_p->kind.sha256.buf[0]);
+        }
+    }
+}
+
+/**
+ * Write the digest to given buffer. Finalizes a copy of the state, so
+ * the digest can be updated afterwards.
+ */
+static void sha256_get(const struct detools_digest_t *self_p,
+                       uint8_t *digest_p)
+{
+    struct detools_digest_t digest;
+    uint8_t padding[72];
+    size_t padding_size;
+    uint64_t size;
+    int i;
+
+    digest = *self_p;
+    size = (self_p->kind.sha256.size * 8);
+    padding_size = (64 - ((self_p->kind.sha256.size + 8) % 64));
+    memset(&padding[0], 0, padding_size);
+    padding[0] = 0x80;
+
+    for (i = 0; i < 8; i++) {
+        padding[padding_size + (size_t)i] = (uint8_t)(size >> (56 - 8 * i));
+    }
+
+    sha256_update(&digest, &padding[0], padding_size + 8);
+
+    for (i = 0; i < 32; i++) {
+        digest_p[i] = (uint8_t)(digest.kind.sha256.state[i / 4]
+                                >> (24 - 8 * (i % 4)));
+    }
+}
+
+#endif
+
+static int digest_init(struct detools_digest_t *self_p, int type)
+{
+    switch (type) {
+
+#if DETOOLS_CONFIG_DIGEST_CRC32 == 1
+    case DETOOLS_DIGEST_CRC32:
+        self_p->kind.crc32 = 0xffffffff;
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DIGEST_SHA256 == 1
+    case DETOOLS_DIGEST_SHA256:
+        self_p->kind.sha256.state[0] = 0x6a09e667;
+        self_p->kind.sha256.state[1] = 0xbb67ae85;
+        self_p->kind.sha256.state[2] = 0x3c6ef372;
+        self_p->kind.sha256.state[3] = 0xa54ff53a;
+        self_p->kind.sha256.state[4] = 0x510e527f;
+        self_p->kind.sha256.state[5] = 0x9b05688c;
+        self_p->kind.sha256.state[6] = 0x1f83d9ab;
+        self_p->kind.sha256.state[7] = 0x5be0cd19;
+        self_p->kind.sha256.size = 0;
+        break;
+#endif
+
+    case DETOOLS_DIGEST_NONE:
+        break;
+
+    default:
+        return (-DETOOLS_BAD_DIGEST);
+    }
+
+    self_p->type = type;
+
+    return (0);
+}
+
+static void digest_update(struct detools_digest_t *self_p,
+                          const uint8_t *buf_p,
+                          size_t size)
+{
+    switch (self_p->type) {
+
+#if DETOOLS_CONFIG_DIGEST_CRC32 == 1
+    case DETOOLS_DIGEST_CRC32:
+        self_p->kind.crc32 = crc32_update(self_p->kind.crc32, buf_p, size);
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DIGEST_SHA256 == 1
+    case DETOOLS_DIGEST_SHA256:
+        sha256_update(self_p, buf_p, size);
+        break;
+#endif
+
+    default:
+        break;
+    }
+}
+
+/**
+ * Write the digest to given buffer.
+ *
+ * @return Digest size in bytes or negative error code.
+ */
+static int digest_get(const struct detools_digest_t *self_p,
+                      uint8_t *digest_p)
+{
+    int res;
+
+    switch (self_p->type) {
+
+#if DETOOLS_CONFIG_DIGEST_CRC32 == 1
+    case DETOOLS_DIGEST_CRC32:
+        digest_p[0] = (uint8_t)(~self_p->kind.crc32 >> 24);
+        digest_p[1] = (uint8_t)(~self_p->kind.crc32 >> 16);
+        digest_p[2] = (uint8_t)(~self_p->kind.crc32 >> 8);
+        digest_p[3] = (uint8_t)~self_p->kind.crc32;
+        res = 4;
+        break;
+#endif
+
+#if DETOOLS_CONFIG_DIGEST_SHA256 == 1
+    case DETOOLS_DIGEST_SHA256:
+        sha256_get(self_p, digest_p);
+        res = 32;
+        break;
+#endif
+
+    default:
+        res = -DETOOLS_BAD_DIGEST;
+        break;
+    }
+
+    return (res);
+}
+
+/**
+ * Compare the digest to given expected digest, if any, once the patch
+ * has been applied.
+ *
+ * @return Given finalize result or negative error code.
+ */
+static int digest_check(const struct detools_digest_t *self_p,
+                        const uint8_t *expected_p,
+                        int res)
+{
+    int size;
+    uint8_t digest[DETOOLS_DIGEST_MAX_SIZE];
+
+    if ((res < 0) || (expected_p == NULL)) {
+        return (res);
+    }
+
+    size = digest_get(self_p, &digest[0]);
+
+    if (size < 0) {
+        return (size);
+    }
+
+    if (memcmp(&digest[0], expected_p, (size_t)size) != 0) {
+        return (-DETOOLS_DIGEST_MISMATCH);
+    }
+
+    return (res);
+}
+
+#endif
+
+/*
+ * Low level normal patch type functionality.
+ */
+
+/**
+ * Seek given offset from current from-data position. Offsets not
+ * fitting in an int are split into multiple seek callback calls.
+ */
+static int from_seek_int64(detools_seek_t from_seek,
+                           void *arg_p,
+                           int64_t offset)
+{
+    int res;
+    int64_t step;
+
+    do {
+        step = MAX(MIN(offset, INT_MAX), INT_MIN);
+        res = from_seek(arg_p, (int)step);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+        offset -= step;
+    } while (offset != 0);
+
+    return (0);
+}
+
+static int apply_patch_from_seek(struct detools_apply_patch_t *self_p,
+                                 int64_t offset)
+{
+    if (self_p->from_seek64 != NULL) {
+        if (self_p->from_seek64(self_p->arg_p, offset) != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+        return (0);
+    }
+
+    return (from_seek_int64(self_p->from_seek, self_p->arg_p, offset));
+}
+
+static int process_init(struct detools_apply_patch_t *self_p)
+{
+    int patch_type;
+    int compression;
+    uint8_t byte;
+    int res;
+    int64_t to_size;
+
+    if (chunk_get(&self_p->chunk, &byte) != 0) {
+        return (-DETOOLS_SHORT_HEADER);
+    }
+
+    patch_type = ((byte >> 4) & 0x7);
+    compression = (byte & 0xf);
+
+    if (patch_type != DETOOLS_PATCH_TYPE_NORMAL) {
+        return (-DETOOLS_BAD_PATCH_TYPE);
+    }
+
+    res = chunk_unpack_header_size(&self_p->chunk, &to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = patch_reader_init(&self_p->patch_reader,
+                            &self_p->chunk,
+                            self_p->patch_size - self_p->chunk.offset,
+                            compression);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if ((to_size < 0) || ((uint64_t)to_size > SIZE_MAX)) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    if ((self_p->checkpoint.to_offset > 0)
+        && ((self_p->checkpoint.to_size != (size_t)to_size)
+            || (self_p->checkpoint.to_offset > (size_t)to_size))) {
+        return (-DETOOLS_BAD_CHECKPOINT);
+    }
+
+    self_p->to_pos = 0;
+    self_p->to_size = (size_t)to_size;
+
+    if (to_size > 0) {
+        self_p->state = detools_apply_patch_state_dfpatch_size_t;
+    } else {
+        self_p->state = detools_apply_patch_state_done_t;
+    }
+
+    return (res);
+}
+
+static int process_dfpatch_size(struct detools_apply_patch_t *self_p)
+{
+    int res;
+    int64_t size;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (size > 0) {
+#if DETOOLS_DATA_FORMAT == 1
+        self_p->data_format.size = (size_t)size;
+        self_p->state = detools_apply_patch_state_data_format_t;
+
+        return (0);
+#else
+        return (-DETOOLS_BAD_DATA_FORMAT);
+#endif
+    }
+
+    self_p->state = detools_apply_patch_state_diff_size_t;
+
+    return (0);
+}
+
+#if DETOOLS_DATA_FORMAT == 1
+
+static int process_data_format(struct detools_apply_patch_t *self_p)
+{
+    int res;
+    int64_t data_format;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &data_format);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (self_p->from_size == SIZE_MAX) {
+        return (-DETOOLS_MISSING_FROM_SIZE);
+    }
+
+    res = data_format_init(&self_p->data_format, data_format);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    self_p->state = detools_apply_patch_state_dfpatch_t;
+
+    return (0);
+}
+
+static int data_format_from_read(void *arg_p,
+                                 uint8_t *buf_p,
+                                 size_t offset,
+                                 size_t size)
+{
+    struct detools_apply_patch_t *self_p;
+    int res;
+
+    self_p = (struct detools_apply_patch_t *)arg_p;
+
+    if (self_p->from_p != NULL) {
+        memcpy(buf_p, &self_p->from_p[offset], size);
+
+        return (0);
+    }
+
+    if ((int64_t)offset != self_p->from_offset) {
+        res = apply_patch_from_seek(self_p,
+                                    (int64_t)offset - self_p->from_offset);
+
+        if (res != 0) {
+            return (res);
+        }
+    }
+
+    res = self_p->from_read(self_p->arg_p, buf_p, size);
+
+    if (res != 0) {
+        return (-DETOOLS_IO_FAILED);
+    }
+
+    self_p->from_offset = (int64_t)(offset + size);
+
+    return (0);
+}
+
+static int process_dfpatch(struct detools_apply_patch_t *self_p)
+{
+    int res;
+
+    res = data_format_process(&self_p->data_format, &self_p->patch_reader);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (!data_format_is_unpacked(&self_p->data_format)) {
+        return (0);
+    }
+
+    res = data_format_disassemble(&self_p->data_format,
+                                  data_format_from_read,
+                                  self_p,
+                                  self_p->from_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    /* Rewind to the beginning of the from-data. */
+    if (self_p->from_offset != 0) {
+        res = apply_patch_from_seek(self_p, -self_p->from_offset);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        self_p->from_offset = 0;
+    }
+
+    self_p->state = detools_apply_patch_state_diff_size_t;
+
+    return (0);
+}
+
+#endif
+
+static int process_size(struct detools_apply_patch_t *self_p,
+                        enum detools_apply_patch_state_t next_state)
+{
+    int res;
+    size_t size;
+
+    res = common_process_size(&self_p->patch_reader,
+                              self_p->to_pos,
+                              self_p->to_size,
+                              &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    self_p->state = next_state;
+    self_p->chunk_size = size;
+
+    return (res);
+}
+
+/**
+ * Get given number of from-data bytes at current from offset, by
+ * pointer if the from-data is in memory, otherwise read into given
+ * buffer.
+ */
+static int process_data_from(struct detools_apply_patch_t *self_p,
+                             uint8_t *buf_p,
+                             size_t size,
+                             const uint8_t **from_pp)
+{
+    int res;
+
+    if (self_p->from_p != NULL) {
+        if ((self_p->from_offset < 0)
+            || ((uint64_t)self_p->from_offset + size > self_p->from_size)) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
+
+        *from_pp = &self_p->from_p[self_p->from_offset];
+    } else {
+        res = self_p->from_read(self_p->arg_p, buf_p, size);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+        *from_pp = buf_p;
+    }
+
+#if DETOOLS_DATA_FORMAT == 1
+    if (self_p->data_format.number_of_kinds > 0) {
+        if (*from_pp != buf_p) {
+            memcpy(buf_p, *from_pp, size);
+            *from_pp = buf_p;
+        }
+
+        data_format_from(&self_p->data_format,
+                         (size_t)self_p->from_offset,
+                         buf_p,
+                         size);
+    }
+#endif
+
+    self_p->from_offset += (int64_t)size;
+
+    return (0);
+}
+
+/**
+ * Skip given number of from-data bytes, already applied before the
+ * checkpoint.
+ */
+static int process_data_skip_from(struct detools_apply_patch_t *self_p,
+                                  size_t size)
+{
+    int res;
+
+    if (self_p->from_p == NULL) {
+        res = apply_patch_from_seek(self_p, (int64_t)size);
+
+        if (res != 0) {
+            return (res);
+        }
+    }
+
+    self_p->from_offset += (int64_t)size;
+
+    return (0);
+}
+
+static int process_data(struct detools_apply_patch_t *self_p,
+                        enum detools_apply_patch_state_t next_state)
+{
+    int res;
+    uint8_t to[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t to_size;
+    uint8_t from[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    const uint8_t *from_p;
+    bool skip;
+
+    to_size = MIN(sizeof(to), self_p->chunk_size);
+
+    if (to_size == 0) {
+        self_p->state = next_state;
+
+        return (0);
+    }
+
+    skip = (self_p->to_pos < self_p->checkpoint.to_offset);
+
+    if (skip) {
+        to_size = MIN(to_size, self_p->checkpoint.to_offset - self_p->to_pos);
+    }
+
+    res = patch_reader_decompress(&self_p->patch_reader,
+                                  &to[0],
+                                  &to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (skip) {
+        if (next_state == detools_apply_patch_state_extra_size_t) {
+            res = process_data_skip_from(self_p, to_size);
+
+            if (res != 0) {
+                return (res);
+            }
+        }
+
+        self_p->to_pos += to_size;
+        self_p->chunk_size -= to_size;
+
+        return (0);
+    }
+
+    if (next_state == detools_apply_patch_state_extra_size_t) {
+        res = process_data_from(self_p, &from[0], to_size, &from_p);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        add_from_to_diff(&to[0], from_p, to_size);
+    }
+
+#if DETOOLS_DATA_FORMAT == 1
+    data_format_add_diff(&self_p->data_format, self_p->to_pos, &to[0], to_size);
+#endif
+
+    res = self_p->to_write(self_p->arg_p, &to[0], to_size);
+
+    if (res != 0) {
+        return (-DETOOLS_IO_FAILED);
+    }
+
+#if DETOOLS_DIGEST == 1
+    digest_update(&self_p->digest, &to[0], to_size);
+#endif
+
+    self_p->to_pos += to_size;
+    self_p->chunk_size -= to_size;
+
+    return (res);
+}
+
+static int process_diff_size(struct detools_apply_patch_t *self_p)
+{
+    return (process_size(self_p, detools_apply_patch_state_diff_data_t));
+}
+
+static int process_diff_data(struct detools_apply_patch_t *self_p)
+{
+    return (process_data(self_p, detools_apply_patch_state_extra_size_t));
+}
+
+static int process_extra_size(struct detools_apply_patch_t *self_p)
+{
+    return (process_size(self_p, detools_apply_patch_state_extra_data_t));
+}
+
+static int process_extra_data(struct detools_apply_patch_t *self_p)
+{
+    return (process_data(self_p, detools_apply_patch_state_adjustment_t));
+}
+
+static int process_adjustment(struct detools_apply_patch_t *self_p)
+{
+    int res;
+    int64_t offset;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &offset);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (self_p->from_p == NULL) {
+        res = apply_patch_from_seek(self_p, offset);
+
+        if (res != 0) {
+            return (res);
+        }
+    }
+
+    self_p->from_offset += offset;
+
+    if (self_p->to_pos == self_p->to_size) {
+        self_p->state = detools_apply_patch_state_done_t;
+    } else {
+        self_p->state = detools_apply_patch_state_diff_size_t;
+    }
+
+    return (res);
+}
+
+static int apply_patch_process_once(struct detools_apply_patch_t *self_p)
+{
+    int res;
+
+    switch (self_p->state) {
+
+    case detools_apply_patch_state_init_t:
+        res = process_init(self_p);
+        break;
+
+    case detools_apply_patch_state_dfpatch_size_t:
+        res = process_dfpatch_size(self_p);
+        break;
+
+#if DETOOLS_DATA_FORMAT == 1
+    case detools_apply_patch_state_data_format_t:
+        res = process_data_format(self_p);
+        break;
+
+    case detools_apply_patch_state_dfpatch_t:
+        res = process_dfpatch(self_p);
+        break;
+#endif
+
+    case detools_apply_patch_state_diff_size_t:
+        res = process_diff_size(self_p);
+        break;
+
+    case detools_apply_patch_state_diff_data_t:
+        res = process_diff_data(self_p);
+        break;
+
+    case detools_apply_patch_state_extra_size_t:
+        res = process_extra_size(self_p);
+        break;
+
+    case detools_apply_patch_state_extra_data_t:
+        res = process_extra_data(self_p);
+        break;
+
+    case detools_apply_patch_state_adjustment_t:
+        res = process_adjustment(self_p);
+        break;
+
+    case detools_apply_patch_state_done_t:
+        res = patch_reader_drain(&self_p->patch_reader);
+        break;
+
+    case detools_apply_patch_state_failed_t:
+        res = -DETOOLS_ALREADY_FAILED;
+        break;
+
+    default:
+        res = -DETOOLS_INTERNAL_ERROR;
+        break;
+    }
+
+    if (res < 0) {
+        self_p->state = detools_apply_patch_state_failed_t;
+    }
+
+    return (res);
+}
+
+/**
+ * Returns given to-data size, or -DETOOLS_TO_SIZE_TOO_LARGE if it
+ * does not fit in an int.
+ */
+static int to_size_as_int(int64_t to_size)
+{
+    if (to_size > INT_MAX) {
+        return (-DETOOLS_TO_SIZE_TOO_LARGE);
+    }
+
+    return ((int)to_size);
+}
+
+static int apply_patch_common_finalize(
+    int res,
+    struct detools_apply_patch_patch_reader_t *patch_reader_p)
+{
+    if (res == 1) {
+        res = -DETOOLS_NOT_ENOUGH_PATCH_DATA;
+    }
+
+    if (res == -DETOOLS_ALREADY_DONE) {
+        res = 0;
+    }
+
+    if (patch_reader_p->destroy != NULL) {
+        if (res == 0) {
+            res = patch_reader_p->destroy(patch_reader_p);
+        } else {
+            (void)patch_reader_p->destroy(patch_reader_p);
+        }
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_init(struct detools_apply_patch_t *self_p,
+                             detools_read_t from_read,
+                             detools_seek_t from_seek,
+                             size_t patch_size,
+                             detools_write_t to_write,
+                             void *arg_p)
+{
+    self_p->from_read = from_read;
+    self_p->from_seek = from_seek;
+    self_p->from_seek64 = NULL;
+    self_p->from_p = NULL;
+    self_p->patch_size = patch_size;
+    self_p->to_write = to_write;
+    self_p->arg_p = arg_p;
+    self_p->state = detools_apply_patch_state_init_t;
+    self_p->from_size = SIZE_MAX;
+    self_p->from_offset = 0;
+    self_p->to_pos = 0;
+    self_p->to_size = 0;
+    self_p->checkpoint.patch_offset = 0;
+    self_p->checkpoint.to_size = 0;
+    self_p->checkpoint.to_offset = 0;
+    self_p->patch_offset = 0;
+    self_p->patch_crc32 = 0xffffffff;
+    self_p->patch_reader.destroy = NULL;
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    self_p->patch_reader.lzma_arena.buf_p = NULL;
+#endif
+#if DETOOLS_DATA_FORMAT == 1
+    self_p->data_format.number_of_kinds = 0;
+#endif
+#if DETOOLS_DIGEST == 1
+    (void)digest_init(&self_p->digest, DETOOLS_DIGEST_NONE);
+    self_p->expected_digest_p = NULL;
+#endif
+
+    return (0);
+}
+
+int detools_apply_patch_init_from_memory(struct detools_apply_patch_t *self_p,
+                                         const uint8_t *from_p,
+                                         size_t from_size,
+                                         size_t patch_size,
+                                         detools_write_t to_write,
+                                         void *arg_p)
+{
+    int res;
+
+    res = detools_apply_patch_init(self_p,
+                                   NULL,
+                                   NULL,
+                                   patch_size,
+                                   to_write,
+                                   arg_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    self_p->from_p = from_p;
+
+    return (detools_apply_patch_set_from_size(self_p, from_size));
+}
+
+int detools_apply_patch_set_from_size(struct detools_apply_patch_t *self_p,
+                                      size_t from_size)
+{
+    self_p->from_size = from_size;
+
+    return (0);
+}
+
+int detools_apply_patch_set_from_seek64(struct detools_apply_patch_t *self_p,
+                                        detools_seek64_t from_seek64)
+{
+    self_p->from_seek64 = from_seek64;
+
+    return (0);
+}
+
+int detools_apply_patch_get_checkpoint(
+    const struct detools_apply_patch_t *self_p,
+    struct detools_apply_patch_checkpoint_t *checkpoint_p)
+{
+    checkpoint_p->magic = DETOOLS_APPLY_PATCH_CHECKPOINT_MAGIC;
+    checkpoint_p->patch_crc32 = self_p->patch_crc32;
+    checkpoint_p->patch_offset = self_p->patch_offset;
+    checkpoint_p->to_size = self_p->to_size;
+    checkpoint_p->to_offset = self_p->to_pos;
+#if DETOOLS_DIGEST == 1
+    checkpoint_p->digest = self_p->digest;
+#endif
+
+    return (0);
+}
+
+int detools_apply_patch_set_checkpoint(
+    struct detools_apply_patch_t *self_p,
+    const struct detools_apply_patch_checkpoint_t *checkpoint_p)
+{
+    if (checkpoint_p->magic != DETOOLS_APPLY_PATCH_CHECKPOINT_MAGIC) {
+        return (-DETOOLS_BAD_CHECKPOINT);
+    }
+
+#if DETOOLS_DIGEST == 1
+    if (checkpoint_p->digest.type != self_p->digest.type) {
+        return (-DETOOLS_BAD_CHECKPOINT);
+    }
+
+    self_p->digest = checkpoint_p->digest;
+#endif
+    self_p->checkpoint = *checkpoint_p;
+
+    return (0);
+}
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+int detools_apply_patch_set_lzma_arena(struct detools_apply_patch_t *self_p,
+                                       void *buf_p,
+                                       size_t size)
+{
+    self_p->patch_reader.lzma_arena.buf_p = (uint8_t *)buf_p;
+    self_p->patch_reader.lzma_arena.size = size;
+
+    return (0);
+}
+
+#endif
+
+#if DETOOLS_DIGEST == 1
+
+int detools_apply_patch_set_digest(struct detools_apply_patch_t *self_p,
+                                   int digest,
+                                   const uint8_t *expected_p)
+{
+    self_p->expected_digest_p = expected_p;
+
+    return (digest_init(&self_p->digest, digest));
+}
+
+int detools_apply_patch_get_digest(const struct detools_apply_patch_t *self_p,
+                                   uint8_t *digest_p)
+{
+    return (digest_get(&self_p->digest, digest_p));
+}
+
+#endif
+
+/**
+ * Update the CRC32 of the patch data given so far, and compare it to
+ * the checkpoint once the checkpoint patch offset is reached.
+ */
+static int update_patch_crc32(struct detools_apply_patch_t *self_p,
+                              const uint8_t *patch_p,
+                              size_t size)
+{
+    size_t checked_size;
+
+    if (self_p->patch_offset < self_p->checkpoint.patch_offset) {
+        checked_size = (self_p->checkpoint.patch_offset
+                        - self_p->patch_offset);
+        checked_size = MIN(size, checked_size);
+        self_p->patch_crc32 = crc32_update(self_p->patch_crc32,
+                                           patch_p,
+                                           checked_size);
+        self_p->patch_offset += checked_size;
+        patch_p += checked_size;
+        size -= checked_size;
+
+        if ((self_p->patch_offset == self_p->checkpoint.patch_offset)
+            && (self_p->patch_crc32 != self_p->checkpoint.patch_crc32)) {
+            return (-DETOOLS_BAD_CHECKPOINT);
+        }
+    }
+
+    self_p->patch_crc32 = crc32_update(self_p->patch_crc32, patch_p, size);
+    self_p->patch_offset += size;
+
+    return (0);
+}
+
+int detools_apply_patch_process(struct detools_apply_patch_t *self_p,
+                                const uint8_t *patch_p,
+                                size_t size)
+{
+    int res;
+
+    if (self_p->state != detools_apply_patch_state_failed_t) {
+        res = update_patch_crc32(self_p, patch_p, size);
+
+        if (res != 0) {
+            self_p->state = detools_apply_patch_state_failed_t;
+
+            return (res);
+        }
+    }
+
+    res = 0;
+    self_p->chunk.buf_p = patch_p;
+    self_p->chunk.size = size;
+    self_p->chunk.offset = 0;
+
+    while (chunk_available(&self_p->chunk) && (res >= 0)) {
+        res = apply_patch_process_once(self_p);
+    }
+
+    if (res == 1) {
+        res = 0;
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_finalize64(struct detools_apply_patch_t *self_p,
+                                   int64_t *to_size_p)
+{
+    int res;
+
+    self_p->chunk.size = 0;
+    self_p->chunk.offset = 0;
+
+    do {
+        res = apply_patch_process_once(self_p);
+    } while (res == 0);
+
+    res = apply_patch_common_finalize(res, &self_p->patch_reader);
+
+#if DETOOLS_DIGEST == 1
+    res = digest_check(&self_p->digest, self_p->expected_digest_p, res);
+#endif
+
+    if (res == 0) {
+        *to_size_p = (int64_t)self_p->to_size;
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_finalize(struct detools_apply_patch_t *self_p)
+{
+    int res;
+    int64_t to_size;
+
+    res = detools_apply_patch_finalize64(self_p, &to_size);
+
+    if (res == 0) {
+        res = to_size_as_int(to_size);
+    }
+
+    return (res);
+}
+
+/*
+ * Low level in-place patch type functionality.
+ */
+
+/**
+ * Wait for the ongoing asynchronous memory write or erase, if any, to
+ * complete.
+ */
+static int in_place_mem_wait(struct detools_apply_patch_in_place_t *self_p)
+{
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+    int res;
+
+    if (!self_p->mem_async.ongoing) {
+        return (0);
+    }
+
+    self_p->mem_async.ongoing = false;
+    res = self_p->mem_async.wait(self_p->arg_p);
+
+    if (res != 0) {
+        return (-DETOOLS_IO_FAILED);
+    }
+#else
+    (void)self_p;
+#endif
+
+    return (0);
+}
+
+/**
+ * Called after an asynchronous memory write or erase has been
+ * started.
+ */
+static void in_place_mem_started(struct detools_apply_patch_in_place_t *self_p)
+{
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+    if (self_p->mem_async.wait != NULL) {
+        self_p->mem_async.ongoing = true;
+        self_p->mem_async.index ^= 1;
+    }
+#else
+    (void)self_p;
+#endif
+}
+
+/**
+ * Returns a buffer to write data from. It must be valid until an
+ * asynchronous write has completed, so the two buffers in the apply
+ * patch object are used in turn. Given stack buffer is used for
+ * synchronous writes.
+ */
+static uint8_t *in_place_write_buffer(struct detools_apply_patch_in_place_t *self_p,
+                                      uint8_t *buf_p)
+{
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+    if (self_p->mem_async.wait != NULL) {
+        return (&self_p->mem_async.buffers[self_p->mem_async.index][0]);
+    }
+#else
+    (void)self_p;
+#endif
+
+    return (buf_p);
+}
+
+/**
+ * Read from memory once any ongoing write or erase has completed.
+ */
+static int in_place_mem_read_direct(struct detools_apply_patch_in_place_t *self_p,
+                                    void *dst_p,
+                                    uintptr_t src,
+                                    size_t size)
+{
+    int res;
+
+    res = in_place_mem_wait(self_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    return (self_p->mem_read(self_p->arg_p, dst_p, src, size));
+}
+
+static int in_place_all_steps_completed(struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+
+    /* All data must be in memory before the step is stored. */
+    res = in_place_mem_wait(self_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (self_p->step_set != NULL) {
+        res = self_p->step_set(self_p->arg_p, 0);
+
+        if (res != 0) {
+            res = -DETOOLS_STEP_SET_FAILED;
+        }
+    }
+
+    return (res);
+}
+
+static int in_place_is_step_completed(struct detools_apply_patch_in_place_t *self_p,
+                                      bool *res_p)
+{
+    int res;
+    int completed_step;
+
+    if (self_p->step_get != NULL) {
+        res = self_p->step_get(self_p->arg_p, &completed_step);
+
+        if (res != 0) {
+            return (-DETOOLS_STEP_GET_FAILED);
+        }
+
+        *res_p = (self_p->ongoing_step <= completed_step);
+    } else {
+        *res_p = false;
+    }
+
+    return (0);
+}
+
+static int in_place_next_step(struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    bool is_step_completed;
+
+    res = 0;
+
+    if (self_p->step_set != NULL) {
+        res = in_place_is_step_completed(self_p, &is_step_completed);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        if (!is_step_completed) {
+            res = in_place_mem_wait(self_p);
+
+            if (res != 0) {
+                return (res);
+            }
+
+            res = self_p->step_set(self_p->arg_p, self_p->ongoing_step);
+
+            if (res != 0) {
+                res = -DETOOLS_STEP_SET_FAILED;
+            }
+        }
+    }
+
+    self_p->ongoing_step++;
+
+    return (res);
+}
+
+static int in_place_mem_read(struct detools_apply_patch_in_place_t *self_p,
+                             void *dst_p,
+                             uintptr_t src,
+                             size_t size)
+{
+    int res;
+    bool is_step_completed;
+
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (!is_step_completed) {
+        return (in_place_mem_read_direct(self_p, dst_p, src, size));
+    } else {
+        memset(dst_p, 0, size);
+
+        return (0);
+    }
+}
+
+static int in_place_mem_write(struct detools_apply_patch_in_place_t *self_p,
+                              uintptr_t dst,
+                              void *src_p,
+                              size_t size)
+{
+    int res;
+    bool is_step_completed;
+
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_step_completed) {
+        return (0);
+    }
+
+    res = in_place_mem_wait(self_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = self_p->mem_write(self_p->arg_p, dst, src_p, size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    in_place_mem_started(self_p);
+
+    return (0);
+}
+
+static int in_place_mem_erase(struct detools_apply_patch_in_place_t *self_p,
+                              uintptr_t addr,
+                              size_t size)
+{
+    int res;
+    bool is_step_completed;
+
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_step_completed) {
+        return (0);
+    }
+
+    res = in_place_mem_wait(self_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = self_p->mem_erase(self_p->arg_p, addr, size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    in_place_mem_started(self_p);
+
+    return (0);
+}
+
+/**
+ * Check if given memory areas have equal content.
+ */
+static int in_place_mem_equal(struct detools_apply_patch_in_place_t *self_p,
+                              uintptr_t addr_1,
+                              uintptr_t addr_2,
+                              size_t size,
+                              bool *res_p)
+{
+    int res;
+    uint8_t buf_1[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    uint8_t buf_2[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t offset;
+    size_t chunk_size;
+
+    *res_p = false;
+    offset = 0;
+
+    while (offset < size) {
+        chunk_size = MIN(sizeof(buf_1), size - offset);
+        res = in_place_mem_read_direct(self_p,
+                                       &buf_1[0],
+                                       addr_1 + offset,
+                                       chunk_size);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+        res = in_place_mem_read_direct(self_p,
+                                       &buf_2[0],
+                                       addr_2 + offset,
+                                       chunk_size);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+        if (memcmp(&buf_1[0], &buf_2[0], chunk_size) != 0) {
+            return (0);
+        }
+
+        offset += chunk_size;
+    }
+
+    *res_p = true;
+
+    return (0);
+}
+
+/**
+ * Copy given segment, unless the destination already has the same
+ * content, which saves an erase.
+ */
+static int in_place_shift_segment(struct detools_apply_patch_in_place_t *self_p,
+                                  size_t read_address,
+                                  size_t write_address)
+{
+    int res;
+    bool is_step_completed;
+    bool is_equal;
+    uint8_t buf[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    uint8_t *buf_p;
+    size_t offset;
+    size_t size;
+
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_step_completed) {
+        return (0);
+    }
+
+    res = in_place_mem_equal(self_p,
+                             read_address,
+                             write_address,
+                             self_p->segment_size,
+                             &is_equal);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_equal) {
+        self_p->skipped_erases++;
+
+        return (0);
+    }
+
+    /* Erase segment to write to. */
+    res = in_place_mem_erase(self_p, write_address, self_p->segment_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    /* Copy data to erased segment. */
+    offset = 0;
+
+    while (offset < self_p->segment_size) {
+        buf_p = in_place_write_buffer(self_p, &buf[0]);
+        size = MIN(sizeof(buf), self_p->segment_size - offset);
+        res = in_place_mem_read(self_p,
+                                buf_p,
+                                read_address + offset,
+                                size);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        res = in_place_mem_write(self_p,
+                                 write_address + offset,
+                                 buf_p,
+                                 size);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        offset += size;
+    }
+
+    return (0);
+}
+
+static int in_place_shift_memory(struct detools_apply_patch_in_place_t *self_p,
+                                 size_t memory_size,
+                                 size_t from_size)
+{
+    size_t i;
+    size_t number_of_segments;
+    int res;
+    size_t read_address;
+    size_t write_address;
+
+    number_of_segments = DIV_CEIL(MIN(from_size, memory_size - self_p->shift_size),
+                                  self_p->segment_size);
+    read_address = ((number_of_segments - 1) * self_p->segment_size);
+    write_address = (read_address + self_p->shift_size);
+
+    for (i = 0; i < number_of_segments; i++) {
+        res = in_place_shift_segment(self_p, read_address, write_address);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        res = in_place_next_step(self_p);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        write_address -= self_p->segment_size;
+        read_address -= self_p->segment_size;
+    }
+
+    return (0);
+}
+
+static int in_place_read_header(struct detools_apply_patch_in_place_t *self_p,
+                                int *compression_p,
+                                int64_t *memory_size_p,
+                                int64_t *segment_size_p,
+                                int64_t *shift_size_p,
+                                int64_t *from_size_p,
+                                int64_t *to_size_p)
+{
+    int patch_type;
+    uint8_t byte;
+    int res;
+
+    if (chunk_get(&self_p->chunk, &byte) != 0) {
+        return (-DETOOLS_SHORT_HEADER);
+    }
+
+    patch_type = ((byte >> 4) & 0x7);
+    *compression_p = (byte & 0xf);
+
+    if ((patch_type != DETOOLS_PATCH_TYPE_IN_PLACE)
+        && (patch_type != DETOOLS_PATCH_TYPE_IN_PLACE_UNCHANGED)) {
+        return (-DETOOLS_BAD_PATCH_TYPE);
+    }
+
+    self_p->unchanged_segments =
+        (patch_type == DETOOLS_PATCH_TYPE_IN_PLACE_UNCHANGED);
+
+    res = chunk_unpack_header_size(&self_p->chunk, memory_size_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = chunk_unpack_header_size(&self_p->chunk, segment_size_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = chunk_unpack_header_size(&self_p->chunk, shift_size_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = chunk_unpack_header_size(&self_p->chunk, from_size_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    return (chunk_unpack_header_size(&self_p->chunk, to_size_p));
+}
+
+static int in_place_process_init(struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    int compression;
+    int64_t memory_size;
+    int64_t segment_size;
+    int64_t shift_size;
+    int64_t from_size;
+    int64_t to_size;
+
+    res = in_place_read_header(self_p,
+                               &compression,
+                               &memory_size,
+                               &segment_size,
+                               &shift_size,
+                               &from_size,
+                               &to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = patch_reader_init(&self_p->patch_reader,
+                            &self_p->chunk,
+                            self_p->patch_size - self_p->chunk.offset,
+                            compression);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (((uint64_t)memory_size > SIZE_MAX)
+        || ((uint64_t)segment_size > SIZE_MAX)
+        || ((uint64_t)shift_size > SIZE_MAX)
+        || ((uint64_t)from_size > SIZE_MAX)
+        || ((uint64_t)to_size > SIZE_MAX)) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    self_p->to_pos = 0;
+    self_p->segment_size = (size_t)segment_size;
+    self_p->shift_size = (size_t)shift_size;
+    self_p->from_size = MIN((size_t)from_size,
+                            (size_t)memory_size - self_p->shift_size);
+    self_p->to_size = (size_t)to_size;
+    self_p->segment.index = 0;
+
+    if (to_size > 0) {
+        res = in_place_shift_memory(self_p,
+                                    (size_t)memory_size,
+                                    (size_t)from_size);
+
+        if (res != 0) {
+            return (res);
+        }
+
+        self_p->state = detools_apply_patch_state_dfpatch_size_t;
+    } else {
+        self_p->state = detools_apply_patch_state_done_t;
+    }
+
+    return (res);
+}
+
+static void in_place_segment_next(struct detools_apply_patch_in_place_t *self_p)
+{
+    self_p->segment.from_offset =
+        (int64_t)MAX(self_p->segment_size * (self_p->segment.index + 1),
+                 self_p->shift_size);
+    self_p->segment.to_offset = (self_p->segment.index * self_p->segment_size);
+    self_p->segment.to_size = MIN(self_p->segment_size,
+                                  self_p->to_size - self_p->segment.to_offset);
+    self_p->segment.to_pos = 0;
+    self_p->segment.index++;
+}
+
+static int in_place_segment_init(struct detools_apply_patch_in_place_t *self_p)
+{
+    in_place_segment_next(self_p);
+    self_p->state = detools_apply_patch_state_diff_size_t;
+
+    return (in_place_mem_erase(self_p,
+                               self_p->segment.to_offset,
+                               self_p->segment.to_size));
+}
+
+#if DETOOLS_DIGEST == 1
+
+/**
+ * Update the digest with given to-data already in memory.
+ */
+static int in_place_digest_update_from_memory(
+    struct detools_apply_patch_in_place_t *self_p,
+    uintptr_t addr,
+    size_t size)
+{
+    int res;
+    uint8_t buf[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t chunk_size;
+
+    if (self_p->digest.type == DETOOLS_DIGEST_NONE) {
+        return (0);
+    }
+
+    while (size > 0) {
+        chunk_size = MIN(sizeof(buf), size);
+        res = in_place_mem_read_direct(self_p, &buf[0], addr, chunk_size);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+        digest_update(&self_p->digest, &buf[0], chunk_size);
+        addr += chunk_size;
+        size -= chunk_size;
+    }
+
+    return (0);
+}
+
+#endif
+
+/**
+ * The to-data of an unchanged segment is already in memory, so it is
+ * neither erased nor written.
+ */
+static int in_place_segment_skip(struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    bool is_step_completed;
+
+    in_place_segment_next(self_p);
+
+#if DETOOLS_DIGEST == 1
+    res = in_place_digest_update_from_memory(self_p,
+                                             self_p->segment.to_offset,
+                                             self_p->segment.to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+#endif
+
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (!is_step_completed) {
+        self_p->skipped_erases++;
+    }
+
+    self_p->to_pos += self_p->segment.to_size;
+
+    if (self_p->to_pos == self_p->to_size) {
+        res = in_place_all_steps_completed(self_p);
+        self_p->state = detools_apply_patch_state_done_t;
+    } else {
+        res = in_place_next_step(self_p);
+    }
+
+    return (res);
+}
+
+static int in_place_process_dfpatch_size(
+    struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    int64_t size;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if ((size == SEGMENT_UNCHANGED) && self_p->unchanged_segments) {
+        return (in_place_segment_skip(self_p));
+    } else if (size < 0) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    } else if (size > 0) {
+        /* The data format patch of the first segment covers all
+           segments. */
+        if (self_p->segment.index > 0) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
+
+#if DETOOLS_DATA_FORMAT == 1
+        self_p->data_format.size = (size_t)size;
+        self_p->state = detools_apply_patch_state_data_format_t;
+
+        return (0);
+#else
+        return (-DETOOLS_BAD_DATA_FORMAT);
+#endif
+    }
+
+    return (in_place_segment_init(self_p));
+}
+
+#if DETOOLS_DATA_FORMAT == 1
+
+static int in_place_process_data_format(
+    struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    int64_t data_format;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &data_format);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = data_format_init(&self_p->data_format, data_format);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    self_p->state = detools_apply_patch_state_dfpatch_t;
+
+    return (0);
+}
+
+static int in_place_data_format_from_read(void *arg_p,
+                                          uint8_t *buf_p,
+                                          size_t offset,
+                                          size_t size)
+{
+    struct detools_apply_patch_in_place_t *self_p;
+
+    self_p = (struct detools_apply_patch_in_place_t *)arg_p;
+
+    return (in_place_mem_read(self_p,
+                              buf_p,
+                              self_p->shift_size + offset,
+                              size));
+}
+
+static int in_place_process_dfpatch(struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    bool is_step_completed;
+
+    res = data_format_process(&self_p->data_format, &self_p->patch_reader);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (!data_format_is_unpacked(&self_p->data_format)) {
+        return (0);
+    }
+
+    /* The shifted from-data is needed to disassemble it. */
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_step_completed) {
+        return (-DETOOLS_NOT_IMPLEMENTED);
+    }
+
+    res = data_format_disassemble(&self_p->data_format,
+                                  in_place_data_format_from_read,
+                                  self_p,
+                                  self_p->from_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    return (in_place_segment_init(self_p));
+}
+
+#endif
+
+static int in_place_process_size(struct detools_apply_patch_in_place_t *self_p,
+                                 enum detools_apply_patch_state_t next_state)
+{
+    int res;
+    size_t size;
+
+    res = common_process_size(&self_p->patch_reader,
+                              self_p->to_pos,
+                              self_p->to_size,
+                              &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    self_p->state = next_state;
+    self_p->chunk_size = size;
+
+    return (0);
+}
+
+#if DETOOLS_DIGEST == 1
+
+/**
+ * Update the digest with given to-data. To-data of completed steps is
+ * read back from memory, as it is not calculated when resuming.
+ */
+static int in_place_digest_update(struct detools_apply_patch_in_place_t *self_p,
+                                  uintptr_t addr,
+                                  uint8_t *buf_p,
+                                  size_t size)
+{
+    int res;
+    bool is_step_completed;
+
+    if (self_p->digest.type == DETOOLS_DIGEST_NONE) {
+        return (0);
+    }
+
+    res = in_place_is_step_completed(self_p, &is_step_completed);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_step_completed) {
+        res = in_place_mem_read_direct(self_p, buf_p, addr, size);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+    }
+
+    digest_update(&self_p->digest, buf_p, size);
+
+    return (0);
+}
+
+#endif
+
+static int in_place_process_data(struct detools_apply_patch_in_place_t *self_p,
+                                 enum detools_apply_patch_state_t next_state)
+{
+    int res;
+    uint8_t to[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    uint8_t *to_p;
+    size_t to_size;
+    uint8_t from[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+
+    to_size = MIN(sizeof(to), self_p->chunk_size);
+
+    if (to_size == 0) {
+        self_p->state = next_state;
+
+        return (0);
+    }
+
+    /* Decompress while any previous asynchronous write is ongoing. */
+    to_p = in_place_write_buffer(self_p, &to[0]);
+    res = patch_reader_decompress(&self_p->patch_reader,
+                                  to_p,
+                                  &to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (next_state == detools_apply_patch_state_extra_size_t) {
+        res = in_place_mem_read(self_p,
+                                &from[0],
+                                (size_t)self_p->segment.from_offset,
+                                to_size);
+
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
+
+#if DETOOLS_DATA_FORMAT == 1
+        data_format_from(&self_p->data_format,
+                         (size_t)self_p->segment.from_offset - self_p->shift_size,
+                         &from[0],
+                         to_size);
+#endif
+        self_p->segment.from_offset += (int64_t)to_size;
+
+        add_from_to_diff(to_p, &from[0], to_size);
+    }
+
+#if DETOOLS_DATA_FORMAT == 1
+    data_format_add_diff(&self_p->data_format, self_p->to_pos, to_p, to_size);
+#endif
+
+    res = in_place_mem_write(self_p,
+                             self_p->segment.to_pos + self_p->segment.to_offset,
+                             to_p,
+                             to_size);
+
+    if (res != 0) {
+        return (-DETOOLS_IO_FAILED);
+    }
+
+#if DETOOLS_DIGEST == 1
+    res = in_place_digest_update(self_p,
+                                 self_p->segment.to_pos + self_p->segment.to_offset,
+                                 to_p,
+                                 to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+#endif
+
+    self_p->to_pos += to_size;
+    self_p->segment.to_pos += to_size;
+    self_p->chunk_size -= to_size;
+
+    return (res);
+}
+
+static int in_place_process_diff_size(struct detools_apply_patch_in_place_t *self_p)
+{
+    return (in_place_process_size(self_p, detools_apply_patch_state_diff_data_t));
+}
+
+static int in_place_process_diff_data(struct detools_apply_patch_in_place_t *self_p)
+{
+    return (in_place_process_data(self_p, detools_apply_patch_state_extra_size_t));
+}
+
+static int in_place_process_extra_size(struct detools_apply_patch_in_place_t *self_p)
+{
+    return (in_place_process_size(self_p, detools_apply_patch_state_extra_data_t));
+}
+
+static int in_place_process_extra_data(struct detools_apply_patch_in_place_t *self_p)
+{
+    return (in_place_process_data(self_p, detools_apply_patch_state_adjustment_t));
+}
+
+static int in_place_process_adjustment(struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    int64_t offset;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &offset);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (self_p->to_pos == self_p->to_size) {
+        res = in_place_all_steps_completed(self_p);
+        self_p->state = detools_apply_patch_state_done_t;
+    } else if (self_p->segment.to_pos == self_p->segment.to_size) {
+        res = in_place_next_step(self_p);
+        self_p->state = detools_apply_patch_state_dfpatch_size_t;
+    } else {
+        self_p->segment.from_offset += offset;
+        self_p->state = detools_apply_patch_state_diff_size_t;
+    }
+
+    return (res);
+}
+
+static int apply_patch_in_place_process_once(
+    struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+
+    switch (self_p->state) {
+
+    case detools_apply_patch_state_init_t:
+        res = in_place_process_init(self_p);
+        break;
+
+    case detools_apply_patch_state_dfpatch_size_t:
+        res = in_place_process_dfpatch_size(self_p);
+        break;
+
+#if DETOOLS_DATA_FORMAT == 1
+    case detools_apply_patch_state_data_format_t:
+        res = in_place_process_data_format(self_p);
+        break;
+
+    case detools_apply_patch_state_dfpatch_t:
+        res = in_place_process_dfpatch(self_p);
+        break;
+#endif
+
+    case detools_apply_patch_state_diff_size_t:
+        res = in_place_process_diff_size(self_p);
+        break;
+
+    case detools_apply_patch_state_diff_data_t:
+        res = in_place_process_diff_data(self_p);
+        break;
+
+    case detools_apply_patch_state_extra_size_t:
+        res = in_place_process_extra_size(self_p);
+        break;
+
+    case detools_apply_patch_state_extra_data_t:
+        res = in_place_process_extra_data(self_p);
+        break;
+
+    case detools_apply_patch_state_adjustment_t:
+        res = in_place_process_adjustment(self_p);
+        break;
+
+    case detools_apply_patch_state_done_t:
+        res = patch_reader_drain(&self_p->patch_reader);
+        break;
+
+    case detools_apply_patch_state_failed_t:
+        res = -DETOOLS_ALREADY_FAILED;
+        break;
+
+    default:
+        res = -DETOOLS_INTERNAL_ERROR;
+        break;
+    }
+
+    if (res < 0) {
+        self_p->state = detools_apply_patch_state_failed_t;
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_in_place_init(
+    struct detools_apply_patch_in_place_t *self_p,
+    detools_mem_read_t mem_read,
+    detools_mem_write_t mem_write,
+    detools_mem_erase_t mem_erase,
+    detools_step_set_t step_set,
+    detools_step_get_t step_get,
+    size_t patch_size,
+    void *arg_p)
+{
+    self_p->mem_read = mem_read;
+    self_p->mem_write = mem_write;
+    self_p->mem_erase = mem_erase;
+    self_p->step_set = step_set;
+    self_p->step_get = step_get;
+    self_p->patch_size = patch_size;
+    self_p->arg_p = arg_p;
+    self_p->state = detools_apply_patch_state_init_t;
+    self_p->ongoing_step = 1;
+    self_p->skipped_erases = 0;
+    self_p->patch_reader.destroy = NULL;
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+    self_p->mem_async.wait = NULL;
+    self_p->mem_async.ongoing = false;
+    self_p->mem_async.index = 0;
+#endif
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    self_p->patch_reader.lzma_arena.buf_p = NULL;
+#endif
+#if DETOOLS_DATA_FORMAT == 1
+    self_p->data_format.number_of_kinds = 0;
+#endif
+#if DETOOLS_DIGEST == 1
+    (void)digest_init(&self_p->digest, DETOOLS_DIGEST_NONE);
+    self_p->expected_digest_p = NULL;
+#endif
+
+    return (0);
+}
+
+int detools_apply_patch_in_place_process(
+    struct detools_apply_patch_in_place_t *self_p,
+    const uint8_t *patch_p,
+    size_t size)
+{
+    int res;
+
+    res = 0;
+    self_p->chunk.buf_p = patch_p;
+    self_p->chunk.size = size;
+    self_p->chunk.offset = 0;
+
+    while (chunk_available(&self_p->chunk) && (res >= 0)) {
+        res = apply_patch_in_place_process_once(self_p);
+    }
+
+    if (res == 1) {
+        res = 0;
+    }
+
+    return (res);
+}
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+int detools_apply_patch_in_place_set_lzma_arena(
+    struct detools_apply_patch_in_place_t *self_p,
+    void *buf_p,
+    size_t size)
+{
+    self_p->patch_reader.lzma_arena.buf_p = (uint8_t *)buf_p;
+    self_p->patch_reader.lzma_arena.size = size;
+
+    return (0);
+}
+
+#endif
+
+#if DETOOLS_DIGEST == 1
+
+int detools_apply_patch_in_place_set_digest(
+    struct detools_apply_patch_in_place_t *self_p,
+    int digest,
+    const uint8_t *expected_p)
+{
+    self_p->expected_digest_p = expected_p;
+
+    return (digest_init(&self_p->digest, digest));
+}
+
+int detools_apply_patch_in_place_get_digest(
+    const struct detools_apply_patch_in_place_t *self_p,
+    uint8_t *digest_p)
+{
+    return (digest_get(&self_p->digest, digest_p));
+}
+
+#endif
+
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+
+int detools_apply_patch_in_place_set_mem_wait(
+    struct detools_apply_patch_in_place_t *self_p,
+    detools_mem_wait_t mem_wait)
+{
+    self_p->mem_async.wait = mem_wait;
+
+    return (0);
+}
+
+#endif
+
+int detools_apply_patch_in_place_get_skipped_erases(
+    const struct detools_apply_patch_in_place_t *self_p)
+{
+    return (self_p->skipped_erases);
+}
+
+int detools_apply_patch_in_place_finalize64(
+    struct detools_apply_patch_in_place_t *self_p,
+    int64_t *to_size_p)
+{
+    int res;
+    int wait_res;
+
+    self_p->chunk.size = 0;
+    self_p->chunk.offset = 0;
+
+    do {
+        res = apply_patch_in_place_process_once(self_p);
+    } while (res == 0);
+
+    res = apply_patch_common_finalize(res, &self_p->patch_reader);
+
+    /* Never leave an asynchronous memory operation behind. */
+    wait_res = in_place_mem_wait(self_p);
+
+    if ((res == 0) && (wait_res != 0)) {
+        res = wait_res;
+    }
+
+#if DETOOLS_DIGEST == 1
+    res = digest_check(&self_p->digest, self_p->expected_digest_p, res);
+#endif
+
+    if (res == 0) {
+        *to_size_p = (int64_t)self_p->to_size;
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_in_place_finalize(
+    struct detools_apply_patch_in_place_t *self_p)
+{
+    int res;
+    int64_t to_size;
+
+    res = detools_apply_patch_in_place_finalize64(self_p, &to_size);
+
+    if (res == 0) {
+        res = to_size_as_int(to_size);
+    }
+
+    return (res);
+}
+
+/*
+ * Patch inspection and validation.
+ */
+
+static int unpack_header_size(struct detools_apply_patch_chunk_t *chunk_p,
+                              size_t *size_p)
+{
+    int res;
+    int64_t size;
+
+    res = chunk_unpack_header_size(chunk_p, &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if ((size < 0) || ((uint64_t)size > SIZE_MAX)) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    *size_p = (size_t)size;
+
+    return (0);
+}
+
+static int patch_info_unpack_in_place(
+    struct detools_apply_patch_chunk_t *chunk_p,
+    struct detools_patch_info_t *info_p)
+{
+    int res;
+
+    res = unpack_header_size(chunk_p, &info_p->memory_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = unpack_header_size(chunk_p, &info_p->segment_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = unpack_header_size(chunk_p, &info_p->shift_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = unpack_header_size(chunk_p, &info_p->from_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = unpack_header_size(chunk_p, &info_p->to_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if ((info_p->shift_size > info_p->memory_size)
+        || (info_p->to_size > info_p->memory_size)
+        || ((info_p->segment_size == 0) && (info_p->to_size > 0))) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    return (0);
+}
+
+static int patch_info_unpack(struct detools_apply_patch_chunk_t *chunk_p,
+                             struct detools_patch_info_t *info_p)
+{
+    uint8_t byte;
+    int res;
+
+    if (chunk_get(chunk_p, &byte) != 0) {
+        return (-DETOOLS_SHORT_HEADER);
+    }
+
+    info_p->type = ((byte >> 4) & 0x7);
+    info_p->compression = (byte & 0xf);
+    info_p->memory_size = 0;
+    info_p->segment_size = 0;
+    info_p->shift_size = 0;
+    info_p->from_size = 0;
+
+    switch (info_p->type) {
+
+    case DETOOLS_PATCH_TYPE_NORMAL:
+        res = unpack_header_size(chunk_p, &info_p->to_size);
+        break;
+
+    case DETOOLS_PATCH_TYPE_IN_PLACE:
+    case DETOOLS_PATCH_TYPE_IN_PLACE_UNCHANGED:
+        res = patch_info_unpack_in_place(chunk_p, info_p);
+        break;
+
+    default:
+        res = -DETOOLS_BAD_PATCH_TYPE;
+        break;
+    }
+
+    return (res);
+}
+
+int detools_patch_info(const uint8_t *patch_p,
+                       size_t size,
+                       struct detools_patch_info_t *info_p)
+{
+    int res;
+    struct detools_apply_patch_chunk_t chunk;
+
+    chunk.buf_p = patch_p;
+    chunk.size = size;
+    chunk.offset = 0;
+    res = patch_info_unpack(&chunk, info_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    return ((int)chunk.offset);
+}
+
+/**
+ * Start the next segment, or the only segment of a normal patch.
+ */
+static void validate_segment_next(struct detools_validate_patch_t *self_p)
+{
+    size_t segment_size;
+
+    if (self_p->to_pos == self_p->info.to_size) {
+        self_p->state = detools_apply_patch_state_done_t;
+    } else {
+        if (self_p->info.type != DETOOLS_PATCH_TYPE_NORMAL) {
+            segment_size = self_p->info.segment_size;
+        } else {
+            segment_size = self_p->info.to_size;
+        }
+
+        self_p->segment_end = (self_p->to_pos
+                               + MIN(segment_size,
+                                     self_p->info.to_size - self_p->to_pos));
+        self_p->state = detools_apply_patch_state_dfpatch_size_t;
+    }
+}
+
+static int validate_process_init(struct detools_validate_patch_t *self_p)
+{
+    int res;
+
+    res = patch_info_unpack(&self_p->chunk, &self_p->info);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = patch_reader_init(&self_p->patch_reader,
+                            &self_p->chunk,
                             self_p->patch_size - self_p->chunk.offset,
-                            compression);
+                            self_p->info.compression);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    validate_segment_next(self_p);
+
+    return (0);
+}
+
+static int validate_process_dfpatch_size(
+    struct detools_validate_patch_t *self_p)
+{
+    int res;
+    int64_t size;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if ((size == SEGMENT_UNCHANGED)
+        && (self_p->info.type == DETOOLS_PATCH_TYPE_IN_PLACE_UNCHANGED)) {
+        self_p->to_pos = self_p->segment_end;
+        validate_segment_next(self_p);
+    } else if (size < 0) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    } else if (size > 0) {
+        /* The data format patch of the first segment covers all
+           segments. */
+        if (self_p->to_pos > 0) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
+
+#if DETOOLS_DATA_FORMAT == 1
+        self_p->chunk_size = (size_t)size;
+        self_p->state = detools_apply_patch_state_data_format_t;
+#else
+        return (-DETOOLS_BAD_DATA_FORMAT);
+#endif
+    } else {
+        self_p->state = detools_apply_patch_state_diff_size_t;
+    }
+
+    return (0);
+}
+
+#if DETOOLS_DATA_FORMAT == 1
+
+static int validate_process_data_format(
+    struct detools_validate_patch_t *self_p)
+{
+    int res;
+    int64_t data_format;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &data_format);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    switch (data_format) {
+
+#if DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1
+    case DATA_FORMAT_ARM_CORTEX_M4:
+#endif
+#if DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1
+    case DATA_FORMAT_AARCH64:
+#endif
+#if DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106 == 1
+    case DATA_FORMAT_XTENSA_LX106:
+#endif
+        self_p->state = detools_apply_patch_state_dfpatch_t;
+        break;
+
+    default:
+        return (-DETOOLS_BAD_DATA_FORMAT);
+    }
+
+    return (0);
+}
+
+#endif
+
+/**
+ * Decompress and discard patch data. The patch structure is checked,
+ * but not the data itself.
+ */
+static int validate_process_skip(struct detools_validate_patch_t *self_p,
+                                 enum detools_apply_patch_state_t next_state,
+                                 bool is_to_data)
+{
+    int res;
+    uint8_t buf[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t size;
+
+    size = MIN(sizeof(buf), self_p->chunk_size);
+
+    if (size == 0) {
+        self_p->state = next_state;
+
+        return (0);
+    }
+
+    res = patch_reader_decompress(&self_p->patch_reader, &buf[0], &size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    if (is_to_data) {
+        self_p->to_pos += size;
+    }
+
+    self_p->chunk_size -= size;
+
+    return (0);
+}
+
+static int validate_process_size(struct detools_validate_patch_t *self_p,
+                                 enum detools_apply_patch_state_t next_state)
+{
+    int res;
+
+    res = common_process_size(&self_p->patch_reader,
+                              self_p->to_pos,
+                              self_p->segment_end,
+                              &self_p->chunk_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    self_p->state = next_state;
+
+    return (0);
+}
+
+static int validate_process_adjustment(struct detools_validate_patch_t *self_p)
+{
+    int res;
+    int64_t offset;
+
+    res = patch_reader_unpack_size(&self_p->patch_reader, &offset);
 
     if (res != 0) {
         return (res);
     }
 
-    if (to_size < 0) {
-        return (-DETOOLS_CORRUPT_PATCH);
+    if (self_p->to_pos == self_p->segment_end) {
+        validate_segment_next(self_p);
+    } else {
+        self_p->state = detools_apply_patch_state_diff_size_t;
+    }
+
+    return (0);
+}
+
+static int validate_patch_process_once(struct detools_validate_patch_t *self_p)
+{
+    int res;
+
+    switch (self_p->state) {
+
+    case detools_apply_patch_state_init_t:
+        res = validate_process_init(self_p);
+        break;
+
+    case detools_apply_patch_state_dfpatch_size_t:
+        res = validate_process_dfpatch_size(self_p);
+        break;
+
+#if DETOOLS_DATA_FORMAT == 1
+    case detools_apply_patch_state_data_format_t:
+        res = validate_process_data_format(self_p);
+        break;
+
+    case detools_apply_patch_state_dfpatch_t:
+        res = validate_process_skip(self_p,
+                                    detools_apply_patch_state_diff_size_t,
+                                    false);
+        break;
+#endif
+
+    case detools_apply_patch_state_diff_size_t:
+        res = validate_process_size(self_p,
+                                    detools_apply_patch_state_diff_data_t);
+        break;
+
+    case detools_apply_patch_state_diff_data_t:
+        res = validate_process_skip(self_p,
+                                    detools_apply_patch_state_extra_size_t,
+                                    true);
+        break;
+
+    case detools_apply_patch_state_extra_size_t:
+        res = validate_process_size(self_p,
+                                    detools_apply_patch_state_extra_data_t);
+        break;
+
+    case detools_apply_patch_state_extra_data_t:
+        res = validate_process_skip(self_p,
+                                    detools_apply_patch_state_adjustment_t,
+                                    true);
+        break;
+
+    case detools_apply_patch_state_adjustment_t:
+        res = validate_process_adjustment(self_p);
+        break;
+
+    case detools_apply_patch_state_done_t:
+        res = patch_reader_drain(&self_p->patch_reader);
+        break;
+
+    case detools_apply_patch_state_failed_t:
+        res = -DETOOLS_ALREADY_FAILED;
+        break;
+
+    default:
+        res = -DETOOLS_INTERNAL_ERROR;
+        break;
+    }
+
+    if (res < 0) {
+        self_p->state = detools_apply_patch_state_failed_t;
     }
 
+    return (res);
+}
+
+int detools_validate_patch_init(struct detools_validate_patch_t *self_p,
+                                size_t patch_size)
+{
+    self_p->patch_size = patch_size;
+    self_p->state = detools_apply_patch_state_init_t;
+    self_p->info.to_size = 0;
     self_p->to_pos = 0;
-    self_p->segment_size = (size_t)segment_size;
-    self_p->shift_size = (size_t)shift_size;
-    self_p->to_size = (size_t)to_size;
-    self_p->segment.index = 0;
+    self_p->segment_end = 0;
+    self_p->chunk_size = 0;
+    self_p->patch_reader.destroy = NULL;
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    self_p->patch_reader.lzma_arena.buf_p = NULL;
+#endif
+
+    return (0);
+}
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+int detools_validate_patch_set_lzma_arena(
+    struct detools_validate_patch_t *self_p,
+    void *buf_p,
+    size_t size)
+{
+    self_p->patch_reader.lzma_arena.buf_p = (uint8_t *)buf_p;
+    self_p->patch_reader.lzma_arena.size = size;
+
+    return (0);
+}
+
+#endif
+
+int detools_validate_patch_process(struct detools_validate_patch_t *self_p,
+                                   const uint8_t *patch_p,
+                                   size_t size)
+{
+    int res;
+
+    res = 0;
+    self_p->chunk.buf_p = patch_p;
+    self_p->chunk.size = size;
+    self_p->chunk.offset = 0;
+
+    while (chunk_available(&self_p->chunk) && (res >= 0)) {
+        res = validate_patch_process_once(self_p);
+    }
+
+    if (res == 1) {
+        res = 0;
+    }
+
+    return (res);
+}
+
+int detools_validate_patch_finalize(struct detools_validate_patch_t *self_p)
+{
+    int res;
+
+    self_p->chunk.size = 0;
+    self_p->chunk.offset = 0;
+
+    do {
+        res = validate_patch_process_once(self_p);
+    } while (res == 0);
+
+    res = apply_patch_common_finalize(res, &self_p->patch_reader);
+
+    if (res == 0) {
+        res = to_size_as_int((int64_t)self_p->info.to_size);
+    }
+
+    return (res);
+}
+
+/*
+ * Callback functionality.
+ */
+
+static int callbacks_process(struct detools_apply_patch_t *apply_patch_p,
+                             detools_read_t patch_read,
+                             size_t patch_size,
+                             void *arg_p,
+                             int64_t *to_size_p)
+{
+    int res;
+    size_t patch_offset;
+    size_t chunk_size;
+    uint8_t chunk[512];
+
+    res = 0;
+    patch_offset = 0;
+
+    while ((patch_offset < patch_size) && (res == 0)) {
+        chunk_size = MIN(patch_size - patch_offset, 512);
+        res = patch_read(arg_p, &chunk[0], chunk_size);
+
+        if (res == 0) {
+            res = detools_apply_patch_process(apply_patch_p,
+                                              &chunk[0],
+                                              chunk_size);
+            patch_offset += chunk_size;
+        } else {
+            res = -DETOOLS_IO_FAILED;
+        }
+    }
+
+    if (res == 0) {
+        res = detools_apply_patch_finalize64(apply_patch_p, to_size_p);
+    } else {
+        (void)detools_apply_patch_finalize64(apply_patch_p, to_size_p);
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_callbacks(detools_read_t from_read,
+                                  detools_seek_t from_seek,
+                                  detools_read_t patch_read,
+                                  size_t patch_size,
+                                  detools_write_t to_write,
+                                  void *arg_p)
+{
+    int res;
+    struct detools_apply_patch_t apply_patch;
+    int64_t to_size;
+
+    res = detools_apply_patch_init(&apply_patch,
+                                   from_read,
+                                   from_seek,
+                                   patch_size,
+                                   to_write,
+                                   arg_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = callbacks_process(&apply_patch,
+                            patch_read,
+                            patch_size,
+                            arg_p,
+                            &to_size);
+
+    if (res == 0) {
+        res = to_size_as_int(to_size);
+    }
+
+    return (res);
+}
+
+static int in_place_callbacks_process(
+    struct detools_apply_patch_in_place_t *apply_patch_p,
+    detools_read_t patch_read,
+    size_t patch_size,
+    void *arg_p)
+{
+    int res;
+    size_t patch_offset;
+    size_t chunk_size;
+    uint8_t chunk[512];
+
+    res = 0;
+    patch_offset = 0;
+
+    while ((patch_offset < patch_size) && (res == 0)) {
+        chunk_size = MIN(patch_size - patch_offset, 512);
+        res = patch_read(arg_p, &chunk[0], chunk_size);
+
+        if (res == 0) {
+            res = detools_apply_patch_in_place_process(apply_patch_p,
+                                                       &chunk[0],
+                                                       chunk_size);
+            patch_offset += chunk_size;
+        } else {
+            res = -DETOOLS_IO_FAILED;
+        }
+    }
+
+    if (res == 0) {
+        res = detools_apply_patch_in_place_finalize(apply_patch_p);
+    } else {
+        (void)detools_apply_patch_in_place_finalize(apply_patch_p);
+    }
+
+    return (res);
+}
+
+int detools_apply_patch_in_place_callbacks(detools_mem_read_t mem_read,
+                                           detools_mem_write_t mem_write,
+                                           detools_mem_erase_t mem_erase,
+                                           detools_step_set_t step_set,
+                                           detools_step_get_t step_get,
+                                           detools_read_t patch_read,
+                                           size_t patch_size,
+                                           void *arg_p)
+{
+    int res;
+    struct detools_apply_patch_in_place_t apply_patch;
+
+    res = detools_apply_patch_in_place_init(&apply_patch,
+                                            mem_read,
+                                            mem_write,
+                                            mem_erase,
+                                            step_set,
+                                            step_get,
+                                            patch_size,
+                                            arg_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    return (in_place_callbacks_process(&apply_patch,
+                                       patch_read,
+                                       patch_size,
+                                       arg_p));
+}
+
+#if DETOOLS_CONFIG_BSDIFF == 1
+
+/*
+ * Bsdiff patch type.
+ */
+
+#define BSDIFF_HEADER_SIZE                                  32
+#define BSDIFF_INPUT_BUFFER_SIZE                           512
+
+/* A bzip2 compressed part of a bsdiff patch. */
+struct bsdiff_reader_t {
+    bz_stream stream;
+    bool stream_end;
+    detools_mem_read_t patch_read;
+    void *arg_p;
+    size_t offset;
+    size_t end;
+    uint8_t input[BSDIFF_INPUT_BUFFER_SIZE];
+};
 
-    if (to_size > 0) {
-        res = in_place_shift_memory(self_p,
-                                    (size_t)memory_size,
-                                    (size_t)from_size);
+static int64_t bsdiff_offtin(const uint8_t *buf_p)
+{
+    uint64_t value;
+    int i;
 
-        if (res != 0) {
-            return (res);
-        }
+    value = 0;
 
-        self_p->state = detools_apply_patch_state_dfpatch_size_t;
-    } else {
-        self_p->state = detools_apply_patch_state_done_t;
+    for (i = 7; i >= 0; i--) {
+        value <<= 8;
+        value |= buf_p[i];
     }
 
-    return (res);
+    if ((value & (UINT64_C(1) << 63)) != 0) {
+        return (-(int64_t)(value & ~(UINT64_C(1) << 63)));
+    } else {
+        return ((int64_t)value);
+    }
 }
 
-static int in_place_process_dfpatch_size(
-    struct detools_apply_patch_in_place_t *self_p)
+static int bz2_ret_to_error(int ret)
 {
-    int res;
-    int size;
+    switch (ret) {
 
-    res = patch_reader_unpack_size(&self_p->patch_reader, &size);
+    case BZ_MEM_ERROR:
+        return (-DETOOLS_OUT_OF_MEMORY);
 
-    if (res != 0) {
-        return (res);
-    }
+    case BZ_DATA_ERROR:
+    case BZ_DATA_ERROR_MAGIC:
+        return (-DETOOLS_CORRUPT_PATCH);
 
-    if (size > 0) {
-        return (-DETOOLS_NOT_IMPLEMENTED);
+    default:
+        return (-DETOOLS_BZ2_DECOMPRESS);
     }
-
-    self_p->state = detools_apply_patch_state_diff_size_t;
-    self_p->segment.from_offset =
-        (int)MAX(self_p->segment_size * (self_p->segment.index + 1),
-                 self_p->shift_size);
-    self_p->segment.to_offset = (self_p->segment.index * self_p->segment_size);
-    self_p->segment.to_size = MIN(self_p->segment_size,
-                                  self_p->to_size - self_p->segment.to_offset);
-    self_p->segment.to_pos = 0;
-    self_p->segment.index++;
-
-    return (in_place_mem_erase(self_p,
-                               self_p->segment.to_offset,
-                               self_p->segment.to_size));
 }
 
-static int in_place_process_size(struct detools_apply_patch_in_place_t *self_p,
-                                 enum detools_apply_patch_state_t next_state)
+static int bsdiff_reader_init(struct bsdiff_reader_t *self_p,
+                              detools_mem_read_t patch_read,
+                              void *arg_p,
+                              size_t offset,
+                              size_t size)
 {
-    int res;
-    int size;
+    int ret;
 
-    res = common_process_size(&self_p->patch_reader,
-                              self_p->to_pos,
-                              self_p->to_size,
-                              &size);
+    memset(&self_p->stream, 0, sizeof(self_p->stream));
+    ret = BZ2_bzDecompressInit(&self_p->stream, 0, 0);
 
-    if (res != 0) {
-        return (res);
+    if (ret != BZ_OK) {
+        if (ret == BZ_MEM_ERROR) {
+            return (-DETOOLS_OUT_OF_MEMORY);
+        } else {
+            return (-DETOOLS_BZ2_INIT);
+        }
     }
 
-    self_p->state = next_state;
-    self_p->chunk_size = (size_t)size;
+    self_p->stream_end = false;
+    self_p->patch_read = patch_read;
+    self_p->arg_p = arg_p;
+    self_p->offset = offset;
+    self_p->end = (offset + size);
 
     return (0);
 }
 
-static int in_place_process_data(struct detools_apply_patch_in_place_t *self_p,
-                                 enum detools_apply_patch_state_t next_state)
+/**
+ * Decompress up to given size bytes, fewer only if the end of the
+ * bzip2 stream is found.
+ */
+static int bsdiff_reader_decompress(struct bsdiff_reader_t *self_p,
+                                    uint8_t *buf_p,
+                                    size_t *size_p)
 {
     int res;
-    size_t i;
-    uint8_t to[128];
-    size_t to_size;
-    uint8_t from[128];
-
-    to_size = MIN(sizeof(to), self_p->chunk_size);
-
-    if (to_size == 0) {
-        self_p->state = next_state;
-
-        return (0);
-    }
+    int ret;
+    size_t size;
+    unsigned int avail_out;
 
-    res = patch_reader_decompress(&self_p->patch_reader,
-                                  &to[0],
-                                  &to_size);
+    self_p->stream.next_out = (char *)buf_p;
+    self_p->stream.avail_out = (unsigned int)*size_p;
 
-    if (res != 0) {
-        return (res);
-    }
+    while ((self_p->stream.avail_out > 0) && !self_p->stream_end) {
+        if ((self_p->stream.avail_in == 0) && (self_p->offset < self_p->end)) {
+            size = MIN(self_p->end - self_p->offset, sizeof(self_p->input));
+            res = self_p->patch_read(self_p->arg_p,
+                                     &self_p->input[0],
+                                     self_p->offset,
+                                     size);
 
-    if (next_state == detools_apply_patch_state_extra_size_t) {
-        res = in_place_mem_read(self_p,
-                                &from[0],
-                                (size_t)self_p->segment.from_offset,
-                                to_size);
+            if (res != 0) {
+                return (-DETOOLS_IO_FAILED);
+            }
 
-        if (res != 0) {
-            return (-DETOOLS_IO_FAILED);
+            self_p->stream.next_in = (char *)&self_p->input[0];
+            self_p->stream.avail_in = (unsigned int)size;
+            self_p->offset += size;
         }
 
-        self_p->segment.from_offset += (int)to_size;
-
-        for (i = 0; i < to_size; i++) {
-            to[i] = (uint8_t)(to[i] + from[i]);
+        avail_out = self_p->stream.avail_out;
+        ret = BZ2_bzDecompress(&self_p->stream);
+
+        if (ret == BZ_STREAM_END) {
+            self_p->stream_end = true;
+        } else if (ret != BZ_OK) {
+            return (bz2_ret_to_error(ret));
+        } else if ((self_p->stream.avail_out == avail_out)
+                   && (self_p->stream.avail_in == 0)
+                   && (self_p->offset == self_p->end)) {
+            return (-DETOOLS_NOT_ENOUGH_PATCH_DATA);
         }
     }
 
-    res = in_place_mem_write(self_p,
-                             self_p->segment.to_pos + self_p->segment.to_offset,
-                             &to[0],
-                             to_size);
-
-    if (res != 0) {
-        return (-DETOOLS_IO_FAILED);
-    }
-
-    self_p->to_pos += to_size;
-    self_p->segment.to_pos += to_size;
-    self_p->chunk_size -= to_size;
+    *size_p -= self_p->stream.avail_out;
 
-    return (res);
+    return (0);
 }
 
-static int in_place_process_diff_size(struct detools_apply_patch_in_place_t *self_p)
+static int bsdiff_reader_read(struct bsdiff_reader_t *self_p,
+                              uint8_t *buf_p,
+                              size_t size)
 {
-    return (in_place_process_size(self_p, detools_apply_patch_state_diff_data_t));
-}
+    int res;
+    size_t decompressed_size;
 
-static int in_place_process_diff_data(struct detools_apply_patch_in_place_t *self_p)
-{
-    return (in_place_process_data(self_p, detools_apply_patch_state_extra_size_t));
-}
+    decompressed_size = size;
+    res = bsdiff_reader_decompress(self_p, buf_p, &decompressed_size);
 
-static int in_place_process_extra_size(struct detools_apply_patch_in_place_t *self_p)
-{
-    return (in_place_process_size(self_p, detools_apply_patch_state_extra_data_t));
-}
+    if (res != 0) {
+        return (res);
+    }
 
-static int in_place_process_extra_data(struct detools_apply_patch_in_place_t *self_p)
-{
-    return (in_place_process_data(self_p, detools_apply_patch_state_adjustment_t));
+    if (decompressed_size != size) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
+
+    return (0);
 }
 
-static int in_place_process_adjustment(struct detools_apply_patch_in_place_t *self_p)
+/**
+ * Returns zero(0) if the end of the bzip2 stream has been reached,
+ * and there is no more data in it.
+ */
+static int bsdiff_reader_end(struct bsdiff_reader_t *self_p)
 {
     int res;
-    int offset;
+    uint8_t byte;
+    size_t size;
 
-    res = patch_reader_unpack_size(&self_p->patch_reader, &offset);
+    size = 1;
+    res = bsdiff_reader_decompress(self_p, &byte, &size);
 
     if (res != 0) {
         return (res);
     }
 
-    if (self_p->to_pos == self_p->to_size) {
-        res = in_place_all_steps_completed(self_p);
-        self_p->state = detools_apply_patch_state_done_t;
-    } else if (self_p->segment.to_pos == self_p->segment.to_size) {
-        res = in_place_next_step(self_p);
-        self_p->state = detools_apply_patch_state_dfpatch_size_t;
-    } else {
-        self_p->segment.from_offset += offset;
-        self_p->state = detools_apply_patch_state_diff_size_t;
+    if (size != 0) {
+        return (-DETOOLS_CORRUPT_PATCH);
     }
 
-    return (res);
+    return (0);
 }
 
-static int apply_patch_in_place_process_once(
-    struct detools_apply_patch_in_place_t *self_p)
+static void bsdiff_reader_destroy(struct bsdiff_reader_t *self_p)
+{
+    (void)BZ2_bzDecompressEnd(&self_p->stream);
+}
+
+static int bsdiff_write_diff(struct bsdiff_reader_t *diff_reader_p,
+                             detools_read_t from_read,
+                             detools_write_t to_write,
+                             void *arg_p,
+                             size_t size)
 {
     int res;
+    uint8_t to[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    uint8_t from[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t chunk_size;
 
-    switch (self_p->state) {
+    while (size > 0) {
+        chunk_size = MIN(size, sizeof(to));
+        res = bsdiff_reader_read(diff_reader_p, &to[0], chunk_size);
 
-    case detools_apply_patch_state_init_t:
-        res = in_place_process_init(self_p);
-        break;
+        if (res != 0) {
+            return (res);
+        }
 
-    case detools_apply_patch_state_dfpatch_size_t:
-        res = in_place_process_dfpatch_size(self_p);
-        break;
+        res = from_read(arg_p, &from[0], chunk_size);
 
-    case detools_apply_patch_state_diff_size_t:
-        res = in_place_process_diff_size(self_p);
-        break;
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
 
-    case detools_apply_patch_state_diff_data_t:
-        res = in_place_process_diff_data(self_p);
-        break;
+        add_from_to_diff(&to[0], &from[0], chunk_size);
+        res = to_write(arg_p, &to[0], chunk_size);
 
-    case detools_apply_patch_state_extra_size_t:
-        res = in_place_process_extra_size(self_p);
-        break;
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
 
-    case detools_apply_patch_state_extra_data_t:
-        res = in_place_process_extra_data(self_p);
-        break;
+        size -= chunk_size;
+    }
 
-    case detools_apply_patch_state_adjustment_t:
-        res = in_place_process_adjustment(self_p);
-        break;
+    return (0);
+}
 
-    case detools_apply_patch_state_done_t:
-        res = -DETOOLS_ALREADY_DONE;
-        break;
+static int bsdiff_write_extra(struct bsdiff_reader_t *extra_reader_p,
+                              detools_write_t to_write,
+                              void *arg_p,
+                              size_t size)
+{
+    int res;
+    uint8_t to[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    size_t chunk_size;
 
-    case detools_apply_patch_state_failed_t:
-        res = -DETOOLS_ALREADY_FAILED;
-        break;
+    while (size > 0) {
+        chunk_size = MIN(size, sizeof(to));
+        res = bsdiff_reader_read(extra_reader_p, &to[0], chunk_size);
 
-    default:
-        res = -DETOOLS_INTERNAL_ERROR;
-        break;
-    }
+        if (res != 0) {
+            return (res);
+        }
 
-    if (res < 0) {
-        self_p->state = detools_apply_patch_state_failed_t;
-    }
+        res = to_write(arg_p, &to[0], chunk_size);
 
-    return (res);
-}
+        if (res != 0) {
+            return (-DETOOLS_IO_FAILED);
+        }
 
-int detools_apply_patch_in_place_init(
-    struct detools_apply_patch_in_place_t *self_p,
-    detools_mem_read_t mem_read,
-    detools_mem_write_t mem_write,
-    detools_mem_erase_t mem_erase,
-    detools_step_set_t step_set,
-    detools_step_get_t step_get,
-    size_t patch_size,
-    void *arg_p)
-{
-    self_p->mem_read = mem_read;
-    self_p->mem_write = mem_write;
-    self_p->mem_erase = mem_erase;
-    self_p->step_set = step_set;
-    self_p->step_get = step_get;
-    self_p->patch_size = patch_size;
-    self_p->arg_p = arg_p;
-    self_p->state = detools_apply_patch_state_init_t;
-    self_p->ongoing_step = 1;
-    self_p->patch_reader.destroy = NULL;
+        size -= chunk_size;
+    }
 
     return (0);
 }
 
-int detools_apply_patch_in_place_process(
-    struct detools_apply_patch_in_place_t *self_p,
-    const uint8_t *patch_p,
-    size_t size)
+static int bsdiff_process(struct bsdiff_reader_t *readers_p,
+                          detools_read_t from_read,
+                          detools_seek_t from_seek,
+                          detools_write_t to_write,
+                          void *arg_p,
+                          int64_t to_size)
 {
     int res;
+    uint8_t ctrl[24];
+    int64_t to_pos;
+    int64_t diff_size;
+    int64_t extra_size;
+    int64_t adjustment;
 
-    res = 0;
-    self_p->chunk.buf_p = patch_p;
-    self_p->chunk.size = size;
-    self_p->chunk.offset = 0;
+    to_pos = 0;
 
-    while (chunk_available(&self_p->chunk) && (res >= 0)) {
-        res = apply_patch_in_place_process_once(self_p);
-    }
+    while (to_pos < to_size) {
+        res = bsdiff_reader_read(&readers_p[0], &ctrl[0], sizeof(ctrl));
 
-    if (res == 1) {
-        res = 0;
-    }
+        if (res != 0) {
+            return (res);
+        }
 
-    return (res);
-}
+        diff_size = bsdiff_offtin(&ctrl[0]);
+        extra_size = bsdiff_offtin(&ctrl[8]);
+        adjustment = bsdiff_offtin(&ctrl[16]);
 
-int detools_apply_patch_in_place_finalize(
-    struct detools_apply_patch_in_place_t *self_p)
-{
-    int res;
+        if ((diff_size < 0) || (diff_size > to_size - to_pos)) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-    self_p->chunk.size = 0;
-    self_p->chunk.offset = 0;
+        res = bsdiff_write_diff(&readers_p[1],
+                                from_read,
+                                to_write,
+                                arg_p,
+                                (size_t)diff_size);
 
-    do {
-        res = apply_patch_in_place_process_once(self_p);
-    } while (res == 0);
+        if (res != 0) {
+            return (res);
+        }
 
-    return (apply_patch_common_finalize(res,
-                                        &self_p->patch_reader,
-                                        self_p->to_size));
-}
+        to_pos += diff_size;
 
-/*
- * Callback functionality.
- */
+        if ((extra_size < 0) || (extra_size > to_size - to_pos)) {
+            return (-DETOOLS_CORRUPT_PATCH);
+        }
 
-static int callbacks_process(struct detools_apply_patch_t *apply_patch_p,
-                             detools_read_t patch_read,
-                             size_t patch_size,
-                             void *arg_p)
-{
-    int res;
-    size_t patch_offset;
-    size_t chunk_size;
-    uint8_t chunk[512];
+        res = bsdiff_write_extra(&readers_p[2],
+                                 to_write,
+                                 arg_p,
+                                 (size_t)extra_size);
 
-    res = 0;
-    patch_offset = 0;
+        if (res != 0) {
+            return (res);
+        }
 
-    while ((patch_offset < patch_size) && (res == 0)) {
-        chunk_size = MIN(patch_size - patch_offset, 512);
-        res = patch_read(arg_p, &chunk[0], chunk_size);
+        to_pos += extra_size;
 
-        if (res == 0) {
-            res = detools_apply_patch_process(apply_patch_p,
-                                              &chunk[0],
-                                              chunk_size);
-            patch_offset += chunk_size;
-        } else {
-            res = -DETOOLS_IO_FAILED;
+        if (adjustment != 0) {
+            res = from_seek_int64(from_seek, arg_p, adjustment);
+
+            if (res != 0) {
+                return (res);
+            }
         }
     }
 
+    res = bsdiff_reader_end(&readers_p[0]);
+
     if (res == 0) {
-        res = detools_apply_patch_finalize(apply_patch_p);
-    } else {
-        (void)detools_apply_patch_finalize(apply_patch_p);
+        res = bsdiff_reader_end(&readers_p[1]);
+    }
+
+    if (res == 0) {
+        res = bsdiff_reader_end(&readers_p[2]);
     }
 
     return (res);
 }
 
-int detools_apply_patch_callbacks(detools_read_t from_read,
-                                  detools_seek_t from_seek,
-                                  detools_read_t patch_read,
-                                  size_t patch_size,
-                                  detools_write_t to_write,
-                                  void *arg_p)
+int detools_apply_patch_bsdiff_callbacks(detools_read_t from_read,
+                                         detools_seek_t from_seek,
+                                         detools_mem_read_t patch_read,
+                                         size_t patch_size,
+                                         detools_write_t to_write,
+                                         void *arg_p)
 {
     int res;
-    struct detools_apply_patch_t apply_patch;
+    int i;
+    uint8_t header[BSDIFF_HEADER_SIZE];
+    int64_t ctrl_size;
+    int64_t diff_size;
+    int64_t to_size;
+    size_t offsets[3];
+    size_t sizes[3];
+    struct bsdiff_reader_t readers[3];
+
+    if (patch_size < sizeof(header)) {
+        return (-DETOOLS_SHORT_HEADER);
+    }
 
-    res = detools_apply_patch_init(&apply_patch,
-                                   from_read,
-                                   from_seek,
-                                   patch_size,
-                                   to_write,
-                                   arg_p);
+    res = patch_read(arg_p, &header[0], 0, sizeof(header));
 
     if (res != 0) {
-        return (res);
+        return (-DETOOLS_IO_FAILED);
     }
 
-    return (callbacks_process(&apply_patch, patch_read, patch_size, arg_p));
-}
+    if (memcmp(&header[0], "BSDIFF40", 8) != 0) {
+        return (-DETOOLS_BAD_PATCH_TYPE);
+    }
 
-static int in_place_callbacks_process(
-    struct detools_apply_patch_in_place_t *apply_patch_p,
-    detools_read_t patch_read,
-    size_t patch_size,
-    void *arg_p)
-{
-    int res;
-    size_t patch_offset;
-    size_t chunk_size;
-    uint8_t chunk[512];
+    ctrl_size = bsdiff_offtin(&header[8]);
+    diff_size = bsdiff_offtin(&header[16]);
+    to_size = bsdiff_offtin(&header[24]);
 
-    res = 0;
-    patch_offset = 0;
+    if ((ctrl_size < 0)
+        || (diff_size < 0)
+        || (to_size < 0)
+        || ((uint64_t)ctrl_size > patch_size - sizeof(header))
+        || ((uint64_t)diff_size
+            > patch_size - sizeof(header) - (size_t)ctrl_size)) {
+        return (-DETOOLS_CORRUPT_PATCH);
+    }
 
-    while ((patch_offset < patch_size) && (res == 0)) {
-        chunk_size = MIN(patch_size - patch_offset, 512);
-        res = patch_read(arg_p, &chunk[0], chunk_size);
+    /* Control, diff and extra data. */
+    offsets[0] = sizeof(header);
+    sizes[0] = (size_t)ctrl_size;
+    offsets[1] = (offsets[0] + sizes[0]);
+    sizes[1] = (size_t)diff_size;
+    offsets[2] = (offsets[1] + sizes[1]);
+    sizes[2] = (patch_size - offsets[2]);
+
+    for (i = 0; i < 3; i++) {
+        res = bsdiff_reader_init(&readers[i],
+                                 patch_read,
+                                 arg_p,
+                                 offsets[i],
+                                 sizes[i]);
 
-        if (res == 0) {
-            res = detools_apply_patch_in_place_process(apply_patch_p,
-                                                       &chunk[0],
-                                                       chunk_size);
-            patch_offset += chunk_size;
-        } else {
-            res = -DETOOLS_IO_FAILED;
+        if (res != 0) {
+            break;
         }
     }
 
     if (res == 0) {
-        res = detools_apply_patch_in_place_finalize(apply_patch_p);
-    } else {
-        (void)detools_apply_patch_in_place_finalize(apply_patch_p);
+        res = bsdiff_process(&readers[0],
+                             from_read,
+                             from_seek,
+                             to_write,
+                             arg_p,
+                             to_size);
     }
 
-    return (res);
-}
-
-int detools_apply_patch_in_place_callbacks(detools_mem_read_t mem_read,
-                                           detools_mem_write_t mem_write,
-                                           detools_mem_erase_t mem_erase,
-                                           detools_step_set_t step_set,
-                                           detools_step_get_t step_get,
-                                           detools_read_t patch_read,
-                                           size_t patch_size,
-                                           void *arg_p)
-{
-    int res;
-    struct detools_apply_patch_in_place_t apply_patch;
-
-    res = detools_apply_patch_in_place_init(&apply_patch,
-                                            mem_read,
-                                            mem_write,
-                                            mem_erase,
-                                            step_set,
-                                            step_get,
-                                            patch_size,
-                                            arg_p);
+    if (res == 0) {
+        res = to_size_as_int(to_size);
+    }
 
-    if (res != 0) {
-        return (res);
+    while (i > 0) {
+        i--;
+        bsdiff_reader_destroy(&readers[i]);
     }
 
-    return (in_place_callbacks_process(&apply_patch,
-                                       patch_read,
-                                       patch_size,
-                                       arg_p));
+    return (res);
 }
 
+#endif
+
 /*
  * File io functionality.
  */
@@ -1997,10 +6031,37 @@ static int get_file_size(FILE *file_p, size_t *size_p)
     return (res);
 }
 
+/**
+ * Get the size of the from-file, which may be empty.
+ */
+static int get_from_file_size(FILE *file_p, size_t *size_p)
+{
+    long size;
+
+    if (fseek(file_p, 0, SEEK_END) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    size = ftell(file_p);
+
+    if (size < 0) {
+        return (-DETOOLS_FILE_TELL_FAILED);
+    }
+
+    *size_p = (size_t)size;
+
+    if (fseek(file_p, 0, SEEK_SET) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    return (0);
+}
+
 static int file_io_init(struct file_io_t *self_p,
                         const char *from_p,
                         const char *patch_p,
                         const char *to_p,
+                        size_t *from_size_p,
                         size_t *patch_size_p)
 {
     int res;
@@ -2016,6 +6077,13 @@ static int file_io_init(struct file_io_t *self_p,
     }
 
     self_p->ffrom_p = file_p;
+    res = get_from_file_size(self_p->ffrom_p, from_size_p);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+    res = -DETOOLS_FILE_OPEN_FAILED;
 
     /* To. */
     file_p = fopen(to_p, "wb");
@@ -2104,6 +6172,19 @@ static int file_io_from_seek(void *arg_p, int offset)
     return (fseek(self_p->ffrom_p, offset, SEEK_CUR));
 }
 
+static int file_io_from_seek64(void *arg_p, int64_t offset)
+{
+    struct file_io_t *self_p;
+
+    self_p = (struct file_io_t *)arg_p;
+
+    if ((offset > LONG_MAX) || (offset < LONG_MIN)) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    return (fseek(self_p->ffrom_p, (long)offset, SEEK_CUR));
+}
+
 static int file_io_patch_read(void *arg_p, uint8_t *buf_p, size_t size)
 {
     struct file_io_t *self_p;
@@ -2130,30 +6211,57 @@ static int file_io_to_write(void *arg_p, const uint8_t *buf_p, size_t size)
     return (res);
 }
 
-int detools_apply_patch_filenames(const char *from_p,
-                                  const char *patch_p,
-                                  const char *to_p)
+int detools_apply_patch_filenames64(const char *from_p,
+                                    const char *patch_p,
+                                    const char *to_p,
+                                    int64_t *to_size_p)
 {
     int res;
     struct file_io_t file_io;
+    struct detools_apply_patch_t apply_patch;
+    size_t from_size;
     size_t patch_size;
 
     res = file_io_init(&file_io,
                        from_p,
                        patch_p,
                        to_p,
+                       &from_size,
                        &patch_size);
 
     if (res != 0) {
         return (res);
     }
 
-    res = detools_apply_patch_callbacks(file_io_from_read,
-                                        file_io_from_seek,
-                                        file_io_patch_read,
-                                        patch_size,
-                                        file_io_to_write,
-                                        &file_io);
+    res = detools_apply_patch_init(&apply_patch,
+                                   file_io_from_read,
+                                   file_io_from_seek,
+                                   patch_size,
+                                   file_io_to_write,
+                                   &file_io);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+    res = detools_apply_patch_set_from_size(&apply_patch, from_size);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+    res = detools_apply_patch_set_from_seek64(&apply_patch,
+                                              file_io_from_seek64);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+    res = callbacks_process(&apply_patch,
+                            file_io_patch_read,
+                            patch_size,
+                            &file_io,
+                            to_size_p);
 
     if (res != 0) {
         goto err1;
@@ -2167,6 +6275,22 @@ int detools_apply_patch_filenames(const char *from_p,
     return (res);
 }
 
+int detools_apply_patch_filenames(const char *from_p,
+                                  const char *patch_p,
+                                  const char *to_p)
+{
+    int res;
+    int64_t to_size;
+
+    res = detools_apply_patch_filenames64(from_p, patch_p, to_p, &to_size);
+
+    if (res == 0) {
+        res = to_size_as_int(to_size);
+    }
+
+    return (res);
+}
+
 struct in_place_file_io_t {
     FILE *fmemory_p;
     FILE *fpatch_p;
@@ -2228,7 +6352,7 @@ static int in_place_file_io_mem_read(void *arg_p,
     res = 0;
 
     if (size > 0) {
-        res = fseek(self_p->fmemory_p, (int)src, SEEK_SET);
+        res = fseek(self_p->fmemory_p, (long)src, SEEK_SET);
 
         if (res != 0) {
             return (-DETOOLS_FILE_SEEK_FAILED);
@@ -2254,7 +6378,7 @@ static int in_place_file_io_mem_write(void *arg_p,
     res = 0;
 
     if (size > 0) {
-        res = fseek(self_p->fmemory_p, (int)dst, SEEK_SET);
+        res = fseek(self_p->fmemory_p, (long)dst, SEEK_SET);
 
         if (res != 0) {
             return (-DETOOLS_FILE_SEEK_FAILED);
@@ -2331,6 +6455,69 @@ int detools_apply_patch_in_place_filenames(const char *memory_p,
     return (res);
 }
 
+#if DETOOLS_CONFIG_BSDIFF == 1
+
+static int bsdiff_file_io_patch_read(void *arg_p,
+                                     void *dst_p,
+                                     uintptr_t src,
+                                     size_t size)
+{
+    struct file_io_t *self_p;
+
+    self_p = (struct file_io_t *)arg_p;
+
+    if (fseek(self_p->fpatch_p, (long)src, SEEK_SET) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    return (file_io_read(self_p->fpatch_p, (uint8_t *)dst_p, size));
+}
+
+int detools_apply_patch_bsdiff_filenames(const char *from_p,
+                                         const char *patch_p,
+                                         const char *to_p)
+{
+    int res;
+    struct file_io_t file_io;
+    size_t from_size;
+    size_t patch_size;
+
+    res = file_io_init(&file_io,
+                       from_p,
+                       patch_p,
+                       to_p,
+                       &from_size,
+                       &patch_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = detools_apply_patch_bsdiff_callbacks(file_io_from_read,
+                                               file_io_from_seek,
+                                               bsdiff_file_io_patch_read,
+                                               patch_size,
+                                               file_io_to_write,
+                                               &file_io);
+
+    if (res < 0) {
+        goto err1;
+    }
+
+    if (file_io_cleanup(&file_io) != 0) {
+        return (-DETOOLS_FILE_CLOSE_FAILED);
+    }
+
+    return (res);
+
+ err1:
+    (void)file_io_cleanup(&file_io);
+
+    return (res);
+}
+
+#endif
+
 #endif
 
 const char *detools_error_as_string(int error)
@@ -2406,6 +6593,33 @@ const char *detools_error_as_string(int error)
     case DETOOLS_STEP_GET_FAILED:
         return "Step get failed.";
 
+    case DETOOLS_BAD_DATA_FORMAT:
+        return "Bad data format.";
+
+    case DETOOLS_MISSING_FROM_SIZE:
+        return "Missing from size.";
+
+    case DETOOLS_BAD_CHECKPOINT:
+        return "Bad checkpoint.";
+
+    case DETOOLS_BAD_DIGEST:
+        return "Bad digest.";
+
+    case DETOOLS_DIGEST_MISMATCH:
+        return "Digest mismatch.";
+
+    case DETOOLS_BZ2_INIT:
+        return "BZ2 init.";
+
+    case DETOOLS_BZ2_DECOMPRESS:
+        return "BZ2 decompress.";
+
+    case DETOOLS_HEATSHRINK_HEADER:
+        return "Heatshrink header.";
+
+    case DETOOLS_TO_SIZE_TOO_LARGE:
+        return "To size too large.";
+
     default:
         return "Unknown error.";
     }
@@ -55,6 +55,109 @@
 #    define DETOOLS_CONFIG_COMPRESSION_HEATSHRINK  1
 #endif
 
+/*
+ * Data format patches. Disabled by default as enabling any of them
+ * adds the data format value and block tables to the apply patch
+ * objects, see DETOOLS_CONFIG_DATA_FORMAT_MAX_VALUES and
+ * DETOOLS_CONFIG_DATA_FORMAT_MAX_BLOCKS below.
+ */
+
+#ifndef DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4
+#    define DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4  0
+#endif
+
+#ifndef DETOOLS_CONFIG_DATA_FORMAT_AARCH64
+#    define DETOOLS_CONFIG_DATA_FORMAT_AARCH64        0
+#endif
+
+#ifndef DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106
+#    define DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106   0
+#endif
+
+#ifndef DETOOLS_CONFIG_DIGEST_CRC32
+#    define DETOOLS_CONFIG_DIGEST_CRC32               1
+#endif
+
+#ifndef DETOOLS_CONFIG_DIGEST_SHA256
+#    define DETOOLS_CONFIG_DIGEST_SHA256              1
+#endif
+
+/*
+ * Asynchronous memory writes and erases in the in-place apply. Adds
+ * two work buffers to the in-place apply patch object.
+ */
+
+#ifndef DETOOLS_CONFIG_MEM_ASYNC
+#    define DETOOLS_CONFIG_MEM_ASYNC                  1
+#endif
+
+/*
+ * Use SSE2 or NEON instructions, if available, when adding diff data
+ * to from data. Portable word-at-a-time addition is used otherwise.
+ */
+
+#ifndef DETOOLS_CONFIG_SIMD
+#    define DETOOLS_CONFIG_SIMD                       1
+#endif
+
+/*
+ * Apply bsdiff (BSDIFF40) patches. Disabled by default as it requires
+ * linking with libbz2.
+ */
+
+#ifndef DETOOLS_CONFIG_BSDIFF
+#    define DETOOLS_CONFIG_BSDIFF                     0
+#endif
+
+/*
+ * Maximum number of blocks and values in a data format patch. The
+ * tables are part of the apply patch objects if any data format is
+ * enabled, using eight bytes per value and twelve bytes per block.
+ */
+
+#ifndef DETOOLS_CONFIG_DATA_FORMAT_MAX_BLOCKS
+#    define DETOOLS_CONFIG_DATA_FORMAT_MAX_BLOCKS     128
+#endif
+
+#ifndef DETOOLS_CONFIG_DATA_FORMAT_MAX_VALUES
+#    define DETOOLS_CONFIG_DATA_FORMAT_MAX_VALUES     4096
+#endif
+
+/*
+ * Size in bytes of the stack buffers data is moved through when
+ * applying a patch. Larger buffers give fewer and larger read and
+ * write callbacks, at the cost of up to three times the size in stack
+ * usage.
+ */
+
+#ifndef DETOOLS_CONFIG_WORK_BUFFER_SIZE
+#    define DETOOLS_CONFIG_WORK_BUFFER_SIZE           128
+#endif
+
+/*
+ * Size in bytes of the LZMA input buffer, part of the apply patch
+ * objects.
+ */
+
+#ifndef DETOOLS_CONFIG_LZMA_INPUT_BUFFER_SIZE
+#    define DETOOLS_CONFIG_LZMA_INPUT_BUFFER_SIZE     128
+#endif
+
+#if ((DETOOLS_CONFIG_DATA_FORMAT_ARM_CORTEX_M4 == 1)    \
+     || (DETOOLS_CONFIG_DATA_FORMAT_AARCH64 == 1)       \
+     || (DETOOLS_CONFIG_DATA_FORMAT_XTENSA_LX106 == 1))
+#    define DETOOLS_DATA_FORMAT                       1
+#else
+#    define DETOOLS_DATA_FORMAT                       0
+#endif
+
+#if ((DETOOLS_CONFIG_DIGEST_CRC32 == 1)                 \
+     || (DETOOLS_CONFIG_DIGEST_SHA256 == 1))
+#    define DETOOLS_DIGEST                            1
+#else
+#    define DETOOLS_DIGEST                            0
+#endif
+
 #include <stdint.h>
 #include <string.h>
 #include <stdio.h>
@@ -86,6 +189,40 @@
 #define DETOOLS_STEP_SET_FAILED                22
 #define DETOOLS_STEP_GET_FAILED                23
 #define DETOOLS_ALREADY_FAILED                 24
+#define DETOOLS_BAD_DATA_FORMAT                25
+#define DETOOLS_MISSING_FROM_SIZE              26
+#define DETOOLS_BAD_CHECKPOINT                 27
+#define DETOOLS_BAD_DIGEST                     28
+#define DETOOLS_DIGEST_MISMATCH                29
+#define DETOOLS_BZ2_INIT                       30
+#define DETOOLS_BZ2_DECOMPRESS                 31
+#define DETOOLS_HEATSHRINK_HEADER              32
+#define DETOOLS_TO_SIZE_TOO_LARGE              33
+
+/* Patch types. */
+#define DETOOLS_PATCH_TYPE_NORMAL               0
+#define DETOOLS_PATCH_TYPE_IN_PLACE             1
+/* In-place patch that may mark segments as unchanged. */
+#define DETOOLS_PATCH_TYPE_IN_PLACE_UNCHANGED   2
+
+/* Compressions. */
+#define DETOOLS_COMPRESSION_NONE                0
+#define DETOOLS_COMPRESSION_LZMA                1
+#define DETOOLS_COMPRESSION_CRLE                2
+#define DETOOLS_COMPRESSION_HEATSHRINK          4
+#define DETOOLS_COMPRESSION_HEATSHRINK_SIZES    5
+
+/* Digest types. */
+#define DETOOLS_DIGEST_NONE                     0
+#define DETOOLS_DIGEST_CRC32                    1
+#define DETOOLS_DIGEST_SHA256                   2
+
+/* Maximum digest size in bytes. */
+#define DETOOLS_DIGEST_MAX_SIZE                32
+
+/* Checkpoint magic number, "dtc" followed by the checkpoint format
+   version. */
+#define DETOOLS_APPLY_PATCH_CHECKPOINT_MAGIC    0x64746301
 
 /**
  * Read callback.
@@ -113,12 +250,25 @@ typedef int (*detools_write_t)(void *arg_p, const uint8_t *buf_p, size_t size);
  * Seek from current position callback.
  *
  * @param[in] arg_p User data passed to detools_apply_patch_init().
- * @param[in] offset Offset to seek to from current position.
+ * @param[in] offset Offset to seek to from current position. Seeks
+ *                   not fitting in an int are split into multiple
+ *                   calls.
  *
  * @return zero(0) or negative error code.
  */
 typedef int (*detools_seek_t)(void *arg_p, int offset);
 
+/**
+ * Seek from current position callback with a 64-bit offset. See
+ * detools_apply_patch_set_from_seek64().
+ *
+ * @param[in] arg_p User data passed to detools_apply_patch_init().
+ * @param[in] offset Offset to seek to from current position.
+ *
+ * @return zero(0) or negative error code.
+ */
+typedef int (*detools_seek64_t)(void *arg_p, int64_t offset);
+
 /**
  * Memory read callback.
  *
@@ -160,6 +310,16 @@ typedef int (*detools_mem_write_t)(void *arg_p,
  */
 typedef int (*detools_mem_erase_t)(void *arg_p, uintptr_t addr, size_t size);
 
+/**
+ * Memory wait callback. Waits for the ongoing asynchronous memory
+ * write or erase to complete.
+ *
+ * @param[in] arg_p User data passed to detools_apply_patch_init().
+ *
+ * @return zero(0) or negative error code.
+ */
+typedef int (*detools_mem_wait_t)(void *arg_p);
+
 /**
  * Step set callback.
  *
@@ -192,8 +352,9 @@ struct detools_apply_patch_patch_reader_none_t {
 
 struct detools_apply_patch_patch_reader_lzma_t {
     lzma_stream stream;
-    uint8_t *input_p;
-    uint8_t *output_p;
+    lzma_allocator allocator;
+    uint8_t input[DETOOLS_CONFIG_LZMA_INPUT_BUFFER_SIZE];
+    uint8_t output[DETOOLS_CONFIG_WORK_BUFFER_SIZE];
     size_t output_size;
 };
 
@@ -203,8 +364,21 @@ struct detools_apply_patch_patch_reader_lzma_t {
 
 #include "heatshrink/heatshrink_decoder.h"
 
+/**
+ * The heatshrink window and lookahead sizes are 8 and 7 for
+ * compression heatshrink, and are read from the first byte of the
+ * compressed data for compression heatshrink sizes. With
+ * HEATSHRINK_DYNAMIC_ALLOC set to 1 the decoder is allocated for the
+ * sizes in the patch, otherwise only the sizes in heatshrink_config.h
+ * are accepted.
+ */
 struct detools_apply_patch_patch_reader_heatshrink_t {
+    bool has_header;
+    /* NULL until the header has been read. */
+    heatshrink_decoder *decoder_p;
+#if !HEATSHRINK_DYNAMIC_ALLOC
     heatshrink_decoder decoder;
+#endif
 };
 
 #endif
@@ -216,7 +390,7 @@ enum detools_unpack_usize_state_t {
 
 struct detools_unpack_usize_t {
     enum detools_unpack_usize_state_t state;
-    int value;
+    uint64_t value;
     int offset;
 };
 
@@ -248,7 +422,7 @@ struct detools_apply_patch_patch_reader_t {
     struct detools_apply_patch_chunk_t *patch_chunk_p;
     struct {
         int state;
-        int value;
+        int64_t value;
         int offset;
         bool is_signed;
     } size;
@@ -266,10 +440,18 @@ struct detools_apply_patch_patch_reader_t {
         struct detools_apply_patch_patch_reader_heatshrink_t heatshrink;
 #endif
     } compression;
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    struct {
+        uint8_t *buf_p;
+        size_t size;
+        size_t offset;
+    } lzma_arena;
+#endif
     int (*destroy)(struct detools_apply_patch_patch_reader_t *self_p);
     int (*decompress)(struct detools_apply_patch_patch_reader_t *self_p,
                       uint8_t *buf_p,
                       size_t *size_p);
+    int (*drain)(struct detools_apply_patch_patch_reader_t *self_p);
 };
 
 struct detools_apply_patch_chunk_t {
@@ -278,9 +460,87 @@ struct detools_apply_patch_chunk_t {
     size_t offset;
 };
 
+#if DETOOLS_DATA_FORMAT == 1
+
+enum detools_data_format_state_t {
+    detools_data_format_state_data_pointers_present_t = 0,
+    detools_data_format_state_data_offset_t,
+    detools_data_format_state_data_begin_t,
+    detools_data_format_state_data_end_t,
+    detools_data_format_state_code_pointers_present_t,
+    detools_data_format_state_code_begin_t,
+    detools_data_format_state_code_end_t,
+    detools_data_format_state_number_of_blocks_t,
+    detools_data_format_state_from_offset_t,
+    detools_data_format_state_to_address_t,
+    detools_data_format_state_number_of_values_t,
+    detools_data_format_state_values_t,
+    detools_data_format_state_done_t
+};
+
+struct detools_data_format_block_t {
+    uint32_t from_offset;
+    uint32_t to_address;
+    uint32_t number_of_values;
+};
+
+struct detools_data_format_cursor_t {
+    size_t block;
+    size_t index;
+    size_t value;
+};
+
+/**
+ * Values of one kind, for example all bl instructions or all data
+ * pointers.
+ */
+struct detools_data_format_kind_t {
+    int type;
+    uint64_t base;
+    size_t first_block;
+    size_t first_value;
+    size_t number_of_values;
+    size_t rank;
+    struct detools_data_format_cursor_t cursor;
+};
+
+struct detools_data_format_t {
+    int data_format;
+    enum detools_data_format_state_t state;
+    size_t size;
+    struct {
+        uint64_t value;
+        int offset;
+        bool is_signed;
+    } number;
+    bool data_pointers_present;
+    bool code_pointers_present;
+    uint64_t data_offset_begin;
+    uint64_t data_begin;
+    uint64_t data_end;
+    uint64_t code_begin;
+    uint64_t code_end;
+    const uint8_t *order_p;
+    int number_of_kinds;
+    int kind;
+    size_t blocks_left;
+    size_t number_of_blocks;
+    size_t number_of_values;
+    size_t value;
+    struct detools_data_format_kind_t kinds[10];
+    struct detools_data_format_block_t
+    blocks[DETOOLS_CONFIG_DATA_FORMAT_MAX_BLOCKS];
+    uint32_t from_addresses[DETOOLS_CONFIG_DATA_FORMAT_MAX_VALUES];
+    uint32_t values[DETOOLS_CONFIG_DATA_FORMAT_MAX_VALUES];
+};
+
+#endif
+
 enum detools_apply_patch_state_t {
     detools_apply_patch_state_init_t = 0,
     detools_apply_patch_state_dfpatch_size_t,
+    detools_apply_patch_state_data_format_t,
+    detools_apply_patch_state_dfpatch_t,
     detools_apply_patch_state_diff_size_t,
     detools_apply_patch_state_diff_data_t,
     detools_apply_patch_state_extra_size_t,
@@ -290,21 +550,81 @@ enum detools_apply_patch_state_t {
     detools_apply_patch_state_failed_t
 };
 
+#if DETOOLS_DIGEST == 1
+
+/**
+ * Digest of to-data, calculated as it is written.
+ */
+struct detools_digest_t {
+    int type;
+    union {
+#if DETOOLS_CONFIG_DIGEST_CRC32 == 1
+        uint32_t crc32;
+#endif
+#if DETOOLS_CONFIG_DIGEST_SHA256 == 1
+        struct {
+            uint32_t state[8];
+            uint64_t size;
+            uint8_t buf[64];
+        } sha256;
+#endif
+    } kind;
+};
+
+#endif
+
+/**
+ * An apply patch checkpoint. Persist it to resume an interrupted
+ * apply later.
+ */
+struct detools_apply_patch_checkpoint_t {
+    /* DETOOLS_APPLY_PATCH_CHECKPOINT_MAGIC, used to detect invalid
+       checkpoints and checkpoints of other versions. */
+    uint32_t magic;
+    /* CRC32 of the first patch_offset bytes of the patch, used to
+       detect checkpoints of other patches. */
+    uint32_t patch_crc32;
+    /* Number of patch bytes given to detools_apply_patch_process(). */
+    size_t patch_offset;
+    /* To-data size, used to detect checkpoints of other patches. */
+    size_t to_size;
+    /* Number of to-data bytes written. */
+    size_t to_offset;
+#if DETOOLS_DIGEST == 1
+    /* Digest of to-data written. */
+    struct detools_digest_t digest;
+#endif
+};
+
 /**
  * The apply patch data structure.
  */
 struct detools_apply_patch_t {
     detools_read_t from_read;
     detools_seek_t from_seek;
+    detools_seek64_t from_seek64;
+    const uint8_t *from_p;
     size_t patch_size;
     detools_write_t to_write;
     void *arg_p;
     enum detools_apply_patch_state_t state;
+    size_t from_size;
+    int64_t from_offset;
     size_t to_pos;
     size_t to_size;
     size_t chunk_size;
+    size_t patch_offset;
+    uint32_t patch_crc32;
+    struct detools_apply_patch_checkpoint_t checkpoint;
     struct detools_apply_patch_patch_reader_t patch_reader;
     struct detools_apply_patch_chunk_t chunk;
+#if DETOOLS_DATA_FORMAT == 1
+    struct detools_data_format_t data_format;
+#endif
+#if DETOOLS_DIGEST == 1
+    struct detools_digest_t digest;
+    const uint8_t *expected_digest_p;
+#endif
 };
 
 /**
@@ -320,20 +640,68 @@ struct detools_apply_patch_in_place_t {
     void *arg_p;
     enum detools_apply_patch_state_t state;
     int ongoing_step;
+    int skipped_erases;
+    bool unchanged_segments;
     size_t to_pos;
     size_t to_size;
     size_t segment_size;
     size_t shift_size;
+    size_t from_size;
     size_t chunk_size;
     struct {
         size_t index;
-        int from_offset;
+        int64_t from_offset;
         size_t to_offset;
         size_t to_size;
         size_t to_pos;
     } segment;
     struct detools_apply_patch_patch_reader_t patch_reader;
     struct detools_apply_patch_chunk_t chunk;
+#if DETOOLS_DATA_FORMAT == 1
+    struct detools_data_format_t data_format;
+#endif
+#if DETOOLS_DIGEST == 1
+    struct detools_digest_t digest;
+    const uint8_t *expected_digest_p;
+#endif
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+    struct {
+        detools_mem_wait_t wait;
+        bool ongoing;
+        int index;
+        uint8_t buffers[2][DETOOLS_CONFIG_WORK_BUFFER_SIZE];
+    } mem_async;
+#endif
+};
+
+/**
+ * Patch header information.
+ */
+struct detools_patch_info_t {
+    /* Patch type, DETOOLS_PATCH_TYPE_*. */
+    int type;
+    /* Compression, DETOOLS_COMPRESSION_*. */
+    int compression;
+    size_t to_size;
+    /* Only valid for in-place patches. */
+    size_t memory_size;
+    size_t segment_size;
+    size_t shift_size;
+    size_t from_size;
+};
+
+/**
+ * The validate patch data structure.
+ */
+struct detools_validate_patch_t {
+    size_t patch_size;
+    enum detools_apply_patch_state_t state;
+    struct detools_patch_info_t info;
+    size_t to_pos;
+    size_t segment_end;
+    size_t chunk_size;
+    struct detools_apply_patch_patch_reader_t patch_reader;
+    struct detools_apply_patch_chunk_t chunk;
 };
 
 /**
@@ -355,6 +723,150 @@ int detools_apply_patch_init(struct detools_apply_patch_t *self_p,
                              detools_write_t to_write,
                              void *arg_p);
 
+/**
+ * Initialize given apply patch object with from-data directly
+ * addressable in memory, for example in memory mapped flash. The
+ * from-data is read by pointer instead of by callbacks, and is not
+ * copied unless the patch has a data format.
+ *
+ * @param[out] self_p Apply patch object to initialize.
+ * @param[in] from_p From-data.
+ * @param[in] from_size From-data size in bytes.
+ * @param[in] patch_size Patch size in bytes.
+ * @param[in] to_write Destination callback.
+ * @param[in] arg_p Argument passed to the callbacks.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_init_from_memory(struct detools_apply_patch_t *self_p,
+                                         const uint8_t *from_p,
+                                         size_t from_size,
+                                         size_t patch_size,
+                                         detools_write_t to_write,
+                                         void *arg_p);
+
+/**
+ * Set the from-data size. Patches with a data format disassemble the
+ * from-data before applying the patch, and this requires the size to
+ * be known. Call after detools_apply_patch_init() and before
+ * detools_apply_patch_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] from_size From-data size in bytes.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_set_from_size(struct detools_apply_patch_t *self_p,
+                                      size_t from_size);
+
+/**
+ * Seek the from-data with given 64-bit seek callback instead of the
+ * seek callback given to detools_apply_patch_init(), which is called
+ * multiple times for seeks not fitting in an int. Call after
+ * detools_apply_patch_init() and before
+ * detools_apply_patch_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] from_seek64 Callback to seek from current position in
+ *                        from-data.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_set_from_seek64(struct detools_apply_patch_t *self_p,
+                                        detools_seek64_t from_seek64);
+
+/**
+ * Get a checkpoint of given apply patch object. Call after
+ * detools_apply_patch_process() and persist the checkpoint once all
+ * to-data written so far has been stored.
+ *
+ * @param[in] self_p Initialized apply patch object.
+ * @param[out] checkpoint_p Checkpoint.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_get_checkpoint(
+    const struct detools_apply_patch_t *self_p,
+    struct detools_apply_patch_checkpoint_t *checkpoint_p);
+
+/**
+ * Resume an interrupted apply from given checkpoint. The whole patch
+ * is processed again from the beginning, but to-data before the
+ * checkpoint is neither written nor calculated from from-data. Call
+ * after detools_apply_patch_init() and before
+ * detools_apply_patch_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] checkpoint_p Checkpoint from
+ *                         detools_apply_patch_get_checkpoint().
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_set_checkpoint(
+    struct detools_apply_patch_t *self_p,
+    const struct detools_apply_patch_checkpoint_t *checkpoint_p);
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+/**
+ * Decode LZMA compressed patches using given memory arena instead of
+ * the heap. The arena must be large enough for the dictionary of the
+ * patch, plus about 33 KiB of decoder state, or 35 KiB with a BCJ
+ * filter. Patches created with detools use an 8 MiB dictionary by
+ * default. See the C library README for a size table. Call after
+ * detools_apply_patch_init() and before detools_apply_patch_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] buf_p Arena, valid until detools_apply_patch_finalize()
+ *                  has returned.
+ * @param[in] size Arena size in bytes.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_set_lzma_arena(struct detools_apply_patch_t *self_p,
+                                       void *buf_p,
+                                       size_t size);
+
+#endif
+
+#if DETOOLS_DIGEST == 1
+
+/**
+ * Calculate a digest of the to-data as it is written, which saves
+ * reading it back after the patch has been applied. Call after
+ * detools_apply_patch_init() and before
+ * detools_apply_patch_set_checkpoint() and
+ * detools_apply_patch_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] digest Digest type, DETOOLS_DIGEST_CRC32 or
+ *                   DETOOLS_DIGEST_SHA256. CRC32 digests are four
+ *                   bytes in big endian byte order.
+ * @param[in] expected_p Expected digest, compared to the calculated
+ *                       digest in detools_apply_patch_finalize(), or
+ *                       NULL. Must be valid until then.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_set_digest(struct detools_apply_patch_t *self_p,
+                                   int digest,
+                                   const uint8_t *expected_p);
+
+/**
+ * Get the digest of the to-data written so far, typically after
+ * detools_apply_patch_finalize().
+ *
+ * @param[in] self_p Initialized apply patch object.
+ * @param[out] digest_p Buffer of at least DETOOLS_DIGEST_MAX_SIZE
+ *                      bytes to write the digest to.
+ *
+ * @return Digest size in bytes or negative error code.
+ */
+int detools_apply_patch_get_digest(const struct detools_apply_patch_t *self_p,
+                                   uint8_t *digest_p);
+
+#endif
+
 /**
  * Call this function repeatedly until all patch data has been
  * processed or an error occurres. Call detools_apply_patch_finalize()
@@ -378,10 +890,25 @@ int detools_apply_patch_process(struct detools_apply_patch_t *self_p,
  * @param[in,out] self_p Initialized apply patch object.
  *
  * @return Size of to-data in bytes if the patch was applied
- *         successfully, or negative error code.
+ *         successfully, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int. Use detools_apply_patch_finalize64() for such patches.
  */
 int detools_apply_patch_finalize(struct detools_apply_patch_t *self_p);
 
+/**
+ * Same as detools_apply_patch_finalize(), but the size of to-data is
+ * given as a 64-bit value.
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[out] to_size_p Size of to-data in bytes, if the patch was
+ *                       applied successfully.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_finalize64(struct detools_apply_patch_t *self_p,
+                                   int64_t *to_size_p);
+
 /**
  * Initialize given in-place apply patch object.
  *
@@ -423,6 +950,107 @@ int detools_apply_patch_in_place_process(
     const uint8_t *patch_p,
     size_t size);
 
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+/**
+ * Decode LZMA compressed patches using given memory arena instead of
+ * the heap. See detools_apply_patch_set_lzma_arena() for details.
+ * Call after detools_apply_patch_in_place_init() and before
+ * detools_apply_patch_in_place_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] buf_p Arena, valid until
+ *                  detools_apply_patch_in_place_finalize() has
+ *                  returned.
+ * @param[in] size Arena size in bytes.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_in_place_set_lzma_arena(
+    struct detools_apply_patch_in_place_t *self_p,
+    void *buf_p,
+    size_t size);
+
+#endif
+
+#if DETOOLS_DIGEST == 1
+
+/**
+ * Calculate a digest of the to-data as it is written, which saves
+ * reading it back after the patch has been applied. To-data of steps
+ * completed before a resume is read back from memory. Call after
+ * detools_apply_patch_in_place_init() and before
+ * detools_apply_patch_in_place_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] digest Digest type, DETOOLS_DIGEST_CRC32 or
+ *                   DETOOLS_DIGEST_SHA256. CRC32 digests are four
+ *                   bytes in big endian byte order.
+ * @param[in] expected_p Expected digest, compared to the calculated
+ *                       digest in
+ *                       detools_apply_patch_in_place_finalize(), or
+ *                       NULL. Must be valid until then.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_in_place_set_digest(
+    struct detools_apply_patch_in_place_t *self_p,
+    int digest,
+    const uint8_t *expected_p);
+
+/**
+ * Get the digest of the to-data written so far, typically after
+ * detools_apply_patch_in_place_finalize().
+ *
+ * @param[in] self_p Initialized apply patch object.
+ * @param[out] digest_p Buffer of at least DETOOLS_DIGEST_MAX_SIZE
+ *                      bytes to write the digest to.
+ *
+ * @return Digest size in bytes or negative error code.
+ */
+int detools_apply_patch_in_place_get_digest(
+    const struct detools_apply_patch_in_place_t *self_p,
+    uint8_t *digest_p);
+
+#endif
+
+#if DETOOLS_CONFIG_MEM_ASYNC == 1
+
+/**
+ * Make memory writes and erases asynchronous, so that decompression
+ * of the next chunk of to-data overlaps the ongoing flash
+ * operation. The write and erase callbacks then only start the
+ * operation, and given wait callback is called before the next
+ * memory read, write or erase, and before the step is set. At most
+ * one operation is ongoing at a time. The buffer given to the write
+ * callback is valid until the wait callback has returned. Call after
+ * detools_apply_patch_in_place_init() and before
+ * detools_apply_patch_in_place_process().
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[in] mem_wait Memory wait callback.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_in_place_set_mem_wait(
+    struct detools_apply_patch_in_place_t *self_p,
+    detools_mem_wait_t mem_wait);
+
+#endif
+
+/**
+ * Get the number of segment erases skipped so far, as the segments
+ * already contained the data to write. Both shifted from-data
+ * segments and to-data segments marked as unchanged in the patch are
+ * counted.
+ *
+ * @param[in] self_p Initialized apply patch object.
+ *
+ * @return Number of skipped erases.
+ */
+int detools_apply_patch_in_place_get_skipped_erases(
+    const struct detools_apply_patch_in_place_t *self_p);
+
 /**
  * Call once after all data has been processed to finalize the
  * patching. The value returned from this function should be ignored
@@ -431,11 +1059,103 @@ int detools_apply_patch_in_place_process(
  * @param[in,out] self_p Initialized apply patch object.
  *
  * @return Size of to-data in bytes if the patch was applied
- *         successfully, or negative error code.
+ *         successfully, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int. Use detools_apply_patch_in_place_finalize64() for such
+ *         patches.
  */
 int detools_apply_patch_in_place_finalize(
     struct detools_apply_patch_in_place_t *self_p);
 
+/**
+ * Same as detools_apply_patch_in_place_finalize(), but the size of
+ * to-data is given as a 64-bit value.
+ *
+ * @param[in,out] self_p Initialized apply patch object.
+ * @param[out] to_size_p Size of to-data in bytes, if the patch was
+ *                       applied successfully.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_in_place_finalize64(
+    struct detools_apply_patch_in_place_t *self_p,
+    int64_t *to_size_p);
+
+/**
+ * Get the header information of given patch, without applying it.
+ *
+ * @param[in] patch_p Beginning of the patch. Headers are at most 46
+ *                    bytes.
+ * @param[in] size Size of given patch data in bytes.
+ * @param[out] info_p Patch header information.
+ *
+ * @return Header size in bytes, or negative error code.
+ */
+int detools_patch_info(const uint8_t *patch_p,
+                       size_t size,
+                       struct detools_patch_info_t *info_p);
+
+/**
+ * Initialize given validate patch object. The patch structure is
+ * checked without any from-data, so a corrupt patch can be rejected
+ * before memory is erased.
+ *
+ * @param[out] self_p Validate patch object to initialize.
+ * @param[in] patch_size Patch size in bytes.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_validate_patch_init(struct detools_validate_patch_t *self_p,
+                                size_t patch_size);
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+/**
+ * Same as detools_apply_patch_set_lzma_arena(), but for a validate
+ * patch object.
+ *
+ * @param[in,out] self_p Initialized validate patch object.
+ * @param[in] buf_p Arena, valid until detools_validate_patch_finalize()
+ *                  has returned.
+ * @param[in] size Arena size in bytes.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_validate_patch_set_lzma_arena(
+    struct detools_validate_patch_t *self_p,
+    void *buf_p,
+    size_t size);
+
+#endif
+
+/**
+ * Call this function repeatedly until all patch data has been
+ * processed or an error occurres. Call
+ * detools_validate_patch_finalize() to finalize the validation, even
+ * if an error occurred.
+ *
+ * @param[in,out] self_p Initialized validate patch object.
+ * @param[in] patch_p Next chunk of the patch.
+ * @param[in] size Patch buffer size.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_validate_patch_process(struct detools_validate_patch_t *self_p,
+                                   const uint8_t *patch_p,
+                                   size_t size);
+
+/**
+ * Call once after all data has been processed to finalize the
+ * validation.
+ *
+ * @param[in,out] self_p Initialized validate patch object.
+ *
+ * @return Size of to-data in bytes if the patch is valid, or
+ *         negative error code. Returns -DETOOLS_TO_SIZE_TOO_LARGE if
+ *         the size does not fit in an int.
+ */
+int detools_validate_patch_finalize(struct detools_validate_patch_t *self_p);
+
 /**
  * Apply given patch using read, write and seek callbacks.
  *
@@ -446,7 +1166,9 @@ int detools_apply_patch_in_place_finalize(
  * @param[in] to_write Destination write callback.
  * @param[in] arg_p Argument passed to all callbacks.
  *
- * @return Size of to-data in bytes or negative error code.
+ * @return Size of to-data in bytes, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int.
  */
 int detools_apply_patch_callbacks(detools_read_t from_read,
                                   detools_seek_t from_seek,
@@ -467,7 +1189,9 @@ int detools_apply_patch_callbacks(detools_read_t from_read,
  * @param[in] patch_size Patch size in bytes.
  * @param[in] arg_p Argument passed to the callbacks.
  *
- * @return Size of to-data in bytes or negative error code.
+ * @return Size of to-data in bytes, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int.
  */
 int detools_apply_patch_in_place_callbacks(detools_mem_read_t mem_read,
                                            detools_mem_write_t mem_write,
@@ -478,6 +1202,35 @@ int detools_apply_patch_in_place_callbacks(detools_mem_read_t mem_read,
                                            size_t patch_size,
                                            void *arg_p);
 
+#if DETOOLS_CONFIG_BSDIFF == 1
+
+/**
+ * Apply given bsdiff patch using read, write and seek callbacks. The
+ * control, diff and extra data are read from different parts of the
+ * patch, so the patch is read at given offsets instead of
+ * sequentially.
+ *
+ * @param[in] from_read Source read callback.
+ * @param[in] from_seek Source seek callback.
+ * @param[in] patch_read Patch read callback, with the patch offset as
+ *                       address.
+ * @param[in] patch_size Patch size in bytes.
+ * @param[in] to_write Destination write callback.
+ * @param[in] arg_p Argument passed to all callbacks.
+ *
+ * @return Size of to-data in bytes, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int.
+ */
+int detools_apply_patch_bsdiff_callbacks(detools_read_t from_read,
+                                         detools_seek_t from_seek,
+                                         detools_mem_read_t patch_read,
+                                         size_t patch_size,
+                                         detools_write_t to_write,
+                                         void *arg_p);
+
+#endif
+
 #if DETOOLS_CONFIG_FILE_IO == 1
 
 /**
@@ -488,12 +1241,32 @@ int detools_apply_patch_in_place_callbacks(detools_mem_read_t mem_read,
  * @param[in] patch_p Patch file name.
  * @param[in] to_p Destination file name.
  *
- * @return Size of to-data in bytes or negative error code.
+ * @return Size of to-data in bytes, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int.
  */
 int detools_apply_patch_filenames(const char *from_p,
                                   const char *patch_p,
                                   const char *to_p);
 
+/**
+ * Same as detools_apply_patch_filenames(), but the size of to-data
+ * is given as a 64-bit value, and the from file is seeked with 64-bit
+ * offsets.
+ *
+ * @param[in] from_p Source file name.
+ * @param[in] patch_p Patch file name.
+ * @param[in] to_p Destination file name.
+ * @param[out] to_size_p Size of to-data in bytes, if the patch was
+ *                       applied successfully.
+ *
+ * @return zero(0) or negative error code.
+ */
+int detools_apply_patch_filenames64(const char *from_p,
+                                    const char *patch_p,
+                                    const char *to_p,
+                                    int64_t *to_size_p);
+
 /**
  * Apply given patch file to given memory file.
  *
@@ -502,13 +1275,35 @@ int detools_apply_patch_filenames(const char *from_p,
  * @param[in] step_set Callback to set the step.
  * @param[in] step_get Callback to get the step.
  *
- * @return Size of to-data in bytes or negative error code.
+ * @return Size of to-data in bytes, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int.
  */
 int detools_apply_patch_in_place_filenames(const char *memory_p,
                                            const char *patch_p,
                                            detools_step_set_t step_set,
                                            detools_step_get_t step_get);
 
+#if DETOOLS_CONFIG_BSDIFF == 1
+
+/**
+ * Apply given bsdiff patch file to given from file and write the
+ * output to given to file.
+ *
+ * @param[in] from_p Source file name.
+ * @param[in] patch_p Patch file name.
+ * @param[in] to_p Destination file name.
+ *
+ * @return Size of to-data in bytes, or negative error code. Returns
+ *         -DETOOLS_TO_SIZE_TOO_LARGE if the size does not fit in an
+ *         int.
+ */
+int detools_apply_patch_bsdiff_filenames(const char *from_p,
+                                         const char *patch_p,
+                                         const char *to_p);
+
+#endif
+
 #endif
 
 /**
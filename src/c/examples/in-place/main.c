@@ -64,14 +64,9 @@ static int serial_read(uint8_t *buf_p, size_t size)
     return (0);
 }
 
-static int verify_written_data(int to_size, uint32_t to_crc)
+static int update(size_t patch_size, const uint8_t *to_sha256_p)
 {
-    return (0);
-}
-
-static int update(size_t patch_size, uint32_t to_crc)
-{
-    struct detools_apply_patch_in_place_t apply_patch;
+    static struct detools_apply_patch_in_place_t apply_patch;
     uint8_t buf[256];
     size_t left;
     int res;
@@ -90,6 +85,15 @@ static int update(size_t patch_size, uint32_t to_crc)
         return (res);
     }
 
+    /* Verify the to-data as it is written. */
+    res = detools_apply_patch_in_place_set_digest(&apply_patch,
+                                                  DETOOLS_DIGEST_SHA256,
+                                                  to_sha256_p);
+
+    if (res != 0) {
+        return (res);
+    }
+
     left = patch_size;
 
     /* Incrementally process patch data until the whole patch has been
@@ -105,13 +109,10 @@ static int update(size_t patch_size, uint32_t to_crc)
         }
     }
 
-    /* Finalize patching and verify written data. */
+    /* Finalize patching, which also compares the digest of written
+       data to the expected digest. */
     if (res == 0) {
         res = detools_apply_patch_in_place_finalize(&apply_patch);
-
-        if (res >= 0) {
-            res = verify_written_data(res, to_crc);
-        }
     } else {
         (void)detools_apply_patch_in_place_finalize(&apply_patch);
     }
@@ -121,5 +122,5 @@ static int update(size_t patch_size, uint32_t to_crc)
 
 int main(int argc, const char *argv[])
 {
-    return (update(atoi(argv[1]), atoi(argv[2])));
+    return (update(atoi(argv[1]), (const uint8_t *)argv[2]));
 }
@@ -30,12 +30,41 @@
  * OF THE POSSIBILITY OF SUCH DAMAGE.
  */
 
+#define _POSIX_C_SOURCE 200809L
+
+#include <limits.h>
 #include <stdlib.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/types.h>
+#include <sys/wait.h>
 #include "detools.h"
 
+/* Longest manifest line, including the newline. */
+#define BATCH_LINE_MAX                                  4096
+
+/* Patch chunk size when applying patches in batch mode. */
+#define BATCH_CHUNK_SIZE                                4096
+
+/* LZMA arena size added to the dictionary size. */
+#define BATCH_LZMA_ARENA_MARGIN                         (1024 * 1024)
+
+struct batch_job_t {
+    FILE *ffrom_p;
+    FILE *fpatch_p;
+    FILE *fto_p;
+    size_t patch_size;
+    int64_t to_size;
+    size_t peak_buffer_size;
+    double seconds;
+    uint8_t chunk[BATCH_CHUNK_SIZE];
+};
+
 static void print_usage_and_exit(const char *name_p)
 {
-    printf("Usage: %s {apply_patch, apply_patch_in_place}\n", name_p);
+    printf("Usage: %s {apply_patch, apply_patch_in_place, "
+           "apply_patch_bsdiff, batch}\n",
+           name_p);
     exit(1);
 }
 
@@ -53,9 +82,647 @@ static void print_apply_patch_in_place_usage_and_exit(const char *name_p)
     exit(1);
 }
 
+static void print_apply_patch_bsdiff_usage_and_exit(const char *name_p)
+{
+    printf("Usage: %s apply_patch_bsdiff <from-file> <patch-file> <to-file>\n",
+           name_p);
+    exit(1);
+}
+
+static void print_batch_usage_and_exit(const char *name_p)
+{
+    printf("Usage: %s batch <manifest-file> [<jobs>]\n", name_p);
+    exit(1);
+}
+
+static double batch_now(void)
+{
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+
+    return ((double)now.tv_sec + (double)now.tv_nsec / 1e9);
+}
+
+static int file_size(FILE *file_p, size_t *size_p)
+{
+    long size;
+
+    if (fseek(file_p, 0, SEEK_END) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    size = ftell(file_p);
+
+    if (size < 0) {
+        return (-DETOOLS_FILE_TELL_FAILED);
+    }
+
+    *size_p = (size_t)size;
+
+    if (fseek(file_p, 0, SEEK_SET) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    return (0);
+}
+
+static int batch_from_read(void *arg_p, uint8_t *buf_p, size_t size)
+{
+    struct batch_job_t *self_p;
+
+    self_p = (struct batch_job_t *)arg_p;
+
+    if (size > 0) {
+        if (fread(buf_p, size, 1, self_p->ffrom_p) != 1) {
+            return (-DETOOLS_FILE_READ_FAILED);
+        }
+    }
+
+    return (0);
+}
+
+static int batch_from_seek(void *arg_p, int offset)
+{
+    struct batch_job_t *self_p;
+
+    self_p = (struct batch_job_t *)arg_p;
+
+    if (fseek(self_p->ffrom_p, offset, SEEK_CUR) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    return (0);
+}
+
+static int batch_from_seek64(void *arg_p, int64_t offset)
+{
+    struct batch_job_t *self_p;
+
+    self_p = (struct batch_job_t *)arg_p;
+
+    if ((offset > LONG_MAX) || (offset < LONG_MIN)) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    if (fseek(self_p->ffrom_p, (long)offset, SEEK_CUR) != 0) {
+        return (-DETOOLS_FILE_SEEK_FAILED);
+    }
+
+    return (0);
+}
+
+static int batch_to_write(void *arg_p, const uint8_t *buf_p, size_t size)
+{
+    struct batch_job_t *self_p;
+
+    self_p = (struct batch_job_t *)arg_p;
+
+    if (size > 0) {
+        if (fwrite(buf_p, size, 1, self_p->fto_p) != 1) {
+            return (-DETOOLS_FILE_WRITE_FAILED);
+        }
+    }
+
+    return (0);
+}
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+
+/**
+ * Skip a variable length integer in .xz headers. Returns the offset
+ * after it, or zero if it does not fit in given buffer.
+ */
+static size_t xz_skip_varint(const uint8_t *buf_p, size_t size, size_t offset)
+{
+    while (offset < size) {
+        if ((buf_p[offset++] & 0x80) == 0) {
+            return (offset);
+        }
+    }
+
+    return (0);
+}
+
+/**
+ * Returns the LZMA2 dictionary size in the first block header of
+ * given .xz stream, or zero if not found.
+ */
+static uint32_t xz_dict_size(const uint8_t *buf_p, size_t size)
+{
+    size_t offset;
+    size_t header_end;
+    int number_of_filters;
+    uint8_t flags;
+    uint8_t filter_id;
+    uint8_t bits;
+
+    /* The block header follows the 12 bytes stream header. */
+    if (size < 14) {
+        return (0);
+    }
+
+    header_end = (12 + ((size_t)buf_p[12] + 1) * 4);
+
+    if (header_end > size) {
+        return (0);
+    }
+
+    flags = buf_p[13];
+    number_of_filters = ((flags & 0x3) + 1);
+    offset = 14;
+
+    /* Optional compressed and uncompressed sizes. */
+    if (flags & 0x40) {
+        offset = xz_skip_varint(buf_p, header_end, offset);
+    }
+
+    if ((offset != 0) && (flags & 0x80)) {
+        offset = xz_skip_varint(buf_p, header_end, offset);
+    }
+
+    while ((offset != 0) && (number_of_filters > 0)) {
+        if (offset + 3 > header_end) {
+            return (0);
+        }
+
+        filter_id = buf_p[offset];
+
+        /* LZMA2 has a one byte property with the dictionary size. */
+        if (filter_id == 0x21) {
+            bits = (buf_p[offset + 2] & 0x3f);
+
+            if (bits > 39) {
+                return (0);
+            }
+
+            return ((uint32_t)(2 | (bits & 1)) << (bits / 2 + 11));
+        }
+
+        offset = xz_skip_varint(buf_p, header_end, offset);
+
+        if ((offset == 0) || (offset >= header_end)) {
+            return (0);
+        }
+
+        offset += (1 + (size_t)buf_p[offset]);
+        number_of_filters--;
+    }
+
+    return (0);
+}
+
+/**
+ * Returns the LZMA arena size needed to decompress given patch, or
+ * zero if the patch is not LZMA compressed. The dictionary size is
+ * found in the .lzma or .xz header following the patch header.
+ */
+static size_t batch_lzma_arena_size(const uint8_t *patch_p, size_t size)
+{
+    struct detools_patch_info_t info;
+    int header_size;
+    uint32_t dict_size;
+
+    header_size = detools_patch_info(patch_p, size, &info);
+
+    if (header_size < 0) {
+        return (0);
+    }
+
+    if (info.compression != DETOOLS_COMPRESSION_LZMA) {
+        return (0);
+    }
+
+    if ((size_t)header_size + 5 > size) {
+        return (0);
+    }
+
+    patch_p += header_size;
+    size -= (size_t)header_size;
+
+    if (patch_p[0] == 0xfd) {
+        dict_size = xz_dict_size(patch_p, size);
+
+        if (dict_size == 0) {
+            return (0);
+        }
+    } else {
+        dict_size = (((uint32_t)patch_p[1] << 0)
+                     | ((uint32_t)patch_p[2] << 8)
+                     | ((uint32_t)patch_p[3] << 16)
+                     | ((uint32_t)patch_p[4] << 24));
+    }
+
+    return (dict_size + BATCH_LZMA_ARENA_MARGIN);
+}
+
+#endif
+
+/**
+ * Apply given patch. The peak buffer size is the size of the apply
+ * patch object, the patch chunk buffer and the used part of the LZMA
+ * arena, if any.
+ */
+static int batch_apply_patch(struct batch_job_t *self_p)
+{
+    int res;
+    size_t from_size;
+    size_t offset;
+    size_t size;
+    double start;
+    struct detools_apply_patch_t *apply_patch_p;
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    uint8_t *arena_p;
+    size_t arena_size;
+#endif
+
+    self_p->peak_buffer_size = 0;
+    self_p->seconds = 0.0;
+    res = file_size(self_p->ffrom_p, &from_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    res = file_size(self_p->fpatch_p, &self_p->patch_size);
+
+    if (res != 0) {
+        return (res);
+    }
+
+    apply_patch_p = malloc(sizeof(*apply_patch_p));
+
+    if (apply_patch_p == NULL) {
+        return (-DETOOLS_OUT_OF_MEMORY);
+    }
+
+    start = batch_now();
+    size = self_p->patch_size;
+
+    if (size > sizeof(self_p->chunk)) {
+        size = sizeof(self_p->chunk);
+    }
+
+    if (size > 0) {
+        if (fread(&self_p->chunk[0], size, 1, self_p->fpatch_p) != 1) {
+            res = -DETOOLS_FILE_READ_FAILED;
+            goto err1;
+        }
+    }
+
+    res = detools_apply_patch_init(apply_patch_p,
+                                   batch_from_read,
+                                   batch_from_seek,
+                                   self_p->patch_size,
+                                   batch_to_write,
+                                   self_p);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+    res = detools_apply_patch_set_from_size(apply_patch_p, from_size);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+    res = detools_apply_patch_set_from_seek64(apply_patch_p, batch_from_seek64);
+
+    if (res != 0) {
+        goto err1;
+    }
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    arena_p = NULL;
+    arena_size = batch_lzma_arena_size(&self_p->chunk[0], size);
+
+    if (arena_size > 0) {
+        arena_p = malloc(arena_size);
+
+        if (arena_p == NULL) {
+            res = -DETOOLS_OUT_OF_MEMORY;
+            goto err1;
+        }
+
+        res = detools_apply_patch_set_lzma_arena(apply_patch_p,
+                                                 arena_p,
+                                                 arena_size);
+
+        if (res != 0) {
+            goto err2;
+        }
+    }
+#endif
+
+    offset = 0;
+
+    while (1) {
+        res = detools_apply_patch_process(apply_patch_p,
+                                          &self_p->chunk[0],
+                                          size);
+
+        if (res != 0) {
+            break;
+        }
+
+        offset += size;
+        size = (self_p->patch_size - offset);
+
+        if (size == 0) {
+            break;
+        }
+
+        if (size > sizeof(self_p->chunk)) {
+            size = sizeof(self_p->chunk);
+        }
+
+        if (fread(&self_p->chunk[0], size, 1, self_p->fpatch_p) != 1) {
+            res = -DETOOLS_FILE_READ_FAILED;
+            break;
+        }
+    }
+
+    self_p->peak_buffer_size = (sizeof(*apply_patch_p)
+                                + sizeof(self_p->chunk));
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+    if (arena_p != NULL) {
+        self_p->peak_buffer_size +=
+            apply_patch_p->patch_reader.lzma_arena.offset;
+    }
+#endif
+
+    if (res == 0) {
+        res = detools_apply_patch_finalize64(apply_patch_p,
+                                             &self_p->to_size);
+    } else {
+        (void)detools_apply_patch_finalize64(apply_patch_p,
+                                             &self_p->to_size);
+    }
+
+    if (fflush(self_p->fto_p) != 0) {
+        res = -DETOOLS_FILE_WRITE_FAILED;
+    }
+
+    self_p->seconds = (batch_now() - start);
+
+#if DETOOLS_CONFIG_COMPRESSION_LZMA == 1
+ err2:
+    free(arena_p);
+#endif
+
+ err1:
+    free(apply_patch_p);
+
+    return (res);
+}
+
+static int batch_open(struct batch_job_t *self_p,
+                      const char *from_p,
+                      const char *patch_p,
+                      const char *to_p)
+{
+    self_p->ffrom_p = fopen(from_p, "rb");
+
+    if (self_p->ffrom_p == NULL) {
+        goto err1;
+    }
+
+    self_p->fpatch_p = fopen(patch_p, "rb");
+
+    if (self_p->fpatch_p == NULL) {
+        goto err2;
+    }
+
+    self_p->fto_p = fopen(to_p, "wb");
+
+    if (self_p->fto_p == NULL) {
+        goto err3;
+    }
+
+    return (0);
+
+ err3:
+    fclose(self_p->fpatch_p);
+
+ err2:
+    fclose(self_p->ffrom_p);
+
+ err1:
+
+    return (-DETOOLS_FILE_OPEN_FAILED);
+}
+
+static int batch_close(struct batch_job_t *self_p)
+{
+    int res;
+    int res2;
+    int res3;
+
+    res = fclose(self_p->ffrom_p);
+    res2 = fclose(self_p->fpatch_p);
+    res3 = fclose(self_p->fto_p);
+
+    if ((res != 0) || (res2 != 0) || (res3 != 0)) {
+        return (-DETOOLS_FILE_CLOSE_FAILED);
+    }
+
+    return (0);
+}
+
+/**
+ * Apply one patch in the manifest and print its result row. Returns
+ * zero(0) on success, otherwise one(1).
+ */
+static int batch_entry(struct batch_job_t *job_p,
+                       int index,
+                       const char *from_p,
+                       const char *patch_p,
+                       const char *to_p)
+{
+    int res;
+    int res2;
+    size_t to_size;
+    double mb_per_second;
+
+    job_p->patch_size = 0;
+    job_p->to_size = 0;
+    job_p->peak_buffer_size = 0;
+    job_p->seconds = 0.0;
+    res = batch_open(job_p, from_p, patch_p, to_p);
+
+    if (res == 0) {
+        res = batch_apply_patch(job_p);
+        res2 = batch_close(job_p);
+
+        if ((res == 0) && (res2 != 0)) {
+            res = res2;
+        }
+    }
+
+    to_size = 0;
+    mb_per_second = 0.0;
+
+    if (res == 0) {
+        to_size = (size_t)job_p->to_size;
+
+        if (job_p->seconds > 0.0) {
+            mb_per_second = ((double)to_size / job_p->seconds / 1e6);
+        }
+    } else {
+        res *= -1;
+        fprintf(stderr,
+                "error: %s: %s (error code %d)\n",
+                patch_p,
+                detools_error_as_string(res),
+                res);
+    }
+
+    printf("%d\t%d\t%zu\t%zu\t%.6f\t%.3f\t%zu\t%s\t%s\t%s\n",
+           index,
+           res,
+           to_size,
+           job_p->patch_size,
+           job_p->seconds,
+           mb_per_second,
+           job_p->peak_buffer_size,
+           from_p,
+           patch_p,
+           to_p);
+    fflush(stdout);
+
+    return (res != 0);
+}
+
+/**
+ * Apply every jobs'th patch in given manifest, starting at entry
+ * worker. Returns zero(0) if all patches were applied, otherwise
+ * one(1).
+ */
+static int batch_worker(const char *manifest_p, int jobs, int worker)
+{
+    FILE *fmanifest_p;
+    char line[BATCH_LINE_MAX];
+    char *from_p;
+    char *patch_p;
+    char *to_p;
+    int line_number;
+    int index;
+    int res;
+    struct batch_job_t *job_p;
+
+    fmanifest_p = fopen(manifest_p, "r");
+
+    if (fmanifest_p == NULL) {
+        return (1);
+    }
+
+    job_p = malloc(sizeof(*job_p));
+
+    if (job_p == NULL) {
+        fclose(fmanifest_p);
+
+        return (1);
+    }
+
+    line_number = 0;
+    index = 0;
+    res = 0;
+
+    while (fgets(&line[0], sizeof(line), fmanifest_p) != NULL) {
+        line_number++;
+        from_p = strtok(&line[0], " \t\r\n");
+
+        if ((from_p == NULL) || (from_p[0] == '#')) {
+            continue;
+        }
+
+        patch_p = strtok(NULL, " \t\r\n");
+        to_p = strtok(NULL, " \t\r\n");
+
+        if ((index % jobs) == worker) {
+            if ((to_p == NULL) || (strtok(NULL, " \t\r\n") != NULL)) {
+                fprintf(stderr,
+                        "error: %s:%d: expected <from-file> <patch-file> "
+                        "<to-file>\n",
+                        manifest_p,
+                        line_number);
+                res = 1;
+            } else {
+                res |= batch_entry(job_p, index, from_p, patch_p, to_p);
+            }
+        }
+
+        index++;
+    }
+
+    free(job_p);
+    fclose(fmanifest_p);
+
+    return (res);
+}
+
+/**
+ * Apply all patches in given manifest, one (from, patch, to) triple
+ * per line, and print one tab separated row per patch. Patches are
+ * applied by given number of worker processes, so rows may be printed
+ * in any order.
+ */
+static int batch(const char *manifest_p, int jobs)
+{
+    FILE *fmanifest_p;
+    pid_t pid;
+    int worker;
+    int status;
+    int res;
+
+    fmanifest_p = fopen(manifest_p, "r");
+
+    if (fmanifest_p == NULL) {
+        return (-DETOOLS_FILE_OPEN_FAILED);
+    }
+
+    fclose(fmanifest_p);
+    printf("index\terror\tto_size\tpatch_size\tseconds\tmb_per_second\t"
+           "peak_buffer_size\tfrom\tpatch\tto\n");
+    fflush(stdout);
+
+    if (jobs == 1) {
+        return (batch_worker(manifest_p, 1, 0));
+    }
+
+    res = 0;
+
+    for (worker = 0; worker < jobs; worker++) {
+        pid = fork();
+
+        if (pid == 0) {
+            exit(batch_worker(manifest_p, jobs, worker));
+        } else if (pid < 0) {
+            res = 1;
+            jobs = worker;
+            break;
+        }
+    }
+
+    for (worker = 0; worker < jobs; worker++) {
+        if (wait(&status) < 0) {
+            return (1);
+        }
+
+        if (!WIFEXITED(status) || (WEXITSTATUS(status) != 0)) {
+            res = 1;
+        }
+    }
+
+    return (res);
+}
+
 int main(int argc, const char *argv[])
 {
     int res;
+    int jobs;
+    int64_t to_size;
 
     if (argc < 2) {
         print_usage_and_exit(argv[0]);
@@ -66,7 +733,10 @@ int main(int argc, const char *argv[])
             print_apply_patch_usage_and_exit(argv[0]);
         }
 
-        res = detools_apply_patch_filenames(argv[2], argv[3], argv[4]);
+        res = detools_apply_patch_filenames64(argv[2],
+                                              argv[3],
+                                              argv[4],
+                                              &to_size);
     } else if (strcmp("apply_patch_in_place", argv[1]) == 0) {
         if (argc != 4) {
             print_apply_patch_in_place_usage_and_exit(argv[0]);
@@ -76,6 +746,33 @@ int main(int argc, const char *argv[])
                                                      argv[3],
                                                      NULL,
                                                      NULL);
+    } else if (strcmp("apply_patch_bsdiff", argv[1]) == 0) {
+        if (argc != 5) {
+            print_apply_patch_bsdiff_usage_and_exit(argv[0]);
+        }
+
+        res = detools_apply_patch_bsdiff_filenames(argv[2], argv[3], argv[4]);
+    } else if (strcmp("batch", argv[1]) == 0) {
+        if ((argc != 3) && (argc != 4)) {
+            print_batch_usage_and_exit(argv[0]);
+        }
+
+        jobs = 1;
+
+        if (argc == 4) {
+            jobs = atoi(argv[3]);
+
+            if (jobs < 1) {
+                print_batch_usage_and_exit(argv[0]);
+            }
+        }
+
+        res = batch(argv[2], jobs);
+
+        /* Failed patches are reported in their rows. */
+        if (res > 0) {
+            return (res);
+        }
     } else {
         print_usage_and_exit(argv[0]);
     }
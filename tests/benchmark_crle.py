@@ -0,0 +1,113 @@
+"""CRLE compression and decompression throughput, for both the C
+extension and the Python fallback.
+
+"""
+
+import os
+import time
+
+from detools.compression import crle
+
+
+SIZE = 4 * 1024 * 1024
+CHUNK_SIZE = 4096
+
+
+def sparse_data():
+    data = bytearray(SIZE)
+
+    for offset in range(0, SIZE, 97):
+        data[offset:offset + 3] = os.urandom(3)
+
+    return bytes(data)
+
+
+def compress(compress_segments, data):
+    scattered = bytearray()
+    run_byte = 0
+    run_length = 0
+    compressed = []
+
+    for offset in range(0, len(data), CHUNK_SIZE):
+        chunk, run_byte, run_length = compress_segments(
+            data[offset:offset + CHUNK_SIZE],
+            scattered,
+            run_byte,
+            run_length,
+            False)
+        compressed.append(chunk)
+
+    chunk, _, _ = compress_segments(b'',
+                                    scattered,
+                                    run_byte,
+                                    run_length,
+                                    True)
+    compressed.append(chunk)
+
+    return b''.join(compressed)
+
+
+def decompress(decompress_segments, compressed):
+    indata = bytearray()
+    scattered_left = 0
+    decompressed = []
+
+    for offset in range(0, len(compressed), CHUNK_SIZE):
+        indata += compressed[offset:offset + CHUNK_SIZE]
+        outdata, consumed, scattered_left = decompress_segments(
+            indata,
+            scattered_left)
+        del indata[:consumed]
+        decompressed.append(outdata)
+
+    return b''.join(decompressed)
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+
+    return result, SIZE / (time.perf_counter() - start) / 1000000
+
+
+def main():
+    implementations = [('python', crle.compress_segments, crle.decompress_segments)]
+
+    try:
+        from detools.compression import ccrle
+
+        implementations.insert(0,
+                               ('c',
+                                ccrle.compress_segments,
+                                ccrle.decompress_segments))
+    except ImportError:
+        print('C extension not available.')
+
+    datas = [
+        ('zeros', bytes(SIZE)),
+        ('sparse', sparse_data()),
+        ('random', os.urandom(SIZE))
+    ]
+
+    print('Implementation  Data    Compress (MB/s)  Decompress (MB/s)')
+
+    for name, compress_segments, decompress_segments in implementations:
+        for data_name, data in datas:
+            compressed, compress_speed = measure(compress,
+                                                 compress_segments,
+                                                 data)
+            decompressed, decompress_speed = measure(decompress,
+                                                     decompress_segments,
+                                                     compressed)
+
+            if decompressed != data:
+                raise Exception('Decompressed data differs.')
+
+            print('{:14}  {:6}  {:15.1f}  {:17.1f}'.format(name,
+                                                       data_name,
+                                                       compress_speed,
+                                                       decompress_speed))
+
+
+if __name__ == '__main__':
+    main()
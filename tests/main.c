@@ -4,6 +4,7 @@
 #include <sys/stat.h>
 #include <unistd.h>
 #include <sys/types.h>
+#include <time.h>
 #include "../src/c/detools.h"
 
 int truncate(const char *path, off_t length);
@@ -235,6 +236,191 @@ static void assert_apply_patch(const char *from_p,
     } while (actual_byte != EOF);
 }
 
+static void assert_apply_patch_from_memory(const char *from_p,
+                                           const char *patch_p,
+                                           const char *to_p)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    uint8_t *from_buf_p;
+    size_t from_size;
+    uint8_t *patch_buf_p;
+    size_t patch_size;
+
+    io_init(&io, from_p, to_p);
+    from_buf_p = read_init(from_p, &from_size);
+    patch_buf_p = read_init(patch_p, &patch_size);
+
+    assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                from_buf_p,
+                                                from_size,
+                                                patch_size,
+                                                io_write,
+                                                &io) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_buf_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == (int)io.to.size);
+    io_assert_to_ok(&io);
+
+    free(from_buf_p);
+    free(patch_buf_p);
+}
+
+static const uint8_t foo_new_crc32[] = {
+    0x8c, 0x5b, 0x6a, 0x4a
+};
+
+static const uint8_t foo_new_sha256[] = {
+    0x8b, 0xe7, 0xc3, 0x3a, 0x6d, 0x2c, 0xc6, 0xcc,
+    0xf9, 0x51, 0x52, 0xf6, 0x8a, 0xa4, 0x45, 0xec,
+    0x64, 0x92, 0xdb, 0x71, 0xc0, 0x1d, 0x00, 0x3c,
+    0x5b, 0xc5, 0xb5, 0xcd, 0xe0, 0x87, 0x3b, 0x7a
+};
+
+static const uint8_t micropython_new_sha256[] = {
+    0x5f, 0x52, 0x13, 0x72, 0x97, 0xf7, 0xdb, 0xbb,
+    0x3a, 0x30, 0x19, 0x98, 0xad, 0x71, 0x0d, 0x8f,
+    0x33, 0xbe, 0xf0, 0x70, 0x39, 0x59, 0x91, 0x08,
+    0x1c, 0x95, 0x93, 0x7e, 0xe2, 0xc5, 0x61, 0x37
+};
+
+static const uint8_t shell_new_sha256[] = {
+    0xd3, 0x01, 0xa8, 0x19, 0x7d, 0x5d, 0xf2, 0x64,
+    0x9b, 0x9f, 0x18, 0x02, 0x3a, 0xd4, 0xf9, 0x61,
+    0xf9, 0x16, 0x80, 0x16, 0xa8, 0x31, 0x8d, 0x63,
+    0xc4, 0x86, 0x4d, 0x70, 0x4e, 0xb8, 0x21, 0x95
+};
+
+static size_t write_limit = 0;
+
+static int io_write_limited(void *arg_p, const uint8_t *buf_p, size_t size)
+{
+    struct io_t *self_p;
+
+    self_p = (struct io_t *)arg_p;
+
+    if (self_p->to.written + size > write_limit) {
+        return (-1);
+    }
+
+    return (io_write(arg_p, buf_p, size));
+}
+
+static void assert_apply_patch_resume(const char *from_p,
+                                      const char *patch_p,
+                                      const char *to_p,
+                                      size_t limit,
+                                      bool from_memory,
+                                      const uint8_t *sha256_p)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct detools_apply_patch_checkpoint_t checkpoint;
+    struct io_t io;
+    uint8_t *from_buf_p;
+    size_t from_size;
+    uint8_t *patch_buf_p;
+    size_t patch_size;
+    size_t patch_offset;
+    size_t size;
+    int res;
+
+    io_init(&io, from_p, to_p);
+    from_buf_p = read_init(from_p, &from_size);
+    patch_buf_p = read_init(patch_p, &patch_size);
+    write_limit = limit;
+
+    if (from_memory) {
+        assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                    from_buf_p,
+                                                    from_size,
+                                                    patch_size,
+                                                    io_write_limited,
+                                                    &io) == 0);
+    } else {
+        assert(detools_apply_patch_init(&apply_patch,
+                                        io_read,
+                                        io_seek,
+                                        patch_size,
+                                        io_write_limited,
+                                        &io) == 0);
+        assert(detools_apply_patch_set_from_size(&apply_patch, from_size) == 0);
+    }
+
+    assert(detools_apply_patch_set_digest(&apply_patch,
+                                          DETOOLS_DIGEST_SHA256,
+                                          sha256_p) == 0);
+
+    /* Persist a checkpoint after each processed patch chunk until
+       writing fails. */
+    memset(&checkpoint, 0, sizeof(checkpoint));
+    patch_offset = 0;
+
+    res = 0;
+
+    while ((patch_offset < patch_size) && (res == 0)) {
+        size = MIN(patch_size - patch_offset, 64);
+        res = detools_apply_patch_process(&apply_patch,
+                                          &patch_buf_p[patch_offset],
+                                          size);
+
+        if (res == 0) {
+            assert(detools_apply_patch_get_checkpoint(&apply_patch,
+                                                      &checkpoint) == 0);
+            patch_offset += size;
+        }
+    }
+
+    if (res == 0) {
+        res = detools_apply_patch_finalize(&apply_patch);
+    } else {
+        assert(detools_apply_patch_finalize(&apply_patch)
+               == -DETOOLS_ALREADY_FAILED);
+    }
+
+    assert(res == -DETOOLS_IO_FAILED);
+    assert(checkpoint.to_size == io.to.size);
+    assert(checkpoint.to_offset > 0);
+    assert(checkpoint.to_offset <= limit);
+
+    /* Resume from the checkpoint, with all to-data after it lost. */
+    memset(&io.to.actual_p[checkpoint.to_offset],
+           0xff,
+           io.to.size - checkpoint.to_offset);
+    io.to.written = checkpoint.to_offset;
+    assert(fseek(io.ffrom_p, 0, SEEK_SET) == 0);
+
+    if (from_memory) {
+        assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                    from_buf_p,
+                                                    from_size,
+                                                    patch_size,
+                                                    io_write,
+                                                    &io) == 0);
+    } else {
+        assert(detools_apply_patch_init(&apply_patch,
+                                        io_read,
+                                        io_seek,
+                                        patch_size,
+                                        io_write,
+                                        &io) == 0);
+        assert(detools_apply_patch_set_from_size(&apply_patch, from_size) == 0);
+    }
+
+    assert(detools_apply_patch_set_digest(&apply_patch,
+                                          DETOOLS_DIGEST_SHA256,
+                                          sha256_p) == 0);
+    assert(detools_apply_patch_set_checkpoint(&apply_patch, &checkpoint) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_buf_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == (int)io.to.size);
+    io_assert_to_ok(&io);
+
+    free(from_buf_p);
+    free(patch_buf_p);
+}
+
 static void assert_apply_patch_in_place_resumable(const char *from_p,
                                                   const char *patch_p,
                                                   const char *to_p,
@@ -391,168 +577,1105 @@ static void test_apply_patch_micropython(void)
         "tests/files/micropython/esp8266-20190125-v1.10.bin");
 }
 
-static void test_apply_patch_foo_none_compression(void)
+static void test_apply_patch_shell_arm_cortex_m4(void)
 {
-    assert_apply_patch("tests/files/foo/old",
-                       "tests/files/foo/none.patch",
-                       "tests/files/foo/new");
+    assert_apply_patch("tests/files/shell/old",
+                       "tests/files/shell/arm-cortex-m4.patch",
+                       "tests/files/shell/new");
 }
 
-static void test_apply_patch_foo_heatshrink_compression(void)
+static void test_apply_patch_shell_arm_cortex_m4_crle(void)
 {
-    assert_apply_patch("tests/files/foo/old",
-                       "tests/files/foo/heatshrink.patch",
-                       "tests/files/foo/new");
+    assert_apply_patch("tests/files/shell/old",
+                       "tests/files/shell/arm-cortex-m4-crle.patch",
+                       "tests/files/shell/new");
 }
 
-static void test_apply_patch_micropython_none_compression(void)
+static void test_apply_patch_micropython_xtensa_lx106(void)
 {
     assert_apply_patch(
         "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
         "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-"
-        "none.patch",
+        "xtensa-lx106.patch",
         "tests/files/micropython/esp8266-20190125-v1.10.bin");
 }
 
-static void test_apply_patch_micropython_heatshrink_compression(void)
+static void test_apply_patch_micropython_xtensa_lx106_data_sections(void)
 {
     assert_apply_patch(
         "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
         "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-"
-        "heatshrink.patch",
+        "xtensa-lx106-data-sections.patch",
         "tests/files/micropython/esp8266-20190125-v1.10.bin");
 }
 
-static void test_apply_patch_foo_crle_compression(void)
+static void test_apply_patch_shell_pi_3_aarch64(void)
 {
-    assert_apply_patch("tests/files/foo/old",
-                       "tests/files/foo/crle.patch",
-                       "tests/files/foo/new");
+    assert_apply_patch("tests/files/shell-pi-3/1.bin",
+                       "tests/files/shell-pi-3/1--2-aarch64.patch",
+                       "tests/files/shell-pi-3/2.bin");
 }
 
-static void test_apply_patch_micropython_crle_compression(void)
+static void test_apply_patch_shell_pi_3_aarch64_data_sections(void)
 {
-    assert_apply_patch(
-        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
-        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-crle.patch",
-        "tests/files/micropython/esp8266-20190125-v1.10.bin");
+    assert_apply_patch("tests/files/shell-pi-3/1.bin",
+                       "tests/files/shell-pi-3/1--2-aarch64-data-sections.patch",
+                       "tests/files/shell-pi-3/2.bin");
 }
 
-static void test_apply_patch_micropython_in_place(void)
+static void test_apply_patch_pybv11_arm_cortex_m4_out_of_memory(void)
 {
-    assert_apply_patch_in_place(
-        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
-        "tests/files/micropython/esp8266-20180511-v1.9.4--"
-        "20190125-v1.10-in-place.patch",
-        "tests/files/micropython/esp8266-20190125-v1.10.bin",
-        2097152);
+    assert_apply_patch_error(
+        "tests/files/pybv11/1f5d945af/firmware1.bin",
+        "tests/files/pybv11/1f5d945af--1f5d945af-dirty-arm-cortex-m4.patch",
+        -DETOOLS_OUT_OF_MEMORY);
 }
 
-static void test_apply_patch_foo_in_place_3000_1500(void)
+static void test_apply_patch_shell_arm_cortex_m4_missing_from_size(void)
 {
-    assert_apply_patch_in_place("tests/files/foo/old",
-                                "tests/files/foo/in-place-3000-1500.patch",
-                                "tests/files/foo/new",
-                                3000);
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    int res;
+
+    io_init(&io, "tests/files/shell/old", "tests/files/shell/new");
+    patch_p = patch_init("tests/files/shell/arm-cortex-m4.patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    /* The error is found in process or finalize depending on the
+       LZMA input buffer size. Finalize must always be called to free
+       the LZMA decoder. */
+    res = detools_apply_patch_process(&apply_patch, patch_p, patch_size);
+
+    if (res == 0) {
+        res = detools_apply_patch_finalize(&apply_patch);
+    } else {
+        assert(detools_apply_patch_finalize(&apply_patch)
+               == -DETOOLS_ALREADY_FAILED);
+    }
+
+    assert(res == -DETOOLS_MISSING_FROM_SIZE);
 }
 
-static void test_apply_patch_foo_in_place_3k_1_5k(void)
+static void test_apply_patch_shell_arm_cortex_m4_set_from_size(void)
 {
-    assert_apply_patch_in_place("tests/files/foo/old",
-                                "tests/files/foo/in-place-3k-1.5k.patch",
-                                "tests/files/foo/new",
-                                3072);
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    size_t from_size;
+
+    io_init(&io, "tests/files/shell/old", "tests/files/shell/new");
+    patch_p = patch_init("tests/files/shell/arm-cortex-m4.patch", &patch_size);
+    free(read_init("tests/files/shell/old", &from_size));
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_from_size(&apply_patch, from_size) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == (int)io.to.size);
+    io_assert_to_ok(&io);
 }
 
-static void test_apply_patch_foo_in_place_3000_1500_1500(void)
+static void test_apply_patch_micropython_lzma_arena(void)
 {
-    assert_apply_patch_in_place("tests/files/foo/old",
-                                "tests/files/foo/in-place-3000-1500-1500.patch",
-                                "tests/files/foo/new",
-                                3000);
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    size_t arena_size;
+    void *arena_p;
+
+    io_init(&io,
+            "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+            "tests/files/micropython/esp8266-20190125-v1.10.bin");
+    patch_p = patch_init(
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10.patch",
+        &patch_size);
+    arena_size = (8 * 1024 * 1024 + 64 * 1024);
+    arena_p = malloc(arena_size);
+    assert(arena_p != NULL);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_lzma_arena(&apply_patch,
+                                              arena_p,
+                                              arena_size) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == (int)io.to.size);
+    io_assert_to_ok(&io);
+
+    free(arena_p);
 }
 
-static void test_apply_patch_foo_in_place_3000_500(void)
+static void test_apply_patch_foo_lzma_arena_too_small(void)
 {
-    assert_apply_patch_in_place("tests/files/foo/old",
-                                "tests/files/foo/in-place-3000-500.patch",
-                                "tests/files/foo/new",
-                                3000);
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    static uint8_t arena[64 * 1024];
+    int res;
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_lzma_arena(&apply_patch,
+                                              &arena[0],
+                                              sizeof(arena)) == 0);
+    res = detools_apply_patch_process(&apply_patch, patch_p, patch_size);
+
+    if (res == 0) {
+        res = detools_apply_patch_finalize(&apply_patch);
+    }
+
+    assert(res == -DETOOLS_OUT_OF_MEMORY);
 }
 
-static void test_apply_patch_foo_in_place_3000_500_crle(void)
+static void test_apply_patch_foo_lzma_options_arena(void)
 {
-    assert_apply_patch_in_place("tests/files/foo/old",
-                                "tests/files/foo/in-place-3000-500-crle.patch",
-                                "tests/files/foo/new",
-                                3000);
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    static uint8_t arena[64 * 1024];
+
+    /* A .xz stream with an ARM Thumb BCJ filter and a 4 KiB
+       dictionary. */
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/lzma-options.patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_lzma_arena(&apply_patch,
+                                              &arena[0],
+                                              sizeof(arena)) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == (int)io.to.size);
+    io_assert_to_ok(&io);
 }
 
-static void test_apply_patch_foo_in_place_6000_1000_crle(void)
+static void test_apply_patch_shell_arm_cortex_m4_lzma_auto(void)
 {
-    assert_apply_patch_in_place("tests/files/foo/old",
-                                "tests/files/foo/in-place-6000-1000-crle.patch",
-                                "tests/files/foo/new",
-                                6000);
+    assert_apply_patch("tests/files/shell/old",
+                       "tests/files/shell/arm-cortex-m4-lzma-auto.patch",
+                       "tests/files/shell/new");
 }
 
-static void test_apply_patch_foo_in_place_resumable_3000_500(void)
+static void test_apply_patch_foo_from_memory(void)
 {
-    stored_step = 0;
-    assert_apply_patch_in_place_resumable("tests/files/foo/old",
-                                          "tests/files/foo/in-place-3000-500.patch",
-                                          "tests/files/foo/new",
-                                          false,
-                                          step_set_ok,
-                                          step_get_ok,
-                                          3000,
-                                          0);
-    assert(stored_step == 0);
+    assert_apply_patch_from_memory("tests/files/foo/old",
+                                   "tests/files/foo/patch",
+                                   "tests/files/foo/new");
 }
 
-static void test_apply_patch_foo_in_place_resume_3000_500_fail_set_step_2(void)
+static void test_apply_patch_micropython_from_memory(void)
 {
-    stored_step = 0;
-    fail_set_step = 2;
-    assert_apply_patch_in_place_resumable("tests/files/foo/old",
-                                          "tests/files/foo/in-place-3000-500.patch",
-                                          "tests/files/foo/new",
-                                          false,
-                                          step_set_fail_after,
-                                          step_get_ok,
-                                          3000,
-                                          -DETOOLS_STEP_SET_FAILED);
-    assert(stored_step == 1);
+    assert_apply_patch_from_memory(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin");
+}
 
-    /* Resume the aborted update. */
-    assert_apply_patch_in_place_resumable("tests/files/foo/old",
-                                          "tests/files/foo/in-place-3000-500.patch",
-                                          "tests/files/foo/new",
-                                          true,
-                                          step_set_ok,
-                                          step_get_ok,
-                                          3000,
-                                          0);
+static void test_apply_patch_shell_arm_cortex_m4_from_memory(void)
+{
+    assert_apply_patch_from_memory("tests/files/shell/old",
+                                   "tests/files/shell/arm-cortex-m4.patch",
+                                   "tests/files/shell/new");
 }
 
-static void test_apply_patch_foo_in_place_resume_3000_500_fail_set_step_5(void)
+static void test_apply_patch_micropython_resume(void)
 {
-    stored_step = 0;
-    fail_set_step = 5;
-    assert_apply_patch_in_place_resumable("tests/files/foo/old",
-                                          "tests/files/foo/in-place-3000-500.patch",
-                                          "tests/files/foo/new",
-                                          false,
-                                          step_set_fail_after,
-                                          step_get_ok,
-                                          3000,
-                                          -DETOOLS_STEP_SET_FAILED);
-    assert(stored_step == 4);
+    assert_apply_patch_resume(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        300000,
+        false,
+        &micropython_new_sha256[0]);
+}
 
-    /* Resume the aborted update. */
-    assert_apply_patch_in_place_resumable("tests/files/foo/old",
-                                          "tests/files/foo/in-place-3000-500.patch",
-                                          "tests/files/foo/new",
+static void test_apply_patch_micropython_resume_from_memory(void)
+{
+    assert_apply_patch_resume(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        400000,
+        true,
+        &micropython_new_sha256[0]);
+}
+
+static void test_apply_patch_shell_arm_cortex_m4_resume(void)
+{
+    assert_apply_patch_resume("tests/files/shell/old",
+                              "tests/files/shell/arm-cortex-m4.patch",
+                              "tests/files/shell/new",
+                              50000,
+                              false,
+                              &shell_new_sha256[0]);
+}
+
+static void test_apply_patch_foo_resume_bad_checkpoint(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct detools_apply_patch_checkpoint_t checkpoint;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+
+    /* Bad magic. */
+    memset(&checkpoint, 0, sizeof(checkpoint));
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_checkpoint(&apply_patch, &checkpoint)
+           == -DETOOLS_BAD_CHECKPOINT);
+
+    /* To size mismatch. */
+    checkpoint.magic = DETOOLS_APPLY_PATCH_CHECKPOINT_MAGIC;
+    checkpoint.to_size = 2781;
+    checkpoint.to_offset = 100;
+    checkpoint.digest.type = DETOOLS_DIGEST_NONE;
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_checkpoint(&apply_patch, &checkpoint) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == -DETOOLS_BAD_CHECKPOINT);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_ALREADY_FAILED);
+
+    /* Digest type mismatch. */
+    checkpoint.to_size = 2780;
+    checkpoint.to_offset = 100;
+    checkpoint.digest.type = DETOOLS_DIGEST_NONE;
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_digest(&apply_patch,
+                                          DETOOLS_DIGEST_CRC32,
+                                          NULL) == 0);
+    assert(detools_apply_patch_set_checkpoint(&apply_patch, &checkpoint)
+           == -DETOOLS_BAD_CHECKPOINT);
+
+    /* To offset beyond to size. */
+    checkpoint.to_size = 2780;
+    checkpoint.to_offset = 2781;
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_checkpoint(&apply_patch, &checkpoint) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == -DETOOLS_BAD_CHECKPOINT);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_ALREADY_FAILED);
+}
+
+static void test_apply_patch_foo_resume_other_patch(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct detools_apply_patch_checkpoint_t checkpoint;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+
+    /* Checkpoint of the LZMA patch. */
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_process(&apply_patch, patch_p, 100) == 0);
+    assert(detools_apply_patch_get_checkpoint(&apply_patch, &checkpoint) == 0);
+    assert(checkpoint.patch_offset == 100);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       &patch_p[100],
+                                       patch_size - 100) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == 2780);
+
+    /* Resume with the CRLE patch, which has the same to size. */
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/crle.patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_checkpoint(&apply_patch, &checkpoint) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == -DETOOLS_BAD_CHECKPOINT);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_ALREADY_FAILED);
+}
+
+static void assert_apply_patch_foo_digest(int digest,
+                                          const uint8_t *expected_p,
+                                          size_t expected_size)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    uint8_t actual[DETOOLS_DIGEST_MAX_SIZE];
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_digest(&apply_patch,
+                                          digest,
+                                          expected_p) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == 2780);
+    io_assert_to_ok(&io);
+    assert(detools_apply_patch_get_digest(&apply_patch, &actual[0])
+           == (int)expected_size);
+    assert(memcmp(&actual[0], expected_p, expected_size) == 0);
+}
+
+static void test_apply_patch_foo_digest_crc32(void)
+{
+    assert_apply_patch_foo_digest(DETOOLS_DIGEST_CRC32,
+                                  &foo_new_crc32[0],
+                                  sizeof(foo_new_crc32));
+}
+
+static void test_apply_patch_foo_digest_sha256(void)
+{
+    assert_apply_patch_foo_digest(DETOOLS_DIGEST_SHA256,
+                                  &foo_new_sha256[0],
+                                  sizeof(foo_new_sha256));
+}
+
+static void test_apply_patch_foo_digest_mismatch(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    uint8_t expected[4];
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+    memcpy(&expected[0], &foo_new_crc32[0], sizeof(expected));
+    expected[3] ^= 1;
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_set_digest(&apply_patch,
+                                          DETOOLS_DIGEST_CRC32,
+                                          &expected[0]) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       patch_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_DIGEST_MISMATCH);
+}
+
+static void test_apply_patch_bad_digest(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    uint8_t actual[DETOOLS_DIGEST_MAX_SIZE];
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    0,
+                                    io_write,
+                                    NULL) == 0);
+    assert(detools_apply_patch_get_digest(&apply_patch, &actual[0])
+           == -DETOOLS_BAD_DIGEST);
+    assert(detools_apply_patch_set_digest(&apply_patch, 99, NULL)
+           == -DETOOLS_BAD_DIGEST);
+}
+
+struct memory_t {
+    uint8_t *buf_p;
+    size_t size;
+};
+
+static int memory_read(void *arg_p, void *dst_p, uintptr_t src, size_t size)
+{
+    struct memory_t *self_p;
+
+    self_p = (struct memory_t *)arg_p;
+    assert(src + size <= self_p->size);
+    memcpy(dst_p, &self_p->buf_p[src], size);
+
+    return (0);
+}
+
+static int memory_write(void *arg_p, uintptr_t dst, void *src_p, size_t size)
+{
+    struct memory_t *self_p;
+
+    self_p = (struct memory_t *)arg_p;
+    assert(dst + size <= self_p->size);
+    memcpy(&self_p->buf_p[dst], src_p, size);
+
+    return (0);
+}
+
+static int memory_erase(void *arg_p, uintptr_t addr, size_t size)
+{
+    struct memory_t *self_p;
+
+    self_p = (struct memory_t *)arg_p;
+    assert(addr + size <= self_p->size);
+    memset(&self_p->buf_p[addr], -1, size);
+
+    return (0);
+}
+
+static int apply_patch_in_place_digest(struct memory_t *memory_p,
+                                       const uint8_t *patch_p,
+                                       size_t patch_size,
+                                       detools_step_set_t step_set,
+                                       int digest,
+                                       const uint8_t *expected_p)
+{
+    struct detools_apply_patch_in_place_t apply_patch;
+    int res;
+
+    assert(detools_apply_patch_in_place_init(&apply_patch,
+                                             memory_read,
+                                             memory_write,
+                                             memory_erase,
+                                             step_set,
+                                             step_get_ok,
+                                             patch_size,
+                                             memory_p) == 0);
+    assert(detools_apply_patch_in_place_set_digest(&apply_patch,
+                                                   digest,
+                                                   expected_p) == 0);
+    res = detools_apply_patch_in_place_process(&apply_patch,
+                                               patch_p,
+                                               patch_size);
+
+    if (res != 0) {
+        (void)detools_apply_patch_in_place_finalize(&apply_patch);
+
+        return (res);
+    }
+
+    return (detools_apply_patch_in_place_finalize(&apply_patch));
+}
+
+static void test_apply_patch_foo_in_place_digest(void)
+{
+    struct memory_t memory;
+    uint8_t *patch_p;
+    size_t patch_size;
+    uint8_t *from_p;
+    size_t from_size;
+    uint8_t expected[4];
+
+    patch_p = read_init("tests/files/foo/in-place-3000-500.patch", &patch_size);
+    from_p = read_init("tests/files/foo/old", &from_size);
+    memory.size = 3000;
+    memory.buf_p = mymalloc(memory.size);
+    memset(memory.buf_p, -1, memory.size);
+    memcpy(memory.buf_p, from_p, from_size);
+
+    stored_step = 0;
+    assert(apply_patch_in_place_digest(&memory,
+                                       patch_p,
+                                       patch_size,
+                                       step_set_ok,
+                                       DETOOLS_DIGEST_CRC32,
+                                       &foo_new_crc32[0]) == 2780);
+
+    /* Another expected digest gives a mismatch. */
+    memcpy(&expected[0], &foo_new_crc32[0], sizeof(expected));
+    expected[0] ^= 1;
+    memset(memory.buf_p, -1, memory.size);
+    memcpy(memory.buf_p, from_p, from_size);
+    assert(apply_patch_in_place_digest(&memory,
+                                       patch_p,
+                                       patch_size,
+                                       NULL,
+                                       DETOOLS_DIGEST_CRC32,
+                                       &expected[0])
+           == -DETOOLS_DIGEST_MISMATCH);
+
+    free(memory.buf_p);
+    free(from_p);
+    free(patch_p);
+}
+
+static const uint8_t foo_periodic_sha256[] = {
+    0xb5, 0xef, 0x59, 0x57, 0x77, 0x73, 0x07, 0x71,
+    0x25, 0x18, 0xde, 0xf5, 0x73, 0xa2, 0xc6, 0xed,
+    0x66, 0x53, 0xb2, 0x42, 0x5d, 0x8b, 0x0e, 0x2b,
+    0xb7, 0x00, 0x01, 0x89, 0x75, 0x55, 0xbb, 0x23
+};
+
+static void test_apply_patch_foo_in_place_unchanged(void)
+{
+    struct detools_apply_patch_in_place_t apply_patch;
+    struct memory_t memory;
+    uint8_t *patch_p;
+    size_t patch_size;
+    uint8_t *from_p;
+    size_t from_size;
+
+    /* All four shifted segments and all six to-data segments are
+       already in memory. */
+    patch_p = read_init("tests/files/foo/in-place-periodic.patch", &patch_size);
+    from_p = read_init("tests/files/foo/periodic", &from_size);
+    memory.size = 3000;
+    memory.buf_p = mymalloc(memory.size);
+    memcpy(memory.buf_p, from_p, from_size);
+
+    assert(detools_apply_patch_in_place_init(&apply_patch,
+                                             memory_read,
+                                             memory_write,
+                                             memory_erase,
+                                             NULL,
+                                             NULL,
+                                             patch_size,
+                                             &memory) == 0);
+    assert(detools_apply_patch_in_place_set_digest(&apply_patch,
+                                                   DETOOLS_DIGEST_SHA256,
+                                                   &foo_periodic_sha256[0]) == 0);
+    assert(detools_apply_patch_in_place_process(&apply_patch,
+                                                patch_p,
+                                                patch_size) == 0);
+    assert(detools_apply_patch_in_place_finalize(&apply_patch) == 3000);
+    assert(detools_apply_patch_in_place_get_skipped_erases(&apply_patch) == 10);
+    assert(memcmp(memory.buf_p, from_p, from_size) == 0);
+
+    free(memory.buf_p);
+    free(from_p);
+    free(patch_p);
+}
+
+static void test_apply_patch_foo_in_place_unchanged_bad_patch_type(void)
+{
+    struct detools_apply_patch_in_place_t apply_patch;
+    struct memory_t memory;
+    uint8_t *patch_p;
+    size_t patch_size;
+
+    /* Unchanged segment markers are corrupt in patches of type
+       in-place. */
+    patch_p = read_init("tests/files/foo/in-place-periodic.patch", &patch_size);
+    patch_p[0] = (uint8_t)((DETOOLS_PATCH_TYPE_IN_PLACE << 4)
+                           | (patch_p[0] & 0xf));
+    memory.size = 3000;
+    memory.buf_p = mymalloc(memory.size);
+    memset(memory.buf_p, 0, memory.size);
+
+    assert(detools_apply_patch_in_place_init(&apply_patch,
+                                             memory_read,
+                                             memory_write,
+                                             memory_erase,
+                                             NULL,
+                                             NULL,
+                                             patch_size,
+                                             &memory) == 0);
+    assert(detools_apply_patch_in_place_process(&apply_patch,
+                                                patch_p,
+                                                patch_size)
+           == -DETOOLS_CORRUPT_PATCH);
+    assert(detools_apply_patch_in_place_finalize(&apply_patch)
+           == -DETOOLS_ALREADY_FAILED);
+
+    free(memory.buf_p);
+    free(patch_p);
+}
+
+/* Writes and erases are performed when waited for, so a write buffer
+   reused too early gives wrong to-data. */
+struct async_memory_t {
+    struct memory_t memory;
+    bool ongoing;
+    uintptr_t addr;
+    const uint8_t *src_p;
+    size_t size;
+    int number_of_waits;
+};
+
+static struct async_memory_t async_memory;
+
+static int async_memory_read(void *arg_p,
+                             void *dst_p,
+                             uintptr_t src,
+                             size_t size)
+{
+    assert(!async_memory.ongoing);
+
+    return (memory_read(arg_p, dst_p, src, size));
+}
+
+static int async_memory_write(void *arg_p,
+                              uintptr_t dst,
+                              void *src_p,
+                              size_t size)
+{
+    (void)arg_p;
+
+    assert(!async_memory.ongoing);
+    async_memory.ongoing = true;
+    async_memory.addr = dst;
+    async_memory.src_p = src_p;
+    async_memory.size = size;
+
+    return (0);
+}
+
+static int async_memory_erase(void *arg_p, uintptr_t addr, size_t size)
+{
+    (void)arg_p;
+
+    assert(!async_memory.ongoing);
+    async_memory.ongoing = true;
+    async_memory.addr = addr;
+    async_memory.src_p = NULL;
+    async_memory.size = size;
+
+    return (0);
+}
+
+static int async_memory_wait(void *arg_p)
+{
+    assert(async_memory.ongoing);
+    async_memory.ongoing = false;
+    async_memory.number_of_waits++;
+
+    if (async_memory.src_p != NULL) {
+        return (memory_write(arg_p,
+                             async_memory.addr,
+                             (void *)async_memory.src_p,
+                             async_memory.size));
+    } else {
+        return (memory_erase(arg_p, async_memory.addr, async_memory.size));
+    }
+}
+
+static int async_step_set(void *arg_p, int step)
+{
+    assert(!async_memory.ongoing);
+
+    return (step_set_ok(arg_p, step));
+}
+
+static void test_apply_patch_foo_in_place_mem_async(void)
+{
+    struct detools_apply_patch_in_place_t apply_patch;
+    uint8_t *patch_p;
+    size_t patch_size;
+    uint8_t *from_p;
+    size_t from_size;
+    uint8_t *to_p;
+    size_t to_size;
+    size_t offset;
+    size_t size;
+    int res;
+
+    patch_p = read_init("tests/files/foo/in-place-3000-500.patch", &patch_size);
+    from_p = read_init("tests/files/foo/old", &from_size);
+    to_p = read_init("tests/files/foo/new", &to_size);
+    memset(&async_memory, 0, sizeof(async_memory));
+    async_memory.memory.size = 3000;
+    async_memory.memory.buf_p = mymalloc(async_memory.memory.size);
+    memset(async_memory.memory.buf_p, -1, async_memory.memory.size);
+    memcpy(async_memory.memory.buf_p, from_p, from_size);
+    stored_step = 0;
+
+    assert(detools_apply_patch_in_place_init(&apply_patch,
+                                             async_memory_read,
+                                             async_memory_write,
+                                             async_memory_erase,
+                                             async_step_set,
+                                             step_get_ok,
+                                             patch_size,
+                                             &async_memory.memory) == 0);
+    assert(detools_apply_patch_in_place_set_mem_wait(&apply_patch,
+                                                     async_memory_wait) == 0);
+    assert(detools_apply_patch_in_place_set_digest(&apply_patch,
+                                                   DETOOLS_DIGEST_SHA256,
+                                                   &foo_new_sha256[0]) == 0);
+
+    /* Small chunks to interleave patch processing and memory
+       operations. */
+    offset = 0;
+    res = 0;
+
+    while ((offset < patch_size) && (res == 0)) {
+        size = MIN(patch_size - offset, 16);
+        res = detools_apply_patch_in_place_process(&apply_patch,
+                                                   &patch_p[offset],
+                                                   size);
+        offset += size;
+    }
+
+    assert(res == 0);
+    assert(detools_apply_patch_in_place_finalize(&apply_patch) == (int)to_size);
+    assert(!async_memory.ongoing);
+    assert(async_memory.number_of_waits > 0);
+    assert(stored_step == 0);
+    assert(memcmp(async_memory.memory.buf_p, to_p, to_size) == 0);
+
+    free(async_memory.memory.buf_p);
+    free(to_p);
+    free(from_p);
+    free(patch_p);
+}
+
+static void test_apply_patch_foo_in_place_resume_digest(void)
+{
+    struct memory_t memory;
+    uint8_t *patch_p;
+    size_t patch_size;
+    uint8_t *from_p;
+    size_t from_size;
+
+    patch_p = read_init("tests/files/foo/in-place-3000-500.patch", &patch_size);
+    from_p = read_init("tests/files/foo/old", &from_size);
+    memory.size = 3000;
+    memory.buf_p = mymalloc(memory.size);
+    memset(memory.buf_p, -1, memory.size);
+    memcpy(memory.buf_p, from_p, from_size);
+
+    /* Interrupted after a few steps. */
+    stored_step = 0;
+    fail_set_step = 8;
+    assert(apply_patch_in_place_digest(&memory,
+                                       patch_p,
+                                       patch_size,
+                                       step_set_fail_after,
+                                       DETOOLS_DIGEST_SHA256,
+                                       &foo_new_sha256[0])
+           == -DETOOLS_STEP_SET_FAILED);
+    assert(stored_step == 7);
+
+    /* Resume, with to-data of completed steps read back. */
+    assert(apply_patch_in_place_digest(&memory,
+                                       patch_p,
+                                       patch_size,
+                                       step_set_ok,
+                                       DETOOLS_DIGEST_SHA256,
+                                       &foo_new_sha256[0]) == 2780);
+    assert(stored_step == 0);
+
+    free(memory.buf_p);
+    free(from_p);
+    free(patch_p);
+}
+
+static void test_apply_patch_foo_from_memory_too_short(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    uint8_t *from_buf_p;
+    size_t from_size;
+    uint8_t *patch_buf_p;
+    size_t patch_size;
+    int res;
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    from_buf_p = read_init("tests/files/foo/old", &from_size);
+    patch_buf_p = read_init("tests/files/foo/patch", &patch_size);
+
+    assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                from_buf_p,
+                                                from_size / 2,
+                                                patch_size,
+                                                io_write,
+                                                &io) == 0);
+    res = detools_apply_patch_process(&apply_patch, patch_buf_p, patch_size);
+
+    if (res == 0) {
+        res = detools_apply_patch_finalize(&apply_patch);
+    }
+
+    assert(res == -DETOOLS_CORRUPT_PATCH);
+
+    free(from_buf_p);
+    free(patch_buf_p);
+}
+
+static void test_apply_patch_foo_none_compression(void)
+{
+    assert_apply_patch("tests/files/foo/old",
+                       "tests/files/foo/none.patch",
+                       "tests/files/foo/new");
+}
+
+static void test_apply_patch_foo_heatshrink_compression(void)
+{
+    assert_apply_patch("tests/files/foo/old",
+                       "tests/files/foo/heatshrink.patch",
+                       "tests/files/foo/new");
+}
+
+static void test_apply_patch_foo_heatshrink_sizes(void)
+{
+#if HEATSHRINK_DYNAMIC_ALLOC
+    assert_apply_patch("tests/files/foo/old",
+                       "tests/files/foo/heatshrink-9-8.patch",
+                       "tests/files/foo/new");
+#else
+    assert_apply_patch_error("tests/files/foo/old",
+                             "tests/files/foo/heatshrink-9-8.patch",
+                             -DETOOLS_HEATSHRINK_HEADER);
+#endif
+}
+
+static void test_apply_patch_micropython_none_compression(void)
+{
+    assert_apply_patch(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-"
+        "none.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin");
+}
+
+static void test_apply_patch_micropython_heatshrink_compression(void)
+{
+    assert_apply_patch(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-"
+        "heatshrink.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin");
+}
+
+static void test_apply_patch_foo_crle_compression(void)
+{
+    assert_apply_patch("tests/files/foo/old",
+                       "tests/files/foo/crle.patch",
+                       "tests/files/foo/new");
+}
+
+static void test_apply_patch_micropython_crle_compression(void)
+{
+    assert_apply_patch(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-crle.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin");
+}
+
+static void test_apply_patch_micropython_in_place(void)
+{
+    assert_apply_patch_in_place(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--"
+        "20190125-v1.10-in-place.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        2097152);
+}
+
+static void test_apply_patch_shell_in_place_arm_cortex_m4(void)
+{
+    assert_apply_patch_in_place("tests/files/shell/old",
+                                "tests/files/shell/in-place-arm-cortex-m4.patch",
+                                "tests/files/shell/new",
+                                196608);
+}
+
+static void test_apply_patch_micropython_in_place_xtensa_lx106(void)
+{
+    assert_apply_patch_in_place(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--"
+        "20190125-v1.10-xtensa-lx106-in-place.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        2097152);
+}
+
+static void test_apply_patch_foo_in_place_3000_1500(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-3000-1500.patch",
+                                "tests/files/foo/new",
+                                3000);
+}
+
+static void test_apply_patch_foo_in_place_3k_1_5k(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-3k-1.5k.patch",
+                                "tests/files/foo/new",
+                                3072);
+}
+
+static void test_apply_patch_foo_in_place_3000_1500_1500(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-3000-1500-1500.patch",
+                                "tests/files/foo/new",
+                                3000);
+}
+
+static void test_apply_patch_foo_in_place_3000_500(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-3000-500.patch",
+                                "tests/files/foo/new",
+                                3000);
+}
+
+static void test_apply_patch_foo_in_place_3000_500_crle(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-3000-500-crle.patch",
+                                "tests/files/foo/new",
+                                3000);
+}
+
+static void test_apply_patch_foo_in_place_6000_1000_crle(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-6000-1000-crle.patch",
+                                "tests/files/foo/new",
+                                6000);
+}
+
+static void test_apply_patch_foo_in_place_many_segments_unchanged(void)
+{
+    assert_apply_patch_in_place(
+        "tests/files/foo/old",
+        "tests/files/foo/in-place-many-segments-unchanged.patch",
+        "tests/files/foo/new",
+        3000);
+}
+
+static void test_apply_patch_foo_in_place_many_segments(void)
+{
+    assert_apply_patch_in_place("tests/files/foo/old",
+                                "tests/files/foo/in-place-many-segments.patch",
+                                "tests/files/foo/new",
+                                3000);
+}
+
+static void test_apply_patch_foo_in_place_resumable_3000_500(void)
+{
+    stored_step = 0;
+    assert_apply_patch_in_place_resumable("tests/files/foo/old",
+                                          "tests/files/foo/in-place-3000-500.patch",
+                                          "tests/files/foo/new",
+                                          false,
+                                          step_set_ok,
+                                          step_get_ok,
+                                          3000,
+                                          0);
+    assert(stored_step == 0);
+}
+
+static void test_apply_patch_foo_in_place_resume_3000_500_fail_set_step_2(void)
+{
+    stored_step = 0;
+    fail_set_step = 2;
+    assert_apply_patch_in_place_resumable("tests/files/foo/old",
+                                          "tests/files/foo/in-place-3000-500.patch",
+                                          "tests/files/foo/new",
+                                          false,
+                                          step_set_fail_after,
+                                          step_get_ok,
+                                          3000,
+                                          -DETOOLS_STEP_SET_FAILED);
+    assert(stored_step == 1);
+
+    /* Resume the aborted update. */
+    assert_apply_patch_in_place_resumable("tests/files/foo/old",
+                                          "tests/files/foo/in-place-3000-500.patch",
+                                          "tests/files/foo/new",
+                                          true,
+                                          step_set_ok,
+                                          step_get_ok,
+                                          3000,
+                                          0);
+}
+
+static void test_apply_patch_foo_in_place_resume_3000_500_fail_set_step_5(void)
+{
+    stored_step = 0;
+    fail_set_step = 5;
+    assert_apply_patch_in_place_resumable("tests/files/foo/old",
+                                          "tests/files/foo/in-place-3000-500.patch",
+                                          "tests/files/foo/new",
+                                          false,
+                                          step_set_fail_after,
+                                          step_get_ok,
+                                          3000,
+                                          -DETOOLS_STEP_SET_FAILED);
+    assert(stored_step == 4);
+
+    /* Resume the aborted update. */
+    assert_apply_patch_in_place_resumable("tests/files/foo/old",
+                                          "tests/files/foo/in-place-3000-500.patch",
+                                          "tests/files/foo/new",
                                           true,
                                           step_set_ok,
                                           step_get_ok,
@@ -780,146 +1903,808 @@ static void test_apply_patch_one_byte(void)
                              -DETOOLS_SHORT_HEADER);
 }
 
-static void test_apply_patch_short_to_size(void)
-{
-    assert_apply_patch_error("tests/files/foo/old",
-                             "tests/files/foo/short-to-size.patch",
-                             -DETOOLS_SHORT_HEADER);
+static void test_apply_patch_short_to_size(void)
+{
+    assert_apply_patch_error("tests/files/foo/old",
+                             "tests/files/foo/short-to-size.patch",
+                             -DETOOLS_SHORT_HEADER);
+}
+
+static void test_apply_patch_file_open_error(void)
+{
+    assert_apply_patch_error("tests/files/foo/old.missing",
+                             "tests/files/foo/bad-compression.patch",
+                             -DETOOLS_FILE_OPEN_FAILED);
+
+    assert_apply_patch_error("tests/files/foo/old",
+                             "tests/files/foo/bad-compression.patch.missing",
+                             -DETOOLS_FILE_OPEN_FAILED);
+
+    assert(detools_apply_patch_filenames("tests/files/foo/old",
+                                         "tests/files/foo/bad-compression.patch",
+                                         "") == -DETOOLS_FILE_OPEN_FAILED);
+}
+
+static void test_apply_patch_foo_in_place_bad_patch_type(void)
+{
+    assert_apply_patch_in_place_error("tests/files/foo/old",
+                                      "tests/files/foo/patch",
+                                      3000,
+                                      -DETOOLS_BAD_PATCH_TYPE);
+}
+
+static void test_apply_patch_foo_in_place_memory_size_missing(void)
+{
+    assert_apply_patch_in_place_error(
+        "tests/files/foo/old",
+        "tests/files/foo/missing-in-place-memory-size.patch",
+        3000,
+        -DETOOLS_SHORT_HEADER);
+}
+
+static void test_apply_patch_foo_in_place_segment_size_missing(void)
+{
+    assert_apply_patch_in_place_error(
+        "tests/files/foo/old",
+        "tests/files/foo/missing-in-place-segment-size.patch",
+        3000,
+        -DETOOLS_SHORT_HEADER);
+}
+
+static void test_apply_patch_foo_in_place_shift_size_missing(void)
+{
+    assert_apply_patch_in_place_error(
+        "tests/files/foo/old",
+        "tests/files/foo/missing-in-place-shift-size.patch",
+        3000,
+        -DETOOLS_SHORT_HEADER);
+}
+
+static void test_apply_patch_foo_in_place_from_size_missing(void)
+{
+    assert_apply_patch_in_place_error(
+        "tests/files/foo/old",
+        "tests/files/foo/missing-in-place-from-size.patch",
+        3000,
+        -DETOOLS_SHORT_HEADER);
+}
+
+static void test_apply_patch_foo_incremental(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+    size_t expected_patch_size;
+    size_t patch_offset;
+    int res;
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+    expected_patch_size = patch_size;
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+
+    /* Process up to 64 new patch bytes per iteration. */
+    patch_offset = 0;
+
+    while (patch_offset < expected_patch_size) {
+        patch_size = MIN(expected_patch_size - patch_offset, 64);
+        res = detools_apply_patch_process(&apply_patch,
+                                          &patch_p[patch_offset],
+                                          patch_size);
+        assert(res == 0);
+        patch_offset += patch_size;
+    }
+
+    assert(detools_apply_patch_finalize(&apply_patch) == 2780);
+    io_assert_to_ok(&io);
+}
+
+static void test_apply_patch_foo_incremental_init_finalize(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    2780,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == -DETOOLS_SHORT_HEADER);
+}
+
+static void test_apply_patch_foo_incremental_process_once(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct io_t io;
+    const uint8_t *patch_p;
+    size_t patch_size;
+
+    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    io_read,
+                                    io_seek,
+                                    patch_size,
+                                    io_write,
+                                    &io) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       &patch_p[0],
+                                       64) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_NOT_ENOUGH_PATCH_DATA);
+}
+
+struct large_from_t {
+    int64_t offset;
+    int number_of_seeks;
+    uint8_t to[8];
+    size_t to_size;
+};
+
+static int large_from_read(void *arg_p, uint8_t *buf_p, size_t size)
+{
+    struct large_from_t *self_p;
+    size_t i;
+
+    self_p = (struct large_from_t *)arg_p;
+
+    for (i = 0; i < size; i++) {
+        buf_p[i] = (uint8_t)(self_p->offset + (int64_t)i);
+    }
+
+    self_p->offset += (int64_t)size;
+
+    return (0);
+}
+
+static int large_from_seek(void *arg_p, int offset)
+{
+    struct large_from_t *self_p;
+
+    self_p = (struct large_from_t *)arg_p;
+    self_p->offset += offset;
+    self_p->number_of_seeks++;
+
+    return (0);
+}
+
+static int large_from_write(void *arg_p, const uint8_t *buf_p, size_t size)
+{
+    struct large_from_t *self_p;
+
+    self_p = (struct large_from_t *)arg_p;
+
+    assert(self_p->to_size + size <= sizeof(self_p->to));
+
+    memcpy(&self_p->to[self_p->to_size], buf_p, size);
+    self_p->to_size += size;
+
+    return (0);
+}
+
+static void test_apply_patch_adjustment_larger_than_int(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct large_from_t large_from;
+    /* Copy 4 bytes at offset 0, adjust 3 GiB + 12 bytes and add one
+       to 4 bytes at that offset. */
+    static const uint8_t patch[] = {
+        0x00, 0x08, 0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0x8c,
+        0x80, 0x80, 0x80, 0x18, 0x04, 0x01, 0x01, 0x01, 0x01, 0x00,
+        0x00
+    };
+    static const uint8_t expected_to[] = {
+        0x00, 0x01, 0x02, 0x03, 0x11, 0x12, 0x13, 0x14
+    };
+
+    memset(&large_from, 0, sizeof(large_from));
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    large_from_read,
+                                    large_from_seek,
+                                    sizeof(patch),
+                                    large_from_write,
+                                    &large_from) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       &patch[0],
+                                       sizeof(patch)) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == 8);
+    assert(large_from.to_size == 8);
+    assert(memcmp(&large_from.to[0], &expected_to[0], 8) == 0);
+    assert(large_from.offset == 3221225492LL);
+    assert(large_from.number_of_seeks == 3);
+}
+
+static int large_from_seek64(void *arg_p, int64_t offset)
+{
+    struct large_from_t *self_p;
+
+    self_p = (struct large_from_t *)arg_p;
+    self_p->offset += offset;
+    self_p->number_of_seeks++;
+
+    return (0);
+}
+
+static void test_apply_patch_adjustment_larger_than_int_seek64(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct large_from_t large_from;
+    int64_t to_size;
+    /* Same patch as in test_apply_patch_adjustment_larger_than_int(). */
+    static const uint8_t patch[] = {
+        0x00, 0x08, 0x00, 0x04, 0x00, 0x00, 0x00, 0x00, 0x00, 0x8c,
+        0x80, 0x80, 0x80, 0x18, 0x04, 0x01, 0x01, 0x01, 0x01, 0x00,
+        0x00
+    };
+
+    memset(&large_from, 0, sizeof(large_from));
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    large_from_read,
+                                    large_from_seek,
+                                    sizeof(patch),
+                                    large_from_write,
+                                    &large_from) == 0);
+    assert(detools_apply_patch_set_from_seek64(&apply_patch,
+                                               large_from_seek64) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       &patch[0],
+                                       sizeof(patch)) == 0);
+    assert(detools_apply_patch_finalize64(&apply_patch, &to_size) == 0);
+    assert(to_size == 8);
+    assert(large_from.offset == 3221225492LL);
+    /* One seek per adjustment, as the 64-bit seek is not split. */
+    assert(large_from.number_of_seeks == 2);
+}
+
+static void test_apply_patch_to_size_larger_than_int(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct large_from_t large_from;
+    /* To size is 4 GiB + 2 bytes, but the patch ends after the first
+       diff and adjustment. */
+    static const uint8_t patch[] = {
+        0x00, 0x82, 0x80, 0x80, 0x80, 0x20, 0x00, 0x04, 0x01, 0x02,
+        0x03, 0x04, 0x00, 0x00
+    };
+    static const uint8_t expected_to[] = {
+        0x01, 0x03, 0x05, 0x07
+    };
+
+    memset(&large_from, 0, sizeof(large_from));
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    large_from_read,
+                                    large_from_seek,
+                                    sizeof(patch),
+                                    large_from_write,
+                                    &large_from) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       &patch[0],
+                                       sizeof(patch)) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_CORRUPT_PATCH);
+    assert(large_from.to_size == 4);
+    assert(memcmp(&large_from.to[0], &expected_to[0], 4) == 0);
+}
+
+static void write_sparse_file(const char *name_p,
+                              const uint8_t *head_p,
+                              size_t head_size,
+                              long hole_size,
+                              const uint8_t *tail_p,
+                              size_t tail_size)
+{
+    FILE *file_p;
+
+    file_p = fopen(name_p, "wb");
+    assert(file_p != NULL);
+
+    if (head_size > 0) {
+        assert(fwrite(head_p, 1, head_size, file_p) == head_size);
+    }
+
+    assert(fseek(file_p, hole_size, SEEK_CUR) == 0);
+    assert(fwrite(tail_p, 1, tail_size, file_p) == tail_size);
+    assert(fclose(file_p) == 0);
+}
+
+/* Apply a patch of 2 GiB + 8 bytes of to-data to a sparse from file
+   of 2 GiB + 4 bytes of zeros. */
+static void test_apply_patch_large_sparse_file(void)
+{
+    int64_t to_size;
+    /* Normal patch without compression. To size 2 GiB + 8 bytes, no
+       data format patch and a diff of 2 GiB + 4 bytes, all zeros. */
+    static const uint8_t patch_head[] = {
+        0x00, 0x88, 0x80, 0x80, 0x80, 0x10, 0x00, 0x84, 0x80, 0x80,
+        0x80, 0x10
+    };
+    /* Four extra bytes and no adjustment. */
+    static const uint8_t patch_tail[] = {
+        0x04, 0x01, 0x02, 0x03, 0x04, 0x00
+    };
+    static const uint8_t from_tail[] = {
+        0x00
+    };
+
+    write_sparse_file("large-sparse.patch",
+                      &patch_head[0],
+                      sizeof(patch_head),
+                      2147483652L,
+                      &patch_tail[0],
+                      sizeof(patch_tail));
+    write_sparse_file("large-sparse.from",
+                      NULL,
+                      0,
+                      2147483651L,
+                      &from_tail[0],
+                      sizeof(from_tail));
+
+    assert(detools_apply_patch_filenames64("large-sparse.from",
+                                           "large-sparse.patch",
+                                           "/dev/null",
+                                           &to_size) == 0);
+    assert(to_size == 2147483656LL);
+    assert(detools_apply_patch_filenames("large-sparse.from",
+                                         "large-sparse.patch",
+                                         "/dev/null")
+           == -DETOOLS_TO_SIZE_TOO_LARGE);
+
+    assert(remove("large-sparse.patch") == 0);
+    assert(remove("large-sparse.from") == 0);
+}
+
+static void test_apply_patch_heatshrink_bad_header(void)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct large_from_t large_from;
+    /* Heatshrink compressed patch with window size 15 and lookahead
+       size 0 in the heatshrink header. */
+    static const uint8_t patch[] = {
+        0x05, 0x02, 0xf0, 0x00
+    };
+
+    memset(&large_from, 0, sizeof(large_from));
+
+    assert(detools_apply_patch_init(&apply_patch,
+                                    large_from_read,
+                                    large_from_seek,
+                                    sizeof(patch),
+                                    large_from_write,
+                                    &large_from) == 0);
+    assert(detools_apply_patch_process(&apply_patch,
+                                       &patch[0],
+                                       sizeof(patch))
+           == -DETOOLS_HEATSHRINK_HEADER);
+    assert(detools_apply_patch_finalize(&apply_patch)
+           == -DETOOLS_ALREADY_FAILED);
+    assert(large_from.to_size == 0);
+}
+
+#if DETOOLS_CONFIG_BSDIFF == 1
+
+struct bsdiff_io_t {
+    struct io_t io;
+    const uint8_t *patch_p;
+};
+
+static int bsdiff_io_patch_read(void *arg_p,
+                                void *dst_p,
+                                uintptr_t src,
+                                size_t size)
+{
+    struct bsdiff_io_t *self_p;
+
+    self_p = (struct bsdiff_io_t *)arg_p;
+    memcpy(dst_p, &self_p->patch_p[src], size);
+
+    return (0);
+}
+
+static int apply_patch_bsdiff_callbacks(const char *from_p,
+                                        const uint8_t *patch_buf_p,
+                                        size_t patch_size,
+                                        const char *to_p,
+                                        bool check_to)
+{
+    struct bsdiff_io_t bsdiff_io;
+    int res;
+
+    io_init(&bsdiff_io.io, from_p, to_p);
+    bsdiff_io.patch_p = patch_buf_p;
+
+    res = detools_apply_patch_bsdiff_callbacks(io_read,
+                                               io_seek,
+                                               bsdiff_io_patch_read,
+                                               patch_size,
+                                               io_write,
+                                               &bsdiff_io);
+
+    if (check_to) {
+        assert(res == (int)bsdiff_io.io.to.size);
+        io_assert_to_ok(&bsdiff_io.io);
+    }
+
+    fclose(bsdiff_io.io.ffrom_p);
+    free(bsdiff_io.io.to.actual_p);
+    free(bsdiff_io.io.to.expected_p);
+
+    return (res);
 }
 
-static void test_apply_patch_file_open_error(void)
+static void assert_apply_patch_bsdiff(const char *from_p,
+                                      const char *patch_p,
+                                      const char *to_p)
 {
-    assert_apply_patch_error("tests/files/foo/old.missing",
-                             "tests/files/foo/bad-compression.patch",
-                             -DETOOLS_FILE_OPEN_FAILED);
+    const char *actual_to_p = "assert-apply-patch-bsdiff.new";
+    uint8_t *patch_buf_p;
+    size_t patch_size;
+    uint8_t *actual_p;
+    size_t actual_size;
+    uint8_t *expected_p;
+    size_t expected_size;
 
-    assert_apply_patch_error("tests/files/foo/old",
-                             "tests/files/foo/bad-compression.patch.missing",
-                             -DETOOLS_FILE_OPEN_FAILED);
+    /* Callbacks. */
+    patch_buf_p = patch_init(patch_p, &patch_size);
+    (void)apply_patch_bsdiff_callbacks(from_p,
+                                       patch_buf_p,
+                                       patch_size,
+                                       to_p,
+                                       true);
+    free(patch_buf_p);
 
-    assert(detools_apply_patch_filenames("tests/files/foo/old",
-                                         "tests/files/foo/bad-compression.patch",
-                                         "") == -DETOOLS_FILE_OPEN_FAILED);
+    /* Filenames. */
+    expected_p = read_init(to_p, &expected_size);
+    assert(detools_apply_patch_bsdiff_filenames(from_p, patch_p, actual_to_p)
+           == (int)expected_size);
+    actual_p = read_init(actual_to_p, &actual_size);
+    assert(actual_size == expected_size);
+    assert(memcmp(actual_p, expected_p, expected_size) == 0);
+    free(actual_p);
+    free(expected_p);
 }
 
-static void test_apply_patch_foo_in_place_bad_patch_type(void)
+static void test_apply_patch_bsdiff_foo(void)
 {
-    assert_apply_patch_in_place_error("tests/files/foo/old",
-                                      "tests/files/foo/patch",
-                                      3000,
-                                      -DETOOLS_BAD_PATCH_TYPE);
+    assert_apply_patch_bsdiff("tests/files/foo/old",
+                              "tests/files/foo/bsdiff.patch",
+                              "tests/files/foo/new");
 }
 
-static void test_apply_patch_foo_in_place_memory_size_missing(void)
+static void test_apply_patch_bsdiff_micropython(void)
 {
-    assert_apply_patch_in_place_error(
-        "tests/files/foo/old",
-        "tests/files/foo/missing-in-place-memory-size.patch",
-        3000,
-        -DETOOLS_SHORT_HEADER);
+    assert_apply_patch_bsdiff(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--"
+        "20190125-v1.10-bsdiff.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin");
 }
 
-static void test_apply_patch_foo_in_place_segment_size_missing(void)
+static int apply_patch_bsdiff_foo_modified(size_t offset,
+                                           uint8_t value,
+                                           size_t patch_size)
 {
-    assert_apply_patch_in_place_error(
-        "tests/files/foo/old",
-        "tests/files/foo/missing-in-place-segment-size.patch",
-        3000,
-        -DETOOLS_SHORT_HEADER);
+    uint8_t *patch_buf_p;
+    size_t size;
+    int res;
+
+    patch_buf_p = patch_init("tests/files/foo/bsdiff.patch", &size);
+    assert(patch_size <= size);
+    patch_buf_p[offset] = value;
+    res = apply_patch_bsdiff_callbacks("tests/files/foo/old",
+                                       patch_buf_p,
+                                       patch_size,
+                                       "tests/files/foo/new",
+                                       false);
+    free(patch_buf_p);
+
+    return (res);
 }
 
-static void test_apply_patch_foo_in_place_shift_size_missing(void)
+static void test_apply_patch_bsdiff_errors(void)
 {
-    assert_apply_patch_in_place_error(
-        "tests/files/foo/old",
-        "tests/files/foo/missing-in-place-shift-size.patch",
-        3000,
-        -DETOOLS_SHORT_HEADER);
+    size_t patch_size;
+
+    free(patch_init("tests/files/foo/bsdiff.patch", &patch_size));
+
+    /* Bad magic. */
+    assert(apply_patch_bsdiff_foo_modified(7, '1', patch_size)
+           == -DETOOLS_BAD_PATCH_TYPE);
+
+    /* Short header. */
+    assert(apply_patch_bsdiff_foo_modified(0, 'B', 31)
+           == -DETOOLS_SHORT_HEADER);
+
+    /* Control data size larger than the patch. */
+    assert(apply_patch_bsdiff_foo_modified(13, 0x01, patch_size)
+           == -DETOOLS_CORRUPT_PATCH);
+
+    /* Negative diff data size. */
+    assert(apply_patch_bsdiff_foo_modified(23, 0x80, patch_size)
+           == -DETOOLS_CORRUPT_PATCH);
+
+    /* Bad bzip2 magic in the control data. */
+    assert(apply_patch_bsdiff_foo_modified(32, 'A', patch_size)
+           == -DETOOLS_CORRUPT_PATCH);
+
+    /* Truncated extra data. */
+    assert(apply_patch_bsdiff_foo_modified(0, 'B', patch_size - 1)
+           == -DETOOLS_NOT_ENOUGH_PATCH_DATA);
 }
 
-static void test_apply_patch_foo_in_place_from_size_missing(void)
+#endif
+
+static void test_patch_info(void)
 {
-    assert_apply_patch_in_place_error(
-        "tests/files/foo/old",
-        "tests/files/foo/missing-in-place-from-size.patch",
-        3000,
-        -DETOOLS_SHORT_HEADER);
+    struct detools_patch_info_t info;
+    uint8_t *patch_p;
+    size_t patch_size;
+
+    /* Normal patch. */
+    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+    assert(detools_patch_info(patch_p, patch_size, &info) == 3);
+    assert(info.type == DETOOLS_PATCH_TYPE_NORMAL);
+    assert(info.compression == DETOOLS_COMPRESSION_LZMA);
+    assert(info.to_size == 2780);
+    assert(info.memory_size == 0);
+    free(patch_p);
+
+    /* In-place patch, given only the header. */
+    patch_p = patch_init("tests/files/foo/in-place-3000-500.patch",
+                         &patch_size);
+    assert(detools_patch_info(patch_p, 11, &info) == 11);
+    assert(info.type == DETOOLS_PATCH_TYPE_IN_PLACE);
+    assert(info.compression == DETOOLS_COMPRESSION_LZMA);
+    assert(info.memory_size == 3000);
+    assert(info.segment_size == 500);
+    assert(info.shift_size == 1000);
+    assert(info.from_size == 2780);
+    assert(info.to_size == 2780);
+    assert(detools_patch_info(patch_p, 10, &info) == -DETOOLS_SHORT_HEADER);
+    assert(detools_patch_info(patch_p, 0, &info) == -DETOOLS_SHORT_HEADER);
+    free(patch_p);
+
+    patch_p = patch_init("tests/files/foo/bad-patch-type.patch", &patch_size);
+    assert(detools_patch_info(patch_p, patch_size, &info)
+           == -DETOOLS_BAD_PATCH_TYPE);
+    free(patch_p);
+}
+
+static int validate_patch(const char *patch_p, size_t chunk_size)
+{
+    struct detools_validate_patch_t validate_patch;
+    uint8_t *patch_buf_p;
+    size_t patch_size;
+    size_t offset;
+    size_t size;
+    int res;
+
+    patch_buf_p = patch_init(patch_p, &patch_size);
+    assert(detools_validate_patch_init(&validate_patch, patch_size) == 0);
+
+    /* The header must be in the first chunk. */
+    offset = MIN(patch_size, 64);
+    res = detools_validate_patch_process(&validate_patch,
+                                         &patch_buf_p[0],
+                                         offset);
+
+    while ((offset < patch_size) && (res == 0)) {
+        size = MIN(chunk_size, patch_size - offset);
+        res = detools_validate_patch_process(&validate_patch,
+                                             &patch_buf_p[offset],
+                                             size);
+        offset += size;
+    }
+
+    if (res == 0) {
+        res = detools_validate_patch_finalize(&validate_patch);
+    } else {
+        (void)detools_validate_patch_finalize(&validate_patch);
+    }
+
+    free(patch_buf_p);
+
+    return (res);
 }
 
-static void test_apply_patch_foo_incremental(void)
+static void assert_validate_patch(const char *patch_p, int expected_res)
 {
-    struct detools_apply_patch_t apply_patch;
-    struct io_t io;
-    const uint8_t *patch_p;
-    size_t patch_size;
-    size_t expected_patch_size;
-    size_t patch_offset;
     int res;
 
-    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
-    patch_p = patch_init("tests/files/foo/patch", &patch_size);
-    expected_patch_size = patch_size;
+    res = validate_patch(patch_p, 1);
 
-    assert(detools_apply_patch_init(&apply_patch,
-                                    io_read,
-                                    io_seek,
-                                    patch_size,
-                                    io_write,
-                                    &io) == 0);
+    if (res == expected_res) {
+        res = validate_patch(patch_p, 4096);
+    }
 
-    /* Process up to 64 new patch bytes per iteration. */
-    patch_offset = 0;
+    if (res != expected_res) {
+        printf("FAIL: validate of '%s' failed with %d, expected %d\n",
+               patch_p,
+               res,
+               expected_res);
+        exit(1);
+    }
+}
 
-    while (patch_offset < expected_patch_size) {
-        patch_size = MIN(expected_patch_size - patch_offset, 64);
-        res = detools_apply_patch_process(&apply_patch,
-                                          &patch_p[patch_offset],
-                                          patch_size);
-        assert(res == 0);
-        patch_offset += patch_size;
+static void test_validate_patch(void)
+{
+    /* Valid patches. */
+    assert_validate_patch("tests/files/foo/patch", 2780);
+    assert_validate_patch("tests/files/foo/none.patch", 2780);
+    assert_validate_patch("tests/files/foo/crle.patch", 2780);
+    assert_validate_patch("tests/files/foo/heatshrink.patch", 2780);
+    assert_validate_patch("tests/files/foo/lzma-options.patch", 2780);
+    assert_validate_patch("tests/files/foo/in-place-3000-500.patch", 2780);
+    assert_validate_patch("tests/files/foo/in-place-6000-1000-crle.patch",
+                          2780);
+    assert_validate_patch("tests/files/foo/in-place-many-segments.patch",
+                          2780);
+    assert_validate_patch(
+        "tests/files/foo/in-place-many-segments-unchanged.patch",
+        2780);
+    assert_validate_patch("tests/files/foo/in-place-periodic.patch", 3000);
+    assert_validate_patch("tests/files/empty/none.patch", 0);
+    assert_validate_patch("tests/files/empty/in-place.patch", 0);
+    assert_validate_patch("tests/files/shell/arm-cortex-m4.patch", 141800);
+    assert_validate_patch("tests/files/shell/in-place-arm-cortex-m4.patch",
+                          141800);
+    assert_validate_patch("tests/files/shell-pi-3/1--2-aarch64.patch",
+                          112576);
+    assert_validate_patch(
+        "tests/files/micropython/esp8266-20180511-v1.9.4--20190125-v1.10-"
+        "xtensa-lx106.patch",
+        615388);
+
+    /* Corrupt patches. */
+    assert_validate_patch("tests/files/foo/short.patch",
+                          -DETOOLS_CORRUPT_PATCH);
+    assert_validate_patch("tests/files/foo/short-none.patch",
+                          -DETOOLS_CORRUPT_PATCH);
+    assert_validate_patch("tests/files/foo/bad-lzma-end.patch",
+                          -DETOOLS_LZMA_DECODE);
+    assert_validate_patch("tests/files/foo/diff-data-too-long.patch",
+                          -DETOOLS_CORRUPT_PATCH);
+    assert_validate_patch("tests/files/foo/extra-data-too-long.patch",
+                          -DETOOLS_CORRUPT_PATCH);
+    assert_validate_patch("tests/files/foo/bad-patch-type.patch",
+                          -DETOOLS_BAD_PATCH_TYPE);
+    assert_validate_patch("tests/files/foo/bad-compression.patch",
+                          -DETOOLS_BAD_COMPRESSION);
+    assert_validate_patch("tests/files/foo/one-byte.patch",
+                          -DETOOLS_SHORT_HEADER);
+    assert_validate_patch("tests/files/foo/short-to-size.patch",
+                          -DETOOLS_SHORT_HEADER);
+    assert_validate_patch("tests/files/foo/missing-in-place-from-size.patch",
+                          -DETOOLS_SHORT_HEADER);
+}
+
+static size_t pack_size(uint8_t *buf_p, size_t value)
+{
+    size_t size;
+
+    buf_p[0] = (uint8_t)(0x80 | (value & 0x3f));
+    value >>= 6;
+    size = 1;
+
+    while (value > 0) {
+        buf_p[size] = (uint8_t)(0x80 | (value & 0x7f));
+        value >>= 7;
+        size++;
     }
 
-    assert(detools_apply_patch_finalize(&apply_patch) == 2780);
-    io_assert_to_ok(&io);
+    buf_p[size - 1] &= 0x7f;
+
+    return (size);
 }
 
-static void test_apply_patch_foo_incremental_init_finalize(void)
+/**
+ * Create an uncompressed normal patch with given diff data followed
+ * by three bytes of extra data, all added to from data at offset 0.
+ */
+static uint8_t *create_diff_patch(const uint8_t *diff_p,
+                                  size_t diff_size,
+                                  size_t *patch_size_p)
 {
-    struct detools_apply_patch_t apply_patch;
-    struct io_t io;
+    uint8_t *patch_p;
+    size_t size;
 
-    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
+    patch_p = mymalloc(diff_size + 32);
+    patch_p[0] = 0x00;
+    size = 1;
+    size += pack_size(&patch_p[size], diff_size + 3);
+    patch_p[size++] = 0x00;
+    size += pack_size(&patch_p[size], diff_size);
+    memcpy(&patch_p[size], diff_p, diff_size);
+    size += diff_size;
+    size += pack_size(&patch_p[size], 3);
+    patch_p[size++] = 0x01;
+    patch_p[size++] = 0x02;
+    patch_p[size++] = 0x03;
+    patch_p[size++] = 0x00;
+    *patch_size_p = size;
 
-    assert(detools_apply_patch_init(&apply_patch,
-                                    io_read,
-                                    io_seek,
-                                    2780,
-                                    io_write,
-                                    &io) == 0);
-    assert(detools_apply_patch_finalize(&apply_patch) == -DETOOLS_SHORT_HEADER);
+    return (patch_p);
 }
 
-static void test_apply_patch_foo_incremental_process_once(void)
+static void assert_apply_diff_patch(const uint8_t *from_p,
+                                    const uint8_t *diff_p,
+                                    size_t diff_size)
 {
     struct detools_apply_patch_t apply_patch;
     struct io_t io;
-    const uint8_t *patch_p;
+    uint8_t *patch_p;
     size_t patch_size;
+    size_t i;
 
-    io_init(&io, "tests/files/foo/old", "tests/files/foo/new");
-    patch_p = patch_init("tests/files/foo/patch", &patch_size);
+    patch_p = create_diff_patch(diff_p, diff_size, &patch_size);
+    io.to.size = (diff_size + 3);
+    io.to.actual_p = mymalloc(io.to.size);
+    io.to.expected_p = mymalloc(io.to.size);
+    io.to.written = 0;
 
-    assert(detools_apply_patch_init(&apply_patch,
-                                    io_read,
-                                    io_seek,
-                                    patch_size,
-                                    io_write,
-                                    &io) == 0);
+    for (i = 0; i < diff_size; i++) {
+        io.to.expected_p[i] = (uint8_t)(from_p[i] + diff_p[i]);
+    }
+
+    memcpy(&io.to.expected_p[diff_size], "\x01\x02\x03", 3);
+
+    assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                from_p,
+                                                diff_size,
+                                                patch_size,
+                                                io_write,
+                                                &io) == 0);
     assert(detools_apply_patch_process(&apply_patch,
-                                       &patch_p[0],
-                                       64) == 0);
-    assert(detools_apply_patch_finalize(&apply_patch)
-           == -DETOOLS_NOT_ENOUGH_PATCH_DATA);
+                                       patch_p,
+                                       patch_size) == 0);
+    assert(detools_apply_patch_finalize(&apply_patch) == (int)io.to.size);
+    io_assert_to_ok(&io);
+
+    free(patch_p);
+    free(io.to.actual_p);
+    free(io.to.expected_p);
+}
+
+static void test_apply_patch_diff_addition(void)
+{
+    uint8_t from[1027];
+    uint8_t diff[1027];
+    size_t i;
+    size_t offset;
+
+    srand(0);
+
+    for (i = 0; i < sizeof(from); i++) {
+        from[i] = (uint8_t)rand();
+        diff[i] = (uint8_t)rand();
+    }
+
+    /* Some all zeros diff chunks and some with a few non-zero
+       bytes. */
+    memset(&diff[256], 0, 512);
+    diff[300] = 0xff;
+    diff[767] = 0x80;
+
+    /* Various sizes and unaligned from and diff data. */
+    for (offset = 0; offset < 17; offset++) {
+        assert_apply_diff_patch(&from[offset],
+                                &diff[17 - offset],
+                                sizeof(diff) - 17);
+        assert_apply_diff_patch(&from[offset], &diff[0], offset + 1);
+    }
 }
 
 static void test_error_as_string(void)
@@ -970,28 +2755,414 @@ static void test_error_as_string(void)
                   "Step set failed.") == 0);
     assert(strcmp(detools_error_as_string(DETOOLS_STEP_GET_FAILED),
                   "Step get failed.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_BAD_DATA_FORMAT),
+                  "Bad data format.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_MISSING_FROM_SIZE),
+                  "Missing from size.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_BAD_CHECKPOINT),
+                  "Bad checkpoint.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_BAD_DIGEST),
+                  "Bad digest.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_DIGEST_MISMATCH),
+                  "Digest mismatch.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_BZ2_INIT),
+                  "BZ2 init.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_BZ2_DECOMPRESS),
+                  "BZ2 decompress.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_HEATSHRINK_HEADER),
+                  "Heatshrink header.") == 0);
+    assert(strcmp(detools_error_as_string(DETOOLS_TO_SIZE_TOO_LARGE),
+                  "To size too large.") == 0);
     assert(strcmp(detools_error_as_string(-1),
                   "Unknown error.") == 0);
 }
 
-int main()
+/*
+ * Benchmark.
+ */
+
+#define BENCHMARK_ITERATIONS 20
+
+struct benchmark_t {
+    const uint8_t *from_p;
+    size_t from_offset;
+    uint8_t *to_p;
+    size_t to_offset;
+    int number_of_reads;
+    int number_of_writes;
+};
+
+static int benchmark_read(void *arg_p, uint8_t *buf_p, size_t size)
+{
+    struct benchmark_t *self_p;
+
+    self_p = (struct benchmark_t *)arg_p;
+    memcpy(buf_p, &self_p->from_p[self_p->from_offset], size);
+    self_p->from_offset += size;
+    self_p->number_of_reads++;
+
+    return (0);
+}
+
+static int benchmark_seek(void *arg_p, int offset)
+{
+    struct benchmark_t *self_p;
+
+    self_p = (struct benchmark_t *)arg_p;
+    self_p->from_offset += (size_t)offset;
+
+    return (0);
+}
+
+static int benchmark_write(void *arg_p, const uint8_t *buf_p, size_t size)
+{
+    struct benchmark_t *self_p;
+
+    self_p = (struct benchmark_t *)arg_p;
+    memcpy(&self_p->to_p[self_p->to_offset], buf_p, size);
+    self_p->to_offset += size;
+    self_p->number_of_writes++;
+
+    return (0);
+}
+
+static int benchmark_mem_read(void *arg_p,
+                              void *dst_p,
+                              uintptr_t src,
+                              size_t size)
+{
+    struct benchmark_t *self_p;
+
+    self_p = (struct benchmark_t *)arg_p;
+    memcpy(dst_p, &self_p->to_p[src], size);
+    self_p->number_of_reads++;
+
+    return (0);
+}
+
+static int benchmark_mem_write(void *arg_p,
+                               uintptr_t dst,
+                               void *src_p,
+                               size_t size)
+{
+    struct benchmark_t *self_p;
+
+    self_p = (struct benchmark_t *)arg_p;
+    memcpy(&self_p->to_p[dst], src_p, size);
+    self_p->number_of_writes++;
+
+    return (0);
+}
+
+static int benchmark_mem_erase(void *arg_p, uintptr_t addr, size_t size)
+{
+    struct benchmark_t *self_p;
+
+    self_p = (struct benchmark_t *)arg_p;
+    memset(&self_p->to_p[addr], -1, size);
+
+    return (0);
+}
+
+static double benchmark_throughput(size_t to_size, clock_t elapsed)
+{
+    double seconds;
+
+    seconds = ((double)elapsed / CLOCKS_PER_SEC);
+
+    return (((double)to_size * BENCHMARK_ITERATIONS) / seconds / 1000000.0);
+}
+
+static void benchmark_apply_patch(const char *from_p,
+                                  const char *patch_p,
+                                  const char *to_p,
+                                  bool from_memory)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct benchmark_t benchmark;
+    uint8_t *patch_buf_p;
+    uint8_t *expected_p;
+    size_t from_size;
+    size_t patch_size;
+    size_t to_size;
+    clock_t start;
+    int i;
+
+    benchmark.from_p = read_init(from_p, &from_size);
+    patch_buf_p = read_init(patch_p, &patch_size);
+    expected_p = read_init(to_p, &to_size);
+    benchmark.to_p = mymalloc(to_size);
+    start = clock();
+
+    for (i = 0; i < BENCHMARK_ITERATIONS; i++) {
+        benchmark.from_offset = 0;
+        benchmark.to_offset = 0;
+        benchmark.number_of_reads = 0;
+        benchmark.number_of_writes = 0;
+        if (from_memory) {
+            assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                        benchmark.from_p,
+                                                        from_size,
+                                                        patch_size,
+                                                        benchmark_write,
+                                                        &benchmark) == 0);
+        } else {
+            assert(detools_apply_patch_init(&apply_patch,
+                                            benchmark_read,
+                                            benchmark_seek,
+                                            patch_size,
+                                            benchmark_write,
+                                            &benchmark) == 0);
+            assert(detools_apply_patch_set_from_size(&apply_patch,
+                                                     from_size) == 0);
+        }
+
+        assert(detools_apply_patch_process(&apply_patch,
+                                           patch_buf_p,
+                                           patch_size) == 0);
+        assert(detools_apply_patch_finalize(&apply_patch) == (int)to_size);
+    }
+
+    printf("  %-9s %7d from reads, %7d to writes, %7.1f MB/s\n",
+           from_memory ? "memory:" : "normal:",
+           benchmark.number_of_reads,
+           benchmark.number_of_writes,
+           benchmark_throughput(to_size, clock() - start));
+    assert(memcmp(benchmark.to_p, expected_p, to_size) == 0);
+
+    free((void *)benchmark.from_p);
+    free(patch_buf_p);
+    free(expected_p);
+    free(benchmark.to_p);
+}
+
+static void benchmark_apply_patch_in_place(const char *from_p,
+                                           const char *patch_p,
+                                           const char *to_p,
+                                           size_t memory_size)
+{
+    struct detools_apply_patch_in_place_t apply_patch;
+    struct benchmark_t benchmark;
+    uint8_t *from_buf_p;
+    uint8_t *patch_buf_p;
+    uint8_t *expected_p;
+    size_t from_size;
+    size_t patch_size;
+    size_t to_size;
+    clock_t start;
+    clock_t elapsed;
+    int i;
+
+    from_buf_p = read_init(from_p, &from_size);
+    patch_buf_p = read_init(patch_p, &patch_size);
+    expected_p = read_init(to_p, &to_size);
+    benchmark.to_p = mymalloc(memory_size);
+    elapsed = 0;
+
+    for (i = 0; i < BENCHMARK_ITERATIONS; i++) {
+        memset(benchmark.to_p, -1, memory_size);
+        memcpy(benchmark.to_p, from_buf_p, from_size);
+        benchmark.number_of_reads = 0;
+        benchmark.number_of_writes = 0;
+        start = clock();
+        assert(detools_apply_patch_in_place_init(&apply_patch,
+                                                 benchmark_mem_read,
+                                                 benchmark_mem_write,
+                                                 benchmark_mem_erase,
+                                                 NULL,
+                                                 NULL,
+                                                 patch_size,
+                                                 &benchmark) == 0);
+        assert(detools_apply_patch_in_place_process(&apply_patch,
+                                                    patch_buf_p,
+                                                    patch_size) == 0);
+        assert(detools_apply_patch_in_place_finalize(&apply_patch)
+               == (int)to_size);
+        elapsed += (clock() - start);
+    }
+
+    printf("  in-place: %7d mem reads,  %7d mem writes, %7.1f MB/s\n",
+           benchmark.number_of_reads,
+           benchmark.number_of_writes,
+           benchmark_throughput(to_size, elapsed));
+    assert(memcmp(benchmark.to_p, expected_p, to_size) == 0);
+
+    free(from_buf_p);
+    free(patch_buf_p);
+    free(expected_p);
+    free(benchmark.to_p);
+}
+
+static void benchmark_diff_addition(const char *name_p,
+                                    const uint8_t *from_p,
+                                    const uint8_t *diff_p,
+                                    size_t diff_size)
+{
+    struct detools_apply_patch_t apply_patch;
+    struct benchmark_t benchmark;
+    uint8_t *patch_p;
+    size_t patch_size;
+    clock_t start;
+    int i;
+
+    patch_p = create_diff_patch(diff_p, diff_size, &patch_size);
+    benchmark.to_p = mymalloc(diff_size + 3);
+    start = clock();
+
+    for (i = 0; i < BENCHMARK_ITERATIONS; i++) {
+        benchmark.to_offset = 0;
+        assert(detools_apply_patch_init_from_memory(&apply_patch,
+                                                    from_p,
+                                                    diff_size,
+                                                    patch_size,
+                                                    benchmark_write,
+                                                    &benchmark) == 0);
+        assert(detools_apply_patch_process(&apply_patch,
+                                           patch_p,
+                                           patch_size) == 0);
+        assert(detools_apply_patch_finalize(&apply_patch)
+               == (int)(diff_size + 3));
+    }
+
+    printf("  %-9s %7.1f MB/s\n",
+           name_p,
+           benchmark_throughput(diff_size, clock() - start));
+
+    for (i = 0; i < (int)diff_size; i++) {
+        assert(benchmark.to_p[i] == (uint8_t)(from_p[i] + diff_p[i]));
+    }
+
+    free(patch_p);
+    free(benchmark.to_p);
+}
+
+/**
+ * Throughput of the diff addition of an uncompressed patch applied
+ * from memory, with random, sparse and all zeros diff data.
+ */
+static void benchmark_diff_additions(void)
+{
+    uint8_t *from_p;
+    uint8_t *diff_p;
+    size_t size;
+    size_t i;
+
+    size = 4194304;
+    from_p = mymalloc(size);
+    diff_p = mymalloc(size);
+    srand(0);
+
+    for (i = 0; i < size; i++) {
+        from_p[i] = (uint8_t)rand();
+        diff_p[i] = (uint8_t)rand();
+    }
+
+    printf("Diff addition:\n");
+    benchmark_diff_addition("random:", from_p, diff_p, size);
+
+    for (i = 0; i < size; i++) {
+        if ((i % 64) != 0) {
+            diff_p[i] = 0;
+        }
+    }
+
+    benchmark_diff_addition("sparse:", from_p, diff_p, size);
+    memset(diff_p, 0, size);
+    benchmark_diff_addition("zeros:", from_p, diff_p, size);
+
+    free(from_p);
+    free(diff_p);
+}
+
+/**
+ * Print callback counts and throughput for the configured work buffer
+ * size. Build with different DETOOLS_CONFIG_WORK_BUFFER_SIZE to
+ * compare.
+ */
+static void benchmark(void)
+{
+    printf("Work buffer size: %d bytes\n", DETOOLS_CONFIG_WORK_BUFFER_SIZE);
+    benchmark_apply_patch(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--"
+        "20190125-v1.10-none.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        false);
+    benchmark_apply_patch(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--"
+        "20190125-v1.10-none.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        true);
+    benchmark_apply_patch_in_place(
+        "tests/files/micropython/esp8266-20180511-v1.9.4.bin",
+        "tests/files/micropython/esp8266-20180511-v1.9.4--"
+        "20190125-v1.10-in-place.patch",
+        "tests/files/micropython/esp8266-20190125-v1.10.bin",
+        2097152);
+    benchmark_diff_additions();
+}
+
+int main(int argc, const char *argv[])
 {
+    if ((argc == 2) && (strcmp(argv[1], "benchmark") == 0)) {
+        benchmark();
+
+        return (0);
+    }
+
     test_apply_patch_foo();
     test_apply_patch_foo_backwards();
     test_apply_patch_micropython();
     test_apply_patch_foo_none_compression();
     test_apply_patch_foo_heatshrink_compression();
+    test_apply_patch_foo_heatshrink_sizes();
     test_apply_patch_micropython_none_compression();
     test_apply_patch_micropython_heatshrink_compression();
     test_apply_patch_foo_crle_compression();
     test_apply_patch_micropython_crle_compression();
+    test_apply_patch_shell_arm_cortex_m4();
+    test_apply_patch_shell_arm_cortex_m4_crle();
+    test_apply_patch_micropython_xtensa_lx106();
+    test_apply_patch_micropython_xtensa_lx106_data_sections();
+    test_apply_patch_shell_pi_3_aarch64();
+    test_apply_patch_shell_pi_3_aarch64_data_sections();
+    test_apply_patch_pybv11_arm_cortex_m4_out_of_memory();
+    test_apply_patch_shell_arm_cortex_m4_missing_from_size();
+    test_apply_patch_shell_arm_cortex_m4_set_from_size();
+    test_apply_patch_micropython_lzma_arena();
+    test_apply_patch_foo_lzma_arena_too_small();
+    test_apply_patch_foo_lzma_options_arena();
+    test_apply_patch_shell_arm_cortex_m4_lzma_auto();
+    test_apply_patch_foo_from_memory();
+    test_apply_patch_micropython_from_memory();
+    test_apply_patch_shell_arm_cortex_m4_from_memory();
+    test_apply_patch_micropython_resume();
+    test_apply_patch_micropython_resume_from_memory();
+    test_apply_patch_shell_arm_cortex_m4_resume();
+    test_apply_patch_foo_resume_bad_checkpoint();
+    test_apply_patch_foo_resume_other_patch();
+    test_apply_patch_foo_digest_crc32();
+    test_apply_patch_foo_digest_sha256();
+    test_apply_patch_foo_digest_mismatch();
+    test_apply_patch_bad_digest();
+    test_apply_patch_foo_in_place_digest();
+    test_apply_patch_foo_in_place_unchanged();
+    test_apply_patch_foo_in_place_unchanged_bad_patch_type();
+    test_apply_patch_foo_in_place_mem_async();
+    test_apply_patch_foo_in_place_resume_digest();
+    test_apply_patch_foo_from_memory_too_short();
     test_apply_patch_micropython_in_place();
+    test_apply_patch_shell_in_place_arm_cortex_m4();
+    test_apply_patch_micropython_in_place_xtensa_lx106();
     test_apply_patch_foo_in_place_3000_1500();
     test_apply_patch_foo_in_place_3k_1_5k();
     test_apply_patch_foo_in_place_3000_1500_1500();
     test_apply_patch_foo_in_place_3000_500();
     test_apply_patch_foo_in_place_3000_500_crle();
     test_apply_patch_foo_in_place_6000_1000_crle();
+    test_apply_patch_foo_in_place_many_segments();
+    test_apply_patch_foo_in_place_many_segments_unchanged();
     test_apply_patch_foo_in_place_resumable_3000_500();
     test_apply_patch_foo_in_place_resume_3000_500_fail_set_step_2();
     test_apply_patch_foo_in_place_resume_3000_500_fail_set_step_5();
@@ -1032,6 +3203,19 @@ int main()
     test_apply_patch_foo_incremental();
     test_apply_patch_foo_incremental_init_finalize();
     test_apply_patch_foo_incremental_process_once();
+    test_apply_patch_adjustment_larger_than_int();
+    test_apply_patch_adjustment_larger_than_int_seek64();
+    test_apply_patch_to_size_larger_than_int();
+    test_apply_patch_large_sparse_file();
+    test_apply_patch_heatshrink_bad_header();
+    test_apply_patch_diff_addition();
+    test_patch_info();
+    test_validate_patch();
+#if DETOOLS_CONFIG_BSDIFF == 1
+    test_apply_patch_bsdiff_foo();
+    test_apply_patch_bsdiff_micropython();
+    test_apply_patch_bsdiff_errors();
+#endif
 
     test_error_as_string();
 
@@ -107,6 +107,19 @@ class DetoolsBsdiffTest(unittest.TestCase):
                 detools.cbsdiff.create_patch(suffix_array, data, readme_data),
                 detools.bsdiff.create_patch(suffix_array, data, readme_data))
 
+    def test_add_bytes_c_and_py_compatibility(self):
+        datas = [
+            (b'', b''),
+            (b'\x01', b''),
+            (b'\xff\x80\x7f', b'\x01\x80\x81\x00'),
+            (read_file('tests/files/foo/old'), read_file('tests/files/foo/new'))
+        ]
+
+        for a, b in datas:
+            expected = bytes((x + y) & 0xff for x, y in zip(a, b))
+            self.assertEqual(detools.cbsdiff.add_bytes(a, b), expected)
+            self.assertEqual(detools.bsdiff.add_bytes(a, b), expected)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -32,6 +32,26 @@ class DetoolsCommandLineTest(unittest.TestCase):
         self.assertEqual(read_file(foo_patch),
                          read_file('tests/files/foo/patch'))
 
+    def test_command_line_create_patch_foo_lzma_options(self):
+        foo_patch = 'foo-lzma-options.patch'
+        argv = [
+            'detools',
+            'create_patch',
+            '--lzma-options', 'bcj=arm-thumb,dict_size=4KiB,lc=0,lp=0,pb=0',
+            'tests/files/foo/old',
+            'tests/files/foo/new',
+            foo_patch
+        ]
+
+        if os.path.exists(foo_patch):
+            os.remove(foo_patch)
+
+        with patch('sys.argv', argv):
+            detools._main()
+
+        self.assertEqual(read_file(foo_patch),
+                         read_file('tests/files/foo/lzma-options.patch'))
+
     def test_command_line_apply_patch_foo(self):
         foo_new = 'foo.new'
         argv = [
@@ -52,6 +72,109 @@ class DetoolsCommandLineTest(unittest.TestCase):
         self.assertEqual(read_file(foo_new),
                          read_file('tests/files/foo/new'))
 
+    def test_command_line_apply_patch_foo_checkpoint(self):
+        foo_new = 'foo.new'
+        argv = [
+            'detools',
+            '--debug',
+            'apply_patch',
+            '--checkpoint', 'foo.checkpoint',
+            '--checkpoint-interval', '1 KiB',
+            'tests/files/foo/old',
+            'tests/files/foo/patch',
+            foo_new
+        ]
+
+        if os.path.exists(foo_new):
+            os.remove(foo_new)
+
+        with patch('sys.argv', argv):
+            detools._main()
+
+        self.assertEqual(read_file(foo_new),
+                         read_file('tests/files/foo/new'))
+        self.assertFalse(os.path.exists('foo.checkpoint'))
+
+    def test_command_line_apply_patch_chain_foo(self):
+        foo_new = 'foo.new'
+        argv = [
+            'detools',
+            '--debug',
+            'apply_patch_chain',
+            'tests/files/foo/old',
+            foo_new,
+            'tests/files/foo/patch'
+        ]
+
+        if os.path.exists(foo_new):
+            os.remove(foo_new)
+
+        with patch('sys.argv', argv):
+            detools._main()
+
+        self.assertEqual(read_file(foo_new),
+                         read_file('tests/files/foo/new'))
+
+    def test_command_line_apply_patches(self):
+        manifest = 'apply-patches.manifest'
+
+        with open(manifest, 'w') as fout:
+            fout.write(
+                '# From, patch and to files.\n'
+                '\n'
+                'tests/files/foo/old tests/files/foo/patch foo.new\n'
+                'tests/files/foo/old tests/files/foo/none.patch foo-none.new\n')
+
+        argv = [
+            'detools',
+            'apply_patches',
+            '--max-workers', '2',
+            '--digest', 'sha256',
+            manifest
+        ]
+        stdout = StringIO()
+
+        with patch('sys.argv', argv):
+            with patch('sys.stdout', stdout):
+                detools._main()
+
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('foo.new: 2780 bytes in '))
+        self.assertTrue(lines[1].startswith('foo-none.new: 2780 bytes in '))
+        self.assertTrue(lines[0].endswith(
+            ', sha256 '
+            '8be7c33a6d2cc6ccf95152f68aa445ec'
+            '6492db71c01d003c5bc5b5cde0873b7a'))
+        self.assertEqual(read_file('foo.new'), read_file('tests/files/foo/new'))
+        self.assertEqual(read_file('foo-none.new'),
+                         read_file('tests/files/foo/new'))
+        os.remove('foo-none.new')
+        os.remove(manifest)
+
+    def test_command_line_apply_patches_error(self):
+        manifest = 'apply-patches.manifest'
+
+        with open(manifest, 'w') as fout:
+            fout.write('tests/files/foo/old tests/files/foo/patch foo.new\n'
+                       'tests/files/foo/old tests/files/foo/bad-lzma-end.patch '
+                       'foo-bad.new\n')
+
+        argv = ['detools', 'apply_patches', manifest]
+        stdout = StringIO()
+
+        with patch('sys.argv', argv):
+            with patch('sys.stdout', stdout):
+                with self.assertRaises(SystemExit) as cm:
+                    detools._main()
+
+        self.assertEqual(str(cm.exception),
+                         'error: 1 of 2 patches failed.')
+        self.assertTrue(stdout.getvalue().endswith(
+            'foo-bad.new: error: Patch decompression failed.\n'))
+        os.remove('foo-bad.new')
+        os.remove(manifest)
+
     def test_command_line_patch_info_foo(self):
         argv = [
             'detools',
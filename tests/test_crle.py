@@ -1,8 +1,60 @@
+import random
 import unittest
 
 import detools
 from detools.create import CrleCompressor
 from detools.apply import CrleDecompressor
+from detools.compression import crle
+
+try:
+    from detools.compression import ccrle
+except ImportError:
+    ccrle = None
+
+
+def random_data(seed):
+    rng = random.Random(seed)
+    data = bytearray()
+
+    for _ in range(200):
+        if rng.random() < 0.3:
+            data += rng.randint(1, 300) * bytes((rng.randint(0, 3), ))
+        else:
+            data += bytes(rng.randint(0, 3) for _ in range(rng.randint(0, 20)))
+
+    return bytes(data)
+
+
+def compress_chunks(data, chunk_size):
+    compressor = CrleCompressor()
+    compressed = b''
+
+    for offset in range(0, len(data), chunk_size):
+        compressed += compressor.compress(data[offset:offset + chunk_size])
+
+    return compressed + compressor.flush()
+
+
+def compress_segments_chunks(compress_segments, data, chunk_size):
+    """Returns the compressed segments and the state after each chunk.
+
+    """
+
+    scattered = bytearray()
+    run_byte = 0
+    run_length = 0
+    result = []
+
+    for offset in range(0, len(data) + chunk_size, chunk_size):
+        compressed, run_byte, run_length = compress_segments(
+            data[offset:offset + chunk_size],
+            scattered,
+            run_byte,
+            run_length,
+            offset >= len(data))
+        result.append((compressed, bytes(scattered), run_byte, run_length))
+
+    return result
 
 
 class DetoolsCrleTest(unittest.TestCase):
@@ -33,6 +85,55 @@ class DetoolsCrleTest(unittest.TestCase):
 
             self.assertEqual(data, compressed)
 
+    def test_compress_chunk_size(self):
+        for seed in range(10):
+            data = random_data(seed)
+            compressed = compress_chunks(data, len(data))
+
+            for chunk_size in [1, 5, 6, 7, 512]:
+                self.assertEqual(compress_chunks(data, chunk_size), compressed)
+
+            for size in [1, 7, 512]:
+                decompressor = CrleDecompressor(len(compressed))
+                decompressed = b''
+
+                for offset in range(0, len(compressed), size):
+                    decompressed += decompressor.decompress(
+                        compressed[offset:offset + size],
+                        size)
+
+                while not decompressor.eof:
+                    decompressed += decompressor.decompress(b'', size)
+
+                self.assertEqual(decompressed, data)
+
+    @unittest.skipIf(ccrle is None, 'C extension not available.')
+    def test_c_extension(self):
+        for seed in range(10):
+            data = random_data(seed)
+            result = compress_segments_chunks(crle.compress_segments,
+                                              data,
+                                              7)
+            self.assertEqual(
+                compress_segments_chunks(ccrle.compress_segments, data, 7),
+                result)
+            compressed = b''.join([compressed for compressed, _, _, _ in result])
+
+            for size in range(0, len(compressed), 13):
+                outdata, consumed, left = crle.decompress_segments(
+                    compressed[:size],
+                    0)
+                self.assertEqual(
+                    ccrle.decompress_segments(compressed[:size], 0),
+                    (bytes(outdata), consumed, left))
+
+        with self.assertRaises(detools.Error) as cm:
+            ccrle.decompress_segments(b'\x02\x01A', 0)
+
+        self.assertEqual(
+            str(cm.exception),
+            'Expected kind scattered(0) or repeated(1), but got 2.')
+
     def test_decompress_no_data(self):
         compressed = b'\x00\x00'
 
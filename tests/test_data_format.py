@@ -1,7 +1,10 @@
 import unittest
+from io import BytesIO
 from elftools.elf.elffile import ELFFile
 
 from detools.data_format.utils import Blocks
+from detools.data_format.utils import DiffReader
+from detools.data_format.utils import FromReader
 from detools.data_format import elf
 
 
@@ -24,6 +27,35 @@ class DetoolsDataFormatTest(unittest.TestCase):
         self.assertEqual(blocks.to_bytes(),
                          (b'\x01\x00\x01\x03', b'\x02\x03\x04'))
 
+    def test_diff_reader(self):
+        blocks = Blocks()
+        blocks.append(0, 2, [1, 2])
+        blocks.append(2, 5, [0])
+        diff_reader = DiffReader(None, 12)
+        diff_reader._write_s32_values_to_to(blocks, {0: 2, 4: 4, 8: 0x1000})
+
+        # The last value overwrites parts of the first two.
+        self.assertEqual(diff_reader.read(),
+                         b'\x00\x00\x01\x00\x00\x00\x10\x00\x00\x00\x00\x00')
+        diff_reader.seek(5)
+        self.assertEqual(diff_reader.read(3), b'\x00\x10\x00')
+        self.assertEqual(diff_reader.tell(), 8)
+        self.assertEqual(diff_reader.read(100), b'\x00\x00\x00\x00')
+        self.assertEqual(diff_reader.read(1), b'')
+
+    def test_from_reader(self):
+        blocks = Blocks()
+        blocks.append(0, 0, [0, 0])
+        from_reader = FromReader(BytesIO(b'0123456789'))
+        from_reader._write_zeros_to_from(blocks, {1: 0, 7: 0, 9: 0}, 2)
+
+        self.assertEqual(from_reader.read(), b'0\x00\x003456\x00\x009')
+        from_reader.seek(2)
+        self.assertEqual(from_reader.read(6), b'\x003456\x00')
+        from_reader.seek(-3, 1)
+        self.assertEqual(from_reader.tell(), 5)
+        self.assertEqual(from_reader.read(100), b'56\x00\x009')
+
     def test_from_elf_file(self):
         filename = 'tests/files/micropython/esp8266-20180511-v1.9.4.elf'
 
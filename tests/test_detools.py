@@ -1,10 +1,20 @@
+import os
 import logging
+import hashlib
+import asyncio
+import random
+import threading
 import unittest
 from io import BytesIO
 
 import detools
 
 
+def read_file(filename):
+    with open(filename, 'rb') as fin:
+        return fin.read()
+
+
 class DetoolsTest(unittest.TestCase):
 
     def assert_create_patch(self,
@@ -185,6 +195,16 @@ class DetoolsTest(unittest.TestCase):
                                            'tests/files/shell/arm-cortex-m4.patch',
                                            data_format='arm-cortex-m4')
 
+    def test_create_and_apply_patch_shell_arm_cortex_m4_in_place(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/shell/old',
+            'tests/files/shell/new',
+            'tests/files/shell/in-place-arm-cortex-m4.patch',
+            patch_type='in-place',
+            memory_size=196608,
+            segment_size=8192,
+            data_format='arm-cortex-m4')
+
     def test_create_and_apply_patch_shell_arm_cortex_m4_bz2_compression(self):
         self.assert_create_and_apply_patch(
             'tests/files/shell/old',
@@ -246,11 +266,40 @@ class DetoolsTest(unittest.TestCase):
                                            compression='crle')
 
     def test_create_and_apply_patch_foo_heatshrink_compression(self):
-        with self.assertRaises(NameError):
-            self.assert_create_and_apply_patch('tests/files/foo/old',
-                                               'tests/files/foo/new',
-                                               'tests/files/foo/heatshrink.patch',
-                                               compression='heatshrink')
+        self.assert_create_and_apply_patch('tests/files/foo/old',
+                                           'tests/files/foo/new',
+                                           'tests/files/foo/heatshrink.patch',
+                                           compression='heatshrink')
+
+    def test_create_and_apply_patch_foo_heatshrink_sizes(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/foo/old',
+            'tests/files/foo/new',
+            'tests/files/foo/heatshrink-9-8.patch',
+            compression='heatshrink',
+            heatshrink_window_sz2=9,
+            heatshrink_lookahead_sz2=8)
+
+    def test_create_and_apply_patch_foo_lzma_options(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/foo/old',
+            'tests/files/foo/new',
+            'tests/files/foo/lzma-options.patch',
+            lzma_options={
+                'bcj': 'arm-thumb',
+                'dict_size': 4096,
+                'lc': 0,
+                'lp': 0,
+                'pb': 0
+            })
+
+    def test_create_and_apply_patch_shell_arm_cortex_m4_lzma_auto(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/shell/old',
+            'tests/files/shell/new',
+            'tests/files/shell/arm-cortex-m4-lzma-auto.patch',
+            data_format='arm-cortex-m4',
+            lzma_options='auto')
 
     def test_create_and_apply_patch_micropython_crle_compression(self):
         self.assert_create_and_apply_patch(
@@ -260,13 +309,12 @@ class DetoolsTest(unittest.TestCase):
             compression='crle')
 
     def test_create_and_apply_patch_micropython_heatshrink_compression(self):
-        with self.assertRaises(NameError):
-            self.assert_create_and_apply_patch(
-                'tests/files/micropython/esp8266-20180511-v1.9.4.bin',
-                'tests/files/micropython/esp8266-20190125-v1.10.bin',
-                'tests/files/micropython/esp8266-20180511-v1.9.4--'
-                '20190125-v1.10-heatshrink.patch',
-                compression='heatshrink')
+        self.assert_create_and_apply_patch(
+            'tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+            'tests/files/micropython/esp8266-20190125-v1.10.bin',
+            'tests/files/micropython/esp8266-20180511-v1.9.4--'
+            '20190125-v1.10-heatshrink.patch',
+            compression='heatshrink')
 
     def test_create_and_apply_patch_micropython_in_place(self):
         self.assert_create_and_apply_patch(
@@ -278,6 +326,17 @@ class DetoolsTest(unittest.TestCase):
             memory_size=2097152,
             segment_size=65536)
 
+    def test_create_and_apply_patch_micropython_xtensa_lx106_in_place(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+            'tests/files/micropython/esp8266-20190125-v1.10.bin',
+            'tests/files/micropython/esp8266-20180511-v1.9.4--'
+            '20190125-v1.10-xtensa-lx106-in-place.patch',
+            patch_type='in-place',
+            memory_size=2097152,
+            segment_size=65536,
+            data_format='xtensa-lx106')
+
     def test_create_and_apply_patch_micropython_xtensa_lx106(self):
         self.assert_create_and_apply_patch(
             'tests/files/micropython/esp8266-20180511-v1.9.4.bin',
@@ -379,6 +438,40 @@ class DetoolsTest(unittest.TestCase):
             memory_size=3000,
             segment_size=50)
 
+    def test_create_and_apply_patch_foo_in_place_periodic(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/foo/periodic',
+            'tests/files/foo/periodic',
+            'tests/files/foo/in-place-periodic.patch',
+            patch_type='in-place',
+            memory_size=3000,
+            segment_size=500,
+            unchanged_segments=True)
+
+    def test_create_and_apply_patch_foo_in_place_many_segments_unchanged(self):
+        self.assert_create_and_apply_patch(
+            'tests/files/foo/old',
+            'tests/files/foo/new',
+            'tests/files/foo/in-place-many-segments-unchanged.patch',
+            patch_type='in-place',
+            memory_size=3000,
+            segment_size=50,
+            unchanged_segments=True)
+
+    def test_apply_patch_in_place_unchanged_bad_patch_type(self):
+        with open('tests/files/foo/in-place-periodic.patch', 'rb') as fpatch:
+            patch = bytearray(fpatch.read())
+
+        # Unchanged segment markers are not allowed in patches of
+        # type in-place.
+        patch[0] = (patch[0] & 0x8f) | 0x10
+        fmem = BytesIO(3000 * b'\x00')
+
+        with self.assertRaises(detools.Error) as cm:
+            detools.apply_patch_in_place(fmem, BytesIO(patch))
+
+        self.assertEqual(str(cm.exception), 'Unexpected unchanged segment.')
+
     def test_create_and_apply_patch_bsdiff(self):
         self.assert_create_and_apply_patch(
             'tests/files/bsdiff.py',
@@ -564,6 +657,56 @@ class DetoolsTest(unittest.TestCase):
                     "Expected compression bz2, crle, heatshrink, lzma or none, "
                     "but got bad.")
 
+    def test_create_patch_foo_bad_heatshrink_sizes(self):
+        datas = [
+            ({'heatshrink_window_sz2': 16},
+             'Expected heatshrink window size 4-15, but got 16.'),
+            ({'heatshrink_window_sz2': 8, 'heatshrink_lookahead_sz2': 8},
+             'Expected heatshrink lookahead size 3-7, but got 8.'),
+            ({'heatshrink_lookahead_sz2': 2},
+             'Expected heatshrink lookahead size 3-7, but got 2.')
+        ]
+
+        for kwargs, message in datas:
+            fpatch = BytesIO()
+
+            with open('tests/files/foo/old', 'rb') as fold:
+                with open('tests/files/foo/new', 'rb') as fnew:
+                    with self.assertRaises(detools.Error) as cm:
+                        detools.create_patch(fold,
+                                             fnew,
+                                             fpatch,
+                                             compression='heatshrink',
+                                             **kwargs)
+
+                    self.assertEqual(str(cm.exception), message)
+
+    def test_create_patch_foo_bad_lzma_options(self):
+        datas = [
+            ({'foo': 1},
+             'Expected LZMA option bcj, dict_size, lc, lp or pb, but got foo.'),
+            ({'bcj': 'mips'},
+             'Expected LZMA BCJ filter arm, arm-thumb, ia64, powerpc, sparc '
+             'or x86, but got mips.'),
+            ({'pb': 5}, 'Expected LZMA pb 0-4, but got 5.'),
+            ({'lc': 4, 'lp': 1}, 'Expected LZMA lc plus lp at most 4, but got 5.'),
+            ({'dict_size': 1024},
+             'Expected LZMA dictionary size 4096-1610612736, but got 1024.')
+        ]
+
+        for lzma_options, message in datas:
+            fpatch = BytesIO()
+
+            with open('tests/files/foo/old', 'rb') as fold:
+                with open('tests/files/foo/new', 'rb') as fnew:
+                    with self.assertRaises(detools.Error) as cm:
+                        detools.create_patch(fold,
+                                             fnew,
+                                             fpatch,
+                                             lzma_options=lzma_options)
+
+                    self.assertEqual(str(cm.exception), message)
+
     def test_apply_patch_one_byte(self):
         fnew = BytesIO()
 
@@ -668,7 +811,7 @@ class DetoolsTest(unittest.TestCase):
 
         self.assertEqual(
             str(cm.exception),
-            "Expected patch type 1, but got 0.")
+            "Expected patch type 1 or 2, but got 0.")
 
     def test_apply_patch_in_place_foo_memory_size_missing(self):
         with self.assertRaises(detools.Error) as cm:
@@ -789,6 +932,565 @@ class DetoolsTest(unittest.TestCase):
             'bsdiff.patch',
             patch_type='bsdiff')
 
+    def test_create_and_apply_patch_bytes(self):
+        with open('tests/files/foo/old', 'rb') as fold:
+            from_data = fold.read()
+
+        with open('tests/files/foo/new', 'rb') as fnew:
+            to_data = fnew.read()
+
+        with open('tests/files/foo/patch', 'rb') as fpatch:
+            expected_patch = fpatch.read()
+
+        patch = detools.create_patch_bytes(bytearray(from_data),
+                                           memoryview(to_data))
+        self.assertEqual(patch, expected_patch)
+        self.assertEqual(detools.apply_patch_bytes(memoryview(from_data),
+                                                   bytearray(patch)),
+                         to_data)
+
+    def test_create_and_apply_patch_bytes_data_format(self):
+        with open('tests/files/programmer/0.8.0.bin', 'rb') as fold:
+            from_data = fold.read()
+
+        with open('tests/files/programmer/0.9.0.bin', 'rb') as fnew:
+            to_data = fnew.read()
+
+        patch = detools.create_patch_bytes(from_data,
+                                           to_data,
+                                           data_format='arm-cortex-m4')
+
+        with open('tests/files/programmer/0.8.0--0.9.0-arm-cortex-m4.patch',
+                  'rb') as fpatch:
+            self.assertEqual(patch, fpatch.read())
+
+        self.assertEqual(detools.apply_patch_bytes(from_data, patch), to_data)
+
+    def test_apply_patch_bytes_empty(self):
+        with open('tests/files/empty/patch', 'rb') as fpatch:
+            patch = fpatch.read()
+
+        self.assertEqual(detools.apply_patch_bytes(b'', patch), b'')
+
+    def test_apply_patch_into(self):
+        with open('tests/files/foo/old', 'rb') as fold:
+            from_data = fold.read()
+
+        with open('tests/files/foo/new', 'rb') as fnew:
+            to_data = fnew.read()
+
+        with open('tests/files/foo/patch', 'rb') as fpatch:
+            patch = fpatch.read()
+
+        out_buf = bytearray(2790 * b'\xff')
+        self.assertEqual(detools.apply_patch_into(from_data, patch, out_buf),
+                         2780)
+        self.assertEqual(out_buf[:2780], to_data)
+        self.assertEqual(out_buf[2780:], 10 * b'\xff')
+
+    def test_apply_patch_into_bad_output_buffer(self):
+        with open('tests/files/foo/old', 'rb') as fold:
+            from_data = fold.read()
+
+        with open('tests/files/foo/patch', 'rb') as fpatch:
+            patch = fpatch.read()
+
+        with self.assertRaises(detools.Error) as cm:
+            detools.apply_patch_into(from_data, patch, bytearray(2779))
+
+        self.assertEqual(
+            str(cm.exception),
+            'Expected an output buffer of at least 2780 bytes, but got 2779.')
+
+        with self.assertRaises(detools.Error) as cm:
+            detools.apply_patch_into(from_data, patch, bytes(2780))
+
+        self.assertEqual(str(cm.exception), 'Output buffer is not writable.')
+
+    def test_apply_patches(self):
+        jobs = [
+            ('tests/files/foo/old',
+             'tests/files/foo/patch',
+             'apply-patches-foo.new'),
+            ('tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+             'tests/files/micropython/'
+             'esp8266-20180511-v1.9.4--20190125-v1.10.patch',
+             'apply-patches-micropython.new'),
+            ('tests/files/foo/old',
+             'tests/files/foo/bad-lzma-end.patch',
+             'apply-patches-bad-lzma-end.new'),
+            ('tests/files/foo/old',
+             'tests/files/foo/patch',
+             'apply-patches-foo-2.new')
+        ]
+        expected = [
+            ('tests/files/foo/new', None),
+            ('tests/files/micropython/esp8266-20190125-v1.10.bin', None),
+            (None, 'Patch decompression failed.'),
+            ('tests/files/foo/new', None)
+        ]
+
+        results = detools.apply_patches(jobs, max_workers=2, digest='sha256')
+
+        self.assertEqual(len(results), len(jobs))
+
+        for job, result, (tofile, error) in zip(jobs, results, expected):
+            self.assertEqual((result.fromfile, result.patchfile, result.tofile),
+                             job)
+            self.assertEqual(result.error, error)
+            self.assertGreaterEqual(result.elapsed, 0)
+
+            if tofile is not None:
+                to_data = read_file(tofile)
+                self.assertEqual(read_file(result.tofile), to_data)
+                self.assertEqual(result.to_size, len(to_data))
+                self.assertEqual(result.digest,
+                                 hashlib.sha256(to_data).hexdigest())
+
+            os.remove(result.tofile)
+
+    def test_apply_patches_no_digest(self):
+        results = detools.apply_patches([('tests/files/foo/old',
+                                          'tests/files/foo/patch',
+                                          'apply-patches-foo.new')])
+
+        self.assertEqual(results[0].to_size, 2780)
+        self.assertIsNone(results[0].digest)
+        self.assertIsNone(results[0].error)
+        os.remove('apply-patches-foo.new')
+
+    def test_apply_patches_bad_digest(self):
+        with self.assertRaises(detools.Error) as cm:
+            detools.apply_patches([], digest='foo')
+
+        self.assertEqual(str(cm.exception), "Unsupported digest 'foo'.")
+
+    def assert_async_patch_applier(self,
+                                   from_filename,
+                                   patch_filename,
+                                   to_filename,
+                                   chunk_size,
+                                   **kwargs):
+        patch = read_file(patch_filename)
+        fto = BytesIO()
+
+        async def apply():
+            with open(from_filename, 'rb') as ffrom:
+                applier = detools.AsyncPatchApplier(ffrom, fto, **kwargs)
+
+                for offset in range(0, len(patch), chunk_size):
+                    await applier.feed(patch[offset:offset + chunk_size])
+
+                return await applier.finalize()
+
+        to_data = read_file(to_filename)
+        self.assertEqual(asyncio.run(apply()), len(to_data))
+        self.assertEqual(fto.getvalue(), to_data)
+
+    def test_async_patch_applier(self):
+        self.assert_async_patch_applier('tests/files/foo/old',
+                                        'tests/files/foo/patch',
+                                        'tests/files/foo/new',
+                                        1)
+        self.assert_async_patch_applier(
+            'tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+            'tests/files/micropython/'
+            'esp8266-20180511-v1.9.4--20190125-v1.10.patch',
+            'tests/files/micropython/esp8266-20190125-v1.10.bin',
+            1000,
+            max_buffered=4096)
+        self.assert_async_patch_applier(
+            'tests/files/foo/old',
+            'tests/files/foo/none.patch',
+            'tests/files/foo/new',
+            100,
+            patch_size=len(read_file('tests/files/foo/none.patch')))
+        self.assert_async_patch_applier(
+            'tests/files/foo/old',
+            'tests/files/foo/crle.patch',
+            'tests/files/foo/new',
+            7,
+            patch_size=len(read_file('tests/files/foo/crle.patch')))
+
+    def test_async_patch_applier_large_feed(self):
+        patch = read_file('tests/files/micropython/'
+                          'esp8266-20180511-v1.9.4--20190125-v1.10.patch')
+        to_data = read_file('tests/files/micropython/esp8266-20190125-v1.10.bin')
+        fto = BytesIO()
+        maximum_buffered = []
+
+        class PatchStream(detools.apply._PatchStream):
+
+            def try_write(self, data):
+                written = super().try_write(data)
+                maximum_buffered.append(self._buffered)
+
+                return written
+
+        async def apply():
+            with open('tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+                      'rb') as ffrom:
+                applier = detools.AsyncPatchApplier(ffrom,
+                                                    fto,
+                                                    max_buffered=1000)
+                applier._stream = PatchStream(None, 1000, applier._on_space)
+                await applier.feed(patch)
+
+                return await applier.finalize()
+
+        self.assertEqual(asyncio.run(apply()), len(to_data))
+        self.assertEqual(fto.getvalue(), to_data)
+        self.assertLessEqual(max(maximum_buffered), 1000)
+
+    def assert_async_patch_applier_threads_exit(self, apply):
+        threads = set(threading.enumerate())
+        asyncio.run(apply())
+
+        for thread in set(threading.enumerate()) - threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_async_patch_applier_aclose(self):
+        patch = read_file('tests/files/micropython/'
+                          'esp8266-20180511-v1.9.4--20190125-v1.10.patch')
+        fto = BytesIO()
+
+        async def apply():
+            with open('tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+                      'rb') as ffrom:
+                applier = detools.AsyncPatchApplier(ffrom, fto)
+                await applier.feed(patch[:len(patch) // 2])
+                await applier.aclose()
+
+                with self.assertRaises(detools.Error) as cm:
+                    await applier.feed(patch[len(patch) // 2:])
+
+                self.assertEqual(str(cm.exception), 'Patch apply aborted.')
+
+                with self.assertRaises(detools.Error) as cm:
+                    await applier.finalize()
+
+                self.assertEqual(str(cm.exception), 'Patch apply aborted.')
+
+        self.assert_async_patch_applier_threads_exit(apply)
+
+    def test_async_patch_applier_context_manager(self):
+        patch = read_file('tests/files/foo/patch')
+        fto = BytesIO()
+
+        async def apply():
+            with open('tests/files/foo/old', 'rb') as ffrom:
+                with self.assertRaises(RuntimeError):
+                    async with detools.AsyncPatchApplier(ffrom,
+                                                         fto) as applier:
+                        await applier.feed(patch[:50])
+
+                        raise RuntimeError('Download failed.')
+
+                async with detools.AsyncPatchApplier(ffrom, fto) as applier:
+                    ffrom.seek(0)
+                    fto.seek(0)
+                    await applier.feed(patch)
+                    self.assertEqual(await applier.finalize(), 2780)
+
+        self.assert_async_patch_applier_threads_exit(apply)
+        self.assertEqual(fto.getvalue(), read_file('tests/files/foo/new'))
+
+    def test_async_patch_applier_errors(self):
+        datas = [
+            ('tests/files/foo/bad-lzma-end.patch', 'Patch decompression failed.'),
+            ('tests/files/foo/short.patch', 'End of patch not found.'),
+            (read_file('tests/files/foo/patch')[:100], 'Out of patch data.'),
+            ('tests/files/foo/none.patch',
+             'Patch size must be given for streamed patches with compression '
+             'none, crle or heatshrink.'),
+            ('tests/files/foo/in-place-3000-500.patch',
+             'Expected patch type 0, but got 1.')
+        ]
+
+        async def apply(patch):
+            with open('tests/files/foo/old', 'rb') as ffrom:
+                applier = detools.AsyncPatchApplier(ffrom, BytesIO())
+
+                for offset in range(0, len(patch), 10):
+                    await applier.feed(patch[offset:offset + 10])
+
+                return await applier.finalize()
+
+        for patch, message in datas:
+            if isinstance(patch, str):
+                patch = read_file(patch)
+
+            with self.assertRaises(detools.Error) as cm:
+                asyncio.run(apply(patch))
+
+            self.assertEqual(str(cm.exception), message)
+
+    def test_apply_patch_resumable(self):
+        """Kill the apply at random points and resume it from the last
+        checkpoint.
+
+        """
+
+        class Killed(Exception):
+            pass
+
+        class KillingFile(object):
+
+            def __init__(self, fto, kill_pos):
+                self._fto = fto
+                self._kill_pos = kill_pos
+
+            def write(self, data):
+                if self._fto.tell() + len(data) > self._kill_pos:
+                    raise Killed()
+
+                return self._fto.write(data)
+
+            def __getattr__(self, name):
+                return getattr(self._fto, name)
+
+        datas = [
+            ('tests/files/foo/old',
+             'tests/files/foo/patch',
+             'tests/files/foo/new',
+             100),
+            ('tests/files/foo/old',
+             'tests/files/foo/crle.patch',
+             'tests/files/foo/new',
+             1),
+            ('tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+             'tests/files/micropython/'
+             'esp8266-20180511-v1.9.4--20190125-v1.10.patch',
+             'tests/files/micropython/esp8266-20190125-v1.10.bin',
+             10000),
+            ('tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+             'tests/files/micropython/'
+             'esp8266-20180511-v1.9.4--20190125-v1.10-xtensa-lx106.patch',
+             'tests/files/micropython/esp8266-20190125-v1.10.bin',
+             10000)
+        ]
+        rand = random.Random(0)
+
+        for from_filename, patch_filename, to_filename, interval in datas:
+            from_data = read_file(from_filename)
+            patch = read_file(patch_filename)
+            to_data = read_file(to_filename)
+            fto = BytesIO()
+            checkpoints = [None]
+
+            for _ in range(5):
+                with self.assertRaises(Killed):
+                    detools.apply_patch_resumable(
+                        BytesIO(from_data),
+                        BytesIO(patch),
+                        KillingFile(fto, rand.randrange(len(to_data))),
+                        checkpoints.append,
+                        checkpoints[-1],
+                        interval)
+
+            self.assertEqual(
+                detools.apply_patch_resumable(BytesIO(from_data),
+                                              BytesIO(patch),
+                                              fto,
+                                              checkpoints.append,
+                                              checkpoints[-1],
+                                              interval),
+                len(to_data))
+            self.assertEqual(fto.getvalue(), to_data)
+            self.assertGreater(len(checkpoints), 1)
+
+    def test_apply_patch_resumable_filenames(self):
+        fto = BytesIO()
+        checkpoints = []
+
+        def save_checkpoint(checkpoint):
+            checkpoints.append((checkpoint, fto.getvalue()))
+
+        with open('tests/files/foo/old', 'rb') as ffrom:
+            with open('tests/files/foo/patch', 'rb') as fpatch:
+                detools.apply_patch_resumable(ffrom,
+                                              fpatch,
+                                              fto,
+                                              save_checkpoint,
+                                              checkpoint_interval=1000)
+
+        self.assertEqual(len(checkpoints), 2)
+        checkpoint, to_data = checkpoints[0]
+
+        with open('apply-patch-resumable.checkpoint', 'wb') as fout:
+            fout.write(checkpoint)
+
+        with open('apply-patch-resumable.new', 'wb') as fout:
+            fout.write(to_data)
+
+        self.assertEqual(
+            detools.apply_patch_resumable_filenames(
+                'tests/files/foo/old',
+                'tests/files/foo/patch',
+                'apply-patch-resumable.new',
+                'apply-patch-resumable.checkpoint'),
+            2780)
+        self.assertEqual(read_file('apply-patch-resumable.new'),
+                         read_file('tests/files/foo/new'))
+        self.assertFalse(os.path.exists('apply-patch-resumable.checkpoint'))
+        os.remove('apply-patch-resumable.new')
+
+    def test_apply_patch_resumable_bad_checkpoint(self):
+        datas = [
+            (b'', 'Failed to read the checkpoint.'),
+            (b'\x9c\x2b\x00\x00\x00\x00\x02\x00', 'Bad checkpoint.'),
+            (b'\x9c\x2b\x00\x00\x00\x00\x00\x80\x40', 'Bad checkpoint.'),
+            (b'\x00\x00\x00\x00\x00\x00\x00',
+             'Checkpoint does not match the patch.')
+        ]
+
+        for checkpoint, message in datas:
+            with open('tests/files/foo/old', 'rb') as ffrom:
+                with open('tests/files/foo/patch', 'rb') as fpatch:
+                    with self.assertRaises(detools.Error) as cm:
+                        detools.apply_patch_resumable(ffrom,
+                                                      fpatch,
+                                                      BytesIO(),
+                                                      None,
+                                                      checkpoint)
+
+                    self.assertEqual(str(cm.exception), message)
+
+    def test_apply_patch_resumable_wrong_patch(self):
+        from_data = read_file('tests/files/foo/old')
+        to_data = read_file('tests/files/foo/new')
+        checkpoints = []
+
+        with open('tests/files/foo/patch', 'rb') as fpatch:
+            detools.apply_patch_resumable(BytesIO(from_data),
+                                          fpatch,
+                                          BytesIO(),
+                                          checkpoints.append,
+                                          checkpoint_interval=1000)
+
+        # Same to-data size, but another patch.
+        other_patch = detools.create_patch_bytes(from_data[::-1], to_data)
+
+        with self.assertRaises(detools.Error) as cm:
+            detools.apply_patch_resumable(BytesIO(from_data[::-1]),
+                                          BytesIO(other_patch),
+                                          BytesIO(to_data),
+                                          None,
+                                          checkpoints[0])
+
+        self.assertEqual(str(cm.exception),
+                         'Checkpoint does not match the patch.')
+
+        # Another to-data size.
+        with self.assertRaises(detools.Error) as cm:
+            detools.apply_patch_resumable(
+                BytesIO(from_data),
+                BytesIO(detools.create_patch_bytes(from_data, from_data)),
+                BytesIO(),
+                None,
+                checkpoints[0])
+
+        self.assertEqual(str(cm.exception),
+                         'Checkpoint does not match the patch.')
+
+    def test_apply_patch_bsdiff_bounded_reads(self):
+        class PatchFile(BytesIO):
+
+            maximum_read_size = 0
+
+            def read(self, size=-1):
+                data = super().read(size)
+                self.maximum_read_size = max(self.maximum_read_size, len(data))
+
+                return data
+
+        fpatch = PatchFile(read_file(
+            'tests/files/micropython/'
+            'esp8266-20180511-v1.9.4--20190125-v1.10-bsdiff.patch'))
+        fto = BytesIO()
+
+        with open('tests/files/micropython/esp8266-20180511-v1.9.4.bin',
+                  'rb') as ffrom:
+            self.assertEqual(detools.apply_patch_bsdiff(ffrom, fpatch, fto),
+                             615388)
+
+        self.assertEqual(
+            fto.getvalue(),
+            read_file('tests/files/micropython/esp8266-20190125-v1.10.bin'))
+        self.assertEqual(fpatch.maximum_read_size, 4096)
+
+    def test_apply_patch_bsdiff_short(self):
+        patch = read_file('tests/files/foo/bsdiff.patch')
+
+        with open('tests/files/foo/old', 'rb') as ffrom:
+            with self.assertRaises(detools.Error) as cm:
+                detools.apply_patch_bsdiff(ffrom,
+                                           BytesIO(patch[:-10]),
+                                           BytesIO())
+
+        self.assertEqual(str(cm.exception), 'Out of patch data.')
+
+    def test_apply_patch_chain(self):
+        old = read_file('tests/files/micropython/esp8266-20180511-v1.9.4.bin')
+        new = read_file('tests/files/micropython/esp8266-20190125-v1.10.bin')
+        patch_old_new = read_file(
+            'tests/files/micropython/'
+            'esp8266-20180511-v1.9.4--20190125-v1.10.patch')
+        patch_new_old = detools.create_patch_bytes(new,
+                                                   old,
+                                                   compression='crle')
+        datas = [
+            ([patch_old_new], new),
+            ([patch_old_new, patch_new_old], old),
+            ([patch_old_new, patch_new_old, patch_old_new], new)
+        ]
+
+        for patches, to_data in datas:
+            fto = BytesIO()
+            to_size = detools.apply_patch_chain(
+                BytesIO(old),
+                [BytesIO(patch) for patch in patches],
+                fto)
+            self.assertEqual(to_size, len(to_data))
+            self.assertEqual(fto.getvalue(), to_data)
+
+    def test_apply_patch_chain_spooled(self):
+        old = read_file('tests/files/micropython/esp8266-20180511-v1.9.4.bin')
+        new = read_file('tests/files/micropython/esp8266-20190125-v1.10.bin')
+        patch_old_new = read_file(
+            'tests/files/micropython/'
+            'esp8266-20180511-v1.9.4--20190125-v1.10.patch')
+        patch_new_old = detools.create_patch_bytes(new,
+                                                   old,
+                                                   compression='crle')
+        fto = BytesIO()
+        to_size = detools.apply_patch_chain(
+            BytesIO(old),
+            [BytesIO(patch_old_new), BytesIO(patch_new_old)],
+            fto,
+            spool_size=4096)
+        self.assertEqual(to_size, len(old))
+        self.assertEqual(fto.getvalue(), old)
+
+    def test_apply_patch_chain_errors(self):
+        patch = read_file('tests/files/foo/patch')
+        bad_patch = read_file('tests/files/foo/bad-lzma-end.patch')
+        datas = [
+            ([], 'Expected at least one patch.'),
+            ([bad_patch, patch], 'Patch decompression failed.'),
+            ([patch, bad_patch], 'Patch decompression failed.')
+        ]
+
+        for patches, message in datas:
+            with self.assertRaises(detools.Error) as cm:
+                detools.apply_patch_chain(
+                    BytesIO(read_file('tests/files/foo/old')),
+                    [BytesIO(patch) for patch in patches],
+                    BytesIO())
+
+            self.assertEqual(str(cm.exception), message)
+
 
 # This file is not '__main__' when executed via 'python setup.py3
 # test'.
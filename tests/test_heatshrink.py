@@ -0,0 +1,135 @@
+import random
+import unittest
+
+import detools
+from detools.create import HeatshrinkCompressor
+from detools.apply import HeatshrinkDecompressor
+from detools.compression.heatshrink import has_header
+
+
+def random_data(seed):
+    rng = random.Random(seed)
+    data = bytearray()
+
+    for _ in range(200):
+        if rng.random() < 0.3:
+            data += rng.randint(1, 300) * bytes((rng.randint(0, 3), ))
+        else:
+            data += bytes(rng.randint(0, 3) for _ in range(rng.randint(0, 20)))
+
+    return bytes(data)
+
+
+def compress_chunks(data, chunk_size, window_sz2=8, lookahead_sz2=7):
+    compressor = HeatshrinkCompressor(window_sz2, lookahead_sz2)
+    compressed = b''
+
+    for offset in range(0, len(data), chunk_size):
+        compressed += compressor.compress(data[offset:offset + chunk_size])
+
+    return compressed + compressor.flush()
+
+
+class DetoolsHeatshrinkTest(unittest.TestCase):
+
+    def test_compress(self):
+        datas = [
+            (       [b''], 8, 7, b''),
+            (      [b'A'], 8, 7, b'\xa0\x80'),
+            ([b'A', b'A'], 8, 7, b'\xa0\xd0\x40'),
+            ([100 * b'A'], 8, 7, b'\xa0\x80\x31\x00'),
+            (       [b''], 9, 8, b'\x98'),
+            (      [b'A'], 9, 8, b'\x98\xa0\x80')
+        ]
+
+        for chunks, window_sz2, lookahead_sz2, compressed in datas:
+            compressor = HeatshrinkCompressor(window_sz2, lookahead_sz2)
+            data = b''
+
+            for chunk in chunks:
+                data += compressor.compress(chunk)
+
+            data += compressor.flush()
+
+            self.assertEqual(data, compressed)
+
+    def test_compress_chunk_size(self):
+        for seed in range(10):
+            data = random_data(seed)
+
+            for window_sz2, lookahead_sz2 in [(4, 3), (8, 7), (12, 8)]:
+                compressed = compress_chunks(data,
+                                             len(data),
+                                             window_sz2,
+                                             lookahead_sz2)
+
+                for chunk_size in [1, 7, 512]:
+                    self.assertEqual(compress_chunks(data,
+                                                     chunk_size,
+                                                     window_sz2,
+                                                     lookahead_sz2),
+                                     compressed)
+
+                for size in [1, 7, 512]:
+                    decompressor = HeatshrinkDecompressor(
+                        len(compressed),
+                        has_header(window_sz2, lookahead_sz2))
+                    decompressed = b''
+
+                    for offset in range(0, len(compressed), size):
+                        chunk = decompressor.decompress(
+                            compressed[offset:offset + size],
+                            size)
+                        self.assertLessEqual(len(chunk), size)
+                        decompressed += chunk
+
+                    while not decompressor.eof:
+                        chunk = decompressor.decompress(b'', size)
+                        self.assertLessEqual(len(chunk), size)
+                        decompressed += chunk
+
+                    self.assertEqual(decompressed, data)
+
+    def test_decompress_no_data(self):
+        decompressor = HeatshrinkDecompressor(0)
+
+        self.assertEqual(decompressor.needs_input, False)
+        self.assertEqual(decompressor.eof, True)
+
+    def test_decompress_needs_input(self):
+        compressed = b'\xa0\x80\x31\x00'
+        decompressor = HeatshrinkDecompressor(len(compressed))
+
+        self.assertEqual(decompressor.needs_input, True)
+        self.assertEqual(decompressor.decompress(compressed, 0), b'')
+        self.assertEqual(decompressor.needs_input, False)
+        self.assertEqual(decompressor.eof, False)
+        self.assertEqual(decompressor.decompress(b'', 60), 60 * b'A')
+        self.assertEqual(decompressor.needs_input, False)
+        self.assertEqual(decompressor.decompress(b'', 60), 40 * b'A')
+        self.assertEqual(decompressor.eof, True)
+
+    def test_decompress_bad_header(self):
+        decompressor = HeatshrinkDecompressor(2, header=True)
+
+        with self.assertRaises(detools.Error) as cm:
+            decompressor.decompress(b'\xf0\x00', 1)
+
+        self.assertEqual(str(cm.exception),
+                         'Expected heatshrink lookahead size 3-14, but got 0.')
+
+    def test_decompress_at_eof(self):
+        compressed = b'\xa0\x80'
+        decompressor = HeatshrinkDecompressor(len(compressed))
+
+        self.assertEqual(decompressor.decompress(compressed, 2), b'A')
+        self.assertEqual(decompressor.eof, True)
+
+        with self.assertRaises(detools.Error) as cm:
+            decompressor.decompress(b'', 1)
+
+        self.assertEqual(str(cm.exception), 'Already at end of stream.')
+
+
+if __name__ == '__main__':
+    unittest.main()
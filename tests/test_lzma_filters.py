@@ -0,0 +1,66 @@
+import lzma
+import unittest
+
+from detools.compression.lzma_filters import LzmaAutoCompressor
+from detools.compression.lzma_filters import auto_options
+from detools.compression.lzma_filters import fitted_dict_size
+
+
+def compress_default(data):
+    compressor = lzma.LZMACompressor(format=lzma.FORMAT_ALONE)
+
+    return compressor.compress(data) + compressor.flush()
+
+
+class DetoolsLzmaFiltersTest(unittest.TestCase):
+
+    def test_fitted_dict_size(self):
+        datas = [
+            (      0,    4096),
+            (      1,    4096),
+            (   4096,    4096),
+            (   4097,    8192),
+            ( 144700,  262144),
+            (1048576, 1048576)
+        ]
+
+        for size, dict_size in datas:
+            self.assertEqual(fitted_dict_size(size), dict_size)
+
+    def test_auto_options(self):
+        self.assertEqual(len(auto_options(None, 100)), 4)
+        self.assertEqual(len(auto_options('xtensa-lx106', 100)), 4)
+
+        options = auto_options('arm-cortex-m4', 5000)
+
+        self.assertEqual(len(options), 8)
+        self.assertEqual(options[0],
+                         {'dict_size': 8192, 'lc': 3, 'lp': 0, 'pb': 2})
+        self.assertEqual(options[4],
+                         {
+                             'bcj': 'arm-thumb',
+                             'dict_size': 8192,
+                             'lc': 3,
+                             'lp': 0,
+                             'pb': 2
+                         })
+
+    def test_auto_compressor(self):
+        with open('tests/files/shell/new', 'rb') as fin:
+            data = fin.read()
+
+        for data_format in [None, 'arm-cortex-m4']:
+            compressor = LzmaAutoCompressor(data_format)
+            compressed = b''
+
+            for offset in range(0, len(data), 4096):
+                compressed += compressor.compress(data[offset:offset + 4096])
+
+            compressed += compressor.flush()
+
+            self.assertLessEqual(len(compressed), len(compress_default(data)))
+            self.assertEqual(lzma.decompress(compressed), data)
+
+
+if __name__ == '__main__':
+    unittest.main()